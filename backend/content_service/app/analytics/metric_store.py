@@ -0,0 +1,365 @@
+"""
+Columnar ring buffer of recent analytics metrics.
+
+``RealTimeAnalyticsService`` used to answer device, campaign and dashboard
+queries by scanning a ``deque`` of ``AnalyticsMetric`` dataclasses, each
+carrying several dicts, so it could only afford the last 10k metrics. The store
+keeps the fields those queries read in fixed-size typed ``array`` columns:
+timestamps, values, counts, durations and revenue as numbers, enum members
+and ids as small interned integers. At roughly 90 bytes per slot a 1M-metric
+store is a fixed ~90MB, allocated on first use.
+
+Each slot also records the previous slot written for the same device and for
+the same campaign, so per-device and per-campaign queries walk only their own
+chain instead of the whole buffer. When the ring wraps, the oldest slot is
+overwritten and its chains end there.
+
+Device capabilities, network conditions and content metadata are not kept;
+only persisted metrics carry them. Location and demographic data, which may
+nest dicts and lists, are interned by their canonical JSON, which assumes they
+repeat (devices are stationary, demographics are coarse buckets). Interned ids and contexts are reference-counted per slot and freed
+when the ring overwrites their last slot, so the interners never outgrow the
+values live in the ring.
+"""
+
+import copy
+import json
+import math
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional
+
+EPOCH = datetime(1970, 1, 1)
+_NO_ID = -1
+_NO_SLOT = -1
+
+
+class StoredMetric(NamedTuple):
+    """Read view of one stored metric; duck-types the AnalyticsMetric fields queries use"""
+    metric_type: Any
+    event_type: Any
+    device_id: str
+    content_id: Optional[str]
+    campaign_id: Optional[str]
+    value: float
+    count: int
+    duration_seconds: Optional[float]
+    revenue_impact: Optional[float]
+    audience_count: Optional[int]
+    timestamp: datetime
+    location: Optional[Dict[str, float]]
+    demographic_data: Optional[Dict[str, Any]]
+
+
+class _Interner:
+    """Maps hashable values to dense integer ids and back"""
+
+    def __init__(self):
+        self._ids: Dict[Hashable, int] = {}
+        self.values: List[Any] = []
+
+    def intern(self, value: Hashable) -> int:
+        if value is None:
+            return _NO_ID
+        interned = self._ids.get(value)
+        if interned is None:
+            interned = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return interned
+
+    def lookup(self, value: Hashable) -> int:
+        if value is None:
+            return _NO_ID
+        return self._ids.get(value, _NO_ID)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def table_bytes(self) -> int:
+        return sys.getsizeof(self._ids) + sys.getsizeof(self.values)
+
+
+class _CountedInterner(_Interner):
+    """Interner whose ids are released once no ring slot references them.
+
+    Every ``intern`` takes a reference and every ``release`` drops one; an id
+    with no references left is forgotten and reused, so the table holds at
+    most the values live in the ring.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._refs: List[int] = []
+        self._free: List[int] = []
+
+    def intern(self, value: Hashable) -> int:
+        if value is None:
+            return _NO_ID
+        interned = self._ids.get(value)
+        if interned is None:
+            if self._free:
+                interned = self._free.pop()
+                self.values[interned] = value
+                self._refs[interned] = 0
+            else:
+                interned = len(self.values)
+                self.values.append(value)
+                self._refs.append(0)
+            self._ids[value] = interned
+        self._refs[interned] += 1
+        return interned
+
+    def release(self, interned: int) -> None:
+        if interned == _NO_ID:
+            return
+        self._refs[interned] -= 1
+        if not self._refs[interned]:
+            del self._ids[self.values[interned]]
+            self.values[interned] = None
+            self._free.append(interned)
+
+    def table_bytes(self) -> int:
+        return super().table_bytes() + sys.getsizeof(self._refs) + sys.getsizeof(self._free)
+
+
+class _ContextInterner(_CountedInterner):
+    """Counted interner for location and demographic dicts, which may nest dicts and lists.
+
+    Dicts are keyed by their canonical JSON; a private copy of the first dict
+    seen for each key is kept and handed out as copies.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.dicts: List[Optional[Dict[str, Any]]] = []
+
+    def intern_dict(self, mapping: Optional[Dict[str, Any]]) -> int:
+        if not mapping:
+            return _NO_ID
+        interned = self.intern(json.dumps(mapping, sort_keys=True, default=str))
+        if interned == len(self.dicts):
+            self.dicts.append(None)
+        if self.dicts[interned] is None:
+            self.dicts[interned] = copy.deepcopy(mapping)
+        return interned
+
+    def release(self, interned: int) -> None:
+        super().release(interned)
+        if interned != _NO_ID and self.values[interned] is None:
+            self.dicts[interned] = None
+
+    def get(self, interned: int) -> Optional[Dict[str, Any]]:
+        return None if interned == _NO_ID else copy.deepcopy(self.dicts[interned])
+
+    def table_bytes(self) -> int:
+        return super().table_bytes() + sys.getsizeof(self.dicts)
+
+
+def _to_seconds(timestamp: datetime) -> float:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return (timestamp - EPOCH).total_seconds()
+
+
+class MetricStore:
+    """Fixed-capacity columnar ring buffer of analytics metrics"""
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._written = 0  # total metrics ever appended; slot = sequence % capacity
+        self._allocated = False
+
+        self._ids = _CountedInterner()       # device, content and campaign ids
+        self._enums = _Interner()            # MetricType / AnalyticsEvent members
+        self._contexts = _ContextInterner()  # location / demographic dicts
+        self._device_heads: Dict[int, int] = {}
+        self._campaign_heads: Dict[int, int] = {}
+
+    def _allocate(self) -> None:
+        n = self.capacity
+
+        def column(typecode):
+            return array(typecode, bytes(array(typecode).itemsize * n))
+
+        self._timestamp = column('d')      # seconds since the epoch, UTC
+        self._value = column('d')
+        self._duration = column('d')       # NaN for None
+        self._revenue = column('d')        # NaN for None
+        self._count = column('i')
+        self._audience = column('i')       # -1 for None
+        self._metric_type = column('B')
+        self._event_type = column('B')
+        self._device = column('i')
+        self._content = column('i')
+        self._campaign = column('i')
+        self._location = column('i')
+        self._demographics = column('i')
+        self._prev_device = column('q')    # previous sequence for the same device
+        self._prev_campaign = column('q')  # previous sequence for the same campaign
+        self._allocated = True
+
+    def __len__(self) -> int:
+        return min(self._written, self.capacity)
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def append(self, metric) -> None:
+        """Store one AnalyticsMetric, overwriting the oldest slot when full"""
+        if not self._allocated:
+            self._allocate()
+        sequence = self._written
+        slot = sequence % self.capacity
+
+        # Intern before evicting so values shared with the old slot stay live
+        device = self._ids.intern(metric.device_id)
+        content = self._ids.intern(metric.content_id)
+        campaign = self._ids.intern(metric.campaign_id)
+        location = self._contexts.intern_dict(metric.location)
+        demographics = self._contexts.intern_dict(metric.demographic_data)
+        if sequence >= self.capacity:
+            self._evict(slot, sequence - self.capacity)
+
+        self._timestamp[slot] = _to_seconds(metric.timestamp)
+        self._value[slot] = metric.value
+        self._count[slot] = metric.count
+        self._duration[slot] = math.nan if metric.duration_seconds is None else metric.duration_seconds
+        self._revenue[slot] = math.nan if metric.revenue_impact is None else metric.revenue_impact
+        self._audience[slot] = _NO_ID if metric.audience_count is None else metric.audience_count
+        self._metric_type[slot] = self._enums.intern(metric.metric_type)
+        self._event_type[slot] = self._enums.intern(metric.event_type)
+        self._device[slot] = device
+        self._content[slot] = content
+        self._campaign[slot] = campaign
+        self._location[slot] = location
+        self._demographics[slot] = demographics
+
+        self._prev_device[slot] = self._device_heads.get(device, _NO_SLOT)
+        self._device_heads[device] = sequence
+        if campaign != _NO_ID:
+            self._prev_campaign[slot] = self._campaign_heads.get(campaign, _NO_SLOT)
+            self._campaign_heads[campaign] = sequence
+        self._written = sequence + 1
+
+    def extend(self, metrics) -> None:
+        for metric in metrics:
+            self.append(metric)
+
+    def _evict(self, slot: int, sequence: int) -> None:
+        """Release the slot about to be overwritten: its chain heads and interned values"""
+        device = self._device[slot]
+        if self._device_heads.get(device) == sequence:
+            del self._device_heads[device]
+        campaign = self._campaign[slot]
+        if campaign != _NO_ID and self._campaign_heads.get(campaign) == sequence:
+            del self._campaign_heads[campaign]
+        self._ids.release(device)
+        self._ids.release(self._content[slot])
+        self._ids.release(campaign)
+        self._contexts.release(self._location[slot])
+        self._contexts.release(self._demographics[slot])
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def _row(self, slot: int) -> StoredMetric:
+        ids = self._ids.values
+        contexts = self._contexts
+        content = self._content[slot]
+        campaign = self._campaign[slot]
+        duration = self._duration[slot]
+        revenue = self._revenue[slot]
+        audience = self._audience[slot]
+        return StoredMetric(
+            metric_type=self._enums.values[self._metric_type[slot]],
+            event_type=self._enums.values[self._event_type[slot]],
+            device_id=ids[self._device[slot]],
+            content_id=ids[content] if content != _NO_ID else None,
+            campaign_id=ids[campaign] if campaign != _NO_ID else None,
+            value=self._value[slot],
+            count=self._count[slot],
+            duration_seconds=None if math.isnan(duration) else duration,
+            revenue_impact=None if math.isnan(revenue) else revenue,
+            audience_count=None if audience == _NO_ID else audience,
+            timestamp=EPOCH + timedelta(seconds=self._timestamp[slot]),
+            location=contexts.get(self._location[slot]),
+            demographic_data=contexts.get(self._demographics[slot])
+        )
+
+    def _walk(self, head: Optional[int], prev: array, start: float, end: float) -> List[StoredMetric]:
+        """Follow one chain newest-first, stopping at slots already overwritten"""
+        oldest_live = self._written - self.capacity
+        rows = []
+        sequence = _NO_SLOT if head is None else head
+        timestamps = self._timestamp
+        while sequence != _NO_SLOT and sequence >= oldest_live:
+            slot = sequence % self.capacity
+            if start <= timestamps[slot] <= end:
+                rows.append(self._row(slot))
+            sequence = prev[slot]
+        rows.reverse()
+        return rows
+
+    def for_device(self, device_id: str, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> List[StoredMetric]:
+        """Metrics for one device with start <= timestamp <= end, oldest first"""
+        device = self._ids.lookup(device_id)
+        if device == _NO_ID or not self._allocated:
+            return []
+        return self._walk(self._device_heads.get(device), self._prev_device,
+                          _to_seconds(start) if start else -math.inf,
+                          _to_seconds(end) if end else math.inf)
+
+    def for_campaign(self, campaign_id: str, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None) -> List[StoredMetric]:
+        """Metrics for one campaign with start <= timestamp <= end, oldest first"""
+        campaign = self._ids.lookup(campaign_id)
+        if campaign == _NO_ID or not self._allocated:
+            return []
+        return self._walk(self._campaign_heads.get(campaign), self._prev_campaign,
+                          _to_seconds(start) if start else -math.inf,
+                          _to_seconds(end) if end else math.inf)
+
+    def in_window(self, start: datetime, end: datetime) -> List[StoredMetric]:
+        """All metrics with start <= timestamp <= end, oldest first.
+
+        Scans only the timestamp column and materializes matching rows.
+        """
+        if not self._written:
+            return []
+        low, high = _to_seconds(start), _to_seconds(end)
+        timestamps = self._timestamp
+        first = max(0, self._written - self.capacity)
+        return [
+            self._row(sequence % self.capacity)
+            for sequence in range(first, self._written)
+            if low <= timestamps[sequence % self.capacity] <= high
+        ]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'capacity': self.capacity,
+            'stored': len(self),
+            'total_appended': self._written,
+            'interned_ids': len(self._ids),
+            'interned_contexts': len(self._contexts),
+            'interned_enums': len(self._enums),
+            'interner_bytes': self._ids.table_bytes() + self._enums.table_bytes() + self._contexts.table_bytes(),
+            'tracked_devices': len(self._device_heads),
+            'tracked_campaigns': len(self._campaign_heads),
+            'allocated_bytes': self._allocated_bytes()
+        }
+
+    def _allocated_bytes(self) -> int:
+        if not self._allocated:
+            return 0
+        columns = (self._timestamp, self._value, self._duration, self._revenue, self._count,
+                   self._audience, self._metric_type, self._event_type, self._device, self._content,
+                   self._campaign, self._location, self._demographics, self._prev_device,
+                   self._prev_campaign)
+        return sum(column.itemsize * len(column) for column in columns)
@@ -15,6 +15,8 @@ from enum import Enum
 import uuid
 from collections import defaultdict, deque
 
+from .metric_store import MetricStore
+
 logger = logging.getLogger(__name__)
 
 class MetricType(Enum):
@@ -130,6 +132,14 @@ class RealTimeMetrics:
     verification_rate: float = 100.0
     confidence_level: float = 95.0
 
+# Value -> member lookups; cheaper than Enum(value) on the ingestion hot path
+_METRIC_TYPES = {member.value: member for member in MetricType}
+_EVENT_TYPES = {member.value: member for member in AnalyticsEvent}
+
+# Metric types folded into the real-time cache as they arrive
+_REAL_TIME_METRIC_TYPES = (MetricType.IMPRESSION, MetricType.ENGAGEMENT, MetricType.ERROR)
+_AUDITED_METRIC_TYPES = (MetricType.ERROR, MetricType.REVENUE)
+
 class RealTimeAnalyticsService:
     """Service for real-time analytics collection, processing, and delivery"""
     
@@ -166,7 +176,8 @@ class RealTimeAnalyticsService:
         }
         
         # In-memory stores for real-time processing
-        self.metric_buffer = deque(maxlen=10000)  # Buffer for incoming metrics
+        self.metric_buffer = deque(maxlen=10000)  # Metrics awaiting aggregation and persistence
+        self.metric_store = MetricStore(self._metric_store_capacity())  # Recent metrics for queries
         self.real_time_cache = {}  # Cache for real-time aggregations
         self.active_sessions = {}  # Track active viewing sessions
         self.device_status = {}    # Track device online/offline status
@@ -184,6 +195,14 @@ class RealTimeAnalyticsService:
         self.processing_task = None
         self.start_processing()
     
+    @staticmethod
+    def _metric_store_capacity() -> int:
+        try:
+            from app.config import settings
+            return settings.ANALYTICS_METRIC_STORE_CAPACITY
+        except (ImportError, AttributeError):
+            return 1_000_000
+    
     def start_processing(self):
         """Start background analytics processing"""
         # Only create the background task if an event loop is actively running.
@@ -217,55 +236,22 @@ class RealTimeAnalyticsService:
         
         try:
             # Create metric object
-            metric = AnalyticsMetric(
-                id=str(uuid.uuid4()),
-                metric_type=MetricType(metric_data["metric_type"]),
-                event_type=AnalyticsEvent(metric_data["event_type"]),
-                device_id=metric_data["device_id"],
-                content_id=metric_data.get("content_id"),
-                campaign_id=metric_data.get("campaign_id"),
-                
-                value=float(metric_data.get("value", 1.0)),
-                count=int(metric_data.get("count", 1)),
-                duration_seconds=metric_data.get("duration_seconds"),
-                
-                timestamp=datetime.fromisoformat(metric_data.get("timestamp", datetime.utcnow().isoformat())),
-                location=metric_data.get("location"),
-                audience_count=metric_data.get("audience_count"),
-                demographic_data=metric_data.get("demographic_data"),
-                
-                device_capabilities=metric_data.get("device_capabilities"),
-                network_conditions=metric_data.get("network_conditions"),
-                content_metadata=metric_data.get("content_metadata"),
-                
-                advertiser_id=metric_data.get("advertiser_id"),
-                host_id=metric_data.get("host_id"),
-                revenue_impact=metric_data.get("revenue_impact"),
-                
-                data_quality_score=metric_data.get("data_quality_score", 1.0),
-                verification_level=metric_data.get("verification_level", "standard"),
-                confidence_interval=metric_data.get("confidence_interval")
-            )
+            metric = self._build_metric(metric_data, datetime.utcnow())
             
             # Add to processing buffer
             self.metric_buffer.append(metric)
+            self.metric_store.append(metric)
             
             # Update real-time aggregations immediately for critical metrics
-            if metric.metric_type in [MetricType.IMPRESSION, MetricType.ENGAGEMENT, MetricType.ERROR]:
+            if metric.metric_type in _REAL_TIME_METRIC_TYPES:
                 await self._update_real_time_metrics(metric)
             
             # Notify real-time subscribers
             await self._notify_subscribers(metric)
             
             # Log critical metrics
-            if self.audit_logger and metric.metric_type in [MetricType.ERROR, MetricType.REVENUE]:
-                self.audit_logger.log_content_event(f"analytics_{metric.event_type.value}", {
-                    "metric_id": metric.id,
-                    "device_id": metric.device_id,
-                    "content_id": metric.content_id,
-                    "value": metric.value,
-                    "metric_type": metric.metric_type.value
-                })
+            if self.audit_logger and metric.metric_type in _AUDITED_METRIC_TYPES:
+                self._audit_metric(metric)
             
             return {
                 "success": True,
@@ -279,19 +265,43 @@ class RealTimeAnalyticsService:
             return {"success": False, "error": str(e)}
     
     async def record_batch_metrics(self, metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Record multiple analytics metrics efficiently"""
+        """Record multiple analytics metrics efficiently
+        
+        Parses and validates the whole batch in one pass, folds it into the
+        real-time cache once per period key and sends subscribers a single
+        coalesced update, instead of running record_metric per item.
+        """
+        self._ensure_processing_started()
+        
         try:
-            successful = 0
-            failed = 0
+            now = datetime.utcnow()
+            parsed = []
             errors = []
+            build_metric = self._build_metric
             
             for metric_data in metrics:
-                result = await self.record_metric(metric_data)
-                if result.get("success"):
-                    successful += 1
-                else:
-                    failed += 1
-                    errors.append(result.get("error"))
+                try:
+                    parsed.append(build_metric(metric_data, now))
+                except Exception as e:
+                    errors.append(str(e))
+            
+            failed = len(errors)
+            successful = len(parsed)
+            if errors:
+                logger.error(f"Rejected {failed} of {len(metrics)} batch metrics: {errors[0]}")
+            
+            if parsed:
+                self.metric_buffer.extend(parsed)
+                self.metric_store.extend(parsed)
+                self._apply_real_time_batch(
+                    [m for m in parsed if m.metric_type in _REAL_TIME_METRIC_TYPES], now
+                )
+                await self._notify_subscribers_batch(parsed)
+                
+                if self.audit_logger:
+                    for metric in parsed:
+                        if metric.metric_type in _AUDITED_METRIC_TYPES:
+                            self._audit_metric(metric)
             
             return {
                 "success": failed == 0,
@@ -560,6 +570,132 @@ class RealTimeAnalyticsService:
         except Exception as e:
             logger.error(f"Error updating real-time metrics: {e}")
     
+    def _build_metric(self, metric_data: Dict[str, Any], now: datetime) -> AnalyticsMetric:
+        """Validate one raw metric dict and build its AnalyticsMetric"""
+        metric_type = _METRIC_TYPES.get(metric_data["metric_type"])
+        if metric_type is None:
+            raise ValueError(f"{metric_data['metric_type']!r} is not a valid MetricType")
+        event_type = _EVENT_TYPES.get(metric_data["event_type"])
+        if event_type is None:
+            raise ValueError(f"{metric_data['event_type']!r} is not a valid AnalyticsEvent")
+        timestamp = metric_data.get("timestamp")
+        
+        get = metric_data.get
+        return AnalyticsMetric(
+            id=str(uuid.uuid4()),
+            metric_type=metric_type,
+            event_type=event_type,
+            device_id=metric_data["device_id"],
+            content_id=get("content_id"),
+            campaign_id=get("campaign_id"),
+            
+            value=float(get("value", 1.0)),
+            count=int(get("count", 1)),
+            duration_seconds=get("duration_seconds"),
+            
+            timestamp=datetime.fromisoformat(timestamp) if timestamp else now,
+            location=get("location"),
+            audience_count=get("audience_count"),
+            demographic_data=get("demographic_data"),
+            
+            device_capabilities=get("device_capabilities"),
+            network_conditions=get("network_conditions"),
+            content_metadata=get("content_metadata"),
+            
+            advertiser_id=get("advertiser_id"),
+            host_id=get("host_id"),
+            revenue_impact=get("revenue_impact"),
+            
+            data_quality_score=get("data_quality_score", 1.0),
+            verification_level=get("verification_level", "standard"),
+            confidence_interval=get("confidence_interval")
+        )
+    
+    def _audit_metric(self, metric: AnalyticsMetric):
+        self.audit_logger.log_content_event(f"analytics_{metric.event_type.value}", {
+            "metric_id": metric.id,
+            "device_id": metric.device_id,
+            "content_id": metric.content_id,
+            "value": metric.value,
+            "metric_type": metric.metric_type.value
+        })
+    
+    def _apply_real_time_batch(self, metrics: List[AnalyticsMetric], now: datetime):
+        """Fold a batch into the real-time cache with one update per period key"""
+        if not metrics:
+            return
+        try:
+            impressions = viewers = plays = completions = 0
+            errors = 0
+            dwell_time = 0.0
+            for metric in metrics:
+                metric_type = metric.metric_type
+                if metric_type is MetricType.IMPRESSION:
+                    impressions += metric.count
+                    viewers += 1  # Simplified
+                elif metric_type is MetricType.ENGAGEMENT:
+                    dwell_time += metric.duration_seconds or 0
+                elif metric_type is MetricType.ERROR:
+                    errors += metric.count
+                
+                if metric.event_type is AnalyticsEvent.CONTENT_VIEW_START:
+                    plays += 1
+                elif metric.event_type is AnalyticsEvent.CONTENT_VIEW_END:
+                    completions += 1
+            
+            for period in (AggregationPeriod.MINUTE, AggregationPeriod.HOUR):
+                period_key = self._get_period_key(now, period)
+                cached = self.real_time_cache.get(period_key)
+                if cached is None:
+                    cached = self.real_time_cache[period_key] = RealTimeMetrics(timestamp=now, period=period)
+                cached.total_impressions += impressions
+                cached.unique_viewers += viewers
+                cached.total_dwell_time += dwell_time
+                cached.error_count += errors
+                cached.content_plays += plays
+                cached.content_completions += completions
+                
+        except Exception as e:
+            logger.error(f"Error updating real-time metrics: {e}")
+    
+    async def _notify_subscribers_batch(self, metrics: List[AnalyticsMetric]):
+        """Send subscribers one summary of a batch rather than one message per metric"""
+        try:
+            if not self.streaming_enabled or not (self.subscribers or self.metric_subscribers):
+                return
+            
+            by_type = defaultdict(lambda: {"count": 0, "value": 0.0})
+            devices = set()
+            for metric in metrics:
+                summary = by_type[metric.metric_type]
+                summary["count"] += 1
+                summary["value"] += metric.value
+                devices.add(metric.device_id)
+            
+            notification = {
+                "type": "metric_batch_update",
+                "metric_count": len(metrics),
+                "device_count": len(devices),
+                "metrics": {metric_type.value: summary for metric_type, summary in by_type.items()},
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            
+            # Notify all subscribers (implementation would use WebSockets/SSE)
+            for subscriber_id in self.subscribers:
+                logger.debug("Notify subscriber %s: %s", subscriber_id, notification)
+            
+            # Metric-specific subscribers only see the types they asked for
+            for metric_type, summary in by_type.items():
+                specific_subscribers = self.metric_subscribers.get(metric_type)
+                if not specific_subscribers:
+                    continue
+                type_notification = {**notification, "metrics": {metric_type.value: summary}}
+                for subscriber_id in specific_subscribers:
+                    logger.debug("Notify specific subscriber %s: %s", subscriber_id, type_notification)
+                
+        except Exception as e:
+            logger.error(f"Error notifying subscribers: {e}")
+    
     async def _notify_subscribers(self, metric: AnalyticsMetric):
         """Notify subscribers of new metrics"""
         try:
@@ -615,10 +751,7 @@ class RealTimeAnalyticsService:
     def _get_device_metrics_from_buffer(self, device_id: str, hours: int) -> List[AnalyticsMetric]:
         """Get metrics for a specific device from buffer"""
         cutoff = datetime.utcnow() - timedelta(hours=hours)
-        return [
-            metric for metric in self.metric_buffer
-            if metric.device_id == device_id and metric.timestamp > cutoff
-        ]
+        return self.metric_store.for_device(device_id, start=cutoff)
     
     def _calculate_average_performance(self, metrics: List[AnalyticsMetric]) -> float:
         """Calculate average performance score from metrics"""
@@ -764,10 +897,7 @@ class RealTimeAnalyticsService:
     
     def _get_campaign_metrics_from_buffer(self, campaign_id: str, start_date: datetime, end_date: datetime) -> List[AnalyticsMetric]:
         """Get campaign metrics from buffer"""
-        return [
-            metric for metric in self.metric_buffer
-            if metric.campaign_id == campaign_id and start_date <= metric.timestamp <= end_date
-        ]
+        return self.metric_store.for_campaign(campaign_id, start_date, end_date)
     
     def _extract_unique_locations(self, metrics: List[AnalyticsMetric]) -> List[Dict]:
         """Extract unique locations from metrics"""
@@ -814,19 +944,19 @@ class RealTimeAnalyticsService:
                 end_time = datetime.utcnow()
             
             # Filter metrics by time range and device
-            filtered_metrics = [
-                metric for metric in self.metric_buffer
-                if start_time <= metric.timestamp <= end_time
-                and (not device_filter or metric.device_id == device_filter)
-            ]
+            if device_filter:
+                filtered_metrics = self.metric_store.for_device(device_filter, start_time, end_time)
+            else:
+                filtered_metrics = self.metric_store.in_window(start_time, end_time)
             
-            # Get unique devices
-            device_ids = list(set(metric.device_id for metric in filtered_metrics))
+            # Group by device
+            metrics_by_device = defaultdict(list)
+            for metric in filtered_metrics:
+                metrics_by_device[metric.device_id].append(metric)
             
             # Build device analytics
             devices_data = []
-            for device_id in device_ids:
-                device_metrics = [m for m in filtered_metrics if m.device_id == device_id]
+            for device_id, device_metrics in metrics_by_device.items():
                 
                 # Calculate device-level analytics
                 impressions = len([m for m in device_metrics if m.metric_type == MetricType.IMPRESSION])
@@ -0,0 +1,356 @@
+"""
+Minute/hour/day rollups of device analytics events.
+
+``RollupAccumulator`` collapses events into per-bucket deltas keyed by
+(granularity, bucket start, device, content, event type); the analytics
+write-behind flushes those deltas into the ``analytics_rollups`` collection
+with the same ``bulk_write`` cycle that writes the raw events, so rollups are
+as fresh as ``device_analytics``. Deltas that fail to write are put back with
+``restore`` and retried by the next flush.
+
+``summarize`` answers ``get_analytics_summary`` from rollups. The requested
+range is split into the coarsest whole buckets that fit (days in the middle,
+hours and minutes towards the edges), so it reads O(buckets) documents. Only
+the sub-minute slivers at the edges - in practice the partial current minute -
+are read from raw events. Like the original query, ``end`` itself is
+included. Rollup documents carry the device's ``company_id`` so access
+control no longer needs every accessible device loaded first.
+
+The write-behind records the timestamp of the first event it rolled up as the
+cutover in ``analytics_rollup_state``. Events before the cutover were never
+rolled up, so that part of a range is read from raw events, and only there are
+events without a ``company_id`` matched by the device's company.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+MINUTE = timedelta(minutes=1)
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+GRANULARITIES = (("minute", MINUTE), ("hour", HOUR), ("day", DAY))
+
+TOP_CONTENT_LIMIT = 5
+CUTOVER_ID = "device_analytics"
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    """Rollups and raw timestamps are naive UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_timestamp(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return to_utc_naive(value)
+    return to_utc_naive(datetime.fromisoformat(str(value).replace("Z", "+00:00")))
+
+
+def floor_to(value: datetime, step: timedelta) -> datetime:
+    if step == DAY:
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if step == HOUR:
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(second=0, microsecond=0)
+
+
+def ceil_to(value: datetime, step: timedelta) -> datetime:
+    floored = floor_to(value, step)
+    return floored if floored == value else floored + step
+
+
+class RollupAccumulator:
+    """In-memory rollup deltas waiting to be flushed"""
+
+    def __init__(self):
+        self._deltas: Dict[Tuple, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    def add(self, event: Dict, company_id: Optional[str] = None) -> None:
+        """``company_id`` overrides the event's own, which older events lack"""
+        company_id = company_id or event.get("company_id")
+        timestamp = parse_timestamp(event["timestamp"])
+        duration = event.get("duration_seconds")
+        has_duration = isinstance(duration, (int, float))
+        revenue = event.get("estimated_revenue") or 0
+
+        for granularity, step in GRANULARITIES:
+            key = (granularity, floor_to(timestamp, step), event["device_id"],
+                   event.get("content_id"), event.get("event_type"))
+            delta = self._deltas.get(key)
+            if delta is None:
+                delta = self._deltas[key] = {
+                    "company_id": company_id,
+                    "count": 0, "revenue": 0.0, "duration_sum": 0.0, "duration_count": 0
+                }
+            delta["count"] += 1
+            delta["revenue"] += revenue
+            if has_duration:
+                delta["duration_sum"] += duration
+                delta["duration_count"] += 1
+
+    def drain(self) -> List[UpdateOne]:
+        """Upserts for every pending delta; the accumulator is left empty"""
+        return self.operations(self.take())
+
+    def take(self) -> Dict[Tuple, Dict[str, Any]]:
+        """Every pending delta by bucket key; the accumulator is left empty"""
+        deltas, self._deltas = self._deltas, {}
+        return deltas
+
+    def restore(self, deltas: Dict[Tuple, Dict[str, Any]]) -> None:
+        """Merge deltas that could not be written back in, to go out with the next drain"""
+        for key, delta in deltas.items():
+            pending = self._deltas.get(key)
+            if pending is None:
+                self._deltas[key] = dict(delta)
+                continue
+            pending["company_id"] = pending["company_id"] or delta["company_id"]
+            for field in ("count", "revenue", "duration_sum", "duration_count"):
+                pending[field] += delta[field]
+
+    @staticmethod
+    def operations(deltas: Dict[Tuple, Dict[str, Any]]) -> List[UpdateOne]:
+        """One upsert per delta, in the order of ``deltas``"""
+        now = datetime.utcnow().isoformat()
+        operations = []
+        for (granularity, bucket_start, device_id, content_id, event_type), delta in deltas.items():
+            rollup_id = f"{granularity}:{bucket_start.isoformat()}:{device_id}:{content_id}:{event_type}"
+            operations.append(UpdateOne(
+                {"id": rollup_id},
+                {
+                    "$set": {
+                        "granularity": granularity,
+                        "bucket_start": bucket_start,
+                        "device_id": device_id,
+                        "company_id": delta["company_id"],
+                        "content_id": content_id,
+                        "event_type": event_type,
+                        "last_updated": now
+                    },
+                    "$inc": {
+                        "count": delta["count"],
+                        "revenue": delta["revenue"],
+                        "duration_sum": delta["duration_sum"],
+                        "duration_count": delta["duration_count"]
+                    }
+                },
+                upsert=True
+            ))
+        return operations
+
+
+def plan_ranges(start: Optional[datetime], end: datetime
+                ) -> Tuple[List[Tuple[str, Optional[datetime], datetime]], List[Tuple[Optional[datetime], datetime]]]:
+    """Split [start, end) into whole rollup buckets plus raw-event slivers.
+
+    Returns ``(bucket_ranges, raw_ranges)``: ``(granularity, from, to)``
+    ranges of bucket starts, and ``(from, to)`` timestamp ranges to read from
+    raw events. ``start=None`` means unbounded. The last raw range always
+    ends at ``end``, so events at exactly ``end`` can be included.
+    """
+    end_minute = floor_to(end, MINUTE)
+    raw_ranges = [(end_minute, end)]
+
+    if start is None:
+        end_day = floor_to(end_minute, DAY)
+        end_hour = floor_to(end_minute, HOUR)
+        buckets = [("day", None, end_day), ("hour", end_day, end_hour), ("minute", end_hour, end_minute)]
+        return [b for b in buckets if b[1] is None or b[1] < b[2]], raw_ranges
+
+    start_minute = ceil_to(start, MINUTE)
+    if start_minute >= end_minute:
+        return [], [(start, end)]
+    if start < start_minute:
+        raw_ranges.insert(0, (start, start_minute))
+
+    start_hour, end_hour = ceil_to(start_minute, HOUR), floor_to(end_minute, HOUR)
+    if start_hour >= end_hour:
+        return [("minute", start_minute, end_minute)], raw_ranges
+
+    start_day, end_day = ceil_to(start_hour, DAY), floor_to(end_hour, DAY)
+    if start_day >= end_day:
+        buckets = [("minute", start_minute, start_hour), ("hour", start_hour, end_hour),
+                   ("minute", end_hour, end_minute)]
+    else:
+        buckets = [("minute", start_minute, start_hour), ("hour", start_hour, start_day),
+                   ("day", start_day, end_day), ("hour", end_day, end_hour),
+                   ("minute", end_hour, end_minute)]
+    return [b for b in buckets if b[1] < b[2]], raw_ranges
+
+
+def _scope_filter(company_ids: List[str], device_ids: Optional[List[str]],
+                  content_ids: Optional[List[str]], event_types: Optional[List[str]]) -> Dict:
+    match: Dict[str, Any] = {"company_id": {"$in": company_ids}}
+    if device_ids:
+        match["device_id"] = {"$in": device_ids}
+    if content_ids:
+        match["content_id"] = {"$in": content_ids}
+    if event_types:
+        match["event_type"] = {"$in": event_types}
+    return match
+
+
+def _bucket_filter(bucket_ranges: Iterable[Tuple[str, Optional[datetime], datetime]]) -> Dict:
+    clauses = []
+    for granularity, range_start, range_end in bucket_ranges:
+        bounds: Dict[str, Any] = {"$lt": range_end}
+        if range_start is not None:
+            bounds["$gte"] = range_start
+        clauses.append({"granularity": granularity, "bucket_start": bounds})
+    return {"$or": clauses}
+
+
+def _raw_filter(raw_ranges: Iterable[Tuple[Optional[datetime], datetime]], end: datetime) -> Dict:
+    clauses = []
+    for range_start, range_end in raw_ranges:
+        bounds: Dict[str, Any] = {"$lte" if range_end == end else "$lt": range_end.isoformat()}
+        if range_start is not None:
+            bounds["$gte"] = range_start.isoformat()
+        clauses.append({"timestamp": bounds})
+    return {"$or": clauses}
+
+
+async def _legacy_scope(db, scope: Dict, company_ids: List[str], device_ids: Optional[List[str]]) -> Dict:
+    """Scope for pre-cutover events; those without a ``company_id`` are matched by device"""
+    devices = await db.digital_screens.distinct("id", {"company_id": {"$in": company_ids}})
+    if device_ids:
+        requested = set(device_ids)
+        devices = [device_id for device_id in devices if device_id in requested]
+    legacy_scope = {key: value for key, value in scope.items() if key != "company_id"}
+    legacy_scope["$and"] = [{"$or": [
+        {"company_id": scope["company_id"]},
+        {"company_id": None, "device_id": {"$in": devices}}
+    ]}]
+    return legacy_scope
+
+
+async def record_cutover(db, first_event: datetime) -> None:
+    """Note the earliest rolled-up event; ``$min`` keeps the earliest across workers"""
+    await db.analytics_rollup_state.update_one(
+        {"id": CUTOVER_ID}, {"$min": {"cutover": first_event}}, upsert=True
+    )
+
+
+async def rollup_cutover(db) -> Optional[datetime]:
+    """When rollups started, or None if nothing has been rolled up yet"""
+    state = await db.analytics_rollup_state.find_one({"id": CUTOVER_ID}, {"cutover": 1})
+    return state.get("cutover") if state else None
+
+
+def _totals_stage(count_expr: Any, revenue: str, duration_sum: Any, duration_count: Any) -> Dict:
+    return {"$group": {
+        "_id": {"content_id": "$content_id", "event_type": "$event_type"},
+        "count": {"$sum": count_expr},
+        "revenue": {"$sum": revenue},
+        "duration_sum": {"$sum": duration_sum},
+        "duration_count": {"$sum": duration_count},
+        "devices": {"$addToSet": "$device_id"}
+    }}
+
+
+async def _collect(cursor) -> List[Dict]:
+    return await cursor.to_list(length=None)
+
+
+async def _raw_groups(db, match: Dict) -> List[Dict]:
+    numeric_duration = {"$isNumber": "$duration_seconds"}
+    return await _collect(db.device_analytics.aggregate([
+        {"$match": match},
+        _totals_stage(1, "$estimated_revenue",
+                      {"$cond": [numeric_duration, "$duration_seconds", 0]},
+                      {"$cond": [numeric_duration, 1, 0]})
+    ]))
+
+
+async def summarize(db, company_ids: List[str], start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, device_ids: Optional[List[str]] = None,
+                    content_ids: Optional[List[str]] = None,
+                    event_types: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Analytics summary fields for ``AnalyticsSummary``, read from rollups"""
+    end = to_utc_naive(end) if end else datetime.utcnow()
+    start = to_utc_naive(start) if start else None
+    scope = _scope_filter(company_ids, device_ids, content_ids, event_types)
+
+    cutover = await rollup_cutover(db)
+    bucket_ranges: List[Tuple[str, Optional[datetime], datetime]] = []
+    raw_ranges: List[Tuple[Optional[datetime], datetime]] = []
+    legacy_ranges: List[Tuple[Optional[datetime], datetime]] = []
+    if cutover is None or end <= cutover:
+        legacy_ranges = [(start, end)]
+    elif start is None or start < cutover:
+        legacy_ranges = [(start, cutover)]
+        bucket_ranges, raw_ranges = plan_ranges(cutover, end)
+    else:
+        bucket_ranges, raw_ranges = plan_ranges(start, end)
+
+    groups: List[Dict] = []
+    if bucket_ranges:
+        groups += await _collect(db.analytics_rollups.aggregate([
+            {"$match": {**scope, **_bucket_filter(bucket_ranges)}},
+            _totals_stage("$count", "$revenue", "$duration_sum", "$duration_count")
+        ]))
+    if raw_ranges:
+        groups += await _raw_groups(db, {**scope, **_raw_filter(raw_ranges, end)})
+    if legacy_ranges:
+        legacy_scope = await _legacy_scope(db, scope, company_ids, device_ids)
+        groups += await _raw_groups(db, {**legacy_scope, **_raw_filter(legacy_ranges, end)})
+
+    impressions = interactions = duration_count = 0
+    revenue = duration_sum = 0.0
+    devices = set()
+    content_impressions: Dict[Any, int] = {}
+    for group in groups:
+        event_type = group["_id"].get("event_type")
+        revenue += group.get("revenue") or 0
+        duration_sum += group.get("duration_sum") or 0
+        duration_count += group.get("duration_count") or 0
+        devices.update(group.get("devices", []))
+        if event_type == "impression":
+            impressions += group["count"]
+            content_id = group["_id"].get("content_id")
+            content_impressions[content_id] = content_impressions.get(content_id, 0) + group["count"]
+        elif event_type == "interaction":
+            interactions += group["count"]
+
+    top_content = sorted(content_impressions.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "total_impressions": impressions,
+        "total_revenue": revenue,
+        "total_interactions": interactions,
+        "unique_devices": len(devices),
+        "avg_engagement_time": duration_sum / duration_count if duration_count else 0.0,
+        "top_performing_content": [
+            {"_id": content_id, "impressions": count}
+            for content_id, count in top_content[:TOP_CONTENT_LIMIT]
+        ],
+        "hourly_breakdown": await _hourly_breakdown(db, scope, start, end)
+    }
+
+
+async def _hourly_breakdown(db, scope: Dict, start: Optional[datetime], end: datetime) -> List[Dict]:
+    """Per-hour totals from hour rollups; the last 24 hours when no start is given.
+
+    Hours before the rollup cutover have no rollups and are left out.
+    """
+    first_hour = floor_to(start or end - DAY, HOUR)
+    rows = await _collect(db.analytics_rollups.aggregate([
+        {"$match": {**scope, "granularity": "hour", "bucket_start": {"$gte": first_hour, "$lt": end}}},
+        {"$group": {
+            "_id": "$bucket_start",
+            "impressions": {"$sum": {"$cond": [{"$eq": ["$event_type", "impression"]}, "$count", 0]}},
+            "interactions": {"$sum": {"$cond": [{"$eq": ["$event_type", "interaction"]}, "$count", 0]}},
+            "revenue": {"$sum": "$revenue"}
+        }},
+        {"$sort": {"_id": 1}}
+    ]))
+    return [
+        {"hour": row["_id"].isoformat(), "impressions": row["impressions"],
+         "interactions": row["interactions"], "revenue": row["revenue"]}
+        for row in rows
+    ]
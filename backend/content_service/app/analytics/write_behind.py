@@ -0,0 +1,294 @@
+"""
+Write-behind buffer for device analytics events and their rollups.
+
+Devices post analytics events continuously; writing each one as an insert plus
+an upsert made per-event round trips the dominant Mongo write load. Events are
+instead buffered in process and flushed every ``ANALYTICS_FLUSH_INTERVAL_SECONDS``:
+raw events go out in one unordered ``insert_many`` and the ``daily_metrics``
+``$inc`` deltas, collapsed per (device, content, date), in one unordered
+``bulk_write``. The minute/hour/day ``analytics_rollups`` deltas (see
+``app.analytics.rollups``) go out in a second ``bulk_write`` in the same flush;
+the first flush of each process also records the rollup cutover.
+
+Memory is bounded by ``ANALYTICS_MAX_BUFFERED_EVENTS``. When the buffer is full
+the flusher is woken early and further events are dropped (and counted) until
+it drains. ``stop()`` flushes whatever is still buffered.
+
+Each flush stage fails on its own. Rollup deltas are built at flush time from
+the events ``insert_many`` actually wrote, so only events that were not
+inserted are counted as dropped and none of their deltas are applied. A
+``daily_metrics`` or ``analytics_rollups`` upsert that fails is merged back
+into the pending deltas and retried with the next flush, so the rollups
+converge with ``device_analytics`` once Mongo recovers. A ``BulkWriteError``
+names the failed upserts and only those are requeued; any other error requeues
+the whole batch, which double counts only if the server applied it and the
+connection was lost before it replied.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.analytics.rollups import RollupAccumulator, parse_timestamp, record_cutover
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# analytics event_type -> daily_metrics counter
+ROLLUP_COUNTERS = {
+    "impression": "impressions",
+    "interaction": "interactions",
+    "completion": "completions",
+}
+
+
+class AnalyticsWriteBehind:
+    """Buffers analytics events and flushes them to Mongo in batches"""
+
+    def __init__(self, get_db: Optional[Callable[[], Any]] = None,
+                 flush_interval: Optional[float] = None,
+                 max_buffered_events: Optional[int] = None):
+        self._get_db = get_db or _default_db
+        self.flush_interval = flush_interval if flush_interval is not None else settings.ANALYTICS_FLUSH_INTERVAL_SECONDS
+        self.max_buffered_events = max_buffered_events or settings.ANALYTICS_MAX_BUFFERED_EVENTS
+        self._events: List[Dict] = []
+        self._rollups: Dict[str, Dict[str, Any]] = {}
+        self._buckets = RollupAccumulator()
+        self._cutover_recorded = False
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._metrics = {
+            'events_received': 0,
+            'events_flushed': 0,
+            'events_dropped': 0,
+            'rollups_flushed': 0,
+            'bucket_rollups_flushed': 0,
+            'rollups_requeued': 0,
+            'bucket_rollups_requeued': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0.0
+        }
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def record(self, analytics_doc: Dict) -> bool:
+        """Buffer one event; False if it was dropped"""
+        self._metrics['events_received'] += 1
+        self._ensure_started()
+        if len(self._events) >= self.max_buffered_events:
+            self._metrics['events_dropped'] += 1
+            self._wake()
+            return False
+
+        self._events.append(analytics_doc)
+        if len(self._events) >= self.max_buffered_events:
+            self._wake()
+        return True
+
+    def _add_rollup(self, analytics_doc: Dict) -> None:
+        timestamp = datetime.fromisoformat(analytics_doc["timestamp"].replace("Z", "+00:00"))
+        date_key = timestamp.date().isoformat()
+        daily_key = f"{analytics_doc['device_id']}_{analytics_doc['content_id']}_{date_key}"
+
+        rollup = self._rollups.get(daily_key)
+        if rollup is None:
+            rollup = self._rollups[daily_key] = {
+                "set": {
+                    "device_id": analytics_doc["device_id"],
+                    "content_id": analytics_doc["content_id"],
+                    "date": date_key
+                },
+                "inc": {}
+            }
+        rollup["set"]["last_updated"] = datetime.utcnow().isoformat()
+
+        inc = rollup["inc"]
+        counter = ROLLUP_COUNTERS.get(analytics_doc.get("event_type"))
+        if counter:
+            inc[counter] = inc.get(counter, 0) + 1
+        revenue = analytics_doc.get("estimated_revenue") or 0
+        if revenue > 0:
+            inc["revenue"] = inc.get("revenue", 0) + revenue
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    async def flush(self) -> int:
+        """Write everything buffered so far; returns the number of events written"""
+        async with self._flush_lock:
+            if not self._events and not self._rollups and not len(self._buckets):
+                return 0
+            events, self._events = self._events, []
+
+            started = time.perf_counter()
+            try:
+                try:
+                    db = self._get_db()
+                    if events and not self._cutover_recorded:
+                        await record_cutover(db, min(parse_timestamp(event["timestamp"]) for event in events))
+                        self._cutover_recorded = True
+                except Exception as e:
+                    # Nothing was written yet, so the events can simply wait for the next flush
+                    self._events[:0] = events
+                    self._metrics['flush_errors'] += 1
+                    logger.error(f"Analytics flush of {len(events)} events failed before writing: {e}")
+                    return 0
+
+                written = await self._insert_events(db, events)
+                for event in written:
+                    self._add_rollup(event)
+                    self._buckets.add(event)
+                await self._write_daily_metrics(db)
+                await self._write_bucket_rollups(db)
+            finally:
+                self._metrics['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+            self._metrics['flushes'] += 1
+            self._metrics['events_flushed'] += len(written)
+            return len(written)
+
+    async def _insert_events(self, db, events: List[Dict]) -> List[Dict]:
+        """Insert raw events; returns the ones that were written"""
+        if not events:
+            return []
+        try:
+            await db.device_analytics.insert_many(events, ordered=False)
+            return events
+        except BulkWriteError as e:
+            failed = {write_error["index"] for write_error in e.details.get("writeErrors", [])}
+            written = [event for index, event in enumerate(events) if index not in failed]
+            error = e
+        except Exception as e:
+            failed, written, error = events, [], e
+        self._metrics['flush_errors'] += 1
+        self._metrics['events_dropped'] += len(failed)
+        logger.error(f"Analytics insert of {len(failed)} of {len(events)} events failed: {error}")
+        return written
+
+    async def _write_daily_metrics(self, db) -> None:
+        """Upsert pending ``daily_metrics`` deltas, requeueing the ones that failed"""
+        if not self._rollups:
+            return
+        rollups, self._rollups = self._rollups, {}
+        keys = list(rollups)
+        operations = []
+        for daily_key in keys:
+            rollup = rollups[daily_key]
+            update = {"$set": rollup["set"]}
+            if rollup["inc"]:
+                update["$inc"] = rollup["inc"]
+            operations.append(UpdateOne({"id": daily_key}, update, upsert=True))
+        try:
+            await db.daily_metrics.bulk_write(operations, ordered=False)
+            self._metrics['rollups_flushed'] += len(operations)
+            return
+        except BulkWriteError as e:
+            failed = sorted({write_error["index"] for write_error in e.details.get("writeErrors", [])})
+            self._metrics['rollups_flushed'] += len(operations) - len(failed)
+            error = e
+        except Exception as e:
+            failed, error = range(len(keys)), e
+        for index in failed:
+            self._requeue_rollup(keys[index], rollups[keys[index]])
+        self._metrics['flush_errors'] += 1
+        self._metrics['rollups_requeued'] += len(failed)
+        logger.error(f"Analytics flush of {len(failed)} daily rollups failed, requeued: {error}")
+
+    async def _write_bucket_rollups(self, db) -> None:
+        """Upsert pending ``analytics_rollups`` deltas, requeueing the ones that failed"""
+        if not len(self._buckets):
+            return
+        deltas = self._buckets.take()
+        keys = list(deltas)
+        operations = self._buckets.operations(deltas)
+        try:
+            await db.analytics_rollups.bulk_write(operations, ordered=False)
+            self._metrics['bucket_rollups_flushed'] += len(operations)
+            return
+        except BulkWriteError as e:
+            failed = sorted({write_error["index"] for write_error in e.details.get("writeErrors", [])})
+            self._metrics['bucket_rollups_flushed'] += len(operations) - len(failed)
+            error = e
+        except Exception as e:
+            failed, error = range(len(keys)), e
+        self._buckets.restore({keys[index]: deltas[keys[index]] for index in failed})
+        self._metrics['flush_errors'] += 1
+        self._metrics['bucket_rollups_requeued'] += len(failed)
+        logger.error(f"Analytics flush of {len(failed)} bucket rollups failed, requeued: {error}")
+
+    def _requeue_rollup(self, daily_key: str, rollup: Dict[str, Any]) -> None:
+        pending = self._rollups.get(daily_key)
+        if pending is None:
+            # Copied: the failed operation still references the original
+            pending = self._rollups[daily_key] = {"set": dict(rollup["set"]), "inc": {}}
+        inc = pending["inc"]
+        for counter, value in rollup["inc"].items():
+            inc[counter] = inc.get(counter, 0) + value
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _ensure_started(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._stopping:
+            return
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        """Stop the background flusher and flush what is still buffered"""
+        self._stopping = True
+        try:
+            if self._task is not None:
+                # Let an in-progress flush finish rather than cancelling it mid-write
+                self._wake()
+                await self._task
+                self._task = None
+            await self.flush()
+        finally:
+            self._stopping = False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self._metrics,
+            'events_buffered': len(self._events),
+            'rollups_buffered': len(self._rollups),
+            'bucket_rollups_buffered': len(self._buckets),
+            'max_buffered_events': self.max_buffered_events,
+            'flush_interval_seconds': self.flush_interval
+        }
+
+
+def _default_db():
+    from app.database_service import db_service
+    return db_service.db
+
+
+# Global analytics write-behind buffer
+analytics_write_behind = AnalyticsWriteBehind()
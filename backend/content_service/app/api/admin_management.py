@@ -15,6 +15,7 @@ from app.models.ad_slot_models import (
 )
 from app.auth_service import get_current_user, require_role
 from app.database_service import db_service
+from app.playlist_cache import playlist_cache
 
 router = APIRouter(prefix="/admin", tags=["Admin Management"])
 
@@ -359,6 +360,7 @@ async def override_moderation_decision(
             "updated_at": datetime.utcnow()
         }}
     )
+    playlist_cache.invalidate_content(content_id)
     
     # Log the override
     moderation_log = ModerationLog(
@@ -14,6 +14,7 @@ from app.models.ad_slot_models import (
 )
 from app.auth_service import get_current_user, require_role
 from app.database_service import db_service
+from app.playlist_cache import playlist_cache
 
 router = APIRouter(prefix="/moderation", tags=["Content Moderation"])
 
@@ -44,6 +45,7 @@ async def trigger_ai_moderation(
             "updated_at": datetime.utcnow()
         }}
     )
+    playlist_cache.invalidate_content(content_id)
     
     # Trigger AI moderation process
     ai_result = await run_ai_moderation(content)
@@ -73,6 +75,7 @@ async def trigger_ai_moderation(
         {"_id": content_id},
         {"$set": update_data}
     )
+    playlist_cache.invalidate_content(content_id)
     
     # Log moderation action
     moderation_log = ModerationLog(
@@ -350,6 +353,7 @@ async def approve_content(
         {"_id": content_id},
         {"$set": update_data}
     )
+    playlist_cache.invalidate_content(content_id)
     
     # Log moderation action
     moderation_log = ModerationLog(
@@ -407,6 +411,7 @@ async def reject_content(
             "updated_at": datetime.utcnow()
         }}
     )
+    playlist_cache.invalidate_content(content_id)
     
     # Log moderation action
     moderation_log = ModerationLog(
@@ -470,6 +475,7 @@ async def quarantine_content(
             "updated_at": datetime.utcnow()
         }}
     )
+    playlist_cache.invalidate_content(content_id)
     
     # Log moderation action
     moderation_log = ModerationLog(
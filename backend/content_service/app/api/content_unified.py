@@ -15,8 +15,8 @@ This unified API provides:
 - Analytics and reporting
 """
 
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request, BackgroundTasks, Query, Form
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request, BackgroundTasks, Query, Form, Header
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
 from typing import List, Dict, Optional, Any
 from datetime import datetime, timedelta
 import uuid
@@ -35,7 +35,11 @@ from ..models import (
 from app.api.auth import get_current_user, require_roles, get_user_company_context
 from ..repo import repo
 from ..database_service import db_service
-from ..storage import save_media
+from ..playlist_cache import playlist_cache
+from ..schedule_index import schedule_index
+from ..upload_pipeline import ingest_upload
+from ..analytics.write_behind import analytics_write_behind
+from ..analytics import rollups as analytics_rollups
 from ..utils.serialization import safe_json_response
 from ..history_service import HistoryService
 from app.events.event_manager import publish_content_event
@@ -44,7 +48,7 @@ from app.events.event_manager import publish_content_event
 try:
     from ..content_delivery import (
         content_scheduler, proof_of_play_service, content_distributor,
-        PlaybackEvent, DeliveryMode, SchedulePriority
+        PlaybackEvent, DeliveryMode, SchedulePriority, fleet_playlist_precomputer
     )
     CONTENT_DELIVERY_AVAILABLE = True
 except ImportError:
@@ -157,6 +161,7 @@ async def update_content(
         )
 
         updated_content = await repo.update_content_meta(content_id, filtered_data)
+        playlist_cache.invalidate_content(content_id)
         return safe_json_response(updated_content)
     except HTTPException:
         raise
@@ -229,19 +234,16 @@ async def replace_content_file(
         if file.size > 100 * 1024 * 1024:  # 100MB limit
             raise HTTPException(status_code=413, detail="File too large")
 
-        # Read file content
-        file_content = await file.read()
-
-        # Save new file
-        from ..storage import save_media
-        file_url = save_media(file.filename, file_content, file.content_type)
+        # Stream the new file to storage
+        ingest = await ingest_upload(file, file.filename, file.content_type)
+        file_url = ingest.path
 
         # Update content with new file information
         update_data = {
             "filename": file.filename,
             "file_url": file_url,
             "content_type": file.content_type,
-            "size": len(file_content),
+            "size": ingest.file_size,
             "updated_at": datetime.utcnow().isoformat(),
             "updated_by": current_user.get("id"),
             "status": "quarantine"  # Re-quarantine for review after file replacement
@@ -257,12 +259,13 @@ async def replace_content_file(
                 "action": "file_replaced",
                 "old_filename": existing_content.get("filename"),
                 "new_filename": file.filename,
-                "new_size": len(file_content),
+                "new_size": ingest.file_size,
                 "new_content_type": file.content_type
             }
         )
 
         updated_content = await repo.update_content_meta(content_id, update_data)
+        playlist_cache.invalidate_content(content_id)
         return safe_json_response({
             "message": "File replaced successfully",
             "content": updated_content
@@ -285,6 +288,7 @@ async def delete_content(
             raise HTTPException(status_code=404, detail="Content not found")
 
         await repo.delete_content_meta(content_id)
+        playlist_cache.invalidate_content(content_id)
         return {"message": "Content deleted successfully"}
     except HTTPException:
         raise
@@ -303,6 +307,7 @@ async def approve_content(
             raise HTTPException(status_code=404, detail="Content not found")
 
         await repo.update_content_status(content_id, "approved", current_user.get("id"))
+        playlist_cache.invalidate_content(content_id)
         return {"message": "Content approved successfully"}
     except HTTPException:
         raise
@@ -322,6 +327,7 @@ async def reject_content(
             raise HTTPException(status_code=404, detail="Content not found")
 
         await repo.update_content_status(content_id, "rejected", current_user.get("id"), reason)
+        playlist_cache.invalidate_content(content_id)
         return {"message": "Content rejected successfully"}
     except HTTPException:
         raise
@@ -431,6 +437,7 @@ async def review_content(
 
         # Update content
         await repo.update_content_meta(content_id, update_data)
+        playlist_cache.invalidate_content(content_id)
 
         # Track review event
         event_type = ContentHistoryEventType.APPROVED if review_data.action == "approve" else ContentHistoryEventType.REJECTED
@@ -549,6 +556,7 @@ async def admin_reject_content(
             current_user.id,
             notes="Rejected by admin"
         )
+        playlist_cache.invalidate_content(content_id)
 
         return safe_json_response({"message": "Content rejected successfully"})
 
@@ -583,11 +591,16 @@ async def _process_upload_files(
     client_ip = request.client.host if request.client else "unknown"
 
     for f in files:
+        filename = f.filename or "upload.bin"
         try:
-            filename = f.filename or "upload.bin"
             ctype = f.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
-            content = await f.read()
-            file_size = len(content)
+
+            # Stream to storage, hashing and scanning each chunk on the way
+            ingest = await ingest_upload(
+                f, filename, ctype,
+                scanner=content_scanner if SECURITY_SCANNING_ENABLED else None
+            )
+            file_size = ingest.file_size
 
             # Security scanning
             if SECURITY_SCANNING_ENABLED:
@@ -599,8 +612,8 @@ async def _process_upload_files(
                     ip_address=client_ip
                 )
 
-                scan_result = await content_scanner.scan_content(content, filename, ctype)
-                if scan_result.security_level == "blocked":
+                scan_result = ingest.scan_result
+                if ingest.blocked:
                     rejected.append({
                         "filename": filename,
                         "reason": "security_blocked",
@@ -608,8 +621,7 @@ async def _process_upload_files(
                     })
                     continue
 
-            # Save file
-            path = save_media(filename, content, content_type=ctype)
+            path = ingest.path
 
             # Create metadata
             content_status = "approved" if SECURITY_SCANNING_ENABLED and 'scan_result' in locals() and scan_result.security_level == "safe" else "pending"
@@ -717,10 +729,15 @@ async def upload_content_file(
             raise HTTPException(status_code=400, detail="No file provided")
 
         filename = file.filename
-        content = await file.read()
-        file_size = len(content)
         content_type = file.content_type or "application/octet-stream"
 
+        # Stream to storage, hashing and scanning each chunk on the way
+        ingest = await ingest_upload(
+            file, filename, content_type,
+            scanner=content_scanner if SECURITY_SCANNING_ENABLED else None
+        )
+        file_size = ingest.file_size
+
         # Security scanning
         if SECURITY_SCANNING_ENABLED:
             client_ip = request.client.host if request.client else "unknown"
@@ -732,16 +749,14 @@ async def upload_content_file(
                 ip_address=client_ip
             )
 
-            scan_result = await content_scanner.scan_content(content, filename, content_type)
-            if scan_result.security_level == "blocked":
+            if ingest.blocked:
                 return safe_json_response({
                     "status": "rejected",
                     "message": "Content blocked by security scanner",
-                    "details": scan_result.content_warnings
+                    "details": ingest.scan_result.content_warnings
                 })
 
-        # Save file
-        file_path = save_media(filename, content, content_type=content_type)
+        file_path = ingest.path
 
         # Detect content duration for videos
         detected_duration = None
@@ -885,6 +900,20 @@ async def upload_content_files(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
 
+@router.get("/scanner/metrics")
+async def get_scanner_metrics(
+    current_user: UserProfile = Depends(require_roles("SUPER_USER"))
+):
+    """Image analysis pool queue depth and latency (Super User only)"""
+    try:
+        from ..security.image_analysis import image_analysis_pool
+    except ImportError:
+        raise HTTPException(status_code=503, detail="Image analysis not available")
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "image_analysis": image_analysis_pool.get_metrics()
+    }
+
 @router.get("/files/{filename}")
 async def serve_content_file(filename: str):
     """Serve content files"""
@@ -992,9 +1021,10 @@ async def create_content_schedule(
 async def get_device_playlist(
     device_id: str,
     target_time: Optional[str] = Query(None, description="ISO format datetime"),
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(require_roles("HOST", "ADMIN"))
 ):
-    """Get optimized playlist for a device"""
+    """Get optimized playlist for a device; 304 if the If-None-Match ETag is current"""
     if not CONTENT_DELIVERY_AVAILABLE:
         raise HTTPException(status_code=503, detail="Content delivery service not available")
 
@@ -1004,12 +1034,16 @@ async def get_device_playlist(
         else:
             target_datetime = datetime.utcnow()
 
-        result = await content_scheduler.get_device_playlist(device_id, target_datetime)
+        # Usually a precomputed, already serialized playlist from the playlist cache
+        compiled = await content_scheduler.get_device_playlist_payload(device_id, target_datetime)
 
-        if not result.get("success"):
-            raise HTTPException(status_code=400, detail=result.get("error"))
+        if not compiled.result.get("success"):
+            raise HTTPException(status_code=400, detail=compiled.result.get("error"))
 
-        return JSONResponse(content=result)
+        headers = {"ETag": compiled.etag, "Cache-Control": "private, no-cache"}
+        if if_none_match and _etag_matches(if_none_match, compiled.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=compiled.body, media_type="application/json", headers=headers)
 
     except HTTPException:
         raise
@@ -1017,6 +1051,25 @@ async def get_device_playlist(
         logger.error(f"Failed to get playlist for device {device_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to get playlist")
 
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """True if an If-None-Match header lists the ETag (weak comparison, as for GET)"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+@router.get("/schedules/playlists/metrics")
+async def get_playlist_cache_metrics(
+    current_user: UserProfile = Depends(require_roles("SUPER_USER"))
+):
+    """Compiled playlist cache hit rate, build times and fleet precompute runs (Super User only)"""
+    metrics = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "playlist_cache": playlist_cache.get_metrics()
+    }
+    if CONTENT_DELIVERY_AVAILABLE:
+        metrics["fleet_precompute"] = fleet_playlist_precomputer.get_metrics()
+    return metrics
+
 @router.post("/proof-of-play/record")
 async def record_playback_event(
     request: PlaybackEventRequest,
@@ -1290,6 +1343,9 @@ async def schedule_content_to_devices(
 
         # Save schedule to database
         await db_service.db.content_schedules.insert_one(schedule_data)
+        schedule_index.add({k: v for k, v in schedule_data.items() if k != "_id"})
+        schedule_index.mark_written(await repo.bump_schedule_version())
+        playlist_cache.invalidate_schedule(schedule_id, schedule_request.device_ids)
 
         # If immediate deployment, trigger distribution now
         if schedule_request.deployment_type == "immediate":
@@ -1518,6 +1574,7 @@ async def update_device_content_config(device_id: str, content_id: str, layout_i
         {"id": device_id},
         {"$set": config_update}
     )
+    playlist_cache.invalidate_device(device_id, config_update)
 
 # ============================================================================
 # CONTENT ANALYTICS (from app/api/enhanced_content.py)
@@ -1537,17 +1594,31 @@ async def record_device_analytics(
         analytics_doc = {
             **analytics.model_dump(),
             "id": str(uuid.uuid4()),
+            "company_id": device.get("company_id"),
             "timestamp": datetime.utcnow().isoformat()
         }
 
-        await db_service.db.device_analytics.insert_one(analytics_doc)
-        await update_aggregated_metrics(analytics_doc)
+        # Buffered and written in batches, together with the daily and time-bucketed rollups
+        if not analytics_write_behind.record(analytics_doc):
+            raise HTTPException(status_code=503, detail="Analytics buffer full, retry later")
 
         return {"success": True, "message": "Analytics recorded"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to record analytics: {str(e)}")
 
+@router.get("/analytics/write-behind/metrics")
+async def get_analytics_write_behind_metrics(
+    current_user: UserProfile = Depends(require_roles("SUPER_USER"))
+):
+    """Analytics write-behind buffer counters (Super User only)"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "write_behind": analytics_write_behind.get_metrics()
+    }
+
 @router.get("/analytics/summary", response_model=AnalyticsSummary)
 async def get_analytics_summary(
     query: AnalyticsQuery,
@@ -1556,129 +1627,22 @@ async def get_analytics_summary(
 ):
     """Get analytics summary with filtering"""
     try:
-        match_stage = {}
-
-        if query.start_date:
-            match_stage["timestamp"] = {"$gte": query.start_date.isoformat()}
-        if query.end_date:
-            if "timestamp" not in match_stage:
-                match_stage["timestamp"] = {}
-            match_stage["timestamp"]["$lte"] = query.end_date.isoformat()
-
+        # Read from the minute/hour/day rollups; only sub-minute edges hit raw events
         accessible_company_ids = [c["id"] for c in company_context["accessible_companies"]]
-        if query.device_ids:
-            device_query = {
-                "id": {"$in": query.device_ids},
-                "company_id": {"$in": accessible_company_ids}
-            }
-            devices_cursor = db_service.db.digital_screens.find(device_query)
-            accessible_devices = await devices_cursor.to_list(length=None)
-            accessible_device_ids = [d["id"] for d in accessible_devices]
-            match_stage["device_id"] = {"$in": accessible_device_ids}
-        else:
-            devices_cursor = db_service.db.digital_screens.find({"company_id": {"$in": accessible_company_ids}})
-            accessible_devices = await devices_cursor.to_list(length=None)
-            accessible_device_ids = [d["id"] for d in accessible_devices]
-            match_stage["device_id"] = {"$in": accessible_device_ids}
-
-        if query.content_ids:
-            match_stage["content_id"] = {"$in": query.content_ids}
-
-        if query.event_types:
-            match_stage["event_type"] = {"$in": query.event_types}
-
-        pipeline = [
-            {"$match": match_stage},
-            {
-                "$group": {
-                    "_id": None,
-                    "total_impressions": {
-                        "$sum": {"$cond": [{"$eq": ["$event_type", "impression"]}, 1, 0]}
-                    },
-                    "total_revenue": {"$sum": "$estimated_revenue"},
-                    "total_interactions": {
-                        "$sum": {"$cond": [{"$eq": ["$event_type", "interaction"]}, 1, 0]}
-                    },
-                    "unique_devices": {"$addToSet": "$device_id"},
-                    "avg_engagement_time": {"$avg": "$duration_seconds"}
-                }
-            }
-        ]
-
-        cursor = db_service.db.device_analytics.aggregate(pipeline)
-        result = await cursor.to_list(length=1)
-
-        if result:
-            summary_data = result[0]
-            summary_data["unique_devices"] = len(summary_data.get("unique_devices", []))
-        else:
-            summary_data = {
-                "total_impressions": 0,
-                "total_revenue": 0.0,
-                "total_interactions": 0,
-                "unique_devices": 0,
-                "avg_engagement_time": 0.0
-            }
-
-        top_content_pipeline = [
-            {"$match": match_stage},
-            {"$group": {
-                "_id": "$content_id",
-                "impressions": {"$sum": {"$cond": [{"$eq": ["$event_type", "impression"]}, 1, 0]}}}},
-            {"$sort": {"impressions": -1}},
-            {"$limit": 5}
-        ]
-
-        top_content_cursor = db_service.db.device_analytics.aggregate(top_content_pipeline)
-        top_content = await top_content_cursor.to_list(length=5)
-
-        return AnalyticsSummary(
-            **summary_data,
-            top_performing_content=top_content,
-            revenue_by_category={},
-            hourly_breakdown=[]
+        summary_data = await analytics_rollups.summarize(
+            db_service.db,
+            accessible_company_ids,
+            start=query.start_date,
+            end=query.end_date,
+            device_ids=query.device_ids,
+            content_ids=query.content_ids,
+            event_types=query.event_types
         )
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get analytics summary: {str(e)}")
-
-async def update_aggregated_metrics(analytics_doc: Dict):
-    """Update aggregated metrics for faster querying"""
-    try:
-        timestamp = datetime.fromisoformat(analytics_doc["timestamp"].replace("Z", "+00:00"))
-        date_key = timestamp.date().isoformat()
-        hour_key = timestamp.hour
-
-        daily_key = f"{analytics_doc['device_id']}_{analytics_doc['content_id']}_{date_key}"
-
-        update_data = {
-            "device_id": analytics_doc["device_id"],
-            "content_id": analytics_doc["content_id"],
-            "date": date_key,
-            "last_updated": datetime.utcnow().isoformat()
-        }
-
-        if analytics_doc["event_type"] == "impression":
-            update_data["$inc"] = {"impressions": 1}
-        elif analytics_doc["event_type"] == "interaction":
-            update_data["$inc"] = {"interactions": 1}
-        elif analytics_doc["event_type"] == "completion":
-            update_data["$inc"] = {"completions": 1}
-
-        if analytics_doc.get("estimated_revenue", 0) > 0:
-            if "$inc" not in update_data:
-                update_data["$inc"] = {}
-            update_data["$inc"]["revenue"] = analytics_doc["estimated_revenue"]
-
-        await db_service.db.daily_metrics.update_one(
-            {"id": daily_key},
-            {"$set": update_data, "$inc": update_data.get("$inc", {})},
-            upsert=True
-        )
+        return AnalyticsSummary(**summary_data, revenue_by_category={})
 
     except Exception as e:
-        # Log error for debugging
-        print(f"Failed to update aggregated metrics: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get analytics summary: {str(e)}")
 
 
 # ============================================================================
@@ -1750,6 +1714,7 @@ async def _trigger_ai_moderation(content_id: str, file_path: str, content_meta:
             update_data["ai_warnings"] = warnings
 
         await repo.update_content_meta(content_id, update_data)
+        playlist_cache.invalidate_content(content_id)
 
         # Track AI moderation completion event
         company_id = content_meta.get("company_id") or content_meta.get("owner_company_id")
@@ -1887,6 +1852,7 @@ async def _trigger_content_distribution(schedule_id: str, schedule_data: Dict):
             {"id": {"$in": device_ids}},
             {"$set": update_data}
         )
+        playlist_cache.invalidate_devices(device_ids)
 
         # Record distribution in schedule history
         distribution_record = {
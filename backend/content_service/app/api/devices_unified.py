@@ -37,6 +37,9 @@ from app.api.auth import require_roles, get_user_company_context
 from app.auth_service import get_current_user, get_current_user_with_super_admin_bypass
 from ..repo import repo
 from ..device_auth import device_auth_service
+from ..heartbeat_pipeline import heartbeat_pipeline
+from ..monitoring import device_health_monitor
+from ..monitoring.liveness import device_liveness
 from ..database_service import db_service
 from ..utils.serialization import safe_json_response
 
@@ -342,7 +345,7 @@ async def device_heartbeat(
     if not device_id:
         raise HTTPException(status_code=400, detail="Invalid device token")
 
-    result = await device_auth_service.process_device_heartbeat(device_id, heartbeat_data)
+    result = await heartbeat_pipeline.process(device_id, heartbeat_data)
 
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("error", "Failed to process heartbeat"))
@@ -386,17 +389,32 @@ async def enhanced_device_heartbeat(
 async def get_device_heartbeat_history(
     device_id: str,
     limit: int = 100,
+    granularity: Optional[str] = Query(None, pattern="^(raw|5m|1h)$"),
+    hours: int = Query(24, ge=1, le=24 * 365),
     device_payload: Dict = Depends(verify_device_token)
 ):
-    """Get device heartbeat history"""
+    """Get device heartbeat history
+
+    Without ``granularity`` returns the latest ``limit`` heartbeats. With it,
+    returns the last ``hours`` of raw samples or 5-minute/hourly min/avg/max
+    rollups. With HEARTBEAT_STORAGE_MODE=buckets the rollups are read from the
+    stored rollup documents; in document mode they are aggregated from the
+    per-beat heartbeats on each request.
+    """
     requesting_device_id = device_payload.get("sub")
     if requesting_device_id != device_id:
         raise HTTPException(status_code=403, detail="Access denied")
 
     try:
-        heartbeats = await repo.get_device_heartbeats(device_id, limit)
+        if granularity:
+            heartbeats = await repo.get_device_heartbeat_history(
+                device_id, datetime.utcnow() - timedelta(hours=hours), granularity=granularity
+            )
+        else:
+            heartbeats = await repo.get_device_heartbeats(device_id, limit)
         return convert_objectid_to_str({
             "device_id": device_id,
+            "granularity": granularity or "raw",
             "heartbeats": heartbeats,
             "total": len(heartbeats)
         })
@@ -1017,6 +1035,10 @@ async def delete_device(
     if not success:
         raise HTTPException(status_code=500, detail="Failed to delete device")
 
+    # Otherwise the trackers would report the deleted device offline once its deadline passes
+    device_liveness.forget(device_id)
+    device_health_monitor.forget_device(device_id)
+
     return {"message": "Device deleted successfully"}
 
 # ============================================================================
@@ -1253,37 +1275,23 @@ async def device_heartbeat(
         if not credentials:
             raise HTTPException(status_code=401, detail="Device authentication required")
 
-        device_token = credentials.credentials
-        device = await device_auth_service.authenticate_device(device_id, device_token)
-
-        if not device:
+        if not heartbeat_pipeline.authenticate(device_id, credentials.credentials):
             raise HTTPException(status_code=401, detail="Invalid device credentials")
 
-        status_update = {
-            "last_heartbeat": datetime.utcnow(),
-            "status": "active",
-            "health_data": {
-                "cpu_usage": heartbeat_data.cpu_usage,
-                "memory_usage": heartbeat_data.memory_usage,
-                "disk_usage": heartbeat_data.disk_usage,
-                "network_status": heartbeat_data.network_status,
-                "display_status": heartbeat_data.display_status,
-                "current_content": heartbeat_data.current_content_id,
-                "performance_score": heartbeat_data.performance_score,
-                "errors": heartbeat_data.errors or []
-            }
-        }
-
-        await repo.update_device_status(device_id, status_update)
-
-        pending_commands = await repo.get_device_pending_commands(device_id)
+        result = await heartbeat_pipeline.process(
+            device_id, heartbeat_data.model_dump(exclude_none=True, exclude={"id", "device_id", "timestamp"}, mode="json")
+        )
+        if not result.get("success"):
+            raise HTTPException(status_code=400, detail=result.get("error", "Failed to process heartbeat"))
 
         return {
             "success": True,
             "device_id": device_id,
             "status": "acknowledged",
             "server_time": datetime.utcnow().isoformat(),
-            "pending_commands": pending_commands,
+            "performance_score": result.get("performance_score"),
+            # Commands and content updates are delivered through the WebSocket outbox
+            "pending_commands": [],
             "next_heartbeat_seconds": 300
         }
 
@@ -11,9 +11,11 @@ except ImportError:
         ObjectId = None
 from app.models import User, UserCreate, UserUpdate, UserRole, UserProfile, Role, RoleCreate, RoleUpdate, PermissionCheck
 from app.repo import repo
+from app.permission_cache import permission_cache
+from app.profile_cache import profile_cache
 from app.api.auth import require_roles, get_user_company_context
 from app.auth_service import get_current_user_with_super_admin_bypass
-from app.auth_service import get_current_user
+from app.auth_service import get_current_user, auth_service
 # Data initialization is handled at server startup
 
 def convert_objectid_to_str(data: Any) -> Any:
@@ -535,6 +537,9 @@ async def create_user(
                 }
                 user_role_store[user_role_id] = user_role
             
+            # These writes bypass the repo methods that invalidate the permission and profile caches
+            permission_cache.invalidate_user(user_id)
+            profile_cache.invalidate_user(user_id)
             return {"message": "User created successfully", "user_id": user_id}
         else:
             # MongoRepo - use proper async methods
@@ -576,6 +581,9 @@ async def create_user(
                     }
                     await repo._user_role_col.insert_one(role_doc)
                 
+                # These writes bypass the repo methods that invalidate the permission and profile caches
+                permission_cache.invalidate_user(user_id)
+                profile_cache.invalidate_user(user_id)
                 return {"message": "User created successfully", "user_id": user_id}
             else:
                 raise HTTPException(status_code=500, detail="Unsupported repository type")
@@ -638,7 +646,8 @@ async def update_user(
             user_store[user_id] = updated_user
             
             # Handle role updates
-            if user_update.roles is not None:
+            roles = getattr(user_update, "roles", None)
+            if roles is not None:
                 # Delete existing roles for this user
                 roles_to_delete = [role_id for role_id, role_data in user_role_store.items() 
                                  if role_data.get("user_id") == user_id]
@@ -646,7 +655,7 @@ async def update_user(
                     del user_role_store[role_id]
                 
                 # Create new roles
-                for role_data in user_update.roles:
+                for role_data in roles:
                     role_id = str(uuid.uuid4())
                     user_role = {
                         "id": role_id,
@@ -660,6 +669,10 @@ async def update_user(
                     }
                     user_role_store[role_id] = user_role
             
+            # These writes bypass the repo methods that invalidate the permission and profile caches
+            permission_cache.invalidate_user(user_id)
+            profile_cache.invalidate_user(user_id)
+            
             # Return user with roles
             user_with_roles = updated_user.copy()
             user_roles = [role_data for role_data in user_role_store.values() 
@@ -688,12 +701,13 @@ async def update_user(
                 )
                 
                 # Handle role updates
-                if user_update.roles is not None:
+                roles = getattr(user_update, "roles", None)
+                if roles is not None:
                     # Delete existing roles
                     await repo._user_role_col.delete_many({"user_id": user_id})
                     
                     # Create new roles
-                    for role_data in user_update.roles:
+                    for role_data in roles:
                         role_doc = {
                             "user_id": user_id,
                             "company_id": role_data["company_id"],
@@ -705,6 +719,10 @@ async def update_user(
                         }
                         await repo._user_role_col.insert_one(role_doc)
                 
+                # These writes bypass the repo methods that invalidate the permission and profile caches
+                permission_cache.invalidate_user(user_id)
+                profile_cache.invalidate_user(user_id)
+                
                 # Return user with roles
                 updated_user = await repo._user_col.find_one({"id": user_id})
                 if updated_user:
@@ -772,6 +790,8 @@ async def delete_user(
             for role_id in roles_to_delete:
                 del user_role_store[role_id]
             
+            permission_cache.invalidate_user(user_id)
+            profile_cache.invalidate_user(user_id)
             return {"message": "User deleted successfully"}
         else:
             # MongoRepo - use proper async methods
@@ -782,6 +802,8 @@ async def delete_user(
                 
                 # Delete user
                 result = await repo._user_col.delete_one({"id": user_id})
+                permission_cache.invalidate_user(user_id)
+                profile_cache.invalidate_user(user_id)
                 if result.deleted_count == 0:
                     raise HTTPException(status_code=404, detail="User not found")
                 
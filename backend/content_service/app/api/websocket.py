@@ -39,7 +39,7 @@ async def device_websocket(websocket: WebSocket, device_id: str, token: str = Qu
         except Exception as e:
             logger.error(f"WebSocket error for device {device_id}: {e}")
         finally:
-            await websocket_manager.disconnect_device(device_id)
+            await websocket_manager.disconnect_device(device_id, websocket)
     
     except Exception as e:
         logger.error(f"Failed to establish WebSocket connection for device {device_id}: {e}")
@@ -17,6 +17,7 @@ from functools import wraps
 from typing import Optional, Dict, Any, Tuple
 from dataclasses import dataclass
 from enum import Enum
+from app.profile_cache import profile_cache
 
 logger = logging.getLogger(__name__)
 
@@ -422,6 +423,7 @@ class AuthService:
             # Remove refresh token from memory
             if refresh_data.jti in self.refresh_tokens:
                 del self.refresh_tokens[refresh_data.jti]
+            profile_cache.invalidate_token(access_data.user_id, access_data.jti)
             
             await self.log_security_event(SecurityEvent.LOGOUT, {
                 "user_id": access_data.user_id
@@ -465,10 +467,17 @@ class AuthService:
             
             user_id = payload.get("sub")
             email = payload.get("email")
+            jti = payload.get("jti")
             
             if not user_id:
                 raise HTTPException(status_code=401, detail="Invalid token format")
             
+            # Profiles already resolved for this token are served from the cache
+            cached_profile = profile_cache.get(user_id, jti)
+            if cached_profile is not None:
+                return cached_profile
+            cache_epoch = profile_cache.epoch
+            
             # Get user profile
             user_profile = await db_service.get_user_profile(user_id)
             
@@ -490,6 +499,7 @@ class AuthService:
                 if not user_profile.get('is_active', True):
                     raise HTTPException(status_code=401, detail="User account is inactive")
             
+            profile_cache.put(user_id, jti, user_profile, epoch=cache_epoch)
             return user_profile
             
         except jwt.ExpiredSignatureError:
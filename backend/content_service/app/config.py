@@ -103,6 +103,53 @@ class EnhancedConfig:
         self.CONTENT_SCAN_ENABLED = os.getenv("CONTENT_SCAN_ENABLED", "true").lower() == "true"
         self.COPYRIGHT_CHECK_ENABLED = os.getenv("COPYRIGHT_CHECK_ENABLED", "true").lower() == "true"
         
+        # Streaming uploads
+        self.UPLOAD_CHUNK_SIZE_KB = int(os.getenv("UPLOAD_CHUNK_SIZE_KB", "1024"))
+        self.AZURE_BLOCK_SIZE_MB = int(os.getenv("AZURE_BLOCK_SIZE_MB", "4"))
+        
+        # Permission and profile caching
+        self.PERMISSION_CACHE_TTL_SECONDS = float(os.getenv("PERMISSION_CACHE_TTL_SECONDS", "60"))
+        self.PERMISSION_CACHE_MAX_ENTRIES = int(os.getenv("PERMISSION_CACHE_MAX_ENTRIES", "10000"))
+        self.PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "30"))
+        self.PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+        
+        # Analytics write-behind and in-memory metric store
+        self.ANALYTICS_FLUSH_INTERVAL_SECONDS = float(os.getenv("ANALYTICS_FLUSH_INTERVAL_SECONDS", "1.0"))
+        self.ANALYTICS_MAX_BUFFERED_EVENTS = int(os.getenv("ANALYTICS_MAX_BUFFERED_EVENTS", "50000"))
+        self.ANALYTICS_METRIC_STORE_CAPACITY = int(os.getenv("ANALYTICS_METRIC_STORE_CAPACITY", "1000000"))
+        
+        # WebSocket hub
+        self.WEBSOCKET_DEVICE_QUEUE_SIZE = int(os.getenv("WEBSOCKET_DEVICE_QUEUE_SIZE", "256"))
+        self.WEBSOCKET_ADMIN_QUEUE_SIZE = int(os.getenv("WEBSOCKET_ADMIN_QUEUE_SIZE", "1024"))
+        self.WEBSOCKET_BACKPLANE_URL = os.getenv("WEBSOCKET_BACKPLANE_URL")  # Redis URL; unset = single worker
+        self.DEVICE_OUTBOX_MAX_MESSAGES = int(os.getenv("DEVICE_OUTBOX_MAX_MESSAGES", "500"))
+        self.DEVICE_OUTBOX_TTL_HOURS = float(os.getenv("DEVICE_OUTBOX_TTL_HOURS", "24"))
+        self.DEVICE_OUTBOX_BATCH_SIZE = int(os.getenv("DEVICE_OUTBOX_BATCH_SIZE", "200"))
+        self.DEVICE_LIVENESS_TIMEOUT_SECONDS = float(os.getenv("DEVICE_LIVENESS_TIMEOUT_SECONDS", "300"))
+        self.DEVICE_LIVENESS_CHECK_INTERVAL_SECONDS = float(os.getenv("DEVICE_LIVENESS_CHECK_INTERVAL_SECONDS", "15"))
+        
+        # Heartbeat ingestion
+        self.HEARTBEAT_FLUSH_INTERVAL_SECONDS = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL_SECONDS", "5"))
+        self.HEARTBEAT_RAW_SAMPLE_RATE = float(os.getenv("HEARTBEAT_RAW_SAMPLE_RATE", "0.1"))  # unchanged beats kept as raw rows
+        self.HEARTBEAT_DEVICE_CACHE_TTL_SECONDS = float(os.getenv("HEARTBEAT_DEVICE_CACHE_TTL_SECONDS", "300"))
+        self.HEARTBEAT_MAX_BUFFERED_ROWS = int(os.getenv("HEARTBEAT_MAX_BUFFERED_ROWS", "50000"))
+        self.HEARTBEAT_STORAGE_MODE = os.getenv("HEARTBEAT_STORAGE_MODE", "documents")  # documents | buckets
+        self.HEARTBEAT_RAW_RETENTION_HOURS = float(os.getenv("HEARTBEAT_RAW_RETENTION_HOURS", "48"))
+        self.HEARTBEAT_5M_RETENTION_DAYS = float(os.getenv("HEARTBEAT_5M_RETENTION_DAYS", "30"))
+        self.HEARTBEAT_HOURLY_RETENTION_DAYS = float(os.getenv("HEARTBEAT_HOURLY_RETENTION_DAYS", "365"))
+        self.HEARTBEAT_DOWNSAMPLE_INTERVAL_SECONDS = float(os.getenv("HEARTBEAT_DOWNSAMPLE_INTERVAL_SECONDS", "300"))
+        
+        # Playlist compilation
+        self.PLAYLIST_SLOT_MINUTES = int(os.getenv("PLAYLIST_SLOT_MINUTES", "60"))
+        self.PLAYLIST_CACHE_MAX_ENTRIES = int(os.getenv("PLAYLIST_CACHE_MAX_ENTRIES", "100000"))
+        self.PLAYLIST_PRECOMPUTE_LEAD_SECONDS = float(os.getenv("PLAYLIST_PRECOMPUTE_LEAD_SECONDS", "120"))
+        self.PLAYLIST_FLEET_PRECOMPUTE_ENABLED = os.getenv("PLAYLIST_FLEET_PRECOMPUTE_ENABLED", "true").lower() == "true"
+        self.PLAYLIST_FLEET_PRECOMPUTE_LEAD_SECONDS = float(os.getenv("PLAYLIST_FLEET_PRECOMPUTE_LEAD_SECONDS", "300"))
+        self.PLAYLIST_PRECOMPUTE_CHUNK_SIZE = int(os.getenv("PLAYLIST_PRECOMPUTE_CHUNK_SIZE", "500"))
+        self.PLAYLIST_PRECOMPUTE_WORKERS = int(os.getenv("PLAYLIST_PRECOMPUTE_WORKERS", "8"))
+        self.SCHEDULE_INDEX_REFRESH_SECONDS = float(os.getenv("SCHEDULE_INDEX_REFRESH_SECONDS", "2"))
+        self.PLAYLIST_CACHE_REFRESH_SECONDS = float(os.getenv("PLAYLIST_CACHE_REFRESH_SECONDS", "2"))
+        
         # Rate Limiting
         self.RATE_LIMIT_REQUESTS_PER_MINUTE = int(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", "100"))
         self.RATE_LIMIT_UPLOADS_PER_HOUR = int(os.getenv("RATE_LIMIT_UPLOADS_PER_HOUR", "10"))
@@ -122,12 +169,35 @@ class EnhancedConfig:
         self.USE_LOCAL_EVENT_PROCESSOR = os.getenv("USE_LOCAL_EVENT_PROCESSOR", "true").lower() == "true"
         self.EVENT_PROCESSOR_QUEUE_SIZE = int(os.getenv("EVENT_PROCESSOR_QUEUE_SIZE", "100"))
         
+        # Event bus consumers
+        self.EVENT_BUS_WORKERS = int(os.getenv("EVENT_BUS_WORKERS", "4"))
+        self.EVENT_BUS_QUEUE_CAPACITY = int(os.getenv("EVENT_BUS_QUEUE_CAPACITY", "10000"))  # per lane per worker
+        self.EVENT_BUS_BACKPRESSURE = os.getenv("EVENT_BUS_BACKPRESSURE", "critical=block,default=block,bulk=drop_oldest")
+        self.EVENT_BUS_HANDLER_CONCURRENCY = int(os.getenv("EVENT_BUS_HANDLER_CONCURRENCY", "0"))  # 0 = unlimited
+        self.EVENT_BUS_SPILL_DIR = os.getenv("EVENT_BUS_SPILL_DIR", "")  # default: system temp dir
+        self.EVENT_RETRY_MAX_ATTEMPTS = int(os.getenv("EVENT_RETRY_MAX_ATTEMPTS", "5"))  # then dead-lettered
+        self.EVENT_RETRY_BASE_SECONDS = float(os.getenv("EVENT_RETRY_BASE_SECONDS", "1.0"))  # doubled per attempt
+        self.EVENT_RETRY_MAX_SECONDS = float(os.getenv("EVENT_RETRY_MAX_SECONDS", "300"))
+        self.EVENT_BATCH_MAX_SIZE = int(os.getenv("EVENT_BATCH_MAX_SIZE", "200"))  # for handlers with handle_batch
+        self.EVENT_BATCH_MAX_WAIT_MS = float(os.getenv("EVENT_BATCH_MAX_WAIT_MS", "250"))
+        self.NOTIFICATION_RECIPIENT_CACHE_TTL_SECONDS = int(os.getenv("NOTIFICATION_RECIPIENT_CACHE_TTL_SECONDS", "60"))
+        
+        # Durable event log
+        self.EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "")  # empty = events are kept in memory only
+        self.EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+        self.EVENT_LOG_COMMIT_INTERVAL_MS = float(os.getenv("EVENT_LOG_COMMIT_INTERVAL_MS", "5"))  # group commit window
+        self.EVENT_LOG_DURABLE_LANES = os.getenv("EVENT_LOG_DURABLE_LANES", "critical")  # publish waits for fsync
+        
         # CORS Configuration
         self.ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
         self.ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "").split(",") if os.getenv("ALLOWED_HOSTS") else []
         
         # Logging
         self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+        self.REQUEST_METRICS_ENABLED = os.getenv("REQUEST_METRICS_ENABLED", "true").lower() == "true"  # per-route latency
+        self.REQUEST_LOGGING_ENABLED = os.getenv("REQUEST_LOGGING_ENABLED", "false").lower() == "true"  # one log line per request
+        self.REQUEST_LOG_BODY_MAX_BYTES = int(os.getenv("REQUEST_LOG_BODY_MAX_BYTES", "0"))  # JSON bodies up to this are sampled; 0 = never
+        self.REQUEST_LOG_QUEUE_SIZE = int(os.getenv("REQUEST_LOG_QUEUE_SIZE", "10000"))  # records past this are dropped
         
         # Track initialization state
         self._secrets_initialized = False
@@ -302,6 +372,31 @@ settings = SimpleNamespace(
     USE_LOCAL_EVENT_PROCESSOR=enhanced_config.USE_LOCAL_EVENT_PROCESSOR,
     EVENT_PROCESSOR_QUEUE_SIZE=enhanced_config.EVENT_PROCESSOR_QUEUE_SIZE,
     
+    # Event bus consumers
+    EVENT_BUS_WORKERS=enhanced_config.EVENT_BUS_WORKERS,
+    EVENT_BUS_QUEUE_CAPACITY=enhanced_config.EVENT_BUS_QUEUE_CAPACITY,
+    EVENT_BUS_BACKPRESSURE=enhanced_config.EVENT_BUS_BACKPRESSURE,
+    EVENT_BUS_HANDLER_CONCURRENCY=enhanced_config.EVENT_BUS_HANDLER_CONCURRENCY,
+    EVENT_BUS_SPILL_DIR=enhanced_config.EVENT_BUS_SPILL_DIR,
+    EVENT_RETRY_MAX_ATTEMPTS=enhanced_config.EVENT_RETRY_MAX_ATTEMPTS,
+    EVENT_RETRY_BASE_SECONDS=enhanced_config.EVENT_RETRY_BASE_SECONDS,
+    EVENT_RETRY_MAX_SECONDS=enhanced_config.EVENT_RETRY_MAX_SECONDS,
+    EVENT_BATCH_MAX_SIZE=enhanced_config.EVENT_BATCH_MAX_SIZE,
+    EVENT_BATCH_MAX_WAIT_MS=enhanced_config.EVENT_BATCH_MAX_WAIT_MS,
+    NOTIFICATION_RECIPIENT_CACHE_TTL_SECONDS=enhanced_config.NOTIFICATION_RECIPIENT_CACHE_TTL_SECONDS,
+    
+    # Durable event log
+    EVENT_LOG_DIR=enhanced_config.EVENT_LOG_DIR,
+    EVENT_LOG_SEGMENT_BYTES=enhanced_config.EVENT_LOG_SEGMENT_BYTES,
+    EVENT_LOG_COMMIT_INTERVAL_MS=enhanced_config.EVENT_LOG_COMMIT_INTERVAL_MS,
+    EVENT_LOG_DURABLE_LANES=enhanced_config.EVENT_LOG_DURABLE_LANES,
+    
+    # Request logging
+    REQUEST_METRICS_ENABLED=enhanced_config.REQUEST_METRICS_ENABLED,
+    REQUEST_LOGGING_ENABLED=enhanced_config.REQUEST_LOGGING_ENABLED,
+    REQUEST_LOG_BODY_MAX_BYTES=enhanced_config.REQUEST_LOG_BODY_MAX_BYTES,
+    REQUEST_LOG_QUEUE_SIZE=enhanced_config.REQUEST_LOG_QUEUE_SIZE,
+    
     # Security enhancements
     JWT_SECRET_KEY=None,  # Will be loaded asynchronously
     REFRESH_TOKEN_SECRET=None,  # Will be loaded asynchronously
@@ -313,6 +408,53 @@ settings = SimpleNamespace(
     CONTENT_SCAN_ENABLED=enhanced_config.CONTENT_SCAN_ENABLED,
     COPYRIGHT_CHECK_ENABLED=enhanced_config.COPYRIGHT_CHECK_ENABLED,
     
+    # Streaming uploads
+    UPLOAD_CHUNK_SIZE_KB=enhanced_config.UPLOAD_CHUNK_SIZE_KB,
+    AZURE_BLOCK_SIZE_MB=enhanced_config.AZURE_BLOCK_SIZE_MB,
+    
+    # Permission and profile caching
+    PERMISSION_CACHE_TTL_SECONDS=enhanced_config.PERMISSION_CACHE_TTL_SECONDS,
+    PERMISSION_CACHE_MAX_ENTRIES=enhanced_config.PERMISSION_CACHE_MAX_ENTRIES,
+    PROFILE_CACHE_TTL_SECONDS=enhanced_config.PROFILE_CACHE_TTL_SECONDS,
+    PROFILE_CACHE_MAX_ENTRIES=enhanced_config.PROFILE_CACHE_MAX_ENTRIES,
+    
+    # Analytics write-behind
+    ANALYTICS_FLUSH_INTERVAL_SECONDS=enhanced_config.ANALYTICS_FLUSH_INTERVAL_SECONDS,
+    ANALYTICS_MAX_BUFFERED_EVENTS=enhanced_config.ANALYTICS_MAX_BUFFERED_EVENTS,
+    ANALYTICS_METRIC_STORE_CAPACITY=enhanced_config.ANALYTICS_METRIC_STORE_CAPACITY,
+    
+    # WebSocket hub
+    WEBSOCKET_DEVICE_QUEUE_SIZE=enhanced_config.WEBSOCKET_DEVICE_QUEUE_SIZE,
+    WEBSOCKET_ADMIN_QUEUE_SIZE=enhanced_config.WEBSOCKET_ADMIN_QUEUE_SIZE,
+    WEBSOCKET_BACKPLANE_URL=enhanced_config.WEBSOCKET_BACKPLANE_URL,
+    DEVICE_OUTBOX_MAX_MESSAGES=enhanced_config.DEVICE_OUTBOX_MAX_MESSAGES,
+    DEVICE_OUTBOX_TTL_HOURS=enhanced_config.DEVICE_OUTBOX_TTL_HOURS,
+    DEVICE_OUTBOX_BATCH_SIZE=enhanced_config.DEVICE_OUTBOX_BATCH_SIZE,
+    DEVICE_LIVENESS_TIMEOUT_SECONDS=enhanced_config.DEVICE_LIVENESS_TIMEOUT_SECONDS,
+    DEVICE_LIVENESS_CHECK_INTERVAL_SECONDS=enhanced_config.DEVICE_LIVENESS_CHECK_INTERVAL_SECONDS,
+    
+    # Heartbeat ingestion
+    HEARTBEAT_FLUSH_INTERVAL_SECONDS=enhanced_config.HEARTBEAT_FLUSH_INTERVAL_SECONDS,
+    HEARTBEAT_RAW_SAMPLE_RATE=enhanced_config.HEARTBEAT_RAW_SAMPLE_RATE,
+    HEARTBEAT_DEVICE_CACHE_TTL_SECONDS=enhanced_config.HEARTBEAT_DEVICE_CACHE_TTL_SECONDS,
+    HEARTBEAT_MAX_BUFFERED_ROWS=enhanced_config.HEARTBEAT_MAX_BUFFERED_ROWS,
+    HEARTBEAT_STORAGE_MODE=enhanced_config.HEARTBEAT_STORAGE_MODE,
+    HEARTBEAT_RAW_RETENTION_HOURS=enhanced_config.HEARTBEAT_RAW_RETENTION_HOURS,
+    HEARTBEAT_5M_RETENTION_DAYS=enhanced_config.HEARTBEAT_5M_RETENTION_DAYS,
+    HEARTBEAT_HOURLY_RETENTION_DAYS=enhanced_config.HEARTBEAT_HOURLY_RETENTION_DAYS,
+    HEARTBEAT_DOWNSAMPLE_INTERVAL_SECONDS=enhanced_config.HEARTBEAT_DOWNSAMPLE_INTERVAL_SECONDS,
+    
+    # Playlist compilation
+    PLAYLIST_SLOT_MINUTES=enhanced_config.PLAYLIST_SLOT_MINUTES,
+    PLAYLIST_CACHE_MAX_ENTRIES=enhanced_config.PLAYLIST_CACHE_MAX_ENTRIES,
+    PLAYLIST_PRECOMPUTE_LEAD_SECONDS=enhanced_config.PLAYLIST_PRECOMPUTE_LEAD_SECONDS,
+    PLAYLIST_FLEET_PRECOMPUTE_ENABLED=enhanced_config.PLAYLIST_FLEET_PRECOMPUTE_ENABLED,
+    PLAYLIST_FLEET_PRECOMPUTE_LEAD_SECONDS=enhanced_config.PLAYLIST_FLEET_PRECOMPUTE_LEAD_SECONDS,
+    PLAYLIST_PRECOMPUTE_CHUNK_SIZE=enhanced_config.PLAYLIST_PRECOMPUTE_CHUNK_SIZE,
+    PLAYLIST_PRECOMPUTE_WORKERS=enhanced_config.PLAYLIST_PRECOMPUTE_WORKERS,
+    SCHEDULE_INDEX_REFRESH_SECONDS=enhanced_config.SCHEDULE_INDEX_REFRESH_SECONDS,
+    PLAYLIST_CACHE_REFRESH_SECONDS=enhanced_config.PLAYLIST_CACHE_REFRESH_SECONDS,
+    
     # Rate limiting
     RATE_LIMIT_REQUESTS_PER_MINUTE=enhanced_config.RATE_LIMIT_REQUESTS_PER_MINUTE,
     RATE_LIMIT_UPLOADS_PER_HOUR=enhanced_config.RATE_LIMIT_UPLOADS_PER_HOUR,
@@ -6,6 +6,7 @@ Provides secure content distribution, scheduling, and proof-of-play verification
 from .content_scheduler import content_scheduler, ContentSchedule, DeliveryMode, SchedulePriority
 from .proof_of_play import proof_of_play_service, ProofOfPlayRecord, PlaybackEvent
 from .content_distributor import content_distributor, DeliveryStatus, ContentPackage
+from .playlist_precompute import fleet_playlist_precomputer, FleetPlaylistPrecomputer
 
 __all__ = [
     'content_scheduler',
@@ -17,5 +18,7 @@ __all__ = [
     'PlaybackEvent',
     'content_distributor',
     'DeliveryStatus',
-    'ContentPackage'
+    'ContentPackage',
+    'fleet_playlist_precomputer',
+    'FleetPlaylistPrecomputer'
 ]
\ No newline at end of file
@@ -15,6 +15,8 @@ from dataclasses import dataclass, asdict, field
 from enum import Enum
 import uuid
 
+from app.content_delivery.delivery_scheduler import DeliveryScheduler
+
 logger = logging.getLogger(__name__)
 
 class DeliveryStatus(Enum):
@@ -129,6 +131,9 @@ class ContentDistributorService:
         
         # Distribution configuration
         self.max_concurrent_deliveries = 10
+        self.max_total_bandwidth_mbps = 1000.0
+        self.default_device_bandwidth_mbps = 10.0  # When a package has no bandwidth_limit
+        self.priority_step_seconds = 300.0  # Deadline slack traded for one priority level
         self.default_chunk_size = 1024 * 1024  # 1MB
         self.bandwidth_monitoring = True
         self.adaptive_quality = True
@@ -137,14 +142,23 @@ class ContentDistributorService:
         # Network optimization
         self.network_conditions_cache = {}
         self.device_capabilities_cache = {}
-        self.delivery_queue = []
         self.active_deliveries = {}
         
         # Retry and fallback settings
         self.default_max_retries = 3
         self.retry_delay_multiplier = 2.0
+        self.max_retry_delay_seconds = 300.0
         self.fallback_quality_enabled = True
         
+        # Queued packages are delivered by a fixed worker pool in effective-deadline order
+        self.delivery_scheduler = DeliveryScheduler(
+            self._deliver_package,
+            max_workers=self.max_concurrent_deliveries,
+            total_bandwidth_mbps=self.max_total_bandwidth_mbps,
+            device_bandwidth_mbps=self.default_device_bandwidth_mbps,
+            priority_step_seconds=self.priority_step_seconds
+        )
+        
         # Performance tracking
         self.delivery_metrics = DeliveryMetrics()
         self.performance_history = []
@@ -217,9 +231,9 @@ class ContentDistributorService:
             
             # Save package
             if self.repo:
-                saved_package = await self.repo.save_content_package(asdict(package))
+                saved_package = await self.repo.save_content_package(self._package_document(package))
             else:
-                saved_package = asdict(package)
+                saved_package = self._package_document(package)
             
             # Log package creation
             if self.audit_logger:
@@ -257,7 +271,7 @@ class ContentDistributorService:
             if not package_data:
                 return {"success": False, "error": "Package not found"}
             
-            package = ContentPackage(**package_data)
+            package = self._package_from_document(package_data)
             
             # Check if already queued or delivered
             if package.status in [DeliveryStatus.QUEUED, DeliveryStatus.DOWNLOADING, DeliveryStatus.DELIVERED]:
@@ -269,20 +283,14 @@ class ContentDistributorService:
             if self.repo:
                 await self.repo.update_content_package(package_id, {"status": package.status.value})
             
-            # Add to delivery queue
-            self.delivery_queue.append(package)
-            
-            # Sort queue by priority and deadline
-            self.delivery_queue.sort(key=lambda p: (p.priority, p.delivery_deadline))
-            
-            # Start delivery processing if not already running
-            asyncio.create_task(self._process_delivery_queue())
+            # Hand to the delivery scheduler; its workers pick packages up in priority order
+            self.delivery_scheduler.submit(package)
             
             return {
                 "success": True,
                 "package_id": package_id,
                 "status": "queued",
-                "queue_position": len(self.delivery_queue),
+                "queue_position": len(self.delivery_scheduler),
                 "estimated_start": self._estimate_queue_processing_time()
             }
             
@@ -302,8 +310,16 @@ class ContentDistributorService:
             if not package_data:
                 return {"success": False, "error": "Package not found"}
             
-            package = ContentPackage(**package_data)
+            return await self._deliver_package(self._package_from_document(package_data))
             
+        except Exception as e:
+            logger.error(f"Failed to deliver content: {e}")
+            return {"success": False, "error": str(e)}
+    
+    async def _deliver_package(self, package: ContentPackage) -> Dict[str, Any]:
+        """One delivery attempt; failures with retries left are re-queued with backoff"""
+        package_id = package.id
+        try:
             # Check if delivery is still valid
             if datetime.utcnow() > package.delivery_deadline:
                 package.status = DeliveryStatus.EXPIRED
@@ -352,12 +368,12 @@ class ContentDistributorService:
                 package.retry_count += 1
                 
                 if package.retry_count <= package.max_retries:
-                    # Schedule retry
-                    retry_delay = self.retry_delay_multiplier ** package.retry_count
-                    await asyncio.sleep(retry_delay)
-                    
+                    # Schedule retry; the backoff waits in the scheduler, not in a worker
+                    retry_delay = min(
+                        self.retry_delay_multiplier ** package.retry_count, self.max_retry_delay_seconds
+                    )
                     package.status = DeliveryStatus.QUEUED
-                    self.delivery_queue.append(package)
+                    self.delivery_scheduler.submit(package, delay=retry_delay)
                     
                     self.delivery_metrics.retry_rate = (
                         self.delivery_metrics.retry_rate * 0.9 + 0.1
@@ -374,6 +390,13 @@ class ContentDistributorService:
                             package.delivered_at = datetime.utcnow()
             
             finally:
+                if package.delivered_at:
+                    delivery_seconds = (package.delivered_at - package.created_at).total_seconds()
+                    self.delivery_metrics.average_delivery_time = (
+                        self.delivery_metrics.average_delivery_time * 0.9 + delivery_seconds * 0.1
+                        if self.delivery_metrics.average_delivery_time else delivery_seconds
+                    )
+                
                 # Update package status
                 if self.repo:
                     await self.repo.update_content_package(package_id, {
@@ -471,7 +494,7 @@ class ContentDistributorService:
                 failure_rate = 0.0
             
             # Get current queue status
-            queue_length = len(self.delivery_queue)
+            queue_length = len(self.delivery_scheduler)
             active_deliveries = len(self.active_deliveries)
             
             # Calculate bandwidth utilization
@@ -496,6 +519,7 @@ class ContentDistributorService:
                     "active_deliveries": active_deliveries,
                     "max_concurrent": self.max_concurrent_deliveries
                 },
+                "queue_metrics": self.delivery_scheduler.get_metrics(),
                 "bandwidth_metrics": {
                     "current_usage_mbps": current_bandwidth,
                     "total_bytes_delivered": self.delivery_metrics.total_bytes_delivered,
@@ -509,22 +533,26 @@ class ContentDistributorService:
             logger.error(f"Failed to get delivery metrics: {e}")
             return {"success": False, "error": str(e)}
     
-    async def _process_delivery_queue(self):
-        """Process the delivery queue with concurrency control"""
-        while self.delivery_queue and len(self.active_deliveries) < self.max_concurrent_deliveries:
-            try:
-                # Get next package from queue
-                package = self.delivery_queue.pop(0)
-                
-                # Start delivery task
-                asyncio.create_task(self.deliver_content(package.id))
-                
-                # Small delay to prevent overwhelming
-                await asyncio.sleep(0.1)
-                
-            except Exception as e:
-                logger.error(f"Error processing delivery queue: {e}")
-                break
+    @staticmethod
+    def _package_document(package: ContentPackage) -> Dict[str, Any]:
+        """Storable form of a package: enums as their values"""
+        document = asdict(package)
+        document["delivery_method"] = package.delivery_method.value
+        document["compression_level"] = package.compression_level.value
+        document["status"] = package.status.value
+        return document
+    
+    @staticmethod
+    def _package_from_document(document: Dict[str, Any]) -> ContentPackage:
+        """Inverse of _package_document; ignores storage-only keys such as _id"""
+        data = {key: value for key, value in document.items() if key in ContentPackage.__dataclass_fields__}
+        data["delivery_method"] = DeliveryMethod(data.get("delivery_method", DeliveryMethod.PUSH))
+        data["compression_level"] = CompressionLevel(data.get("compression_level", CompressionLevel.MEDIUM))
+        data["status"] = DeliveryStatus(data.get("status", DeliveryStatus.PENDING))
+        for key in ("delivery_deadline", "created_at", "delivered_at", "last_attempt_at"):
+            if isinstance(data.get(key), str):
+                data[key] = datetime.fromisoformat(data[key])
+        return ContentPackage(**data)
     
     async def _get_content_info(self, content_id: str) -> Optional[Dict]:
         """Get content information"""
@@ -668,7 +696,7 @@ class ContentDistributorService:
         """Estimate when queue processing will start"""
         # Simple estimation based on queue length and average delivery time
         avg_time = self.delivery_metrics.average_delivery_time or 30.0
-        queue_time = len(self.delivery_queue) * avg_time / self.max_concurrent_deliveries
+        queue_time = len(self.delivery_scheduler) * avg_time / self.max_concurrent_deliveries
         
         start_time = datetime.utcnow() + timedelta(seconds=queue_time)
         return start_time.isoformat()
@@ -10,8 +10,12 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, asdict
 from enum import Enum
+import asyncio
 import uuid
 
+from app.playlist_cache import CompiledPlaylist, for_device, playlist_cache
+from app.schedule_index import schedule_index
+
 logger = logging.getLogger(__name__)
 
 class DeliveryMode(Enum):
@@ -101,6 +105,12 @@ class ContentSchedule:
 class ContentSchedulerService:
     """Service for managing content scheduling and optimization"""
     
+    # Device fields the content filters may read; devices that agree on all of them
+    # and have the same active schedules get the same playlist
+    targeting_fields = (
+        "company_id", "resolution_width", "resolution_height", "orientation", "aspect_ratio", "status"
+    )
+    
     def __init__(self):
         # Import dependencies
         try:
@@ -135,6 +145,12 @@ class ContentSchedulerService:
         self.audience_optimization = True
         self.weather_integration = False  # Future enhancement
         
+        # Compiled playlists per (device, slot) and the per-device interval index behind them
+        self.playlist_cache = playlist_cache
+        self.schedule_index = schedule_index
+        self._index_lock = asyncio.Lock()
+        self.max_reported_conflicts = 100
+        
     async def create_schedule(self, schedule_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new content schedule with optimization"""
         try:
@@ -199,11 +215,13 @@ class ContentSchedulerService:
                     "conflicts": conflicts
                 }
             
-            # Save schedule
+            # Save schedule; the repository keeps the schedule index and playlist cache in step
             if self.repo:
-                saved_schedule = await self.repo.save_content_schedule(asdict(schedule))
+                saved_schedule = await self.repo.save_content_schedule(self._schedule_document(schedule))
             else:
-                saved_schedule = asdict(schedule)
+                saved_schedule = self._schedule_document(schedule)
+                self.schedule_index.add(saved_schedule)
+                self.playlist_cache.invalidate_schedule(schedule.id, schedule.device_ids)
             
             # Log audit event
             if self.audit_logger:
@@ -232,60 +250,108 @@ class ContentSchedulerService:
             return {"success": False, "error": str(e)}
     
     async def get_device_playlist(self, device_id: str, target_time: datetime = None) -> Dict[str, Any]:
-        """Generate optimized playlist for a specific device at a given time"""
+        """Get the compiled playlist for a device for the slot containing the given time"""
         try:
             if not target_time:
                 target_time = datetime.utcnow()
-            
-            # Get active schedules for this device
-            schedules = await self._get_active_schedules(device_id, target_time)
-            
-            if not schedules:
-                return {
-                    "success": True,
-                    "device_id": device_id,
-                    "playlist": [],
-                    "message": "No active schedules"
-                }
-            
-            # Get device capabilities and status
-            device_info = await self._get_device_info(device_id)
-            if not device_info:
-                return {"success": False, "error": "Device not found"}
-            
-            # Apply content filters and business rules
-            filtered_schedules = await self._apply_content_filters(schedules, device_info)
-            
-            # Optimize playlist order
-            optimized_playlist = await self._optimize_playlist_order(
-                filtered_schedules, device_info, target_time
-            )
-            
-            # Generate playlist with timing
-            playlist = await self._generate_playlist_with_timing(optimized_playlist, target_time)
-            
-            # Track playlist generation
-            if self.audit_logger:
-                self.audit_logger.log_content_event("playlist_generated", {
-                    "device_id": device_id,
-                    "content_count": len(playlist),
-                    "total_duration": sum([item.get("duration", 0) for item in playlist]),
-                    "optimization_applied": self.optimization_enabled
-                })
-            
-            return {
-                "success": True,
-                "device_id": device_id,
-                "generated_at": target_time.isoformat(),
-                "playlist": playlist,
-                "next_update": self._calculate_next_playlist_update(target_time),
-                "optimization_score": self._calculate_optimization_score(playlist)
-            }
+            await self._ensure_schedule_index()
+            return await self.playlist_cache.get_or_build(device_id, target_time, self._compile_playlist)
             
         except Exception as e:
             logger.error(f"Failed to generate playlist for device {device_id}: {e}")
             return {"success": False, "error": str(e)}
     
+    async def get_device_playlist_payload(self, device_id: str, target_time: datetime = None) -> CompiledPlaylist:
+        """Like get_device_playlist, with the response serialized and an ETag attached"""
+        try:
+            if not target_time:
+                target_time = datetime.utcnow()
+            await self._ensure_schedule_index()
+            return await self.playlist_cache.get_or_build_encoded(device_id, target_time, self._compile_playlist)
+            
+        except Exception as e:
+            logger.error(f"Failed to generate playlist for device {device_id}: {e}")
+            return CompiledPlaylist({"success": False, "error": str(e)})
+    
+    async def precompute_next_slot(self, device_ids: List[str], now: datetime = None) -> int:
+        """Compile the next slot's playlist for each device ahead of time; returns playlists built"""
+        next_slot = self.playlist_cache.next_slot(now or datetime.utcnow())
+        built = 0
+        for device_id in device_ids:
+            try:
+                if await self.playlist_cache.precompute(device_id, next_slot, self._compile_playlist):
+                    built += 1
+            except Exception as e:
+                logger.warning(f"Failed to precompute playlist for device {device_id}: {e}")
+        return built
+    
+    async def get_slot_schedules(self, device_id: str, slot_start: datetime) -> List[Dict]:
+        """Schedules active for a device at any point in the slot starting at slot_start"""
+        return await self._get_active_schedules(
+            device_id, slot_start, slot_start + self.playlist_cache.slot_length
+        )
+    
+    def targeting_key(self, device_info: Dict) -> str:
+        """Hashable form of the device fields in targeting_fields"""
+        return json.dumps([device_info.get(field) for field in self.targeting_fields], default=str)
+    
+    async def _compile_playlist(self, device_id: str, slot_start: datetime) -> CompiledPlaylist:
+        """Generate optimized playlist for a specific device for the slot starting at slot_start"""
+        schedules = await self.get_slot_schedules(device_id, slot_start)
+        if not schedules:
+            return for_device(await self.compile_shared_playlist(schedules, {}, slot_start), device_id)
+        
+        # Get device capabilities and status
+        device_info = await self._get_device_info(device_id)
+        if not device_info:
+            return CompiledPlaylist({"success": False, "error": "Device not found"})
+        
+        shared = await self.compile_shared_playlist(schedules, device_info, slot_start)
+        
+        # Track playlist generation
+        if self.audit_logger:
+            playlist = shared.result["playlist"]
+            self.audit_logger.log_content_event("playlist_generated", {
+                "device_id": device_id,
+                "content_count": len(playlist),
+                "total_duration": sum([item.get("duration", 0) for item in playlist]),
+                "optimization_applied": self.optimization_enabled
+            })
+        
+        return for_device(shared, device_id)
+    
+    async def compile_shared_playlist(self, schedules: List[Dict], device_info: Dict,
+                                      slot_start: datetime) -> CompiledPlaylist:
+        """Compile the playlist, without a device id, for devices with these schedules and targeting"""
+        schedule_ids = tuple(schedule["id"] for schedule in schedules if schedule.get("id"))
+        content_ids = tuple({schedule["content_id"] for schedule in schedules if schedule.get("content_id")})
+        
+        if not schedules:
+            return CompiledPlaylist({
+                "success": True,
+                "playlist": [],
+                "message": "No active schedules"
+            })
+        
+        # Apply content filters and business rules
+        filtered_schedules = await self._apply_content_filters(schedules, device_info)
+        
+        # Optimize playlist order
+        optimized_playlist = await self._optimize_playlist_order(
+            filtered_schedules, device_info, slot_start
+        )
+        
+        # Generate playlist with timing
+        playlist = await self._generate_playlist_with_timing(optimized_playlist, slot_start)
+        
+        return CompiledPlaylist({
+            "success": True,
+            "generated_at": slot_start.isoformat(),
+            "playlist": playlist,
+            "next_update": self._calculate_next_playlist_update(slot_start),
+            "optimization_score": self._calculate_optimization_score(playlist)
+        }, schedule_ids, content_ids)
+    
     async def update_schedule_performance(self, schedule_id: str, performance_data: Dict) -> Dict[str, Any]:
         """Update schedule with performance data from proof-of-play"""
         try:
@@ -364,6 +430,7 @@ class ContentSchedulerService:
                 target_audience={},
                 location_targeting={},
                 device_requirements={},
+                weather_conditions=None,
                 
                 frequency_cap=None,  # No frequency limits for emergency
                 rotation_weight=1000.0,  # Highest weight
@@ -380,12 +447,16 @@ class ContentSchedulerService:
                 status="approved",  # Auto-approved
                 created_by=authorized_by,
                 approved_by=authorized_by,
-                created_at=datetime.utcnow()
+                created_at=datetime.utcnow(),
+                updated_at=None
             )
             
             # Save emergency schedule
             if self.repo:
-                await self.repo.save_content_schedule(asdict(emergency_schedule))
+                await self.repo.save_content_schedule(self._schedule_document(emergency_schedule))
+            else:
+                self.schedule_index.add(self._schedule_document(emergency_schedule))
+                self.playlist_cache.invalidate_schedule(emergency_schedule.id, device_ids)
             
             # Immediately deploy to devices
             deployment_result = await self._trigger_immediate_deployment(emergency_schedule)
@@ -487,15 +558,64 @@ class ContentSchedulerService:
         return time_slots
     
     async def _check_schedule_conflicts(self, schedule: ContentSchedule) -> List[Dict]:
-        """Check for scheduling conflicts"""
-        # Simplified implementation
-        return []  # No conflicts for now
+        """Check for scheduling conflicts on every targeted device.
+        
+        A device conflicts when it already has a schedule for the same content in
+        an overlapping time slot, or when it would exceed max_schedules_per_device
+        concurrent schedules.
+        """
+        await self._ensure_schedule_index()
+        document = self._schedule_document(schedule)
+        conflicts = []
+        total = 0
+        for device_id, existing in self.schedule_index.overlapping(document).items():
+            device_conflicts = [{
+                "device_id": device_id,
+                "type": "duplicate_content",
+                "schedule_id": other["id"],
+                "content_id": other.get("content_id")
+            } for other in existing if other.get("content_id") == schedule.content_id]
+            if len(existing) >= self.max_schedules_per_device:
+                device_conflicts.append({
+                    "device_id": device_id,
+                    "type": "device_capacity",
+                    "overlapping_schedules": len(existing),
+                    "limit": self.max_schedules_per_device
+                })
+            total += len(device_conflicts)
+            conflicts.extend(device_conflicts[:self.max_reported_conflicts - len(conflicts)])
+        if total > len(conflicts):
+            logger.info(f"Schedule {schedule.id}: {total} conflicts, reporting first {len(conflicts)}")
+        return conflicts
     
-    async def _get_active_schedules(self, device_id: str, target_time: datetime) -> List[Dict]:
-        """Get active schedules for a device at a specific time"""
-        if self.repo:
-            return await self.repo.get_active_schedules(device_id, target_time)
-        return []
+    async def _get_active_schedules(self, device_id: str, target_time: datetime,
+                                    until: Optional[datetime] = None) -> List[Dict]:
+        """Get active schedules for a device at a specific time, or at any point before until"""
+        await self._ensure_schedule_index()
+        return self.schedule_index.active_for_device(device_id, target_time, until)
+    
+    async def _ensure_schedule_index(self) -> None:
+        """Load the schedule index, or reload it if another worker has written schedules
+
+        Also drops compiled playlists when another worker has changed content
+        or devices since the last check.
+        """
+        if not self.repo:
+            return
+        async with self._index_lock:
+            was_loaded = self.schedule_index.loaded
+            if await self.schedule_index.sync(self.repo) and was_loaded:
+                # Playlists compiled here before the reload may miss the other worker's writes
+                self.playlist_cache.clear()
+            await self.playlist_cache.sync()
+    
+    @staticmethod
+    def _schedule_document(schedule: ContentSchedule) -> Dict[str, Any]:
+        """Storable form of a schedule: enums as their values"""
+        document = asdict(schedule)
+        document["delivery_mode"] = schedule.delivery_mode.value
+        document["priority"] = schedule.priority.value
+        return document
     
     async def _get_device_info(self, device_id: str) -> Optional[Dict]:
         """Get device information and capabilities"""
@@ -585,9 +705,8 @@ class ContentSchedulerService:
     
     def _calculate_next_playlist_update(self, current_time: datetime) -> str:
         """Calculate when the next playlist update should occur"""
-        # Update every hour
-        next_hour = current_time.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
-        return next_hour.isoformat()
+        # Playlists are compiled per slot, so the next update is the next slot boundary
+        return self.playlist_cache.next_slot(current_time).isoformat()
     
     def _calculate_optimization_score(self, playlist: List[Dict]) -> float:
         """Calculate optimization score for the playlist"""
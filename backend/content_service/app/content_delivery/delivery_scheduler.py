@@ -0,0 +1,254 @@
+"""
+Priority delivery scheduler for content packages.
+
+``ContentDistributorService`` hands queued packages to a ``DeliveryScheduler``:
+
+- A fixed pool of ``max_workers`` tasks runs deliveries, so no more than
+  ``max_concurrent_deliveries`` packages are in flight at a time.
+- Waiting packages sit in a heap ordered by an effective deadline. This is
+  the delivery deadline plus ``priority_step_seconds`` per priority level,
+  and a lower priority number means more urgent, as in ``ContentPackage``.
+  Urgent low-priority work can therefore overtake relaxed high-priority work.
+- Retries and bandwidth-deferred packages wait in a second heap keyed by the
+  time they become ready, so a backoff never ties up a worker.
+- Bytes are metered through a global token bucket and one bucket per device.
+  A package whose device bucket is empty is deferred until it refills, and the
+  worker moves on to other devices. The global bucket throttles every worker.
+
+Queue latency (ready to dispatch), delivery time and throughput over the last
+minute are reported by ``get_metrics``.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Set, Tuple
+
+from app.utils.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# (effective deadline in epoch seconds, sequence, ready time on the scheduler clock, package)
+Entry = Tuple[float, int, float, Any]
+
+THROUGHPUT_WINDOW_SECONDS = 60.0
+
+
+def mbps_to_bytes_per_second(mbps: float) -> float:
+    """Same convention as ``ContentDistributorService._estimate_delivery_time``"""
+    return mbps * 1024 * 1024 / 8
+
+
+class TokenBucket:
+    """Byte-rate limiter that lets one oversized request through and runs into debt
+
+    ``consume`` either takes the bytes and returns 0, or returns how long to
+    wait before trying again. A request larger than the bucket is admitted
+    once the bucket is full and leaves the balance negative. Later requests
+    then wait until the average rate is back within ``rate``.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def consume(self, amount: float, now: float) -> float:
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            self.tokens -= amount
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class DeliveryScheduler:
+    """Heap-ordered delivery queue drained by a fixed worker pool"""
+
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]], max_workers: int = 10,
+                 total_bandwidth_mbps: float = 1000.0, device_bandwidth_mbps: float = 10.0,
+                 priority_step_seconds: float = 300.0, burst_seconds: float = 1.0,
+                 max_device_buckets: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.device_bandwidth_mbps = device_bandwidth_mbps
+        self.priority_step_seconds = priority_step_seconds
+        self.burst_seconds = burst_seconds
+        self.max_device_buckets = max_device_buckets
+        self.clock = clock
+        total_rate = mbps_to_bytes_per_second(total_bandwidth_mbps)
+        self._global_bucket = TokenBucket(total_rate, total_rate * burst_seconds, clock())
+        self._device_buckets: Dict[str, TokenBucket] = {}
+
+        self._ready: List[Entry] = []
+        self._delayed: List[Tuple[float, int, Entry]] = []
+        self._queued_ids: Set[str] = set()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self.active = 0
+
+        self._queue_latency = LatencyHistogram()
+        self._delivery_latency = LatencyHistogram()
+        self._completions: Deque[Tuple[float, int]] = deque()
+        self._metrics = {
+            'submitted': 0,
+            'duplicates_ignored': 0,
+            'dispatched': 0,
+            'retries_scheduled': 0,
+            'bandwidth_deferrals': 0,
+            'bandwidth_wait_seconds': 0.0,
+            'handler_errors': 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    # ------------------------------------------------------------------
+    # Submission
+    # ------------------------------------------------------------------
+
+    def submit(self, package: Any, delay: float = 0.0) -> bool:
+        """Queue a package, or re-queue it after ``delay`` seconds; False if it is already queued"""
+        if package.id in self._queued_ids:
+            self._metrics['duplicates_ignored'] += 1
+            return False
+        self._queued_ids.add(package.id)
+        self._start()
+        now = self.clock()
+        if delay > 0:
+            self._metrics['retries_scheduled'] += 1
+            ready_at = now + delay
+            heapq.heappush(self._delayed, (ready_at, next(self._seq), self._entry(package, ready_at)))
+        else:
+            self._metrics['submitted'] += 1
+            heapq.heappush(self._ready, self._entry(package, now))
+        self._wakeup.set()
+        return True
+
+    def _entry(self, package: Any, ready_at: float) -> Entry:
+        deadline = package.delivery_deadline.timestamp()
+        key = deadline + package.priority * self.priority_step_seconds
+        return key, next(self._seq), ready_at, package
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+
+    def _start(self) -> None:
+        self._workers = [task for task in self._workers if not task.done()]
+        while len(self._workers) < self.max_workers:
+            self._workers.append(asyncio.ensure_future(self._worker()))
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self) -> None:
+        while True:
+            entry = await self._next_entry()
+            _, _, ready_at, package = entry
+            self._queued_ids.discard(package.id)
+            await self._wait_for_global_bandwidth(package)
+            self._queue_latency.observe(max(0.0, self.clock() - ready_at))
+            self._metrics['dispatched'] += 1
+            self.active += 1
+            started = self.clock()
+            try:
+                await self.handler(package)
+            except Exception as e:
+                self._metrics['handler_errors'] += 1
+                logger.error(f"Delivery of package {package.id} failed: {e}")
+            finally:
+                self.active -= 1
+                finished = self.clock()
+                self._delivery_latency.observe(finished - started)
+                self._completions.append((finished, package.content_size or 0))
+                self._trim_completions(finished)
+
+    async def _next_entry(self) -> Entry:
+        while True:
+            now = self.clock()
+            self._promote(now)
+            while self._ready:
+                entry = heapq.heappop(self._ready)
+                package = entry[3]
+                wait = self._device_bucket(package, now).consume(package.content_size or 0, now)
+                if wait <= 0:
+                    return entry
+                # Leave the worker for other devices until this device's bucket refills
+                self._metrics['bandwidth_deferrals'] += 1
+                heapq.heappush(self._delayed, (now + wait, next(self._seq), entry))
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _promote(self, now: float) -> None:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, entry = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, entry)
+
+    async def _wait_for_global_bandwidth(self, package: Any) -> None:
+        size = package.content_size or 0
+        while True:
+            wait = self._global_bucket.consume(size, self.clock())
+            if wait <= 0:
+                return
+            self._metrics['bandwidth_wait_seconds'] += wait
+            await asyncio.sleep(wait)
+
+    def _device_bucket(self, package: Any, now: float) -> TokenBucket:
+        bucket = self._device_buckets.get(package.device_id)
+        if bucket is None:
+            if len(self._device_buckets) >= self.max_device_buckets:
+                # Full buckets carry no state worth keeping
+                for device_id in [d for d, b in self._device_buckets.items() if b.full(now)]:
+                    del self._device_buckets[device_id]
+            rate = mbps_to_bytes_per_second(package.bandwidth_limit or self.device_bandwidth_mbps)
+            bucket = self._device_buckets[package.device_id] = TokenBucket(rate, rate * self.burst_seconds, now)
+        return bucket
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+
+    def _trim_completions(self, now: float) -> None:
+        while self._completions and self._completions[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+            self._completions.popleft()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        self._trim_completions(self.clock())
+        completed_bytes = sum(size for _, size in self._completions)
+        return {
+            **self._metrics,
+            'bandwidth_wait_seconds': round(self._metrics['bandwidth_wait_seconds'], 3),
+            'ready': len(self._ready),
+            'delayed': len(self._delayed),
+            'active': self.active,
+            'workers': len([task for task in self._workers if not task.done()]),
+            'device_buckets': len(self._device_buckets),
+            'throughput_per_second': round(len(self._completions) / THROUGHPUT_WINDOW_SECONDS, 3),
+            'bytes_per_second': round(completed_bytes / THROUGHPUT_WINDOW_SECONDS, 1),
+            'queue_latency': self._queue_latency.snapshot(),
+            'delivery_latency': self._delivery_latency.snapshot()
+        }
@@ -0,0 +1,197 @@
+"""
+Fleet-wide playlist precompute ahead of each slot boundary.
+
+Every screen fetches its playlist at the top of the slot, so compiling on
+demand puts the whole fleet's compilation in the same few seconds. This job
+runs ``PLAYLIST_FLEET_PRECOMPUTE_LEAD_SECONDS`` before each boundary and fills
+the playlist cache for the next slot, so those fetches are served from it.
+
+Most screens share their playlist with many others. Two devices get the same
+playlist when they have the same schedules active in the slot and agree on
+``ContentSchedulerService.targeting_fields``. The job groups devices by that
+key and compiles and serializes once per group. Each device gets the shared
+playlist with its id spliced into the bytes (``playlist_cache.for_device``).
+
+Grouping and compilation run in chunks of ``PLAYLIST_PRECOMPUTE_CHUNK_SIZE``
+on ``PLAYLIST_PRECOMPUTE_WORKERS`` concurrent workers, yielding between
+chunks so requests are not starved while the job runs.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.content_delivery.content_scheduler import content_scheduler
+from app.playlist_cache import encode_playlist, for_device
+
+logger = logging.getLogger(__name__)
+
+ClassKey = Tuple[Tuple[str, ...], Optional[str]]
+
+
+class PlaylistClass:
+    """Devices that share one playlist in a slot"""
+
+    __slots__ = ("schedules", "device_info", "device_ids", "epoch")
+
+    def __init__(self, schedules: List[Dict], device_info: Dict, epoch: int):
+        self.schedules = schedules
+        self.device_info = device_info
+        self.device_ids: List[str] = []
+        # Playlist cache epoch when the schedules were read
+        self.epoch = epoch
+
+
+class FleetPlaylistPrecomputer:
+    """Compiles the next slot's playlists for every device, once per equivalence class"""
+
+    def __init__(self, scheduler, chunk_size: Optional[int] = None, workers: Optional[int] = None,
+                 lead_seconds: Optional[float] = None):
+        self.scheduler = scheduler
+        self.chunk_size = chunk_size or settings.PLAYLIST_PRECOMPUTE_CHUNK_SIZE
+        self.workers = workers or settings.PLAYLIST_PRECOMPUTE_WORKERS
+        self.lead_seconds = lead_seconds if lead_seconds is not None else settings.PLAYLIST_FLEET_PRECOMPUTE_LEAD_SECONDS
+        self._task: Optional[asyncio.Task] = None
+        self._metrics = {
+            'runs': 0,
+            'devices': 0,
+            'classes': 0,
+            'playlists_stored': 0,
+            'already_cached': 0,
+            'compiled_per_device': 0,
+            'class_errors': 0,
+            'last_slot': None,
+            'last_run_ms': None
+        }
+
+    @property
+    def cache(self):
+        return self.scheduler.playlist_cache
+
+    # ------------------------------------------------------------------
+    # Background loop
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            next_slot = self.cache.next_slot(datetime.utcnow())
+            wait = (next_slot - datetime.utcnow()).total_seconds() - self.lead_seconds
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await self.run(next_slot)
+            except Exception as e:
+                logger.error(f"Fleet playlist precompute failed: {e}")
+            # Wait for the boundary so the same slot is not computed twice
+            await asyncio.sleep(max(0.0, (next_slot - datetime.utcnow()).total_seconds()) + 1)
+
+    # ------------------------------------------------------------------
+    # One pass
+    # ------------------------------------------------------------------
+
+    async def run(self, slot: Optional[datetime] = None, devices: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """Precompute ``slot`` (default: the next one) for ``devices`` (default: every screen)"""
+        started = time.perf_counter()
+        slot = self.cache.slot_for(slot or self.cache.next_slot(datetime.utcnow()))
+        if devices is None:
+            devices = await self.scheduler.repo.list_digital_screens() if self.scheduler.repo else []
+
+        classes = await self._group(devices, slot)
+        class_list = list(classes.values())
+        queue: asyncio.Queue = asyncio.Queue()
+        for i in range(0, len(class_list), self.chunk_size):
+            queue.put_nowait(class_list[i:i + self.chunk_size])
+        stored = await asyncio.gather(*(self._worker(queue, slot) for _ in range(min(self.workers, queue.qsize()))))
+
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        summary = {
+            "slot": slot.isoformat(),
+            "devices": len(devices),
+            "classes": len(class_list),
+            "playlists_stored": sum(stored),
+            "elapsed_ms": elapsed_ms
+        }
+        self._metrics['runs'] += 1
+        self._metrics['devices'] += len(devices)
+        self._metrics['classes'] += len(class_list)
+        self._metrics['playlists_stored'] += summary["playlists_stored"]
+        self._metrics['last_slot'] = summary["slot"]
+        self._metrics['last_run_ms'] = elapsed_ms
+        logger.info(f"Precomputed playlists for {slot.isoformat()}: {summary['playlists_stored']} devices "
+                    f"from {len(class_list)} unique playlists in {elapsed_ms:.0f}ms")
+        return summary
+
+    async def _group(self, devices: List[Dict], slot: datetime) -> Dict[ClassKey, PlaylistClass]:
+        classes: Dict[ClassKey, PlaylistClass] = {}
+        for i in range(0, len(devices), self.chunk_size):
+            epoch = self.cache.epoch
+            for device in devices[i:i + self.chunk_size]:
+                device_id = device.get("id")
+                if not device_id:
+                    continue
+                if self.cache.contains(device_id, slot):
+                    self._metrics['already_cached'] += 1
+                    continue
+                schedules = await self.scheduler.get_slot_schedules(device_id, slot)
+                schedule_ids = tuple(sorted(schedule["id"] for schedule in schedules))
+                # Without schedules the playlist is empty whatever the device's targeting
+                key = (schedule_ids, self.scheduler.targeting_key(device) if schedules else None)
+                group = classes.get(key)
+                if group is None:
+                    group = classes[key] = PlaylistClass(schedules, device, epoch)
+                group.device_ids.append(device_id)
+            await asyncio.sleep(0)
+        return classes
+
+    async def _worker(self, queue: asyncio.Queue, slot: datetime) -> int:
+        stored = 0
+        while not queue.empty():
+            for group in queue.get_nowait():
+                try:
+                    stored += await self._compile_class(group, slot)
+                except Exception as e:
+                    self._metrics['class_errors'] += 1
+                    logger.warning(f"Failed to precompute playlist for {len(group.device_ids)} devices: {e}")
+            await asyncio.sleep(0)
+        return stored
+
+    async def _compile_class(self, group: PlaylistClass, slot: datetime) -> int:
+        if self.cache.epoch == group.epoch:
+            shared = await self.scheduler.compile_shared_playlist(group.schedules, group.device_info, slot)
+            if self.cache.epoch == group.epoch:
+                body, etag = encode_playlist(shared.result)
+                shared = shared._replace(body=body, etag=etag)
+                for device_id in group.device_ids:
+                    self.cache.put(device_id, slot, for_device(shared, device_id), epoch=group.epoch)
+                return len(group.device_ids)
+        # A schedule, content or device changed since grouping, so the class may no longer hold
+        self._metrics['compiled_per_device'] += len(group.device_ids)
+        return await self.scheduler.precompute_next_slot(group.device_ids, now=slot - self.cache.slot_length)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        classes = self._metrics['classes']
+        return {
+            **self._metrics,
+            'running': self._task is not None and not self._task.done(),
+            'devices_per_class': round(self._metrics['playlists_stored'] / classes, 2) if classes else None
+        }
+
+
+# Global fleet precompute job for the global scheduler
+fleet_playlist_precomputer = FleetPlaylistPrecomputer(content_scheduler)
@@ -8,14 +8,17 @@
 # Clean Database Service
 import logging
 import asyncio
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 import uuid
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 from pymongo.errors import DuplicateKeyError
 from app.config import settings
 from app.rbac_models import *
+from app.permission_cache import permission_cache
+from app.profile_cache import profile_cache
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +59,26 @@ class DatabaseService:
             await self.db.companies.create_index("organization_code", unique=True)
             await self.db.companies.create_index("registration_key", unique=True)
             await self.db.devices.create_index("api_key", unique=True)
+            await self.db.device_analytics.create_index([("company_id", 1), ("timestamp", 1)])
+            await self.db.analytics_rollups.create_index("id", unique=True)
+            await self.db.analytics_rollups.create_index([("granularity", 1), ("company_id", 1), ("bucket_start", 1)])
+            await self.db.analytics_rollups.create_index([("granularity", 1), ("device_id", 1), ("bucket_start", 1)])
+            await self.db.analytics_rollup_state.create_index("id", unique=True)
+            await self.db.device_outbox.create_index([("device_id", 1), ("seq", 1)], unique=True)
+            await self.db.device_outbox.create_index(
+                [("device_id", 1), ("coalesce_key", 1)], unique=True,
+                partialFilterExpression={"coalesce_key": {"$type": "string"}}
+            )
+            await self.db.device_outbox.create_index("expires_at", expireAfterSeconds=0)
+            await self.db.device_heartbeats.create_index([("device_id", 1), ("timestamp", -1)])
+            await self.db.device_heartbeat_buckets.create_index([("device_id", 1), ("bucket_start", -1)])
+            await self.db.device_heartbeat_buckets.create_index([("downsampled", 1), ("bucket_start", 1)])
+            await self.db.device_heartbeat_buckets.create_index("expires_at", expireAfterSeconds=0)
+            await self.db.device_heartbeat_rollups.create_index([("device_id", 1), ("granularity", 1), ("bucket_start", 1)])
+            await self.db.device_heartbeat_rollups.create_index("expires_at", expireAfterSeconds=0)
+            await self.db.content_schedules.create_index("id", unique=True)
+            await self.db.content_schedules.create_index([("device_ids", 1), ("status", 1)])
+            await self.db.content_packages.create_index("id", unique=True)
             logger.info("📊 Database indexes created")
         except Exception as e:
             logger.warning(f"⚠️ Failed to create some indexes: {e}")
@@ -87,6 +110,8 @@ class DatabaseService:
         
         try:
             result = await self.db.users.insert_one(user_doc)
+            permission_cache.invalidate_user(user_doc["id"])
+            profile_cache.invalidate_user(user_doc["id"])
             user_doc["_id"] = result.inserted_id
             user_doc = self._object_id_to_str(user_doc)
             return User(**user_doc)
@@ -97,29 +122,53 @@ class DatabaseService:
         user = await self.db.users.find_one({"email": email, "is_active": True})
         return self._object_id_to_str(user) if user else None
     
+    def _profile_pipeline(self, match: Dict) -> List[Dict]:
+        """Users joined with their company in a single round trip"""
+        return [
+            {"$match": match},
+            {"$lookup": {
+                "from": "companies",
+                "localField": "company_id",
+                "foreignField": "id",
+                "as": "_companies"
+            }}
+        ]
+    
+    async def _load_profile_docs(self, match: Dict, sort: Optional[List] = None,
+                                 limit: Optional[int] = None) -> List[Dict]:
+        pipeline = self._profile_pipeline(match)
+        if sort:
+            pipeline.insert(1, {"$sort": dict(sort)})
+        if limit:
+            pipeline.insert(1 + bool(sort), {"$limit": limit})
+        cursor = self.db.users.aggregate(pipeline)
+        return await cursor.to_list(length=limit)
+    
     async def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
         # First try querying by id field (from JWT token)
-        user = await self.db.users.find_one({"id": user_id, "is_active": True})
+        docs = await self._load_profile_docs({"id": user_id, "is_active": True}, limit=1)
         
         # Fallback: try querying by MongoDB _id in case it's provided
-        if not user:
+        if not docs:
             try:
-                from bson import ObjectId
-                user = await self.db.users.find_one({"_id": ObjectId(user_id), "is_active": True})
+                docs = await self._load_profile_docs({"_id": ObjectId(user_id), "is_active": True}, limit=1)
             except:
                 pass  # Invalid ObjectId format
                 
-        if not user:
+        if not docs:
             return None
         
+        return await self._build_user_profile(docs[0])
+    
+    async def _build_user_profile(self, user: Dict) -> UserProfile:
+        company_docs = user.pop("_companies", None) or []
         user = self._object_id_to_str(user)
         
         # Get company data
         company = None
         if user.get("company_id"):
-            # Try by id field first (standard approach)
-            company_doc = await self.db.companies.find_one({"id": user["company_id"]})
-            # Fallback to _id field
+            company_doc = company_docs[0] if company_docs else None
+            # Fallback to _id field for companies stored without an id field
             if not company_doc:
                 company_doc = await self.db.companies.find_one({"_id": user["company_id"]})
             if company_doc:
@@ -345,24 +394,14 @@ class DatabaseService:
         )
     
     async def list_all_users(self) -> List[UserProfile]:
-        cursor = self.db.users.find({"is_active": True}).sort("created_at", -1)
-        users = []
-        async for user_doc in cursor:
-            user_doc = self._object_id_to_str(user_doc)
-            user_profile = await self.get_user_profile(user_doc["id"])
-            if user_profile:
-                users.append(user_profile)
-        return users
+        docs = await self._load_profile_docs({"is_active": True}, sort=[("created_at", -1)])
+        return [await self._build_user_profile(doc) for doc in docs]
     
     async def list_users_by_company(self, company_id: str) -> List[UserProfile]:
-        cursor = self.db.users.find({"company_id": company_id, "is_active": True}).sort("created_at", -1)
-        users = []
-        async for user_doc in cursor:
-            user_doc = self._object_id_to_str(user_doc)
-            user_profile = await self.get_user_profile(user_doc["id"])
-            if user_profile:
-                users.append(user_profile)
-        return users
+        docs = await self._load_profile_docs(
+            {"company_id": company_id, "is_active": True}, sort=[("created_at", -1)]
+        )
+        return [await self._build_user_profile(doc) for doc in docs]
 
     # Content History Tracking Methods
     async def create_content_history(self, history_data: Dict) -> Dict:
@@ -523,6 +562,28 @@ class DatabaseService:
             logger.error(f"Failed to get user by ID: {e}")
             return None
 
+    def _invalidate_profiles(self, collection: str, query: Dict, update: Optional[Dict] = None) -> None:
+        """Drop cached profiles that a write to users/companies may have changed"""
+        self._invalidate_profile_batch(collection, [(query, update)])
+
+    def _invalidate_profile_batch(self, collection: str, updates: List[Tuple[Dict, Optional[Dict]]]) -> None:
+        """One invalidation for every profile-relevant (query, update) pair"""
+        if collection not in ("users", "companies"):
+            return
+        doc_ids = set()
+        for query, update in updates:
+            if not _touches_profile(update):
+                continue
+            doc_id = _query_id(query)
+            if doc_id is None:
+                profile_cache.clear()
+                return
+            doc_ids.add(doc_id)
+        if collection == "users":
+            profile_cache.invalidate_users(doc_ids)
+        else:
+            profile_cache.invalidate_companies(doc_ids)
+
     # Generic database methods for event handlers
     async def get_document(self, collection: str, query: Dict) -> Optional[Dict]:
         """Get a single document from collection"""
@@ -535,11 +596,27 @@ class DatabaseService:
     async def update_document(self, collection: str, query: Dict, update: Dict, upsert: bool = False):
         """Update a document in collection"""
         try:
-            return await self.db[collection].update_one(query, update, upsert=upsert)
+            result = await self.db[collection].update_one(query, update, upsert=upsert)
+            self._invalidate_profiles(collection, query, update)
+            return result
         except Exception as e:
             logger.error(f"Failed to update document in {collection}: {e}")
             return None
 
+    async def bulk_update(self, collection: str, updates: List[Tuple[Dict, Dict]], upsert: bool = False):
+        """Apply (query, update) pairs with one unordered bulk_write"""
+        if not updates:
+            return None
+        try:
+            result = await self.db[collection].bulk_write(
+                [UpdateOne(query, update, upsert=upsert) for query, update in updates], ordered=False
+            )
+            self._invalidate_profile_batch(collection, updates)
+            return result
+        except Exception as e:
+            logger.error(f"Failed to bulk update documents in {collection}: {e}")
+            return None
+
     async def insert_document(self, collection: str, document: Dict) -> str:
         """Insert a document into collection"""
         try:
@@ -574,7 +651,9 @@ class DatabaseService:
     async def update_many(self, collection: str, query: Dict, update: Dict):
         """Update multiple documents in collection"""
         try:
-            return await self.db[collection].update_many(query, update)
+            result = await self.db[collection].update_many(query, update)
+            self._invalidate_profiles(collection, query, update)
+            return result
         except Exception as e:
             logger.error(f"Failed to update documents in {collection}: {e}")
             return None
@@ -582,7 +661,9 @@ class DatabaseService:
     async def delete_many(self, collection: str, query: Dict):
         """Delete multiple documents from collection"""
         try:
-            return await self.db[collection].delete_many(query)
+            result = await self.db[collection].delete_many(query)
+            self._invalidate_profiles(collection, query)
+            return result
         except Exception as e:
             logger.error(f"Failed to delete documents from {collection}: {e}")
             return None
@@ -604,5 +685,28 @@ class DatabaseService:
             logger.error(f"Failed to run aggregation on {collection}: {e}")
             return []
 
+
+def _query_id(query: Dict) -> Optional[str]:
+    """The single document id a users/companies query targets, if any"""
+    for field in ("id", "_id"):
+        value = query.get(field)
+        if isinstance(value, (str, ObjectId)):
+            return str(value)
+    return None
+
+
+def _touches_profile(update: Optional[Dict]) -> bool:
+    """False when an update only changes ``analytics.*`` counters"""
+    if not update:
+        return True
+    for operator, fields in update.items():
+        # A replacement document (no operators) may change anything
+        if not operator.startswith("$") or not isinstance(fields, dict):
+            return True
+        if any(field != "analytics" and not field.startswith("analytics.") for field in fields):
+            return True
+    return False
+
+
 # Global instance
 db_service = DatabaseService()
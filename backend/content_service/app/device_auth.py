@@ -11,9 +11,10 @@ from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography import x509
 from cryptography.x509.oid import NameOID
 
-from app.models import DeviceCredentials, DeviceHeartbeat, DeviceFingerprint, ScreenStatus
+from app.models import DeviceCredentials, DeviceFingerprint
 from app.repo import repo
 from app.config import settings
+from app.heartbeat_pipeline import heartbeat_pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -270,124 +271,8 @@ class DeviceAuthService:
             return False
     
     async def process_device_heartbeat(self, device_id: str, heartbeat_data: Dict) -> Dict:
-        """Process and store device heartbeat with comprehensive health monitoring"""
-        try:
-            # Verify device exists and is authenticated
-            device_info = await repo.get_device_with_credentials(device_id)
-            if not device_info or not device_info.get("device"):
-                return {"success": False, "error": "Device not found or not authenticated"}
-            
-            # Use comprehensive health monitoring if available
-            if HEALTH_MONITORING_AVAILABLE:
-                # Process through health monitor for enhanced analysis
-                health_result = await device_health_monitor.process_device_heartbeat(device_id, heartbeat_data)
-                
-                if not health_result.get("success"):
-                    return health_result
-                
-                # Get health status and metrics
-                health_status = await device_health_monitor.get_device_health_status(device_id)
-                
-                # Update device with health information
-                device_updates = {
-                    "last_seen": datetime.utcnow(),
-                    "health_status": health_status.get("overall_health", "unknown"),
-                    "performance_score": health_status.get("performance_score", 0),
-                    "sla_compliance": health_status.get("sla_compliance", 0)
-                }
-                
-                await repo.update_digital_screen(device_id, device_updates)
-                
-                # Return comprehensive health information
-                return {
-                    "success": True,
-                    "message": "Heartbeat processed with health monitoring",
-                    "health_status": health_status,
-                    "alerts": health_result.get("alerts", []),
-                    "recommendations": health_result.get("recommendations", [])
-                }
-            else:
-                # Fallback to basic heartbeat processing
-                heartbeat = DeviceHeartbeat(
-                    device_id=device_id,
-                    status=ScreenStatus(heartbeat_data.get("status", "active")),
-                    cpu_usage=heartbeat_data.get("cpu_usage"),
-                    memory_usage=heartbeat_data.get("memory_usage"),
-                    storage_usage=heartbeat_data.get("storage_usage"),
-                    temperature=heartbeat_data.get("temperature"),
-                    network_strength=heartbeat_data.get("network_strength"),
-                    bandwidth_mbps=heartbeat_data.get("bandwidth_mbps"),
-                    current_content_id=heartbeat_data.get("current_content_id"),
-                    content_errors=heartbeat_data.get("content_errors", 0),
-                    latitude=heartbeat_data.get("latitude"),
-                    longitude=heartbeat_data.get("longitude"),
-                    error_logs=heartbeat_data.get("error_logs", []),
-                    performance_score=self._calculate_performance_score(heartbeat_data)
-                )
-                
-                # Save heartbeat
-                await repo.save_device_heartbeat(heartbeat)
-                
-                # Update device last_seen
-                await repo.update_digital_screen(device_id, {"last_seen": datetime.utcnow()})
-                
-                return {
-                    "success": True,
-                    "message": "Heartbeat processed successfully",
-                    "performance_score": heartbeat.performance_score
-                }
-            
-        except Exception as e:
-            logger.error(f"Failed to process heartbeat for device {device_id}: {e}")
-            return {"success": False, "error": str(e)}
-    
-    def _calculate_performance_score(self, heartbeat_data: Dict) -> float:
-        """Calculate overall device performance score (0-100)"""
-        score = 100.0
-        
-        # CPU usage penalty
-        cpu_usage = heartbeat_data.get("cpu_usage")
-        if cpu_usage is not None:
-            if cpu_usage > 80:
-                score -= 20
-            elif cpu_usage > 60:
-                score -= 10
-        
-        # Memory usage penalty
-        memory_usage = heartbeat_data.get("memory_usage")
-        if memory_usage is not None:
-            if memory_usage > 90:
-                score -= 15
-            elif memory_usage > 70:
-                score -= 5
-        
-        # Storage usage penalty
-        storage_usage = heartbeat_data.get("storage_usage")
-        if storage_usage is not None:
-            if storage_usage > 95:
-                score -= 25
-            elif storage_usage > 80:
-                score -= 10
-        
-        # Network strength penalty
-        network_strength = heartbeat_data.get("network_strength")
-        if network_strength is not None:
-            if network_strength < 30:
-                score -= 20
-            elif network_strength < 50:
-                score -= 10
-        
-        # Content errors penalty
-        content_errors = heartbeat_data.get("content_errors", 0)
-        if content_errors > 0:
-            score -= min(content_errors * 5, 30)  # Max 30 point penalty
-        
-        # Error logs penalty
-        error_logs = heartbeat_data.get("error_logs", [])
-        if error_logs:
-            score -= min(len(error_logs) * 2, 20)  # Max 20 point penalty
-        
-        return max(0.0, min(100.0, score))
+        """Process a device heartbeat through the shared heartbeat pipeline"""
+        return await heartbeat_pipeline.process(device_id, heartbeat_data)
     
     def _create_device_fingerprint(self, device_info: Dict) -> str:
         """Create device fingerprint hash for security validation"""
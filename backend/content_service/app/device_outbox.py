@@ -0,0 +1,249 @@
+"""
+Durable per-device outbox for messages sent while a device is offline.
+
+Messages are stored in the ``device_outbox`` collection (in memory when no
+database is connected) with a per-device sequence number, an ``expires_at``
+TTL and a per-device cap, so neither a restart nor a screen that stays dark
+for a week loses or piles up messages.
+
+Messages that supersede each other are coalesced: a newer ``content_update``
+for the same content replaces the queued one instead of being appended.
+
+On reconnect the device gets one ``outbox_batch`` frame holding up to
+``DEVICE_OUTBOX_BATCH_SIZE`` messages in sequence order. Messages stay in the
+outbox until the device answers with ``outbox_ack`` carrying the last
+sequence number it processed; the next batch, if any, follows the ack.
+Delivery is at-least-once, so devices should ignore sequence numbers they
+have already seen.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Message types where a newer message for the same content replaces the older one
+COALESCED_TYPES = ("content_update",)
+
+
+def coalesce_key(message: Dict) -> Optional[str]:
+    if message.get("type") not in COALESCED_TYPES:
+        return None
+    content_id = (message.get("data") or {}).get("content_id")
+    return f"{message['type']}:{content_id}" if content_id else None
+
+
+class InMemoryOutboxStore:
+    """Outbox storage for deployments without MongoDB; lost on restart"""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[int, Dict]] = {}
+        self._sequences: Dict[str, int] = {}
+
+    async def next_seq(self, device_id: str) -> int:
+        seq = self._sequences.get(device_id, 0) + 1
+        self._sequences[device_id] = seq
+        return seq
+
+    async def put(self, entry: Dict) -> bool:
+        """Store an entry; True if it replaced one with the same coalesce key"""
+        entries = self._entries.setdefault(entry["device_id"], {})
+        replaced = False
+        key = entry.get("coalesce_key")
+        if key:
+            for seq in [s for s, e in entries.items() if e.get("coalesce_key") == key]:
+                del entries[seq]
+                replaced = True
+        entries[entry["seq"]] = entry
+        return replaced
+
+    async def count(self, device_id: str) -> int:
+        return len(self._live(device_id))
+
+    async def trim(self, device_id: str, keep: int) -> int:
+        entries = self._entries.get(device_id, {})
+        excess = sorted(entries)[:max(0, len(entries) - keep)]
+        for seq in excess:
+            del entries[seq]
+        return len(excess)
+
+    async def pending(self, device_id: str, limit: int) -> List[Dict]:
+        live = self._live(device_id)
+        return [live[seq] for seq in sorted(live)[:limit]]
+
+    async def ack(self, device_id: str, seq: int) -> int:
+        entries = self._entries.get(device_id, {})
+        acked = [s for s in entries if s <= seq]
+        for s in acked:
+            del entries[s]
+        return len(acked)
+
+    async def purge_expired(self) -> int:
+        purged = 0
+        now = datetime.utcnow()
+        for device_id, entries in list(self._entries.items()):
+            for seq in [s for s, e in entries.items() if e["expires_at"] <= now]:
+                del entries[seq]
+                purged += 1
+            if not entries:
+                del self._entries[device_id]
+        return purged
+
+    def _live(self, device_id: str) -> Dict[int, Dict]:
+        now = datetime.utcnow()
+        entries = self._entries.get(device_id, {})
+        for seq in [s for s, e in entries.items() if e["expires_at"] <= now]:
+            del entries[seq]
+        return entries
+
+
+class MongoOutboxStore:
+    """Outbox storage in ``device_outbox``; expiry is left to the TTL index"""
+
+    def __init__(self, db):
+        self.collection = db.device_outbox
+        self.counters = db.device_outbox_counters
+
+    async def next_seq(self, device_id: str) -> int:
+        counter = await self.counters.find_one_and_update(
+            {"_id": device_id}, {"$inc": {"seq": 1}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    async def put(self, entry: Dict) -> bool:
+        key = entry.get("coalesce_key")
+        if key:
+            previous = await self.collection.find_one_and_update(
+                {"device_id": entry["device_id"], "coalesce_key": key},
+                {"$set": entry}, upsert=True
+            )
+            return previous is not None
+        await self.collection.insert_one(dict(entry))
+        return False
+
+    async def count(self, device_id: str) -> int:
+        return await self.collection.count_documents({"device_id": device_id})
+
+    async def trim(self, device_id: str, keep: int) -> int:
+        cursor = self.collection.find({"device_id": device_id}, {"seq": 1}).sort("seq", -1).skip(keep)
+        excess = [doc["seq"] async for doc in cursor]
+        if not excess:
+            return 0
+        result = await self.collection.delete_many({"device_id": device_id, "seq": {"$in": excess}})
+        return result.deleted_count
+
+    async def pending(self, device_id: str, limit: int) -> List[Dict]:
+        cursor = self.collection.find(
+            {"device_id": device_id, "expires_at": {"$gt": datetime.utcnow()}}, {"_id": 0}
+        ).sort("seq", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def ack(self, device_id: str, seq: int) -> int:
+        result = await self.collection.delete_many({"device_id": device_id, "seq": {"$lte": seq}})
+        return result.deleted_count
+
+    async def purge_expired(self) -> int:
+        return 0
+
+
+class DeviceOutbox:
+    """Per-device offline message outbox"""
+
+    def __init__(self, store=None, max_messages: Optional[int] = None,
+                 ttl: Optional[timedelta] = None, batch_size: Optional[int] = None):
+        self._store = store
+        self.max_messages = max_messages or settings.DEVICE_OUTBOX_MAX_MESSAGES
+        self.ttl = ttl or timedelta(hours=settings.DEVICE_OUTBOX_TTL_HOURS)
+        self.batch_size = batch_size or settings.DEVICE_OUTBOX_BATCH_SIZE
+        self._device_locks: Dict[str, asyncio.Lock] = {}
+        self._metrics = {
+            'messages_enqueued': 0,
+            'messages_coalesced': 0,
+            'messages_trimmed': 0,
+            'messages_acked': 0,
+            'batches_sent': 0
+        }
+
+    @property
+    def store(self):
+        if self._store is None:
+            from app.database_service import db_service
+            self._store = MongoOutboxStore(db_service.db) if db_service.connected else InMemoryOutboxStore()
+        return self._store
+
+    def _lock(self, device_id: str) -> asyncio.Lock:
+        lock = self._device_locks.get(device_id)
+        if lock is None:
+            lock = self._device_locks[device_id] = asyncio.Lock()
+        return lock
+
+    async def enqueue(self, device_id: str, message: Dict) -> int:
+        """Store a message for an offline device; returns its sequence number"""
+        return (await self.enqueue_many(device_id, [message]))[-1]
+
+    async def enqueue_many(self, device_id: str, messages: List[Dict]) -> List[int]:
+        """Store messages in order, coalescing and enforcing the per-device cap"""
+        seqs = []
+        store = self.store
+        async with self._lock(device_id):
+            now = datetime.utcnow()
+            for message in messages:
+                seq = await store.next_seq(device_id)
+                replaced = await store.put({
+                    "device_id": device_id,
+                    "seq": seq,
+                    "coalesce_key": coalesce_key(message),
+                    "message": message,
+                    "created_at": now,
+                    "expires_at": now + self.ttl
+                })
+                seqs.append(seq)
+                self._metrics['messages_enqueued'] += 1
+                if replaced:
+                    self._metrics['messages_coalesced'] += 1
+
+            if await store.count(device_id) > self.max_messages:
+                trimmed = await store.trim(device_id, self.max_messages)
+                self._metrics['messages_trimmed'] += trimmed
+                logger.warning(f"Outbox for device {device_id} over {self.max_messages} messages; dropped {trimmed} oldest")
+        return seqs
+
+    async def next_batch(self, device_id: str) -> Optional[Dict]:
+        """The catch-up frame for a device, or None if nothing is pending"""
+        entries = await self.store.pending(device_id, self.batch_size)
+        if not entries:
+            return None
+        self._metrics['batches_sent'] += 1
+        return {
+            "type": "outbox_batch",
+            "data": {
+                "first_seq": entries[0]["seq"],
+                "last_seq": entries[-1]["seq"],
+                "count": len(entries),
+                "messages": [{**entry["message"], "seq": entry["seq"]} for entry in entries]
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+    async def ack(self, device_id: str, seq: int) -> int:
+        """Drop everything up to and including ``seq``; returns how many were removed"""
+        async with self._lock(device_id):
+            acked = await self.store.ack(device_id, seq)
+        self._metrics['messages_acked'] += acked
+        return acked
+
+    async def pending_count(self, device_id: str) -> int:
+        return await self.store.count(device_id)
+
+    async def purge_expired(self) -> int:
+        return await self.store.purge_expired()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {**self._metrics, 'store': type(self.store).__name__}
@@ -0,0 +1,133 @@
+"""
+Micro-batching for handlers that implement ``EventHandler.handle_batch``.
+
+A handler created with ``batch_size`` gets one ``MicroBatcher`` on the bus.
+Partition workers add its events to the batcher and move on without waiting.
+The batcher calls ``handle_batch`` with up to ``batch_size`` events, as soon
+as that many are waiting or ``batch_max_wait`` seconds after the first one
+arrived, whichever comes first. Batches for one handler run one at a time and
+in arrival order, so per-entity ordering across partitions is kept as far as
+the partitions keep it.
+
+At most ``MAX_PENDING_BATCHES`` batches of events can wait. Past that,
+``add`` waits, which holds the partition worker back as a slow direct
+handler would.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING_BATCHES = 4
+
+# (event, event log offset or None)
+BatchItem = Tuple[Any, Optional[int]]
+
+
+class MicroBatcher:
+    """Size- and time-bounded batches of one handler's events"""
+
+    def __init__(self, name: str, flush: Callable[[List[BatchItem]], Awaitable[None]],
+                 max_size: int, max_wait: float):
+        self.name = name
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.max_pending = max_size * MAX_PENDING_BATCHES
+        self._flush = flush
+        self._items: List[BatchItem] = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._flushing = 0
+        self._flush_now = False
+        self._closing = False
+        self._idle = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._metrics = {
+            'batches': 0,
+            'events': 0,
+            'full_batches': 0,
+            'waits_for_space': 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._items) + self._flushing
+
+    async def add(self, event: Any, offset: Optional[int] = None) -> None:
+        if len(self._items) >= self.max_pending:
+            self._metrics['waits_for_space'] += 1
+            while len(self._items) >= self.max_pending:
+                self._space.clear()
+                await self._space.wait()
+        self._items.append((event, offset))
+        self._has_items.set()
+        if len(self._items) >= self.max_size:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while self._items or not self._closing:
+            await self._has_items.wait()
+            if len(self._items) < self.max_size and not self._closing and not self._flush_now:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush_next()
+            if not self._items:
+                self._flush_now = False
+                self._idle.set()
+
+    async def _flush_next(self) -> None:
+        batch, self._items = self._items[:self.max_size], self._items[self.max_size:]
+        if not self._items:
+            self._has_items.clear()
+        self._space.set()
+        if not batch:
+            return
+        self._metrics['batches'] += 1
+        self._metrics['events'] += len(batch)
+        if len(batch) == self.max_size:
+            self._metrics['full_batches'] += 1
+        self._flushing = len(batch)
+        try:
+            await self._flush(batch)
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} events for '{self.name}' failed: {e}")
+        finally:
+            self._flushing = 0
+
+    async def flush(self) -> None:
+        """Hand everything waiting to the handler now, without waiting for batches to fill"""
+        if self._items and self._task is not None and not self._task.done():
+            self._flush_now = True
+            self._idle.clear()
+            self._full.set()
+            await self._idle.wait()
+
+    async def stop(self) -> None:
+        """Flush what is waiting, let the last batch finish, then stop the flusher"""
+        if self._task is not None:
+            self._closing = True
+            self._has_items.set()
+            self._full.set()
+            try:
+                await self._task
+            finally:
+                self._task = None
+                self._closing = False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        batches = self._metrics['batches']
+        return {
+            **self._metrics,
+            'max_size': self.max_size,
+            'max_wait_seconds': self.max_wait,
+            'pending': len(self._items),
+            'average_batch_size': round(self._metrics['events'] / batches, 2) if batches else None
+        }
@@ -1,16 +1,45 @@
 """
 Event-driven architecture for reducing load on primary application
 Implements async event publishing and subscription with background processing
+
+Published events are consumed by ``EVENT_BUS_WORKERS`` workers. An event goes
+to the partition chosen by its ``device_id``, ``content_id`` or
+``company_id``, in that order, so events about one entity in one lane are
+handled in publish order. Each partition has critical, default and bulk
+lanes (see ``app.events.lanes``). A burst of analytics events therefore
+waits behind moderation work, not in front of it. Lanes hold at most
+``EVENT_BUS_QUEUE_CAPACITY`` events per partition, and
+``EVENT_BUS_BACKPRESSURE`` sets what a full lane does. A handler can cap its
+own concurrency with ``max_concurrency``. A handler that sets ``batch_size``
+receives its events through ``handle_batch`` in micro-batches instead (see
+``app.events.batching``).
+
+A handler that fails an event is retried, for that event alone, with
+exponential backoff. After ``EVENT_RETRY_MAX_ATTEMPTS`` failures the event
+is dead-lettered until ``retry_failed_events``. With ``EVENT_LOG_DIR`` set,
+events are appended to a durable log before they are queued and replayed
+after a restart (see ``app.events.event_log``).
 """
 import asyncio
+import contextvars
 import json
 import logging
-from typing import Any, Dict, List, Callable, Optional, Union
+import tempfile
+import time
+import zlib
+from collections import deque
+from typing import Any, Deque, Dict, List, Callable, Optional, Set, Tuple, Union
 from datetime import datetime
 from dataclasses import dataclass, asdict
 from enum import Enum
 import uuid
 
+from app.config import settings
+from app.events.batching import BatchItem, MicroBatcher
+from app.events.event_log import EventLog
+from app.events.lanes import LANES, BackpressurePolicy, Partition, lane_for, parse_backpressure
+from app.utils.metrics import LatencyHistogram
+
 logger = logging.getLogger(__name__)
 
 class EventType(str, Enum):
@@ -80,31 +109,112 @@ class Event:
 class EventHandler:
     """Base class for event handlers"""
 
-    def __init__(self, name: str, event_types: List[EventType]):
+    def __init__(self, name: str, event_types: List[EventType], max_concurrency: Optional[int] = None,
+                 batch_size: Optional[int] = None, batch_max_wait: Optional[float] = None):
         self.name = name
         self.event_types = event_types
+        # Events this handler may process at once across all workers; None uses the bus default
+        self.max_concurrency = max_concurrency
+        # With a batch size the bus calls handle_batch with up to batch_size events,
+        # at most batch_max_wait seconds after the first of them was dispatched
+        self.batch_size = batch_size
+        self.batch_max_wait = batch_max_wait
 
     async def handle(self, event: Event) -> bool:
         """Handle an event. Return True if handled successfully."""
         raise NotImplementedError
 
+    async def handle_batch(self, events: List[Event]) -> List[bool]:
+        """Handle several events at once; one result per event, in order.
+
+        Only called for handlers created with ``batch_size``. Events that
+        fail are retried one at a time through ``handle``.
+        """
+        return [await self.handle(event) for event in events]
+
     def can_handle(self, event_type: EventType) -> bool:
         """Check if this handler can process the given event type"""
         return event_type in self.event_types
 
+# True inside consumer workers and the handler tasks they start
+_in_consumer = contextvars.ContextVar("event_bus_in_consumer", default=False)
+
+# Dead letters kept in memory when there is no event log
+FAILED_EVENTS_KEPT = 1000
+
+
+def _log_record(event: Event, handlers: Optional[List[str]] = None) -> Dict[str, Any]:
+    """``Event.to_dict`` without the deep copy ``asdict`` makes; this runs on every publish"""
+    record = {
+        'event_id': event.event_id,
+        'event_type': event.event_type.value,
+        'timestamp': event.timestamp.isoformat(),
+        'source': event.source,
+        'company_id': event.company_id,
+        'user_id': event.user_id,
+        'device_id': event.device_id,
+        'content_id': event.content_id,
+        'payload': event.payload,
+        'correlation_id': event.correlation_id
+    }
+    if handlers is not None:
+        record['handlers'] = handlers
+    return record
+
+
 class AsyncEventBus:
     """Async event bus for decoupled event processing"""
 
-    def __init__(self):
+    def __init__(self, workers: Optional[int] = None, queue_capacity: Optional[int] = None,
+                 backpressure: Optional[Union[str, Dict[str, BackpressurePolicy]]] = None,
+                 handler_concurrency: Optional[int] = None, spill_dir: Optional[str] = None,
+                 log_dir: Optional[str] = None, retry_attempts: Optional[int] = None,
+                 retry_base_seconds: Optional[float] = None):
         self._handlers: Dict[EventType, List[EventHandler]] = {}
-        self._event_queue = asyncio.Queue()
-        self._processing_task = None
+        self.worker_count = workers or settings.EVENT_BUS_WORKERS
+        self.queue_capacity = queue_capacity or settings.EVENT_BUS_QUEUE_CAPACITY
+        if backpressure is None:
+            backpressure = settings.EVENT_BUS_BACKPRESSURE
+        self.backpressure = parse_backpressure(backpressure) if isinstance(backpressure, str) else backpressure
+        self.handler_concurrency = (handler_concurrency if handler_concurrency is not None
+                                    else settings.EVENT_BUS_HANDLER_CONCURRENCY)
+        spill_dir = spill_dir or settings.EVENT_BUS_SPILL_DIR or tempfile.gettempdir()
+        self._partitions = [
+            Partition(index, self.queue_capacity, self.backpressure, spill_dir)
+            for index in range(self.worker_count)
+        ]
+        self._workers: List[asyncio.Task] = []
         self._running = False
-        self._failed_events: List[Event] = []
+        self.retry_attempts = retry_attempts or settings.EVENT_RETRY_MAX_ATTEMPTS
+        self.retry_base_seconds = (retry_base_seconds if retry_base_seconds is not None
+                                   else settings.EVENT_RETRY_BASE_SECONDS)
+        self._retries: Set[asyncio.Task] = set()
+        log_dir = log_dir if log_dir is not None else settings.EVENT_LOG_DIR
+        self._log: Optional[EventLog] = EventLog(
+            log_dir,
+            segment_bytes=settings.EVENT_LOG_SEGMENT_BYTES,
+            commit_interval=settings.EVENT_LOG_COMMIT_INTERVAL_MS / 1000
+        ) if log_dir else None
+        self.durable_lanes = {lane.strip() for lane in settings.EVENT_LOG_DURABLE_LANES.split(",") if lane.strip()}
+        self._replayed = False
+        # (handler name, attempts, event) of dead letters when there is no event log
+        self._failed_events: Deque[Tuple[str, int, Event]] = deque(maxlen=FAILED_EVENTS_KEPT)
+        self._handler_limits: Dict[str, asyncio.Semaphore] = {}
+        self._batchers: Dict[str, MicroBatcher] = {}
+        self._handler_latency: Dict[str, LatencyHistogram] = {}
+        self._lane_lag = {lane: LatencyHistogram() for lane in LANES}
+        self._lane_counts = {
+            lane: {'enqueued': 0, 'dispatched': 0, 'dropped': 0, 'spilled': 0, 'blocked': 0}
+            for lane in LANES
+        }
         self._metrics = {
             'events_published': 0,
             'events_processed': 0,
             'events_failed': 0,
+            'batched_events_processed': 0,
+            'retries': 0,
+            'dead_lettered': 0,
+            'replayed': 0,
             'handlers_registered': 0
         }
 
@@ -115,21 +225,84 @@ class AsyncEventBus:
                 self._handlers[event_type] = []
             self._handlers[event_type].append(handler)
 
+        limit = getattr(handler, "max_concurrency", None) or self.handler_concurrency
+        if limit:
+            self._handler_limits[handler.name] = asyncio.Semaphore(limit)
+        self._handler_latency.setdefault(handler.name, LatencyHistogram())
+        if getattr(handler, "batch_size", None) and handler.name not in self._batchers:
+            max_wait = handler.batch_max_wait
+            self._batchers[handler.name] = MicroBatcher(
+                handler.name,
+                lambda batch, handler=handler: self._process_batch(handler, batch),
+                max_size=handler.batch_size,
+                max_wait=max_wait if max_wait is not None else settings.EVENT_BATCH_MAX_WAIT_MS / 1000
+            )
+        if self._log is not None:
+            self._log.add_consumer(handler.name)
+
         self._metrics['handlers_registered'] += 1
         logger.info(f"Registered handler '{handler.name}' for events: {[et.value for et in handler.event_types]}")
 
     async def publish(self, event: Event):
-        """Publish an event to the bus (non-blocking)"""
+        """Publish an event to the bus; waits only if its lane is full and set to block
+
+        With an event log, events in ``EVENT_LOG_DURABLE_LANES`` are also
+        waited on until the group commit that covers them has been fsynced.
+        """
+        await self._enqueue(event)
+
+    async def _enqueue(self, event: Event, handlers: Optional[List[str]] = None,
+                       offset: Optional[int] = None):
+        """Log and queue an event for ``handlers`` (default: every subscriber)
+
+        Events replayed from the log pass their ``offset`` and are not logged again.
+        """
         try:
-            await self._event_queue.put(event)
-            self._metrics['events_published'] += 1
+            lane = lane_for(event.event_type)
+            partition = self._partitions[self._partition_index(event)]
+            queue = partition.lanes[lane]
+            counts = self._lane_counts[lane]
+
+            if queue.full():
+                if queue.policy is BackpressurePolicy.DROP_OLDEST:
+                    _, dropped, dropped_offset, _ = queue.drop_oldest()
+                    if dropped_offset is not None:
+                        self._log.ack_all(dropped_offset)
+                    counts['dropped'] += 1
+                    logger.debug(f"Dropped event {dropped.event_id} from full '{lane}' lane")
+                elif queue.policy is BackpressurePolicy.BLOCK and not _in_consumer.get():
+                    # A handler publishing into its own full partition must not wait on itself,
+                    # so events published from consumers may overrun the bound instead
+                    counts['blocked'] += 1
+                    while queue.full():
+                        await queue.wait_not_full()
+
+            replayed = offset is not None
+            if self._log is not None and not replayed:
+                names = handlers or [h.name for h in self._handlers.get(event.event_type, [])]
+                offset = self._log.append(_log_record(event, handlers), names)
+            if queue.put((time.monotonic(), event, offset, handlers)):
+                counts['spilled'] += 1
+            counts['enqueued'] += 1
+            partition.ready.set()
+            if replayed:
+                self._metrics['replayed'] += 1
+            else:
+                self._metrics['events_published'] += 1
 
             logger.debug(f"Published event: {event.event_type.value} (ID: {event.event_id})")
 
+            if offset is not None and not replayed and lane in self.durable_lanes:
+                await self._log.wait_durable(offset)
+
         except Exception as e:
             logger.error(f"Failed to publish event {event.event_id}: {e}")
             self._metrics['events_failed'] += 1
 
+    def _partition_index(self, event: Event) -> int:
+        key = event.device_id or event.content_id or event.company_id or event.event_id or ""
+        return zlib.crc32(str(key).encode("utf-8")) % len(self._partitions)
+
     async def publish_and_wait(self, event: Event, timeout: float = 30.0) -> List[bool]:
         """Publish an event and wait for all handlers to complete"""
         handlers = self._handlers.get(event.event_type, [])
@@ -158,53 +331,93 @@ class AsyncEventBus:
             return
 
         self._running = True
-        self._processing_task = asyncio.create_task(self._process_events())
-        logger.info("Event bus processing started")
-
-    async def stop_processing(self):
-        """Stop background event processing"""
+        self._workers = [
+            asyncio.create_task(self._process_events(partition)) for partition in self._partitions
+        ]
+        logger.info(f"Event bus processing started with {len(self._workers)} workers")
+        if self._log is not None:
+            # Workers are already running, so replay into a full blocking lane waits rather than hangs
+            if not self._replayed:
+                self._replayed = True
+                await self._replay()
+            self._log.start()
+
+    async def stop_processing(self, drain_timeout: float = 0.0):
+        """Stop background event processing, first waiting up to drain_timeout for queued events"""
         if not self._running:
             return
 
+        if drain_timeout > 0:
+            deadline = time.monotonic() + drain_timeout
+            while self.queue_size() and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+
         self._running = False
-        if self._processing_task:
-            self._processing_task.cancel()
-            try:
-                await self._processing_task
-            except asyncio.CancelledError:
-                pass
+        # Events waiting for a retry stay unacknowledged in the log and are replayed on restart
+        for task in [*self._workers, *self._retries]:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._retries, return_exceptions=True)
+        self._workers = []
+        self._retries.clear()
+        for batcher in self._batchers.values():
+            await batcher.stop()
+        if self._log is not None:
+            await self._log.stop()
+        for partition in self._partitions:
+            if not len(partition):
+                partition.close()
 
         logger.info("Event bus processing stopped")
 
-    async def _process_events(self):
-        """Background event processing loop"""
+    async def _process_events(self, partition: Partition):
+        """Consume one partition, always taking the highest-priority lane first"""
+        _in_consumer.set(True)
         while self._running:
             try:
-                # Get event with timeout to allow graceful shutdown
-                event = await asyncio.wait_for(self._event_queue.get(), timeout=1.0)
+                item = partition.pop()
+                if item is None:
+                    partition.ready.clear()
+                    await partition.ready.wait()
+                    continue
+
+                lane, (enqueued_at, event, offset, names) = item
+                self._lane_lag[lane].observe(time.monotonic() - enqueued_at)
+                self._lane_counts[lane]['dispatched'] += 1
 
-                # Process event with all registered handlers
+                # Process event with all registered handlers, or those it was replayed or retried for
                 handlers = self._handlers.get(event.event_type, [])
+                if names is not None:
+                    handlers = [handler for handler in handlers if handler.name in names]
                 if handlers:
-                    await self._process_event(event, handlers)
+                    await self._process_event(event, handlers, offset)
                 else:
                     logger.warning(f"No handlers for event: {event.event_type.value}")
 
-                self._event_queue.task_done()
-
-            except asyncio.TimeoutError:
-                # Normal timeout for graceful shutdown
-                continue
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Error in event processing loop: {e}")
                 await asyncio.sleep(1)
 
-    async def _process_event(self, event: Event, handlers: List[EventHandler]):
+    def queue_size(self) -> int:
+        return (sum(len(partition) for partition in self._partitions)
+                + sum(len(batcher) for batcher in self._batchers.values()))
+
+    async def flush_batches(self):
+        """Hand every micro-batch that is still filling to its handler now"""
+        await asyncio.gather(*(batcher.flush() for batcher in self._batchers.values()))
+
+    async def _process_event(self, event: Event, handlers: List[EventHandler], offset: Optional[int] = None):
         """Process an event with multiple handlers concurrently"""
         tasks = []
         for handler in handlers:
             if handler.can_handle(event.event_type):
-                tasks.append(asyncio.create_task(self._handle_event_safely(handler, event)))
+                batcher = self._batchers.get(handler.name)
+                if batcher is not None:
+                    # Settled when its batch runs; this waits only if the batcher is full
+                    await batcher.add(event, offset)
+                else:
+                    tasks.append(asyncio.create_task(self._handle_and_settle(handler, event, offset)))
 
         if tasks:
             results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -216,14 +429,95 @@ class AsyncEventBus:
                 self._metrics['events_processed'] += 1
             if failed > 0:
                 self._metrics['events_failed'] += failed
-                self._failed_events.append(event)
 
             logger.debug(f"Event {event.event_id} processed: {successful} success, {failed} failed")
 
+    async def _process_batch(self, handler: EventHandler, batch: List[BatchItem]):
+        """Run one micro-batch, then acknowledge or retry each of its events"""
+        events = [event for event, _ in batch]
+        limit = self._handler_limits.get(handler.name)
+        started = time.perf_counter()
+        try:
+            if limit is not None:
+                async with limit:
+                    results = await handler.handle_batch(events)
+            else:
+                results = await handler.handle_batch(events)
+            if len(results) != len(events):
+                raise ValueError(f"handle_batch returned {len(results)} results for {len(events)} events")
+        except Exception as e:
+            logger.error(f"Handler '{handler.name}' failed a batch of {len(events)} events: {e}")
+            results = [False] * len(events)
+        finally:
+            self._handler_latency[handler.name].observe(time.perf_counter() - started)
+
+        for (event, offset), result in zip(batch, results):
+            if result is True:
+                self._metrics['batched_events_processed'] += 1
+                if offset is not None:
+                    self._log.ack(handler.name, offset)
+            else:
+                self._metrics['events_failed'] += 1
+                self._handler_failed(handler, event, offset, attempts=1)
+
+    async def _handle_and_settle(self, handler: EventHandler, event: Event, offset: Optional[int],
+                                 attempts: int = 1) -> bool:
+        """Handle an event, then acknowledge it or schedule its retry, without waiting for other handlers"""
+        if await self._handle_event_safely(handler, event):
+            if offset is not None:
+                self._log.ack(handler.name, offset)
+            return True
+        self._handler_failed(handler, event, offset, attempts)
+        return False
+
+    def _handler_failed(self, handler: EventHandler, event: Event, offset: Optional[int], attempts: int):
+        """Retry one handler's failed event with exponential backoff, or dead-letter it"""
+        if attempts < self.retry_attempts:
+            delay = min(self.retry_base_seconds * 2 ** (attempts - 1), settings.EVENT_RETRY_MAX_SECONDS)
+            task = asyncio.ensure_future(self._retry(handler, event, offset, attempts, delay))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+            return
+
+        self._metrics['dead_lettered'] += 1
+        logger.warning(f"Handler '{handler.name}' gave up on event {event.event_id} after {attempts} attempts")
+        if self._log is not None:
+            self._log.dead_letter({'handler': handler.name, 'attempts': attempts, 'event': _log_record(event)})
+            if offset is not None:
+                self._log.ack(handler.name, offset)
+        else:
+            self._failed_events.append((handler.name, attempts, event))
+
+    async def _retry(self, handler: EventHandler, event: Event, offset: Optional[int], attempts: int,
+                     delay: float):
+        await asyncio.sleep(delay)
+        self._metrics['retries'] += 1
+        await self._handle_and_settle(handler, event, offset, attempts + 1)
+
+    async def _replay(self):
+        """Queue the events a previous run logged but did not finish"""
+        def consumers_for(record: Dict[str, Any]) -> List[str]:
+            if 'handlers' in record:
+                return record['handlers']
+            return [handler.name for handler in self._handlers.get(EventType(record['event_type']), [])]
+
+        replayed = 0
+        for offset, record, names in self._log.replay(consumers_for):
+            record.pop('handlers', None)
+            await self._enqueue(Event.from_dict(record), handlers=names, offset=offset)
+            replayed += 1
+        if replayed:
+            logger.info(f"Replaying {replayed} events from the event log")
+
     async def _handle_event_safely(self, handler: EventHandler, event: Event) -> bool:
         """Safely handle an event with error catching"""
+        limit = self._handler_limits.get(handler.name)
         try:
-            result = await handler.handle(event)
+            if limit is not None:
+                async with limit:
+                    result = await self._timed_handle(handler, event)
+            else:
+                result = await self._timed_handle(handler, event)
             if result:
                 logger.debug(f"Handler '{handler.name}' processed event {event.event_id}")
             return result
@@ -232,12 +526,41 @@ class AsyncEventBus:
             logger.error(f"Handler '{handler.name}' failed to process event {event.event_id}: {e}")
             return False
 
+    async def _timed_handle(self, handler: EventHandler, event: Event) -> bool:
+        started = time.perf_counter()
+        try:
+            return await handler.handle(event)
+        finally:
+            histogram = self._handler_latency.get(handler.name)
+            if histogram is None:
+                histogram = self._handler_latency[handler.name] = LatencyHistogram()
+            histogram.observe(time.perf_counter() - started)
+
     def get_metrics(self) -> Dict[str, Any]:
         """Get event bus metrics"""
+        now = time.monotonic()
+        lanes = {}
+        for lane in LANES:
+            queues = [partition.lanes[lane] for partition in self._partitions]
+            oldest = [t for t in (queue.oldest_enqueued_at() for queue in queues) if t is not None]
+            lanes[lane] = {
+                **self._lane_counts[lane],
+                'policy': self.backpressure[lane].value,
+                'queued': sum(len(queue) for queue in queues),
+                'oldest_age_seconds': round(now - min(oldest), 3) if oldest else 0.0,
+                'lag': self._lane_lag[lane].snapshot()
+            }
         return {
             **self._metrics,
-            'queue_size': self._event_queue.qsize(),
-            'failed_events_count': len(self._failed_events),
+            'queue_size': self.queue_size(),
+            'workers': len(self._partitions),
+            'queue_capacity': self.queue_capacity,
+            'failed_events_count': self._log.dead_letter_count if self._log else len(self._failed_events),
+            'retries_pending': len(self._retries),
+            'lanes': lanes,
+            'handler_latency': {name: histogram.snapshot() for name, histogram in self._handler_latency.items()},
+            'batching': {name: batcher.get_metrics() for name, batcher in self._batchers.items()},
+            'event_log': self._log.get_metrics() if self._log else None,
             'handlers_by_type': {
                 event_type.value: len(handlers)
                 for event_type, handlers in self._handlers.items()
@@ -245,22 +568,40 @@ class AsyncEventBus:
         }
 
     async def get_failed_events(self) -> List[Dict[str, Any]]:
-        """Get list of failed events for debugging"""
-        return [event.to_dict() for event in self._failed_events]
+        """Get list of dead-lettered events for debugging"""
+        if self._log is not None:
+            return await self._log.read_dead_letters()
+        return [
+            {'handler': name, 'attempts': attempts, 'event': event.to_dict()}
+            for name, attempts, event in self._failed_events
+        ]
 
     async def retry_failed_events(self) -> int:
-        """Retry processing failed events"""
-        retry_count = 0
-        failed_events = self._failed_events.copy()
-        self._failed_events.clear()
+        """Queue dead-lettered events again, each for the handler that failed it
 
-        for event in failed_events:
+        Events go through the lanes like new ones, so a large backlog is
+        subject to the same backpressure instead of arriving all at once.
+        """
+        retry_count = 0
+        if self._log is not None:
+            # Retries that fail again while these are queued are dead-lettered past ``until`` and kept
+            records, until = await self._log.dead_letter_batch()
+            dead_letters = [(record['handler'], Event.from_dict(record['event'])) for record in records]
+        else:
+            dead_letters = [(name, event) for name, _, event in self._failed_events]
+            self._failed_events.clear()
+
+        for name, event in dead_letters:
             try:
-                await self.publish(event)
+                await self._enqueue(event, handlers=[name])
                 retry_count += 1
             except Exception as e:
                 logger.error(f"Failed to retry event {event.event_id}: {e}")
-                self._failed_events.append(event)
+
+        if self._log is not None:
+            # The events are in the main log again, so the dead letters can go
+            await self._log.log.commit()
+            await self._log.clear_dead_letters(until, len(records))
 
         logger.info(f"Retried {retry_count} failed events")
         return retry_count
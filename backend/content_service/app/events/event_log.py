@@ -0,0 +1,527 @@
+"""
+Durable append-only event log in front of ``AsyncEventBus``.
+
+With ``EVENT_LOG_DIR`` set, every published event is appended to a local
+write-ahead log before it is queued. The log tracks, per handler, which
+events that handler has yet to finish. After a crash or restart, the bus
+replays them from the log. Delivery is at least once: events a handler
+finished after its committed offset was last saved are delivered again.
+
+Each log directory has a single writer. An ``EventLog`` claims its own
+``writer-<n>`` directory under ``EVENT_LOG_DIR`` by taking an exclusive lock
+on its ``writer.lock``, so every uvicorn worker appends to its own segments,
+saves its own offsets and, after a restart, replays only the events it had
+logged itself. A restarted worker reclaims the first free directory; events
+left in a directory no worker claims again (the worker count went down) stay
+there until one does.
+
+Layout under each writer directory:
+
+- ``events/<base offset>.seg``: the log. Each record is a 4-byte big-endian
+  payload length, then the CRC-32 of the payload, then the payload (compact
+  JSON). Offsets are byte positions in the whole log, so a record's offset
+  is its segment's base offset plus its position in the segment.
+- ``dead-letter/<base offset>.seg``: events a handler still failed after
+  ``EVENT_RETRY_MAX_ATTEMPTS`` tries, in the same format.
+- ``offsets.json``: the committed offset of each handler. Everything below
+  it has been handled.
+- ``dead-letter.json``: the offset dead letters were last retried up to.
+  Dead letters below it have been queued again.
+
+Appends only encode the record into an in-memory buffer. A background task
+writes the buffer and fsyncs it, at most ``EVENT_LOG_COMMIT_INTERVAL_MS``
+after the first append that follows a commit (group commit). One fsync
+therefore covers every event published in that interval, and
+``wait_durable`` lets a publisher wait for the commit that covers its event.
+Sealed segments whose events every handler has finished are deleted at each
+checkpoint.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct(">II")  # payload length, CRC-32 of payload
+SEGMENT_SUFFIX = ".seg"
+WRITER_PREFIX = "writer-"
+LOCK_FILE = "writer.lock"
+
+_encode = json.JSONEncoder(separators=(",", ":"), default=str).encode
+
+
+def encode_record(payload: Dict[str, Any]) -> bytes:
+    data = _encode(payload).encode("utf-8")
+    return RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def _try_lock(lock_file) -> bool:
+    """Take a non-blocking exclusive lock, held until the file is closed"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def claim_writer_directory(root: str):
+    """(directory, open lock file) of the first ``writer-<n>`` under ``root`` no other process holds"""
+    number = 0
+    while True:
+        directory = os.path.join(root, f"{WRITER_PREFIX}{number:03d}")
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, LOCK_FILE), "a+b")
+        if _try_lock(lock_file):
+            return directory, lock_file
+        lock_file.close()
+        number += 1
+
+
+def _segment_path(directory: str, base: int) -> str:
+    return os.path.join(directory, f"{base:020d}{SEGMENT_SUFFIX}")
+
+
+def _scan(data: bytes, base: int, start: int = 0) -> Iterator[Tuple[int, int, bytes]]:
+    """(offset, end offset, payload) of each intact record, stopping at the first torn or corrupt one"""
+    position = start
+    header_size = RECORD_HEADER.size
+    while position + header_size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, position)
+        end = position + header_size + length
+        payload = data[position + header_size:end]
+        if end > len(data) or zlib.crc32(payload) != checksum:
+            return
+        yield base + position, base + end, payload
+        position = end
+
+
+class SegmentLog:
+    """Append-only log of JSON records in size-bounded segment files, committed in groups"""
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, commit_interval: float = 0.005):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.commit_interval = commit_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments: List[int] = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        if not self._segments:
+            self._segments.append(0)
+            open(_segment_path(directory, 0), "wb").close()
+        self._file = open(_segment_path(directory, self._segments[-1]), "r+b")
+        self._file_size = self._recover_tail()
+        self._file.seek(self._file_size)
+
+        # Everything below durable_end is fsynced; end includes buffered records
+        self.durable_end = self._segments[-1] + self._file_size
+        self.end = self.durable_end
+        self._buffer = bytearray()
+        self._pending: Optional[asyncio.Future] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._inflight_end = self.durable_end
+        self._dirty: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._metrics = {
+            'appends': 0,
+            'commits': 0,
+            'bytes_written': 0,
+            'segments_rolled': 0,
+            'segments_deleted': 0,
+            'commit_errors': 0
+        }
+
+    @property
+    def start(self) -> int:
+        return self._segments[0]
+
+    def _recover_tail(self) -> int:
+        """Length of the intact records in the last segment, cutting off a torn write"""
+        self._file.seek(0)
+        data = self._file.read()
+        base = self._segments[-1]
+        valid = 0
+        for _, end, _ in _scan(data, base):
+            valid = end - base
+        if valid < len(data):
+            logger.warning(f"Truncating {len(data) - valid} bytes of incomplete records from {self._file.name}")
+            self._file.truncate(valid)
+        return valid
+
+    # ------------------------------------------------------------------
+    # Appending and group commit
+    # ------------------------------------------------------------------
+
+    def append(self, payload: Dict[str, Any]) -> int:
+        """Buffer a record for the next commit; returns its offset"""
+        return self.append_encoded(encode_record(payload))
+
+    def append_encoded(self, record: bytes) -> int:
+        offset = self.end
+        self._buffer += record
+        self.end += len(record)
+        self._metrics['appends'] += 1
+        if self._dirty is not None:
+            self._dirty.set()
+        return offset
+
+    async def wait_durable(self, offset: int) -> None:
+        """Wait until the record at ``offset`` has been fsynced"""
+        if offset < self.durable_end:
+            return
+        if self._task is None:
+            await self.commit()
+            return
+        if self._inflight is not None and offset < self._inflight_end:
+            await asyncio.shield(self._inflight)
+            return
+        if self._pending is None:
+            self._pending = asyncio.get_running_loop().create_future()
+        await asyncio.shield(self._pending)
+
+    async def commit(self) -> None:
+        """Write and fsync everything appended so far"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._buffer:
+                return
+            data, self._buffer = bytes(self._buffer), bytearray()
+            future, self._pending = self._pending or asyncio.get_running_loop().create_future(), None
+            if self._dirty is not None:
+                self._dirty.clear()
+            end = self.end
+            self._inflight, self._inflight_end = future, end
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+            except Exception as e:
+                self._metrics['commit_errors'] += 1
+                logger.error(f"Event log commit to {self.directory} failed: {e}")
+                future.set_exception(e)
+                future.exception()  # Waiters see it; nobody else needs to
+                raise
+            finally:
+                self._inflight = None
+            self.durable_end = end
+            self._metrics['commits'] += 1
+            self._metrics['bytes_written'] += len(data)
+            future.set_result(end)
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file_size += len(data)
+        if self._file_size >= self.segment_bytes:
+            base = self._segments[-1] + self._file_size
+            self._file.close()
+            self._file = open(_segment_path(self.directory, base), "w+b")
+            self._segments.append(base)
+            self._file_size = 0
+            self._metrics['segments_rolled'] += 1
+
+    def start_committer(self) -> None:
+        if self._task is None or self._task.done():
+            self._dirty = asyncio.Event()
+            if self._buffer:
+                self._dirty.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop_committer(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.commit()
+
+    async def _run(self) -> None:
+        while True:
+            await self._dirty.wait()
+            # Let the appends of the next few milliseconds share this fsync
+            await asyncio.sleep(self.commit_interval)
+            try:
+                await self.commit()
+            except Exception:
+                await asyncio.sleep(1)
+
+    # ------------------------------------------------------------------
+    # Reading and retention
+    # ------------------------------------------------------------------
+
+    def read(self, from_offset: int = 0, until: Optional[int] = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """(offset, record) for each durable record from ``from_offset`` up to ``until``"""
+        until = self.durable_end if until is None else min(until, self.durable_end)
+        for i, base in enumerate(self._segments):
+            next_base = self._segments[i + 1] if i + 1 < len(self._segments) else until
+            if next_base <= from_offset or base >= until:
+                continue
+            with open(_segment_path(self.directory, base), "rb") as f:
+                data = f.read(until - base)
+            for offset, _, payload in _scan(data, base, max(0, from_offset - base)):
+                yield offset, json.loads(payload)
+
+    async def delete_before(self, offset: int) -> int:
+        """Delete sealed segments that hold only records below ``offset``"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            deleted = 0
+            while len(self._segments) > 1 and self._segments[1] <= offset:
+                try:
+                    os.remove(_segment_path(self.directory, self._segments[0]))
+                except OSError as e:
+                    logger.warning(f"Could not delete event log segment {self._segments[0]}: {e}")
+                    break
+                self._segments.pop(0)
+                deleted += 1
+            self._metrics['segments_deleted'] += deleted
+            return deleted
+
+    def close(self) -> None:
+        self._file.close()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self._metrics,
+            'segments': len(self._segments),
+            'start_offset': self.start,
+            'end_offset': self.end,
+            'durable_offset': self.durable_end,
+            'buffered_bytes': len(self._buffer)
+        }
+
+
+class ConsumerCursor:
+    """Events one handler has yet to finish; its committed offset is the lowest of them"""
+
+    __slots__ = ("start", "order", "outstanding")
+
+    def __init__(self, start: int):
+        # Offset the handler had committed when the log was opened
+        self.start = start
+        self.order: Deque[int] = deque()
+        self.outstanding: Set[int] = set()
+
+    def track(self, offset: int) -> None:
+        self.order.append(offset)
+        self.outstanding.add(offset)
+
+    def ack(self, offset: int) -> None:
+        self.outstanding.discard(offset)
+        order = self.order
+        while order and order[0] not in self.outstanding:
+            order.popleft()
+
+    def committed(self, end: int) -> int:
+        return self.order[0] if self.order else end
+
+
+class EventLog:
+    """The bus's write-ahead log, dead-letter log and per-handler offsets"""
+
+    def __init__(self, root: str, segment_bytes: int = 64 * 1024 * 1024, commit_interval: float = 0.005,
+                 checkpoint_interval: float = 1.0):
+        self.root = root
+        self.directory, self._lock_file = claim_writer_directory(root)
+        self.checkpoint_interval = checkpoint_interval
+        self.log = SegmentLog(os.path.join(self.directory, "events"), segment_bytes, commit_interval)
+        self.dead_letters = SegmentLog(os.path.join(self.directory, "dead-letter"), segment_bytes, commit_interval)
+        self._dead_letter_start_path = os.path.join(self.directory, "dead-letter.json")
+        self.dead_letter_start = self._load_dead_letter_start()
+        self.dead_letter_count = sum(1 for _ in self.dead_letters.read(self.dead_letter_start))
+        # Events appended before this point belong to a previous run and are replayed
+        self.opened_end = self.log.end
+        self._offsets_path = os.path.join(self.directory, "offsets.json")
+        self._saved = self._load_offsets()
+        self._saved_snapshot: Dict[str, int] = {}
+        self._cursors: Dict[str, ConsumerCursor] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _load_offsets(self) -> Dict[str, int]:
+        try:
+            with open(self._offsets_path, "r") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable event log offsets {self._offsets_path}: {e}")
+            return {}
+        # A torn log tail may end before an offset saved just before the crash
+        return {name: min(int(offset), self.log.end) for name, offset in saved.items()}
+
+    def _load_dead_letter_start(self) -> int:
+        try:
+            with open(self._dead_letter_start_path, "r") as f:
+                start = int(json.load(f)["start"])
+        except FileNotFoundError:
+            return self.dead_letters.start
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable dead-letter offset {self._dead_letter_start_path}: {e}")
+            return self.dead_letters.start
+        return max(self.dead_letters.start, min(start, self.dead_letters.end))
+
+    # ------------------------------------------------------------------
+    # Consumers
+    # ------------------------------------------------------------------
+
+    def add_consumer(self, name: str) -> None:
+        """Start tracking a handler; one never seen before starts at the end of the log"""
+        if name not in self._cursors:
+            self._cursors[name] = ConsumerCursor(max(self._saved.get(name, self.opened_end), self.log.start))
+
+    def append(self, record: Dict[str, Any], consumers: List[str]) -> int:
+        offset = self.log.append_encoded(encode_record(record))
+        cursors = self._cursors
+        for name in consumers:
+            cursor = cursors.get(name)
+            if cursor is not None:
+                cursor.track(offset)
+        return offset
+
+    def ack(self, name: str, offset: int) -> None:
+        cursor = self._cursors.get(name)
+        if cursor is not None:
+            cursor.ack(offset)
+
+    def ack_all(self, offset: int) -> None:
+        for cursor in self._cursors.values():
+            cursor.ack(offset)
+
+    async def wait_durable(self, offset: int) -> None:
+        await self.log.wait_durable(offset)
+
+    def committed_offsets(self) -> Dict[str, int]:
+        end = self.log.end
+        return {name: cursor.committed(end) for name, cursor in self._cursors.items()}
+
+    def replay(self, consumers_for: Callable[[Dict[str, Any]], List[str]]) -> Iterator[Tuple[int, Dict[str, Any], List[str]]]:
+        """Records from a previous run that some handler had not finished, tracked again
+
+        ``consumers_for(record)`` names the handlers the record was published
+        to. Each record is handed to those whose committed offset it is not
+        below.
+        """
+        if not self._cursors:
+            return
+        from_offset = min(cursor.start for cursor in self._cursors.values())
+        for offset, record in self.log.read(from_offset, until=self.opened_end):
+            consumers = [
+                name for name in consumers_for(record)
+                if name in self._cursors and self._cursors[name].start <= offset
+            ]
+            if consumers:
+                for name in consumers:
+                    self._cursors[name].track(offset)
+                yield offset, record, consumers
+
+    # ------------------------------------------------------------------
+    # Dead letters
+    # ------------------------------------------------------------------
+
+    def dead_letter(self, record: Dict[str, Any]) -> None:
+        self.dead_letters.append(record)
+        self.dead_letter_count += 1
+
+    async def read_dead_letters(self) -> List[Dict[str, Any]]:
+        records, _ = await self.dead_letter_batch()
+        return records
+
+    async def dead_letter_batch(self) -> Tuple[List[Dict[str, Any]], int]:
+        """Dead letters not yet retried, and the offset to pass to ``clear_dead_letters``"""
+        await self.dead_letters.commit()
+        until = self.dead_letters.durable_end
+        return [record for _, record in self.dead_letters.read(self.dead_letter_start, until)], until
+
+    async def clear_dead_letters(self, until: int, count: int) -> None:
+        """Forget the ``count`` dead letters below ``until``
+
+        Dead letters written after ``dead_letter_batch`` returned, for example
+        by retries that failed again, are at or above ``until`` and stay.
+        """
+        self.dead_letter_start = max(self.dead_letter_start, until)
+        self.dead_letter_count = max(0, self.dead_letter_count - count)
+        tmp_path = self._dead_letter_start_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"start": self.dead_letter_start}, f)
+        os.replace(tmp_path, self._dead_letter_start_path)
+        await self.dead_letters.delete_before(self.dead_letter_start)
+
+    # ------------------------------------------------------------------
+    # Background commit and checkpoint
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        self.log.start_committer()
+        self.dead_letters.start_committer()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.log.stop_committer()
+        await self.dead_letters.stop_committer()
+        await self.checkpoint()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                logger.error(f"Event log checkpoint failed: {e}")
+
+    async def checkpoint(self) -> None:
+        """Save committed offsets and delete segments every handler is done with"""
+        offsets = self.committed_offsets()
+        # Saved offsets must not run ahead of what is on disk
+        durable = self.log.durable_end
+        offsets = {name: min(offset, durable) for name, offset in offsets.items()}
+        if offsets != self._saved_snapshot:
+            tmp_path = self._offsets_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({**self._saved, **offsets}, f)
+            os.replace(tmp_path, self._offsets_path)
+            self._saved_snapshot = offsets
+        await self.log.delete_before(min(offsets.values()) if offsets else durable)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        end = self.log.end
+        return {
+            'writer_directory': os.path.basename(self.directory),
+            'log': self.log.get_metrics(),
+            'dead_letters': self.dead_letter_count,
+            'consumer_lag_bytes': {name: end - cursor.committed(end) for name, cursor in self._cursors.items()},
+            'outstanding': {name: len(cursor.outstanding) for name, cursor in self._cursors.items()}
+        }
+
+    def close(self) -> None:
+        self.log.close()
+        self.dead_letters.close()
+        # Lets the next process claim this directory and replay what is left
+        self._lock_file.close()
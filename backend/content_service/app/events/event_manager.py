@@ -3,7 +3,6 @@ Event Manager - Central coordinator for event-driven architecture
 Initializes event bus and registers all event handlers
 """
 import logging
-import asyncio
 from typing import Dict, Any, List
 from contextlib import asynccontextmanager
 
@@ -79,18 +78,12 @@ class EventManager:
         try:
             logger.info("🔄 Shutting down Event Manager")
 
-            # Flush any pending analytics
-            if "analytics" in self.handlers:
-                await self.handlers["analytics"].flush_batch()
-
-            # Stop event bus processing
-            await self.event_bus.stop_processing()
-
-            # Process any remaining events
+            # Process any remaining events, then stop event bus processing; stopping
+            # also hands unfinished micro-batches (analytics, notifications) to their handlers
             remaining_events = self.event_bus.get_metrics()["queue_size"]
             if remaining_events > 0:
                 logger.info(f"⏳ Processing {remaining_events} remaining events...")
-                await asyncio.sleep(2)  # Give time for processing
+            await self.event_bus.stop_processing(drain_timeout=2.0)
 
             self._initialized = False
             logger.info("✅ Event Manager shut down successfully")
@@ -22,7 +22,8 @@ class AIContentModerationHandler(EventHandler):
             event_types=[
                 EventType.CONTENT_UPLOADED,
                 EventType.CONTENT_AI_MODERATION_STARTED
-            ]
+            ],
+            max_concurrency=2  # Each event calls out to the AI moderation providers
         )
         self.history_service = None  # Will be initialized when needed
 
@@ -3,16 +3,70 @@ Analytics Event Handler - Processes analytics data in background
 Reduces load on primary application by handling analytics operations asynchronously
 """
 import logging
-from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
+from typing import Dict, Any, List, Tuple
+from datetime import datetime
 import asyncio
+from app.config import settings
 from app.events.event_bus import EventHandler, Event, EventType
 from app.database_service import db_service
 
 logger = logging.getLogger(__name__)
 
+class GroupedUpdates:
+    """Update operators for many events, merged into one update per document
+
+    ``$inc`` amounts add up, later ``$set`` values win, and ``$addToSet`` /
+    ``$push`` values are collected for one ``$each``.
+    """
+
+    def __init__(self):
+        self._docs: Dict[Tuple[str, Any], Dict[str, Dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _ops(self, collection: str, doc_id: Any) -> Dict[str, Dict[str, Any]]:
+        ops = self._docs.get((collection, doc_id))
+        if ops is None:
+            ops = self._docs[(collection, doc_id)] = {}
+        return ops
+
+    def inc(self, collection: str, doc_id: Any, field: str, amount: Any = 1):
+        fields = self._ops(collection, doc_id).setdefault("$inc", {})
+        fields[field] = fields.get(field, 0) + amount
+
+    def set(self, collection: str, doc_id: Any, field: str, value: Any):
+        self._ops(collection, doc_id).setdefault("$set", {})[field] = value
+
+    def add_to_set(self, collection: str, doc_id: Any, field: str, value: Any):
+        values = self._ops(collection, doc_id).setdefault("$addToSet", {}).setdefault(field, [])
+        if value not in values:
+            values.append(value)
+
+    def push(self, collection: str, doc_id: Any, field: str, value: Any):
+        self._ops(collection, doc_id).setdefault("$push", {}).setdefault(field, []).append(value)
+
+    def by_collection(self) -> Dict[str, List[Tuple[Dict, Dict]]]:
+        """(query, update) pairs per collection"""
+        grouped: Dict[str, List[Tuple[Dict, Dict]]] = {}
+        for (collection, doc_id), ops in self._docs.items():
+            update = {}
+            for operator, fields in ops.items():
+                if operator in ("$addToSet", "$push"):
+                    update[operator] = {field: {"$each": values} for field, values in fields.items()}
+                else:
+                    update[operator] = fields
+            grouped.setdefault(collection, []).append(({"_id": doc_id}, update))
+        return grouped
+
+
 class AnalyticsHandler(EventHandler):
-    """Background handler for analytics data processing"""
+    """Background handler for analytics data processing
+
+    Events arrive in micro-batches. Each batch costs one ``insert_many`` of
+    the raw events and one unordered ``bulk_write`` per collection it touches,
+    with every event's counters for a document merged into one update.
+    """
 
     def __init__(self):
         super().__init__(
@@ -25,415 +79,225 @@ class AnalyticsHandler(EventHandler):
                 EventType.CONTENT_DEPLOYED,
                 EventType.DEVICE_SYNC_COMPLETED,
                 EventType.USER_LOGIN
-            ]
+            ],
+            batch_size=settings.EVENT_BATCH_MAX_SIZE
         )
-        self._batch_buffer = []
-        self._batch_size = 50
-        self._batch_timeout = 30  # seconds
-        self._last_batch_time = datetime.utcnow()
+        self._trackers = {
+            EventType.CONTENT_VIEWED: self._track_content_view,
+            EventType.DEVICE_INTERACTION: self._track_device_interaction,
+            EventType.PERFORMANCE_METRIC: self._track_performance_metric,
+            EventType.CONTENT_APPROVED: self._track_content_lifecycle,
+            EventType.CONTENT_DEPLOYED: self._track_content_lifecycle,
+            EventType.DEVICE_SYNC_COMPLETED: self._track_device_sync,
+            EventType.USER_LOGIN: self._track_user_activity
+        }
 
     async def handle(self, event: Event) -> bool:
         """Process analytics event"""
-        try:
-            # Add to batch buffer for efficient processing
-            self._batch_buffer.append(event)
-
-            # Process batch if conditions are met
-            if (len(self._batch_buffer) >= self._batch_size or
-                datetime.utcnow() - self._last_batch_time > timedelta(seconds=self._batch_timeout)):
-                await self._process_batch()
-
-            # Handle specific event types
-            if event.event_type == EventType.CONTENT_VIEWED:
-                await self._track_content_view(event)
-            elif event.event_type == EventType.DEVICE_INTERACTION:
-                await self._track_device_interaction(event)
-            elif event.event_type == EventType.PERFORMANCE_METRIC:
-                await self._track_performance_metric(event)
-            elif event.event_type in [EventType.CONTENT_APPROVED, EventType.CONTENT_DEPLOYED]:
-                await self._track_content_lifecycle(event)
-            elif event.event_type == EventType.DEVICE_SYNC_COMPLETED:
-                await self._track_device_sync(event)
-            elif event.event_type == EventType.USER_LOGIN:
-                await self._track_user_activity(event)
-
-            return True
-
-        except Exception as e:
-            logger.error(f"Analytics handler error for event {event.event_id}: {e}")
-            return False
+        return (await self.handle_batch([event]))[0]
+
+    async def handle_batch(self, events: List[Event]) -> List[bool]:
+        """Process a batch of analytics events"""
+        results = []
+        tracked = []
+        updates = GroupedUpdates()
+        for event in events:
+            tracker = self._trackers.get(event.event_type)
+            try:
+                if tracker is not None:
+                    tracker(event, updates)
+                tracked.append(event)
+                results.append(True)
+            except Exception as e:
+                # Only this event fails; the bus retries it on its own
+                logger.error(f"Analytics handler error for event {event.event_id}: {e}")
+                results.append(False)
 
-    async def _process_batch(self):
-        """Process batched events efficiently"""
-        if not self._batch_buffer:
-            return
-
-        try:
-            # Group events by type for batch processing
-            events_by_type = {}
-            for event in self._batch_buffer:
-                event_type = event.event_type.value
-                if event_type not in events_by_type:
-                    events_by_type[event_type] = []
-                events_by_type[event_type].append(event)
-
-            # Process each event type batch
-            tasks = []
-            for event_type, events in events_by_type.items():
-                tasks.append(self._batch_process_by_type(event_type, events))
-
-            await asyncio.gather(*tasks, return_exceptions=True)
-
-            logger.info(f"Processed batch of {len(self._batch_buffer)} analytics events")
-
-        except Exception as e:
-            logger.error(f"Failed to process analytics batch: {e}")
-
-        finally:
-            self._batch_buffer.clear()
-            self._last_batch_time = datetime.utcnow()
-
-    async def _batch_process_by_type(self, event_type: str, events: List[Event]):
-        """Process events of the same type in batch"""
         try:
-            # Prepare batch data for database
-            analytics_docs = []
-            for event in events:
-                doc = {
-                    "event_id": event.event_id,
-                    "event_type": event_type,
-                    "timestamp": event.timestamp,
-                    "company_id": event.company_id,
-                    "user_id": event.user_id,
-                    "device_id": event.device_id,
-                    "content_id": event.content_id,
-                    "payload": event.payload,
-                    "correlation_id": event.correlation_id,
-                    "processed_at": datetime.utcnow()
-                }
-                analytics_docs.append(doc)
-
-            # Batch insert to analytics collection
-            if analytics_docs:
-                await db_service.insert_many("analytics_events", analytics_docs)
-
-            # Update aggregated metrics
-            await self._update_aggregated_metrics(event_type, events)
+            await asyncio.gather(
+                self._store_events(tracked),
+                self._update_aggregated_metrics(tracked),
+                *(db_service.bulk_update(collection, pairs) for collection, pairs in updates.by_collection().items())
+            )
+            logger.debug(f"Processed batch of {len(events)} analytics events ({len(updates)} documents updated)")
+            return results
 
         except Exception as e:
-            logger.error(f"Failed to batch process {event_type} events: {e}")
+            logger.error(f"Analytics handler error for a batch of {len(events)} events: {e}")
+            return [False] * len(events)
+
+    async def _store_events(self, events: List[Event]):
+        """Insert the raw events into the analytics collection"""
+        processed_at = datetime.utcnow()
+        analytics_docs = [
+            {
+                "event_id": event.event_id,
+                "event_type": event.event_type.value,
+                "timestamp": event.timestamp,
+                "company_id": event.company_id,
+                "user_id": event.user_id,
+                "device_id": event.device_id,
+                "content_id": event.content_id,
+                "payload": event.payload,
+                "correlation_id": event.correlation_id,
+                "processed_at": processed_at
+            }
+            for event in events
+        ]
+        if analytics_docs:
+            await db_service.insert_many("analytics_events", analytics_docs)
 
-    async def _track_content_view(self, event: Event) -> bool:
+    def _track_content_view(self, event: Event, updates: GroupedUpdates) -> bool:
         """Track content view event"""
-        try:
-            content_id = event.content_id
-            device_id = event.device_id
-            company_id = event.company_id
-
-            if not all([content_id, device_id, company_id]):
-                logger.warning(f"Incomplete content view event {event.event_id}")
-                return False
-
-            # Update content view metrics
-            await db_service.update_document(
-                "content",
-                {"_id": content_id},
-                {
-                    "$inc": {
-                        "analytics.total_views": 1,
-                        "analytics.daily_views": 1
-                    },
-                    "$set": {
-                        "analytics.last_viewed": event.timestamp,
-                        "analytics.last_device": device_id
-                    },
-                    "$addToSet": {
-                        "analytics.viewing_devices": device_id
-                    }
-                }
-            )
-
-            # Update device engagement metrics
-            await db_service.update_document(
-                "devices",
-                {"_id": device_id},
-                {
-                    "$inc": {
-                        "analytics.total_content_views": 1
-                    },
-                    "$set": {
-                        "analytics.last_activity": event.timestamp
-                    }
-                }
-            )
-
-            # Update company analytics
-            await self._update_company_metrics(company_id, {
-                "total_content_views": 1,
-                "active_devices": [device_id]
-            })
+        content_id = event.content_id
+        device_id = event.device_id
+        company_id = event.company_id
 
-            return True
-
-        except Exception as e:
-            logger.error(f"Failed to track content view: {e}")
+        if not all([content_id, device_id, company_id]):
+            logger.warning(f"Incomplete content view event {event.event_id}")
             return False
 
-    async def _track_device_interaction(self, event: Event) -> bool:
+        # Content view metrics
+        updates.inc("content", content_id, "analytics.total_views")
+        updates.inc("content", content_id, "analytics.daily_views")
+        updates.set("content", content_id, "analytics.last_viewed", event.timestamp)
+        updates.set("content", content_id, "analytics.last_device", device_id)
+        updates.add_to_set("content", content_id, "analytics.viewing_devices", device_id)
+
+        # Device engagement metrics
+        updates.inc("devices", device_id, "analytics.total_content_views")
+        updates.set("devices", device_id, "analytics.last_activity", event.timestamp)
+
+        # Company analytics
+        self._update_company_metrics(updates, company_id, {
+            "total_content_views": 1,
+            "active_devices": [device_id]
+        })
+        return True
+
+    def _track_device_interaction(self, event: Event, updates: GroupedUpdates) -> bool:
         """Track device interaction event"""
-        try:
-            device_id = event.device_id
-            company_id = event.company_id
-            interaction_data = event.payload
-
-            if not all([device_id, company_id]):
-                return False
-
-            # Update device interaction metrics
-            interaction_type = interaction_data.get("interaction_type", "unknown")
-            duration = interaction_data.get("duration", 0)
-
-            await db_service.update_document(
-                "devices",
-                {"_id": device_id},
-                {
-                    "$inc": {
-                        "analytics.total_interactions": 1,
-                        f"analytics.interactions_by_type.{interaction_type}": 1,
-                        "analytics.total_interaction_time": duration
-                    },
-                    "$set": {
-                        "analytics.last_interaction": event.timestamp
-                    }
-                }
-            )
-
-            return True
+        device_id = event.device_id
+        company_id = event.company_id
+        interaction_data = event.payload
 
-        except Exception as e:
-            logger.error(f"Failed to track device interaction: {e}")
+        if not all([device_id, company_id]):
             return False
 
-    async def _track_performance_metric(self, event: Event) -> bool:
-        """Track performance metrics"""
-        try:
-            metrics = event.payload
-            entity_type = metrics.get("entity_type")  # "device", "content", "company"
-            entity_id = metrics.get("entity_id")
-
-            if not all([entity_type, entity_id]):
-                return False
-
-            collection = f"{entity_type}s"
-            await db_service.update_document(
-                collection,
-                {"_id": entity_id},
-                {
-                    "$push": {
-                        "performance_metrics": {
-                            "timestamp": event.timestamp,
-                            "metrics": metrics,
-                            "recorded_by": event.source
-                        }
-                    },
-                    "$set": {
-                        "last_metrics_update": event.timestamp
-                    }
-                }
-            )
+        interaction_type = interaction_data.get("interaction_type", "unknown")
+        duration = interaction_data.get("duration", 0)
 
-            return True
+        updates.inc("devices", device_id, "analytics.total_interactions")
+        updates.inc("devices", device_id, f"analytics.interactions_by_type.{interaction_type}")
+        updates.inc("devices", device_id, "analytics.total_interaction_time", duration)
+        updates.set("devices", device_id, "analytics.last_interaction", event.timestamp)
+        return True
 
-        except Exception as e:
-            logger.error(f"Failed to track performance metric: {e}")
+    def _track_performance_metric(self, event: Event, updates: GroupedUpdates) -> bool:
+        """Track performance metrics"""
+        metrics = event.payload
+        entity_type = metrics.get("entity_type")  # "device", "content", "company"
+        entity_id = metrics.get("entity_id")
+
+        if not all([entity_type, entity_id]):
             return False
 
-    async def _track_content_lifecycle(self, event: Event) -> bool:
-        """Track content lifecycle events"""
-        try:
-            content_id = event.content_id
-            company_id = event.company_id
+        collection = f"{entity_type}s"
+        updates.push(collection, entity_id, "performance_metrics", {
+            "timestamp": event.timestamp,
+            "metrics": metrics,
+            "recorded_by": event.source
+        })
+        updates.set(collection, entity_id, "last_metrics_update", event.timestamp)
+        return True
 
-            if not all([content_id, company_id]):
-                return False
+    def _track_content_lifecycle(self, event: Event, updates: GroupedUpdates) -> bool:
+        """Track content lifecycle events"""
+        content_id = event.content_id
+        company_id = event.company_id
 
-            lifecycle_data = {
-                "event_type": event.event_type.value,
-                "timestamp": event.timestamp,
-                "user_id": event.user_id,
-                "payload": event.payload
-            }
+        if not all([content_id, company_id]):
+            return False
 
-            await db_service.update_document(
-                "content",
-                {"_id": content_id},
-                {
-                    "$push": {
-                        "analytics.lifecycle_events": lifecycle_data
-                    },
-                    "$set": {
-                        f"analytics.{event.event_type.value}_at": event.timestamp
-                    }
-                }
-            )
+        updates.push("content", content_id, "analytics.lifecycle_events", {
+            "event_type": event.event_type.value,
+            "timestamp": event.timestamp,
+            "user_id": event.user_id,
+            "payload": event.payload
+        })
+        updates.set("content", content_id, f"analytics.{event.event_type.value}_at", event.timestamp)
+        return True
 
-            return True
+    def _track_device_sync(self, event: Event, updates: GroupedUpdates) -> bool:
+        """Track device sync completion"""
+        device_id = event.device_id
+        company_id = event.company_id
+        sync_data = event.payload
 
-        except Exception as e:
-            logger.error(f"Failed to track content lifecycle: {e}")
+        if not all([device_id, company_id]):
             return False
 
-    async def _track_device_sync(self, event: Event) -> bool:
-        """Track device sync completion"""
-        try:
-            device_id = event.device_id
-            company_id = event.company_id
-            sync_data = event.payload
-
-            if not all([device_id, company_id]):
-                return False
-
-            # Update device sync metrics
-            content_count = len(sync_data.get("content_ids", []))
-            sync_duration = sync_data.get("sync_duration", 0)
-
-            await db_service.update_document(
-                "devices",
-                {"_id": device_id},
-                {
-                    "$inc": {
-                        "analytics.total_syncs": 1,
-                        "analytics.total_sync_time": sync_duration,
-                        "analytics.total_content_synced": content_count
-                    },
-                    "$set": {
-                        "analytics.last_sync": event.timestamp,
-                        "analytics.last_sync_duration": sync_duration
-                    }
-                }
-            )
+        content_count = len(sync_data.get("content_ids", []))
+        sync_duration = sync_data.get("sync_duration", 0)
 
-            return True
-
-        except Exception as e:
-            logger.error(f"Failed to track device sync: {e}")
-            return False
+        updates.inc("devices", device_id, "analytics.total_syncs")
+        updates.inc("devices", device_id, "analytics.total_sync_time", sync_duration)
+        updates.inc("devices", device_id, "analytics.total_content_synced", content_count)
+        updates.set("devices", device_id, "analytics.last_sync", event.timestamp)
+        updates.set("devices", device_id, "analytics.last_sync_duration", sync_duration)
+        return True
 
-    async def _track_user_activity(self, event: Event) -> bool:
+    def _track_user_activity(self, event: Event, updates: GroupedUpdates) -> bool:
         """Track user activity"""
-        try:
-            user_id = event.user_id
-            company_id = event.company_id
-
-            if not all([user_id, company_id]):
-                return False
-
-            await db_service.update_document(
-                "users",
-                {"_id": user_id},
-                {
-                    "$inc": {
-                        "analytics.login_count": 1
-                    },
-                    "$set": {
-                        "analytics.last_login": event.timestamp
-                    },
-                    "$push": {
-                        "analytics.login_history": {
-                            "timestamp": event.timestamp,
-                            "source": event.source,
-                            "ip_address": event.payload.get("ip_address"),
-                            "user_agent": event.payload.get("user_agent")
-                        }
-                    }
-                }
-            )
+        user_id = event.user_id
+        company_id = event.company_id
 
-            return True
-
-        except Exception as e:
-            logger.error(f"Failed to track user activity: {e}")
+        if not all([user_id, company_id]):
             return False
 
-    async def _update_company_metrics(self, company_id: str, metrics: Dict[str, Any]):
-        """Update company-level aggregated metrics"""
+        updates.inc("users", user_id, "analytics.login_count")
+        updates.set("users", user_id, "analytics.last_login", event.timestamp)
+        updates.push("users", user_id, "analytics.login_history", {
+            "timestamp": event.timestamp,
+            "source": event.source,
+            "ip_address": event.payload.get("ip_address"),
+            "user_agent": event.payload.get("user_agent")
+        })
+        return True
+
+    def _update_company_metrics(self, updates: GroupedUpdates, company_id: str, metrics: Dict[str, Any]):
+        """Company-level aggregated metrics: numbers are added, lists are added to sets"""
+        for key, value in metrics.items():
+            if isinstance(value, (int, float)):
+                updates.inc("companies", company_id, f"analytics.{key}", value)
+            elif isinstance(value, list):
+                for item in value:
+                    updates.add_to_set("companies", company_id, f"analytics.{key}", item)
+
+    async def _update_aggregated_metrics(self, events: List[Event]):
+        """Daily event counts per company and event type, one upsert each"""
         try:
-            update_ops = {}
-
-            # Increment counters
-            for key, value in metrics.items():
-                if isinstance(value, (int, float)):
-                    if key not in update_ops.get("$inc", {}):
-                        update_ops.setdefault("$inc", {})[f"analytics.{key}"] = value
-
-            # Add to sets (for unique values like active devices)
-            for key, value in metrics.items():
-                if isinstance(value, list):
-                    for item in value:
-                        update_ops.setdefault("$addToSet", {})[f"analytics.{key}"] = item
-
-            if update_ops:
-                await db_service.update_document(
-                    "companies",
-                    {"_id": company_id},
-                    update_ops
-                )
-
-        except Exception as e:
-            logger.error(f"Failed to update company metrics: {e}")
-
-    async def _update_aggregated_metrics(self, event_type: str, events: List[Event]):
-        """Update aggregated metrics for event type"""
-        try:
-            # Group events by company for aggregation
-            company_events = {}
+            counts: Dict[Tuple[str, str], int] = {}
             for event in events:
-                company_id = event.company_id
-                if company_id:
-                    if company_id not in company_events:
-                        company_events[company_id] = []
-                    company_events[company_id].append(event)
-
-            # Update company-level aggregations
-            for company_id, company_event_list in company_events.items():
-                await self._update_company_aggregations(company_id, event_type, company_event_list)
-
-        except Exception as e:
-            logger.error(f"Failed to update aggregated metrics: {e}")
-
-    async def _update_company_aggregations(self, company_id: str, event_type: str, events: List[Event]):
-        """Update company-level event aggregations"""
-        try:
-            aggregation_data = {
-                "event_type": event_type,
-                "count": len(events),
-                "timestamp": datetime.utcnow(),
-                "period": "real_time"
-            }
-
-            await db_service.update_document(
+                if event.company_id:
+                    key = (event.company_id, event.event_type.value)
+                    counts[key] = counts.get(key, 0) + 1
+            if not counts:
+                return
+
+            now = datetime.utcnow()
+            today = now.date().isoformat()
+            await db_service.bulk_update(
                 "analytics_aggregations",
-                {
-                    "company_id": company_id,
-                    "event_type": event_type,
-                    "date": datetime.utcnow().date().isoformat()
-                },
-                {
-                    "$inc": {
-                        "count": len(events)
-                    },
-                    "$set": {
-                        "last_updated": datetime.utcnow()
-                    }
-                },
+                [
+                    (
+                        {"company_id": company_id, "event_type": event_type, "date": today},
+                        {"$inc": {"count": count}, "$set": {"last_updated": now}}
+                    )
+                    for (company_id, event_type), count in counts.items()
+                ],
                 upsert=True
             )
 
         except Exception as e:
-            logger.error(f"Failed to update company aggregations: {e}")
-
-    async def flush_batch(self):
-        """Manually flush the current batch"""
-        if self._batch_buffer:
-            await self._process_batch()
-            logger.info("Analytics batch manually flushed")
\ No newline at end of file
+            logger.error(f"Failed to update aggregated metrics: {e}")
@@ -3,18 +3,97 @@ Notification Event Handler - Processes notifications in background
 Reduces load on primary application by handling notification operations asynchronously
 """
 import logging
-from typing import Dict, Any, List, Optional
+import time
+from typing import Dict, Any, FrozenSet, List, Optional, Set, Tuple
 from datetime import datetime
 import asyncio
+from app.config import settings
 from app.events.event_bus import EventHandler, Event, EventType
 from app.database_service import db_service
 
 logger = logging.getLogger(__name__)
 
+# Recipient role -> (company roles that fill it, permissions that fill it)
+ROLE_RULES = {
+    "content_reviewers": ({"REVIEWER", "ADMIN"}, {"content_approve", "content_moderate"}),
+    "content_editors": ({"EDITOR", "ADMIN"}, {"content_create", "content_update"}),
+    "device_managers": ({"ADMIN"}, {"device_manage", "device_update"}),
+    "company_admins": ({"ADMIN"}, set())
+}
+
+
+class RecipientIndex:
+    """Active users of each company by the recipient roles they fill
+
+    Loading a company costs one ``users`` query, and the technical support
+    list (super users) another. Both are reused for
+    ``NOTIFICATION_RECIPIENT_CACHE_TTL_SECONDS``. Nothing invalidates them
+    early: each worker has its own index, so the TTL is what bounds how long a
+    user or role change (a new reviewer, a deactivated admin) can go
+    unnoticed by notifications on every worker. Keep it short.
+    """
+
+    SUPPORT_KEY = "__technical_support__"
+
+    def __init__(self, ttl_seconds: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.NOTIFICATION_RECIPIENT_CACHE_TTL_SECONDS
+        self._entries: Dict[Optional[str], Tuple[float, Dict[str, List[str]]]] = {}
+        self._metrics = {'hits': 0, 'loads': 0}
+
+    async def recipients(self, company_id: Optional[str], roles: FrozenSet[str]) -> Set[str]:
+        recipients: Set[str] = set()
+        company_roles = roles & ROLE_RULES.keys()
+        if company_roles:
+            index = await self._get(company_id)
+            for role in company_roles:
+                recipients.update(index.get(role, ()))
+        if "technical_support" in roles:
+            recipients.update((await self._get(self.SUPPORT_KEY)).get("technical_support", ()))
+        return recipients
+
+    async def _get(self, key: Optional[str]) -> Dict[str, List[str]]:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[0] > now:
+            self._metrics['hits'] += 1
+            return entry[1]
+        self._metrics['loads'] += 1
+        if key == self.SUPPORT_KEY:
+            users = await db_service.find_documents("users", {"user_type": "SUPER_USER", "is_active": True})
+            index = {"technical_support": [user["_id"] for user in users]}
+        else:
+            users = await db_service.find_documents("users", {"company_id": key, "is_active": True})
+            index = self._classify(users)
+        self._entries[key] = (now + self.ttl_seconds, index)
+        return index
+
+    @staticmethod
+    def _classify(users: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        index: Dict[str, List[str]] = {role: [] for role in ROLE_RULES}
+        for user in users:
+            permissions = user.get("permissions") or []
+            if isinstance(permissions, str):
+                permissions = [permissions]
+            permissions = set(permissions)
+            company_role = user.get("company_role")
+            for role, (company_roles, role_permissions) in ROLE_RULES.items():
+                if company_role in company_roles or permissions & role_permissions:
+                    index[role].append(user["_id"])
+        return index
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {**self._metrics, 'companies': len(self._entries)}
+
+
 class NotificationHandler(EventHandler):
-    """Background handler for notification processing"""
+    """Background handler for notification processing
+
+    Events arrive in micro-batches. Recipients are resolved once per
+    (company, role set) in a batch, through a cached ``RecipientIndex``, and
+    the batch's notifications are stored with one ``insert_many``.
+    """
 
-    def __init__(self):
+    def __init__(self, recipient_index: Optional[RecipientIndex] = None):
         super().__init__(
             name="notification_handler",
             event_types=[
@@ -27,8 +106,10 @@ class NotificationHandler(EventHandler):
                 EventType.DEVICE_STATUS_CHANGED,
                 EventType.SYSTEM_ERROR,
                 EventType.USER_LOGIN
-            ]
+            ],
+            batch_size=settings.EVENT_BATCH_MAX_SIZE
         )
+        self.recipient_index = recipient_index or RecipientIndex()
         self._notification_templates = {
             "content_uploaded": {
                 "title": "Content Uploaded",
@@ -76,29 +157,39 @@ class NotificationHandler(EventHandler):
 
     async def handle(self, event: Event) -> bool:
         """Process notification event"""
-        try:
-            notification_type = self._get_notification_type(event)
-            if not notification_type:
-                return True  # Not all events need notifications
-
-            # Create notification
-            notification = await self._create_notification(event, notification_type)
-            if notification:
-                # Store notification
-                await self._store_notification(notification)
-
-                # Send real-time notification
+        return (await self.handle_batch([event]))[0]
+
+    async def handle_batch(self, events: List[Event]) -> List[bool]:
+        """Create, store and send the notifications for a batch of events"""
+        results = []
+        notifications = []
+        resolved: Dict[Tuple[Optional[str], FrozenSet[str]], Set[str]] = {}
+        for event in events:
+            try:
+                notification_type = self._get_notification_type(event)
+                if notification_type:  # Not all events need notifications
+                    notification = await self._create_notification(event, notification_type, resolved)
+                    if notification:
+                        notifications.append(notification)
+                results.append(True)
+            except Exception as e:
+                logger.error(f"Notification handler error for event {event.event_id}: {e}")
+                results.append(False)
+
+        if notifications:
+            # Store notifications
+            await self._store_notifications(notifications)
+
+            # Send real-time notifications
+            for notification in notifications:
                 await self._send_real_time_notification(notification)
 
-                # Handle urgent notifications
-                if notification.get("urgency") == "high":
-                    await self._handle_urgent_notification(notification)
+            # Handle urgent notifications
+            urgent = [notification for notification in notifications if notification.get("urgency") == "high"]
+            if urgent:
+                await self._handle_urgent_notifications(urgent)
 
-            return True
-
-        except Exception as e:
-            logger.error(f"Notification handler error for event {event.event_id}: {e}")
-            return False
+        return results
 
     def _get_notification_type(self, event: Event) -> Optional[str]:
         """Determine notification type based on event"""
@@ -127,7 +218,8 @@ class NotificationHandler(EventHandler):
 
         return notification_type
 
-    async def _create_notification(self, event: Event, notification_type: str) -> Optional[Dict[str, Any]]:
+    async def _create_notification(self, event: Event, notification_type: str,
+                                   resolved: Optional[Dict] = None) -> Optional[Dict[str, Any]]:
         """Create notification data structure"""
         try:
             template = self._notification_templates.get(notification_type)
@@ -146,7 +238,8 @@ class NotificationHandler(EventHandler):
             recipients = await self._get_notification_recipients(
                 event.company_id,
                 template["recipients"],
-                event
+                event,
+                resolved
             )
 
             if not recipients:
@@ -243,71 +336,24 @@ class NotificationHandler(EventHandler):
 
         return context
 
-    async def _get_notification_recipients(self, company_id: str, recipient_roles: List[str], event: Event) -> List[str]:
-        """Get user IDs for notification recipients based on roles"""
-        try:
-            recipients = set()
-
-            for role in recipient_roles:
-                if role == "content_reviewers":
-                    # Get users with content review permissions
-                    users = await db_service.find_documents("users", {
-                        "company_id": company_id,
-                        "is_active": True,
-                        "$or": [
-                            {"company_role": "REVIEWER"},
-                            {"company_role": "ADMIN"},
-                            {"permissions": {"$in": ["content_approve", "content_moderate"]}}
-                        ]
-                    })
-                    recipients.update(user["_id"] for user in users)
-
-                elif role == "content_editors":
-                    # Get users with content editing permissions
-                    users = await db_service.find_documents("users", {
-                        "company_id": company_id,
-                        "is_active": True,
-                        "$or": [
-                            {"company_role": "EDITOR"},
-                            {"company_role": "ADMIN"},
-                            {"permissions": {"$in": ["content_create", "content_update"]}}
-                        ]
-                    })
-                    recipients.update(user["_id"] for user in users)
-
-                elif role == "device_managers":
-                    # Get users with device management permissions
-                    users = await db_service.find_documents("users", {
-                        "company_id": company_id,
-                        "is_active": True,
-                        "$or": [
-                            {"company_role": "ADMIN"},
-                            {"permissions": {"$in": ["device_manage", "device_update"]}}
-                        ]
-                    })
-                    recipients.update(user["_id"] for user in users)
-
-                elif role == "company_admins":
-                    # Get company administrators
-                    users = await db_service.find_documents("users", {
-                        "company_id": company_id,
-                        "company_role": "ADMIN",
-                        "is_active": True
-                    })
-                    recipients.update(user["_id"] for user in users)
+    async def _get_notification_recipients(self, company_id: str, recipient_roles: List[str], event: Event,
+                                           resolved: Optional[Dict] = None) -> List[str]:
+        """Get user IDs for notification recipients based on roles
 
-                elif role == "technical_support":
-                    # Get super users for technical support
-                    users = await db_service.find_documents("users", {
-                        "user_type": "SUPER_USER",
-                        "is_active": True
-                    })
-                    recipients.update(user["_id"] for user in users)
-
-                elif role == "content_owner":
-                    # Get the content owner
-                    if event.user_id:
-                        recipients.add(event.user_id)
+        ``resolved`` memoizes the role lookups for one batch, keyed by company and role set.
+        """
+        try:
+            roles = frozenset(recipient_roles)
+            key = (company_id, roles)
+            recipients = resolved.get(key) if resolved is not None else None
+            if recipients is None:
+                recipients = await self.recipient_index.recipients(company_id, roles)
+                if resolved is not None:
+                    resolved[key] = recipients
+
+            if "content_owner" in roles and event.user_id:
+                # Get the content owner
+                recipients = recipients | {event.user_id}
 
             return list(recipients)
 
@@ -315,31 +361,31 @@ class NotificationHandler(EventHandler):
             logger.error(f"Failed to get notification recipients: {e}")
             return []
 
-    async def _store_notification(self, notification: Dict[str, Any]):
-        """Store notification in database"""
+    async def _store_notifications(self, notifications: List[Dict[str, Any]]):
+        """Store notifications in database, one record per recipient, in one insert"""
         try:
-            # Create individual notification records for each recipient
             notification_docs = []
-            for recipient_id in notification["recipients"]:
-                doc = {
-                    **notification,
-                    "recipient_id": recipient_id,
-                    "read": False,
-                    "read_at": None,
-                    "delivered": False,
-                    "delivered_at": None
-                }
-                # Remove the recipients list from individual notifications
-                doc.pop("recipients", None)
-                notification_docs.append(doc)
+            for notification in notifications:
+                for recipient_id in notification["recipients"]:
+                    doc = {
+                        **notification,
+                        "recipient_id": recipient_id,
+                        "read": False,
+                        "read_at": None,
+                        "delivered": False,
+                        "delivered_at": None
+                    }
+                    # Remove the recipients list from individual notifications
+                    doc.pop("recipients", None)
+                    notification_docs.append(doc)
 
             # Batch insert notifications
             if notification_docs:
                 await db_service.insert_many("notifications", notification_docs)
-                logger.info(f"Stored {len(notification_docs)} notifications for event {notification['event_id']}")
+                logger.info(f"Stored {len(notification_docs)} notifications for {len(notifications)} events")
 
         except Exception as e:
-            logger.error(f"Failed to store notification: {e}")
+            logger.error(f"Failed to store notifications: {e}")
 
     async def _send_real_time_notification(self, notification: Dict[str, Any]):
         """Send real-time notification via WebSocket (placeholder)"""
@@ -356,10 +402,11 @@ class NotificationHandler(EventHandler):
         except Exception as e:
             logger.error(f"Failed to send real-time notification: {e}")
 
-    async def _handle_urgent_notification(self, notification: Dict[str, Any]):
+    async def _handle_urgent_notifications(self, notifications: List[Dict[str, Any]]):
         """Handle urgent notifications with additional processing"""
         try:
-            logger.warning(f"URGENT NOTIFICATION: {notification['title']} - {notification['message']}")
+            for notification in notifications:
+                logger.warning(f"URGENT NOTIFICATION: {notification['title']} - {notification['message']}")
 
             # For urgent notifications, you might want to:
             # 1. Send email notifications
@@ -371,8 +418,10 @@ class NotificationHandler(EventHandler):
             await db_service.update_many(
                 "notifications",
                 {
-                    "event_id": notification["event_id"],
-                    "type": notification["type"]
+                    "$or": [
+                        {"event_id": notification["event_id"], "type": notification["type"]}
+                        for notification in notifications
+                    ]
                 },
                 {
                     "$set": {
@@ -384,7 +433,7 @@ class NotificationHandler(EventHandler):
             )
 
         except Exception as e:
-            logger.error(f"Failed to handle urgent notification: {e}")
+            logger.error(f"Failed to handle urgent notifications: {e}")
 
     async def mark_notification_read(self, notification_id: str, user_id: str) -> bool:
         """Mark notification as read by user"""
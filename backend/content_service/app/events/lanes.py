@@ -0,0 +1,209 @@
+"""
+Priority lanes and partitions behind ``AsyncEventBus``.
+
+Each consumer worker owns one ``Partition``. A partition holds one bounded
+FIFO per lane. Every event type maps to a lane (``lane_for``):
+
+- critical: content lifecycle and system events, such as moderation
+- default: user, company and device events
+- bulk: analytics
+
+A worker always serves the highest non-empty lane, except that every
+``FAIRNESS_INTERVAL``-th dequeue serves the lowest non-empty one. Under a
+sustained flood of critical events, bulk events therefore still get an
+eighth of the worker.
+
+When a lane is full, its ``BackpressurePolicy`` decides what happens:
+
+- ``block``: the publisher waits for space
+- ``drop_oldest``: the head of the lane is discarded
+- ``spill``: events go to a JSON-lines file next to the lane and are read
+  back, in order, as the lane drains
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from enum import Enum
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from app.events.event_bus import Event
+
+logger = logging.getLogger(__name__)
+
+LANES = ("critical", "default", "bulk")  # Highest priority first
+
+FAIRNESS_INTERVAL = 8
+
+# (enqueue time on the monotonic clock, event, event log offset or None,
+#  names of the handlers to run or None for every subscriber)
+QueuedEvent = Tuple[float, "Event", Optional[int], Optional[List[str]]]
+
+
+class BackpressurePolicy(str, Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    SPILL = "spill"
+
+
+def lane_for(event_type) -> str:
+    """Lane for an ``EventType``, by the prefix of its value"""
+    value = event_type.value if hasattr(event_type, "value") else str(event_type)
+    if value.startswith("analytics."):
+        return "bulk"
+    if value.startswith(("content.", "system.")):
+        return "critical"
+    return "default"
+
+
+def parse_backpressure(spec: str) -> Dict[str, BackpressurePolicy]:
+    """``"critical=block,bulk=drop_oldest"`` to a policy per lane; unnamed lanes block"""
+    policies = {lane: BackpressurePolicy.BLOCK for lane in LANES}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        lane, _, policy = part.partition("=")
+        if lane.strip() not in policies:
+            raise ValueError(f"Unknown event lane '{lane.strip()}'")
+        policies[lane.strip()] = BackpressurePolicy(policy.strip())
+    return policies
+
+
+class SpillFile:
+    """Append-only JSON-lines overflow for one lane, read back front to back"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = 0
+        self._file = None
+        self._read_offset = 0
+
+    def append(self, item: QueuedEvent) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "w+b")
+        enqueued_at, event, offset, handlers = item
+        line = json.dumps({"enqueued_at": enqueued_at, "event": event.to_dict(), "offset": offset,
+                           "handlers": handlers}, default=str)
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(line.encode("utf-8") + b"\n")
+        self.pending += 1
+
+    def read(self, limit: int) -> List[QueuedEvent]:
+        from app.events.event_bus import Event
+
+        items = []
+        self._file.flush()
+        self._file.seek(self._read_offset)
+        while self.pending and len(items) < limit:
+            line = self._file.readline()
+            if not line:
+                break
+            record = json.loads(line)
+            items.append((record["enqueued_at"], Event.from_dict(record["event"]), record["offset"],
+                          record["handlers"]))
+            self.pending -= 1
+        self._read_offset = self._file.tell()
+        if not self.pending:
+            # Everything has been read back; start the file over
+            self._file.seek(0)
+            self._file.truncate()
+            self._read_offset = 0
+        return items
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.pending = 0
+
+
+class LaneQueue:
+    """Bounded FIFO for one lane of one partition"""
+
+    def __init__(self, name: str, capacity: int, policy: BackpressurePolicy, spill_path: Optional[str] = None):
+        self.name = name
+        self.capacity = capacity
+        self.policy = policy
+        self.items: Deque[QueuedEvent] = deque()
+        self.spill = SpillFile(spill_path) if policy is BackpressurePolicy.SPILL and spill_path else None
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+    def __len__(self) -> int:
+        return len(self.items) + (self.spill.pending if self.spill else 0)
+
+    def full(self) -> bool:
+        return len(self.items) >= self.capacity
+
+    def put(self, item: QueuedEvent) -> bool:
+        """Queue an item; True if it went to the spill file"""
+        if self.spill is not None and (self.spill.pending or self.full()):
+            self.spill.append(item)
+            return True
+        self.items.append(item)
+        if self.full():
+            self._not_full.clear()
+        return False
+
+    def pop(self) -> QueuedEvent:
+        if not self.items:
+            self._refill()
+        item = self.items.popleft()
+        if len(self.items) <= self.capacity // 2:
+            self._refill()
+        if not self.full():
+            self._not_full.set()
+        return item
+
+    def drop_oldest(self) -> QueuedEvent:
+        return self.pop()
+
+    def _refill(self) -> None:
+        if self.spill is not None and self.spill.pending:
+            self.items.extend(self.spill.read(self.capacity - len(self.items)))
+
+    async def wait_not_full(self) -> None:
+        await self._not_full.wait()
+
+    def oldest_enqueued_at(self) -> Optional[float]:
+        return self.items[0][0] if self.items else None
+
+    def close(self) -> None:
+        if self.spill is not None:
+            self.spill.close()
+
+
+class Partition:
+    """The lanes consumed by one worker"""
+
+    def __init__(self, index: int, capacity: int, policies: Dict[str, BackpressurePolicy], spill_dir: str):
+        self.index = index
+        self.lanes: Dict[str, LaneQueue] = {
+            lane: LaneQueue(lane, capacity, policies[lane],
+                            os.path.join(spill_dir, f"event-spill-{os.getpid()}-{index}-{lane}.jsonl"))
+            for lane in LANES
+        }
+        self._ordered = [self.lanes[lane] for lane in LANES]
+        self.ready = asyncio.Event()
+        self._dequeues = 0
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._ordered)
+
+    def pop(self) -> Optional[Tuple[str, QueuedEvent]]:
+        non_empty = [queue for queue in self._ordered if len(queue)]
+        if not non_empty:
+            return None
+        self._dequeues += 1
+        queue = non_empty[-1] if self._dequeues % FAIRNESS_INTERVAL == 0 else non_empty[0]
+        return queue.name, queue.pop()
+
+    def close(self) -> None:
+        for queue in self._ordered:
+            queue.close()
@@ -0,0 +1,319 @@
+"""
+High-throughput heartbeat ingestion.
+
+The original heartbeat path made several sequential database round trips per
+beat: a credentials lookup (screen, credentials and latest heartbeat), the
+health update, ``update_digital_screen`` and ``save_device_heartbeat``. Here a
+beat is handled in memory:
+
+- the device document comes from a short-lived cache (``HEARTBEAT_DEVICE_CACHE_TTL_SECONDS``);
+  bearer tokens are verified once and cached until they expire;
+- health state (``DeviceHealthMonitor``) and liveness are updated in process;
+- ``last_seen`` and the health fields are coalesced per device, so only the
+  latest values are kept, and flushed every ``HEARTBEAT_FLUSH_INTERVAL_SECONDS``
+  in one unordered ``bulk_write``;
+- a raw ``device_heartbeats`` row is kept only when the device's state changes
+  (status, health, playing content, errors) or at ``HEARTBEAT_RAW_SAMPLE_RATE``.
+
+As with the analytics write-behind, a failed flush is logged and dropped. The
+next beat from each device brings ``last_seen`` up to date again. ``stop()``
+flushes whatever is still buffered.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.config import settings
+from app.monitoring import device_health_monitor
+from app.monitoring.heartbeat_series import HeartbeatBucketStore, bucketed_heartbeats_enabled
+from app.monitoring.liveness import device_liveness
+
+logger = logging.getLogger(__name__)
+
+# Expired entries are pruned from the token cache once it grows past this
+MAX_CACHED_TOKENS = 100_000
+
+
+class MongoHeartbeatSink:
+    """Writes coalesced screen updates and sampled heartbeat rows to Mongo"""
+
+    def __init__(self, db):
+        self.db = db
+        self.buckets = HeartbeatBucketStore(db) if bucketed_heartbeats_enabled() else None
+
+    async def write(self, screen_updates: Dict[str, Dict], rows: List[Dict]) -> None:
+        if screen_updates:
+            await self.db.digital_screens.bulk_write(
+                [UpdateOne({"id": device_id}, {"$set": fields}) for device_id, fields in screen_updates.items()],
+                ordered=False
+            )
+        if rows and self.buckets is not None:
+            await self.buckets.save_many(rows)
+        elif rows:
+            await self.db.device_heartbeats.insert_many(rows, ordered=False)
+
+
+class RepoHeartbeatSink:
+    """Writes through the repository, for deployments without MongoDB"""
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    async def write(self, screen_updates: Dict[str, Dict], rows: List[Dict]) -> None:
+        from app.models import DeviceHeartbeat
+        for device_id, fields in screen_updates.items():
+            await self.repo.update_digital_screen(device_id, dict(fields))
+        for row in rows:
+            try:
+                await self.repo.save_device_heartbeat(DeviceHeartbeat(**row))
+            except Exception as e:
+                logger.debug(f"Skipping heartbeat row for device {row.get('device_id')}: {e}")
+
+
+class HeartbeatPipeline:
+    """In-memory heartbeat processing with coalesced, batched persistence"""
+
+    def __init__(self, repo=None, sink=None, monitor=None, liveness=None,
+                 flush_interval: Optional[float] = None, sample_rate: Optional[float] = None,
+                 device_cache_ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self._repo = repo
+        self._sink = sink
+        self.monitor = monitor or device_health_monitor
+        self.liveness = liveness or device_liveness
+        self.flush_interval = flush_interval if flush_interval is not None else settings.HEARTBEAT_FLUSH_INTERVAL_SECONDS
+        self.sample_rate = sample_rate if sample_rate is not None else settings.HEARTBEAT_RAW_SAMPLE_RATE
+        self.device_cache_ttl = device_cache_ttl if device_cache_ttl is not None else settings.HEARTBEAT_DEVICE_CACHE_TTL_SECONDS
+        self.clock = clock
+
+        self._devices: Dict[str, Tuple[Dict, float]] = {}    # device_id -> (screen document, cached until)
+        self._tokens: Dict[str, Tuple[str, float]] = {}      # token digest -> (device_id, epoch expiry)
+        self._last_state: Dict[str, Tuple] = {}             # device_id -> last persisted state
+        self._sample_credit: Dict[str, float] = {}
+
+        self._screen_updates: Dict[str, Dict] = {}
+        self._rows: List[Dict] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._metrics = {
+            'heartbeats_processed': 0,
+            'heartbeats_rejected': 0,
+            'device_cache_hits': 0,
+            'device_cache_misses': 0,
+            'rows_on_state_change': 0,
+            'rows_sampled': 0,
+            'screen_updates_flushed': 0,
+            'rows_flushed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0.0
+        }
+
+    @property
+    def repo(self):
+        if self._repo is None:
+            from app.repo import repo
+            self._repo = repo
+        return self._repo
+
+    @property
+    def sink(self):
+        if self._sink is None:
+            from app.database_service import db_service
+            self._sink = MongoHeartbeatSink(db_service.db) if db_service.connected else RepoHeartbeatSink(self.repo)
+        return self._sink
+
+    # ------------------------------------------------------------------
+    # Authentication
+    # ------------------------------------------------------------------
+
+    def authenticate(self, device_id: str, token: str) -> bool:
+        """Check a device bearer token, verifying each distinct token only once"""
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        cached = self._tokens.get(digest)
+        if cached is not None and cached[1] > time.time():
+            return cached[0] == device_id
+
+        from app.device_auth import device_auth_service
+        payload = device_auth_service.verify_device_jwt(token)
+        if not payload or not payload.get("sub"):
+            return False
+        self._tokens[digest] = (payload["sub"], float(payload.get("exp") or time.time() + self.device_cache_ttl))
+        if len(self._tokens) > MAX_CACHED_TOKENS:
+            self._prune_tokens()
+        return payload["sub"] == device_id
+
+    def _prune_tokens(self) -> None:
+        now = time.time()
+        self._tokens = {digest: entry for digest, entry in self._tokens.items() if entry[1] > now}
+
+    async def _device(self, device_id: str) -> Optional[Dict]:
+        cached = self._devices.get(device_id)
+        now = self.clock()
+        if cached is not None and cached[1] > now:
+            self._metrics['device_cache_hits'] += 1
+            return cached[0]
+        self._metrics['device_cache_misses'] += 1
+        device = await self.repo.get_digital_screen(device_id)
+        if device:
+            self._devices[device_id] = (device, now + self.device_cache_ttl)
+            self.liveness.register(device_id, name=device.get("name"), company_id=device.get("company_id"))
+        return device
+
+    # ------------------------------------------------------------------
+    # Processing
+    # ------------------------------------------------------------------
+
+    async def process(self, device_id: str, heartbeat_data: Dict) -> Dict[str, Any]:
+        """Process one heartbeat; database writes are deferred to the next flush"""
+        device = await self._device(device_id)
+        if not device:
+            self._metrics['heartbeats_rejected'] += 1
+            return {"success": False, "error": "Device not found or not authenticated"}
+        self._ensure_started()
+
+        health = await self.monitor.process_heartbeat(device_id, heartbeat_data)
+        if not health.get("success"):
+            self._metrics['heartbeats_rejected'] += 1
+            return health
+        performance_score = health.get("performance_score")
+        self.liveness.heartbeat(device_id, heartbeat_data, performance_score=performance_score)
+
+        now = datetime.utcnow()
+        self._screen_updates[device_id] = {
+            "last_seen": now,
+            "updated_at": now,
+            "health_status": health.get("device_status", "unknown"),
+            "performance_score": performance_score
+        }
+
+        persisted = self._maybe_keep_row(device_id, heartbeat_data, health, now)
+        self._metrics['heartbeats_processed'] += 1
+        if len(self._rows) >= settings.HEARTBEAT_MAX_BUFFERED_ROWS:
+            self._wake()
+        return {
+            "success": True,
+            "message": "Heartbeat processed",
+            "device_status": health.get("device_status"),
+            "performance_score": performance_score,
+            "alerts_active": health.get("alerts_active", 0),
+            "persisted": persisted
+        }
+
+    def _maybe_keep_row(self, device_id: str, heartbeat_data: Dict, health: Dict, now: datetime) -> bool:
+        state = (
+            heartbeat_data.get("status", "active"),
+            health.get("device_status"),
+            heartbeat_data.get("current_content_id"),
+            bool(heartbeat_data.get("content_errors")),
+            bool(heartbeat_data.get("error_logs"))
+        )
+        if self._last_state.get(device_id) != state:
+            self._metrics['rows_on_state_change'] += 1
+        else:
+            credit = self._sample_credit.get(device_id, 0.0) + self.sample_rate
+            if credit < 1.0:
+                self._sample_credit[device_id] = credit
+                return False
+            self._sample_credit[device_id] = credit - 1.0
+            self._metrics['rows_sampled'] += 1
+
+        self._last_state[device_id] = state
+        if len(self._rows) >= settings.HEARTBEAT_MAX_BUFFERED_ROWS:
+            return False
+        self._rows.append({
+            **heartbeat_data,
+            "id": str(uuid.uuid4()),
+            "device_id": device_id,
+            "timestamp": now,
+            "status": state[0],
+            "performance_score": health.get("performance_score")
+        })
+        return True
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    async def flush(self) -> int:
+        """Write buffered screen updates and rows; returns the number of devices updated"""
+        async with self._flush_lock:
+            if not self._screen_updates and not self._rows:
+                return 0
+            screen_updates, self._screen_updates = self._screen_updates, {}
+            rows, self._rows = self._rows, []
+
+            started = time.perf_counter()
+            try:
+                await self.sink.write(screen_updates, rows)
+            except Exception as e:
+                self._metrics['flush_errors'] += 1
+                logger.error(f"Heartbeat flush of {len(screen_updates)} devices failed: {e}")
+                return 0
+            finally:
+                self._metrics['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+            self._metrics['flushes'] += 1
+            self._metrics['screen_updates_flushed'] += len(screen_updates)
+            self._metrics['rows_flushed'] += len(rows)
+            return len(screen_updates)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _ensure_started(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._stopping:
+            return
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        """Stop the background flusher and flush what is still buffered"""
+        self._stopping = True
+        try:
+            if self._task is not None:
+                self._wake()
+                await self._task
+                self._task = None
+            await self.flush()
+        finally:
+            self._stopping = False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self._metrics,
+            'screen_updates_buffered': len(self._screen_updates),
+            'rows_buffered': len(self._rows),
+            'cached_devices': len(self._devices),
+            'cached_tokens': len(self._tokens),
+            'raw_sample_rate': self.sample_rate,
+            'flush_interval_seconds': self.flush_interval
+        }
+
+
+# Global heartbeat pipeline for HTTP and WebSocket heartbeats
+heartbeat_pipeline = HeartbeatPipeline()
@@ -9,6 +9,8 @@
 import os
 import logging
 from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
 
 try:
     from dotenv import load_dotenv
@@ -17,7 +19,7 @@ try:
 except ImportError:
     print("[WARNING] python-dotenv not installed, using system environment variables only")
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
@@ -36,12 +38,17 @@ from app.api import api_router
 # Import event-driven architecture
 from app.events.event_manager import event_manager
 
+from app.api.auth import require_roles
+from app.middleware.logging import RequestLoggingMiddleware, request_log_sink, route_latency
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("🚀 Starting Adara Screen Digital Signage Platform with Enhanced Security")
+    heartbeat_downsampler = None
+    playlist_precomputer = None
     try:
         # Initialize configuration with secrets
         await initialize_config()
@@ -69,6 +76,33 @@ async def lifespan(app: FastAPI):
         await db_service.initialize()
         logger.info("✅ Database service initialized")
 
+        # Roll bucketed heartbeats up into 5-minute and hourly tiers
+        from app.monitoring.heartbeat_series import (
+            HeartbeatBucketStore, HeartbeatDownsampler, bucketed_heartbeats_enabled
+        )
+        if bucketed_heartbeats_enabled() and db_service.connected:
+            heartbeat_downsampler = HeartbeatDownsampler(HeartbeatBucketStore(db_service.db))
+            heartbeat_downsampler.start()
+            logger.info("✅ Heartbeat downsampler started")
+
+        # Index open content schedules per device for playlist and conflict queries
+        try:
+            from app.repo import repo
+            from app.schedule_index import schedule_index
+            await schedule_index.load(repo)
+        except Exception as e:
+            logger.warning(f"Schedule index not loaded at startup: {e}")
+
+        # Compile every screen's next-slot playlist before the top-of-slot fetches
+        if settings.PLAYLIST_FLEET_PRECOMPUTE_ENABLED:
+            try:
+                from app.content_delivery import fleet_playlist_precomputer
+                playlist_precomputer = fleet_playlist_precomputer
+                playlist_precomputer.start()
+                logger.info("✅ Fleet playlist precompute started")
+            except ImportError as e:
+                logger.warning(f"Fleet playlist precompute not available: {e}")
+
         # Initialize event-driven architecture
         await event_manager.initialize()
         logger.info("✅ Event-driven architecture initialized")
@@ -82,9 +116,35 @@ async def lifespan(app: FastAPI):
         await event_manager.shutdown()
         logger.info("📤 Event manager shut down")
 
+        # Flush buffered analytics before the database goes away
+        from app.analytics.write_behind import analytics_write_behind
+        await analytics_write_behind.stop()
+        from app.heartbeat_pipeline import heartbeat_pipeline
+        await heartbeat_pipeline.stop()
+        if heartbeat_downsampler:
+            await heartbeat_downsampler.stop()
+        if playlist_precomputer:
+            await playlist_precomputer.stop()
+        try:
+            from app.content_delivery import content_distributor
+            await content_distributor.delivery_scheduler.stop()
+        except ImportError:
+            pass
+
         await db_service.close()
         logger.info("🔌 Database connections closed")
 
+        try:
+            from app.security.image_analysis import image_analysis_pool
+            image_analysis_pool.shutdown()
+        except ImportError:
+            pass
+
+        # Write out the request log records and audit entries still queued
+        request_log_sink.stop()
+        from app.security.audit_logger import audit_logger
+        audit_logger.close()
+
 app = FastAPI(
     title="Adara Screen Digital Signage Platform",
     description="Enterprise Multi-Tenant Digital Signage Platform with Enhanced Security and RBAC",
@@ -107,6 +167,10 @@ configure_security_middleware(
 cors_config = get_cors_config(enhanced_config.ENVIRONMENT)
 app.add_middleware(CORSMiddleware, **cors_config)
 
+# Outermost, so its timings cover the whole stack
+if enhanced_config.REQUEST_METRICS_ENABLED or enhanced_config.REQUEST_LOGGING_ENABLED:
+    app.add_middleware(RequestLoggingMiddleware)
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception: {exc}")
@@ -147,6 +211,18 @@ async def health_check():
         logger.error(f"Health check failed: {e}")
         return JSONResponse(status_code=503, content={"status": "unhealthy", "error": str(e)})
 
+@app.get("/api/metrics/requests")
+async def request_metrics(
+    top: Optional[int] = None,
+    current_user=Depends(require_roles("SUPER_USER"))
+):
+    """Per-route request latency and request log sink counters (Super User only)"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "routes": route_latency.get_metrics(top),
+        "log_sink": request_log_sink.get_metrics()
+    }
+
 @app.get("/")
 async def root():
     return {
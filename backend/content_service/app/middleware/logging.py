@@ -2,15 +2,41 @@
 Request Logging Middleware
 =========================
 
-Middleware to log all incoming requests and responses for debugging authentication issues.
+``RequestLoggingMiddleware`` is a plain ASGI middleware that times every HTTP
+request without touching its body on the way through. Chunks are passed on
+as they arrive.
+
+Request logging is opt-in (``REQUEST_LOGGING_ENABLED``), and so is body
+sampling: request bodies carry personal data that ``MASKED_FIELDS`` does not
+cover, such as emails, phone numbers and names. A copy is kept only for JSON
+requests whose ``Content-Length`` is at most ``REQUEST_LOG_BODY_MAX_BYTES``
+(0, the default, samples nothing), so multipart uploads are never buffered.
+
+Each finished request becomes one structured record on ``request_log_sink``,
+a bounded queue drained by a background thread. That thread parses and masks
+the sampled body and writes one JSON line per request to the ``middleware``
+logger. When the queue is full, records are dropped and counted rather than
+slowing the request down.
+
+Latencies are kept per route template (``/api/devices/{device_id}``, not the
+raw path) in ``route_latency`` and served by ``/api/metrics/requests``.
 """
 
-import time
+import json
 import logging
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 from fastapi import Request, Response
+from starlette.datastructures import MutableHeaders
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import StreamingResponse
-import json
+
+from app.config import settings
+from app.utils.metrics import LatencyHistogram
 
 # Create a simple console logger to avoid uvicorn logger conflicts
 logger = logging.getLogger("middleware")
@@ -23,96 +49,215 @@ if not logger.handlers:
     logger.addHandler(handler)
     logger.propagate = False  # Prevent propagation to avoid conflicts
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware to log all HTTP requests and responses"""
-    
-    async def dispatch(self, request: Request, call_next):
-        # Start timer
-        start_time = time.time()
-        
-        # Get request info
-        method = request.method
-        url = str(request.url)
-        headers = dict(request.headers)
-        
-        # Read request body if it's JSON
-        request_body = None
-        if request.method in ["POST", "PUT", "PATCH"]:
+# Body fields whose values never reach the log
+MASKED_FIELDS = re.compile(r"pass(word)?|secret|token|credential|auth|api_?key|bearer|session|cookie", re.IGNORECASE)
+MASK = "***"
+UNMATCHED_ROUTE = "<unmatched>"
+# Any other method token is counted under OTHER_METHOD so clients cannot add histograms at will
+STANDARD_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE", "CONNECT"})
+OTHER_METHOD = "OTHER"
+
+_encode = json.JSONEncoder(separators=(",", ":"), default=str).encode
+
+
+def mask_body(value: Any) -> Any:
+    """Copy of a parsed JSON body with sensitive fields masked, at any depth"""
+    if isinstance(value, dict):
+        return {key: MASK if MASKED_FIELDS.search(key) else mask_body(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [mask_body(item) for item in value]
+    return value
+
+
+class RequestLogSink:
+    """Bounded queue of request records, formatted and written by a background thread"""
+
+    def __init__(self, max_queue: int = 10000, emit: Optional[Callable[[int, str], None]] = None):
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(max_queue)
+        self._emit = emit or logger.log
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._metrics = {
+            'records_queued': 0,
+            'records_written': 0,
+            'records_dropped': 0,
+            'write_errors': 0
+        }
+
+    def submit(self, record: Dict[str, Any]) -> bool:
+        """Queue a record without blocking; False if it was dropped"""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._metrics['records_dropped'] += 1
+            return False
+        self._metrics['records_queued'] += 1
+        return True
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-log-sink", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Write what is queued, then stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None, timeout=timeout)
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
             try:
-                body = await request.body()
-                if body:
-                    # Reset the request body for downstream processing
-                    async def receive():
-                        return {"type": "http.request", "body": body}
-                    request._receive = receive
-                    
-                    # Try to parse as JSON for logging (mask passwords)
-                    try:
-                        request_body = json.loads(body.decode())
-                        # Mask sensitive fields
-                        if isinstance(request_body, dict):
-                            masked_body = request_body.copy()
-                            if 'password' in masked_body:
-                                masked_body['password'] = '***'
-                            request_body = masked_body
-                    except:
-                        request_body = f"<binary data: {len(body)} bytes>"
-            except Exception as e:
-                logger.warning(f"Failed to read request body: {e}")
-        
-        # Log request
-        print(f"🔵 {method} {url}")
-        if request_body:
-            print(f"   📤 Request body: {request_body}")
-        
-        # Process request
+                self._write(record)
+                self._metrics['records_written'] += 1
+            except Exception:
+                self._metrics['write_errors'] += 1
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        body = record.get('body')
+        if body is not None:
+            try:
+                record['body'] = mask_body(json.loads(body))
+            except ValueError:
+                record['body'] = f"<{len(body)} bytes, not JSON>"
+        status = record['status']
+        level = logging.ERROR if status >= 500 else logging.WARNING if status >= 400 else logging.INFO
+        self._emit(level, _encode(record))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self._metrics,
+            'queued': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'running': self._thread is not None
+        }
+
+
+class RouteStats:
+    __slots__ = ("latency", "statuses")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses: Dict[str, int] = {}
+
+
+class RouteLatencyRegistry:
+    """Latency histograms and status counts per method and route template"""
+
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], RouteStats] = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float) -> None:
+        if method not in STANDARD_METHODS:
+            method = OTHER_METHOD
+        stats = self._routes.get((method, route))
+        if stats is None:
+            stats = self._routes[(method, route)] = RouteStats()
+        stats.latency.observe(seconds)
+        status_class = f"{status // 100}xx"
+        stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+
+    def reset(self) -> None:
+        self._routes.clear()
+
+    def get_metrics(self, top: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Routes by request count, busiest first"""
+        routes = sorted(self._routes.items(), key=lambda item: item[1].latency.count, reverse=True)
+        if top is not None:
+            routes = routes[:top]
+        return [
+            {"method": method, "route": route, "statuses": dict(stats.statuses), **stats.latency.snapshot()}
+            for (method, route), stats in routes
+        ]
+
+
+request_log_sink = RequestLogSink(max_queue=settings.REQUEST_LOG_QUEUE_SIZE)
+route_latency = RouteLatencyRegistry()
+
+
+class RequestLoggingMiddleware:
+    """Pure ASGI middleware timing, and optionally logging, every HTTP request; bodies are never buffered"""
+
+    def __init__(self, app, sink: Optional[RequestLogSink] = None, routes: Optional[RouteLatencyRegistry] = None,
+                 body_max_bytes: Optional[int] = None, log_requests: Optional[bool] = None):
+        self.app = app
+        self.sink = sink or request_log_sink
+        self.routes = routes or route_latency
+        self.log_requests = settings.REQUEST_LOGGING_ENABLED if log_requests is None else log_requests
+        self.body_max_bytes = settings.REQUEST_LOG_BODY_MAX_BYTES if body_max_bytes is None else body_max_bytes
+        if not self.log_requests:
+            self.body_max_bytes = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        content_type = user_agent = request_id = b""
+        content_length = 0
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                content_type = value
+            elif name == b"content-length":
+                content_length = int(value) if value.isdigit() else 0
+            elif name == b"user-agent":
+                user_agent = value
+            elif name == b"x-request-id":
+                request_id = value
+
+        # Keep a copy of small JSON bodies only; everything else streams straight through
+        chunks: Optional[List[bytes]] = None
+        if 0 < content_length <= self.body_max_bytes and content_type.startswith(b"application/json"):
+            chunks = []
+            downstream_receive = receive
+
+            async def receive():
+                message = await downstream_receive()
+                if message["type"] == "http.request":
+                    chunks.append(message.get("body", b""))
+                return message
+
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("x-process-time", f"{time.perf_counter() - started:.6f}")
+            await send(message)
+
         try:
-            response = await call_next(request)
-            
-            # Calculate processing time
-            process_time = time.time() - start_time
-            
-            # Log response
-            status_code = response.status_code
-            
-            # Try to read response body for logging
-            response_body = None
-            if hasattr(response, 'body'):
-                try:
-                    if isinstance(response, StreamingResponse):
-                        # Don't try to read streaming responses
-                        response_body = "<streaming response>"
-                    else:
-                        # For regular responses, try to read the body
-                        response_body = "<response body>"
-                except:
-                    response_body = "<unreadable response>"
-            
-            # Determine log level based on status
-            if status_code >= 500:
-                log_level = "error"
-                emoji = "🔴"
-            elif status_code >= 400:
-                log_level = "warning" 
-                emoji = "🟡"
-            else:
-                log_level = "info"
-                emoji = "🟢"
-            
-            # Log response with safe logger
-            print(f"{emoji} {method} {url} -> {status_code} ({process_time:.3f}s)")
-            logger.info(f"{emoji} {method} {url} -> {status_code} ({process_time:.3f}s)")
-            
-            # Add processing time header
-            response.headers["X-Process-Time"] = str(process_time)
-            
-            return response
-            
-        except Exception as e:
-            process_time = time.time() - start_time
-            print(f"🔴 {method} {url} -> ERROR ({process_time:.3f}s): {str(e)}")
-            logger.error(f"🔴 {method} {url} -> ERROR ({process_time:.3f}s): {str(e)}")
-            raise
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            method = scope["method"]
+            self.routes.observe(method, route, status, elapsed)
+            if not self.log_requests:
+                return
+            client = scope.get("client")
+            self.sink.submit({
+                'timestamp': datetime.utcnow().isoformat(),
+                'method': method,
+                'route': route,
+                'path': scope["path"],
+                'status': status,
+                'duration_ms': round(elapsed * 1000, 3),
+                'client': client[0] if client else None,
+                'user_agent': user_agent.decode("latin-1") or None,
+                'request_id': request_id.decode("latin-1") or None,
+                'content_length': content_length or None,
+                'body': b"".join(chunks) if chunks else None
+            })
 
 
 class AuthLoggingMiddleware(BaseHTTPMiddleware):
@@ -16,7 +16,10 @@ from typing import Dict, List, Optional, Any, Tuple
 from enum import Enum
 import statistics
 import uuid
-from collections import defaultdict, deque
+from collections import defaultdict
+
+from .liveness import LivenessTracker
+from .metric_history import MetricHistory
 
 logger = logging.getLogger(__name__)
 
@@ -81,8 +84,8 @@ class DeviceHealthProfile:
         self.uptime_percentage = 0.0
         self.performance_score = 0.0
         
-        # Metrics history (last 24 hours)
-        self.metrics_history = defaultdict(lambda: deque(maxlen=1440))  # 1 minute intervals
+        # Metrics history (last 24 hours at 1 minute intervals), float32 rings per metric
+        self.metrics_history = MetricHistory(capacity=1440)
         
         # Current metric values
         self.current_metrics = {}
@@ -149,6 +152,9 @@ class DeviceHealthMonitor:
         self.offline_threshold = 600  # 10 minutes
         self.health_check_interval = 60  # 1 minute
         
+        # Offline detection: only devices whose deadline passed are visited
+        self.liveness = LivenessTracker(timeout_seconds=self.offline_threshold)
+        
         # Performance baselines
         self.performance_baselines = {}
         
@@ -199,6 +205,7 @@ class DeviceHealthMonitor:
             
             # Update last heartbeat
             profile.last_heartbeat = current_time
+            self.liveness.heartbeat(device_id)
             
             # Process individual metrics
             metrics_processed = []
@@ -210,11 +217,8 @@ class DeviceHealthMonitor:
                     metric_type = self._map_metric_name(metric_name)
                     if metric_type and isinstance(value, (int, float)):
                         
-                        # Create metric record
-                        metric = HealthMetric(device_id, metric_type, float(value), current_time)
-                        
                         # Store in history
-                        profile.metrics_history[metric_type].append(metric)
+                        profile.metrics_history.record(metric_type, float(value), current_time)
                         profile.current_metrics[metric_type] = value
                         
                         # Check thresholds
@@ -256,6 +260,11 @@ class DeviceHealthMonitor:
                 "error": str(e)
             }
     
+    def forget_device(self, device_id: str) -> None:
+        """Drop a deleted device so it is neither tracked nor alerted on"""
+        self.device_profiles.pop(device_id, None)
+        self.liveness.forget(device_id)
+
     async def get_device_health_status(self, device_id: str) -> Dict[str, Any]:
         """Get comprehensive health status for a device"""
         try:
@@ -330,6 +339,20 @@ class DeviceHealthMonitor:
                 "error": str(e)
             }
     
+    def get_metric_window_stats(self, device_id: str, metric_type: MetricType, hours: float = 1,
+                                percentiles: Tuple[float, ...] = (50, 95)) -> Dict[str, Any]:
+        """min/max/avg/percentiles of one metric over the last ``hours``"""
+        profile = self.device_profiles.get(device_id)
+        if not profile:
+            return {"device_id": device_id, "metric": metric_type.value, "count": 0}
+        start = datetime.now(timezone.utc) - timedelta(hours=hours)
+        return {
+            "device_id": device_id,
+            "metric": metric_type.value,
+            "window_hours": hours,
+            **profile.metrics_history.stats(metric_type, start=start, percentiles=percentiles)
+        }
+    
     async def schedule_content(self, device_id: str, content_id: str, 
                              scheduled_time: datetime, duration: int) -> str:
         """Schedule content for proof-of-play tracking"""
@@ -668,14 +691,11 @@ class DeviceHealthMonitor:
         return "healthy"
     
     async def _check_all_device_health(self):
-        """Check health status of all devices"""
-        current_time = datetime.now(timezone.utc)
-        
-        for device_id, profile in self.device_profiles.items():
+        """Mark devices whose heartbeats stopped as offline"""
+        for device_id in self.liveness.expire():
+            profile = self.device_profiles.get(device_id)
             # Check if device went offline
-            if (profile.last_heartbeat and 
-                (current_time - profile.last_heartbeat).total_seconds() > self.offline_threshold and
-                profile.current_status != HealthStatus.OFFLINE):
+            if profile and profile.current_status != HealthStatus.OFFLINE:
                 
                 # Generate offline alert
                 alert = HealthAlert(
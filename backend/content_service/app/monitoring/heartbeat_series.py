@@ -0,0 +1,350 @@
+"""
+Bucketed time-series storage for device heartbeats.
+
+With ``HEARTBEAT_STORAGE_MODE=buckets`` heartbeats are not written one
+document per beat to ``device_heartbeats``. Each device gets one document per
+hour in ``device_heartbeat_buckets``, holding parallel arrays: ``timestamps``
+plus one array per field in ``SERIES_FIELDS``, null where a beat did not
+report that field. A beat is an upserted ``$push``, and a history read touches
+one document per device-hour instead of one per beat.
+
+``HeartbeatDownsampler`` periodically folds completed hours into
+``device_heartbeat_rollups``: 5-minute buckets from the raw samples, then an
+hourly bucket from those. Each holds min/avg/max/count per numeric field.
+Every document carries an ``expires_at`` for its tier
+(``HEARTBEAT_RAW_RETENTION_HOURS``, ``HEARTBEAT_5M_RETENTION_DAYS``,
+``HEARTBEAT_HOURLY_RETENTION_DAYS``) and a TTL index removes it, so retention
+costs no scans. Late beats for an hour that was already downsampled reopen
+the bucket, and the next pass rewrites its rollups.
+
+Native MongoDB time-series collections are not used because they need
+MongoDB 5.0+ and restrict updates and TTL per tier. The bucket layout works
+on any deployment.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_FIELDS = ("cpu_usage", "memory_usage", "storage_usage", "temperature", "network_strength",
+                  "bandwidth_mbps", "content_errors", "performance_score")
+SERIES_FIELDS = NUMERIC_FIELDS + ("status", "current_content_id")
+
+HOUR = timedelta(hours=1)
+FIVE_MINUTES = timedelta(minutes=5)
+
+
+def floor_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_five_minutes(value: datetime) -> datetime:
+    return value.replace(minute=value.minute - value.minute % 5, second=0, microsecond=0)
+
+
+def bucket_id(device_id: str, bucket_start: datetime) -> str:
+    return f"{device_id}:{bucket_start.isoformat()}"
+
+
+def _as_datetime(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def summarize(timestamps: List[datetime], series: Dict[str, List], step: timedelta = FIVE_MINUTES
+              ) -> Dict[datetime, Dict[str, Dict[str, float]]]:
+    """min/max/sum/count per numeric field for each ``step`` bucket of raw samples"""
+    floor = floor_five_minutes if step == FIVE_MINUTES else floor_hour
+    buckets: Dict[datetime, Dict[str, Dict[str, float]]] = {}
+    for index, timestamp in enumerate(timestamps):
+        start = floor(timestamp)
+        fields = buckets.setdefault(start, {})
+        for field in NUMERIC_FIELDS:
+            values = series.get(field)
+            value = values[index] if values and index < len(values) else None
+            if value is None:
+                continue
+            stats = fields.get(field)
+            if stats is None:
+                fields[field] = {"min": value, "max": value, "sum": value, "count": 1}
+            else:
+                stats["min"] = min(stats["min"], value)
+                stats["max"] = max(stats["max"], value)
+                stats["sum"] += value
+                stats["count"] += 1
+    return buckets
+
+
+def combine(parts: Iterable[Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+    """Merge per-field stats of finer buckets into one coarser bucket"""
+    merged: Dict[str, Dict[str, float]] = {}
+    for fields in parts:
+        for field, stats in fields.items():
+            current = merged.get(field)
+            if current is None:
+                merged[field] = dict(stats)
+            else:
+                current["min"] = min(current["min"], stats["min"])
+                current["max"] = max(current["max"], stats["max"])
+                current["sum"] += stats["sum"]
+                current["count"] += stats["count"]
+    return merged
+
+
+def _public(fields: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    return {
+        field: {"min": stats["min"], "max": stats["max"], "avg": stats["sum"] / stats["count"],
+                "count": stats["count"], "sum": stats["sum"]}
+        for field, stats in fields.items()
+    }
+
+
+def rollup_row(device_id: str, granularity: str, start: datetime, fields: Dict[str, Dict[str, float]]) -> Dict:
+    """A rollup as ``HeartbeatBucketStore.history`` returns it"""
+    return {"device_id": device_id, "granularity": granularity, "bucket_start": start, "metrics": _public(fields)}
+
+
+def rollup_heartbeats(device_id: str, heartbeats: List[Dict], granularity: str) -> List[Dict]:
+    """5m or 1h rollups computed from per-beat documents, oldest first"""
+    timestamps = [_as_datetime(heartbeat["timestamp"]) for heartbeat in heartbeats]
+    series = {field: [heartbeat.get(field) for heartbeat in heartbeats] for field in NUMERIC_FIELDS}
+    buckets = summarize(timestamps, series, FIVE_MINUTES if granularity == "5m" else HOUR)
+    return [rollup_row(device_id, granularity, start, fields) for start, fields in sorted(buckets.items()) if fields]
+
+
+def heartbeat_rollup_pipeline(device_id: str, start: datetime, end: datetime, granularity: str) -> List[Dict]:
+    """Aggregation over per-beat ``device_heartbeats`` documents grouped like the bucket rollups.
+
+    Buckets are computed with ``$mod`` on the epoch milliseconds rather than
+    ``$dateTrunc``, so this runs on MongoDB before 5.0 as well.
+    """
+    step_ms = int((FIVE_MINUTES if granularity == "5m" else HOUR).total_seconds() * 1000)
+    group: Dict[str, Any] = {
+        "_id": {"$subtract": ["$timestamp", {"$mod": [{"$toLong": "$timestamp"}, step_ms]}]}
+    }
+    for field in NUMERIC_FIELDS:
+        group[f"{field}__min"] = {"$min": f"${field}"}
+        group[f"{field}__max"] = {"$max": f"${field}"}
+        group[f"{field}__sum"] = {"$sum": f"${field}"}
+        group[f"{field}__count"] = {"$sum": {"$cond": [{"$isNumber": f"${field}"}, 1, 0]}}
+    return [
+        {"$match": {"device_id": device_id, "timestamp": {"$gte": start, "$lt": end}}},
+        {"$group": group},
+        {"$sort": {"_id": 1}}
+    ]
+
+
+def rows_from_pipeline(device_id: str, granularity: str, groups: List[Dict]) -> List[Dict]:
+    """Rollups from ``heartbeat_rollup_pipeline`` results"""
+    rows = []
+    for group in groups:
+        fields = {
+            field: {stat: group[f"{field}__{stat}"] for stat in ("min", "max", "sum", "count")}
+            for field in NUMERIC_FIELDS if group.get(f"{field}__count")
+        }
+        if fields:
+            rows.append(rollup_row(device_id, granularity, group["_id"], fields))
+    return rows
+
+
+class HeartbeatBucketStore:
+    """Hourly per-device heartbeat buckets plus their 5-minute and hourly rollups"""
+
+    def __init__(self, db):
+        self.buckets = db.device_heartbeat_buckets
+        self.rollups = db.device_heartbeat_rollups
+        self.raw_retention = timedelta(hours=settings.HEARTBEAT_RAW_RETENTION_HOURS)
+        self.retention = {
+            "5m": timedelta(days=settings.HEARTBEAT_5M_RETENTION_DAYS),
+            "1h": timedelta(days=settings.HEARTBEAT_HOURLY_RETENTION_DAYS)
+        }
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    async def save_many(self, rows: List[Dict]) -> int:
+        """Append heartbeat rows to their device-hour buckets; one bulk_write for all"""
+        grouped: Dict[Tuple[str, datetime], List[Dict]] = {}
+        for row in rows:
+            timestamp = _as_datetime(row.get("timestamp") or datetime.utcnow())
+            grouped.setdefault((row["device_id"], floor_hour(timestamp)), []).append({**row, "timestamp": timestamp})
+        if not grouped:
+            return 0
+
+        operations = []
+        for (device_id, bucket_start), samples in grouped.items():
+            samples.sort(key=lambda sample: sample["timestamp"])
+            push = {"timestamps": {"$each": [sample["timestamp"] for sample in samples]}}
+            for field in SERIES_FIELDS:
+                push[f"series.{field}"] = {"$each": [sample.get(field) for sample in samples]}
+            operations.append(UpdateOne(
+                {"_id": bucket_id(device_id, bucket_start)},
+                {
+                    "$setOnInsert": {
+                        "device_id": device_id,
+                        "bucket_start": bucket_start,
+                        "expires_at": bucket_start + HOUR + self.raw_retention
+                    },
+                    "$set": {"downsampled": False},
+                    "$push": push,
+                    "$inc": {"count": len(samples)},
+                    "$min": {"first_timestamp": samples[0]["timestamp"]},
+                    "$max": {"last_timestamp": samples[-1]["timestamp"]}
+                },
+                upsert=True
+            ))
+        await self.buckets.bulk_write(operations, ordered=False)
+        return len(rows)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _rows(bucket: Dict) -> List[Dict]:
+        """Unroll a bucket into heartbeat rows, oldest first"""
+        series = bucket.get("series", {})
+        rows = []
+        for index, timestamp in enumerate(bucket.get("timestamps", [])):
+            row = {"device_id": bucket["device_id"], "timestamp": timestamp}
+            for field, values in series.items():
+                if index < len(values) and values[index] is not None:
+                    row[field] = values[index]
+            rows.append(row)
+        rows.sort(key=lambda row: row["timestamp"])
+        return rows
+
+    async def latest(self, device_id: str) -> Optional[Dict]:
+        cursor = self.buckets.find({"device_id": device_id}).sort("bucket_start", -1).limit(1)
+        async for bucket in cursor:
+            rows = self._rows(bucket)
+            return rows[-1] if rows else None
+        return None
+
+    async def recent(self, device_id: str, limit: int = 100) -> List[Dict]:
+        """Newest heartbeats first, reading only as many hour buckets as needed"""
+        rows: List[Dict] = []
+        cursor = self.buckets.find({"device_id": device_id}).sort("bucket_start", -1)
+        async for bucket in cursor:
+            rows.extend(reversed(self._rows(bucket)))
+            if len(rows) >= limit:
+                break
+        return rows[:limit]
+
+    async def history(self, device_id: str, start: datetime, end: Optional[datetime] = None,
+                      granularity: str = "5m") -> List[Dict]:
+        """Rolled-up history (``5m`` or ``1h``), or raw samples for ``raw``, oldest first"""
+        end = end or datetime.utcnow()
+        if granularity == "raw":
+            cursor = self.buckets.find({
+                "device_id": device_id, "bucket_start": {"$gte": floor_hour(start), "$lt": end}
+            }).sort("bucket_start", 1)
+            return [row async for bucket in cursor for row in self._rows(bucket) if start <= row["timestamp"] < end]
+        cursor = self.rollups.find({
+            "device_id": device_id, "granularity": granularity, "bucket_start": {"$gte": start, "$lt": end}
+        }, {"_id": 0, "expires_at": 0}).sort("bucket_start", 1)
+        return await cursor.to_list(length=None)
+
+    async def delete_older_than(self, cutoff: datetime) -> int:
+        """Drop raw buckets whose newest sample is before ``cutoff``"""
+        result = await self.buckets.delete_many({"last_timestamp": {"$lt": cutoff}})
+        return result.deleted_count
+
+    # ------------------------------------------------------------------
+    # Downsampling
+    # ------------------------------------------------------------------
+
+    async def downsample(self, now: Optional[datetime] = None, batch_size: int = 500) -> int:
+        """Roll completed hours up into 5-minute and hourly buckets; returns buckets processed"""
+        current_hour = floor_hour(now or datetime.utcnow())
+        processed = 0
+        while True:
+            pending = await self.buckets.find(
+                {"downsampled": False, "bucket_start": {"$lt": current_hour}}
+            ).limit(batch_size).to_list(length=batch_size)
+            if not pending:
+                return processed
+
+            operations = []
+            done = []
+            for bucket in pending:
+                operations.extend(self._rollup_operations(bucket))
+                done.append(UpdateOne({"_id": bucket["_id"], "count": bucket.get("count")},
+                                      {"$set": {"downsampled": True}}))
+            if operations:
+                await self.rollups.bulk_write(operations, ordered=False)
+            await self.buckets.bulk_write(done, ordered=False)
+            processed += len(pending)
+            if len(pending) < batch_size:
+                return processed
+
+    def _rollup_operations(self, bucket: Dict) -> List[UpdateOne]:
+        device_id = bucket["device_id"]
+        timestamps = [_as_datetime(timestamp) for timestamp in bucket.get("timestamps", [])]
+        five_minute = summarize(timestamps, bucket.get("series", {}), FIVE_MINUTES)
+        operations = [
+            self._rollup(device_id, "5m", start, fields) for start, fields in five_minute.items() if fields
+        ]
+        hourly = combine(five_minute.values())
+        if hourly:
+            operations.append(self._rollup(device_id, "1h", bucket["bucket_start"], hourly))
+        return operations
+
+    def _rollup(self, device_id: str, granularity: str, start: datetime, fields: Dict) -> UpdateOne:
+        return UpdateOne(
+            {"_id": f"{granularity}:{bucket_id(device_id, start)}"},
+            {"$set": {
+                "device_id": device_id,
+                "granularity": granularity,
+                "bucket_start": start,
+                "metrics": _public(fields),
+                "expires_at": start + self.retention[granularity]
+            }},
+            upsert=True
+        )
+
+
+class HeartbeatDownsampler:
+    """Background task running ``HeartbeatBucketStore.downsample`` periodically"""
+
+    def __init__(self, store: HeartbeatBucketStore, interval: Optional[float] = None):
+        self.store = store
+        self.interval = interval or settings.HEARTBEAT_DOWNSAMPLE_INTERVAL_SECONDS
+        self._task: Optional[asyncio.Task] = None
+        self.last_processed = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self.last_processed = await self.store.downsample()
+                if self.last_processed:
+                    logger.info(f"Downsampled {self.last_processed} heartbeat buckets")
+            except Exception as e:
+                logger.error(f"Heartbeat downsampling failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+def bucketed_heartbeats_enabled() -> bool:
+    return settings.HEARTBEAT_STORAGE_MODE == "buckets"
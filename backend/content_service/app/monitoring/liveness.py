@@ -0,0 +1,297 @@
+"""
+Event-driven device liveness index.
+
+Heartbeats and WebSocket connect/disconnect events keep an in-memory record
+per device; fleet summaries and offline detection read it instead of listing
+every company, screen and latest heartbeat from the database.
+
+Expiry uses a hashed timing wheel: a device's deadline (last seen plus the
+timeout) lands in a bucket per ``resolution`` seconds, and a heartbeat moves
+it to a later bucket in O(1). ``expire()`` only visits the buckets that came
+due since the previous call, so detecting offline devices costs O(devices that
+changed), not O(fleet). Devices with an open WebSocket are never in the wheel;
+their deadline starts when the socket closes.
+
+Listeners registered with ``add_listener`` are called with
+``(device_id, online)`` on every transition.
+
+Each worker only sees the heartbeats and sockets that reach it, so a device
+served by another worker looks expired here. ``confirm_offline`` checks the
+stored ``last_seen`` of expired devices before anyone is alerted.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch_seconds(value: Any) -> Optional[float]:
+    """Seconds since the epoch for a stored ``last_seen`` (datetime or ISO text)"""
+    if not value:
+        return None
+    try:
+        if not isinstance(value, datetime):
+            value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH).total_seconds()
+
+
+class DeviceLiveness:
+    """What the tracker knows about one device"""
+    __slots__ = ("device_id", "name", "company_id", "company_name", "online", "connected",
+                 "last_seen", "performance_score", "last_heartbeat")
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.name: Optional[str] = None
+        self.company_id: Optional[str] = None
+        self.company_name: Optional[str] = None
+        self.online = False
+        self.connected = False
+        self.last_seen: Optional[float] = None
+        self.performance_score: Optional[float] = None
+        self.last_heartbeat: Optional[Dict[str, Any]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "device_id": self.device_id,
+            "name": self.name,
+            "company_id": self.company_id,
+            "company_name": self.company_name,
+            "is_online": self.online,
+            "connected": self.connected,
+            "last_seen": datetime.utcfromtimestamp(self.last_seen).isoformat() if self.last_seen else None,
+            "latest_heartbeat": self.last_heartbeat,
+            "performance_score": self.performance_score
+        }
+
+
+class LivenessTracker:
+    """In-memory liveness index with timing-wheel expiry"""
+
+    def __init__(self, timeout_seconds: float = 300, resolution_seconds: float = 1.0,
+                 clock: Callable[[], float] = time.time):
+        self.timeout = timeout_seconds
+        self.resolution = resolution_seconds
+        self.clock = clock
+        self.devices: Dict[str, DeviceLiveness] = {}
+        self.company_names: Dict[str, str] = {}
+        self._buckets: Dict[int, Set[str]] = {}
+        self._device_tick: Dict[str, int] = {}
+        self._last_tick = self._tick(clock())
+        self._listeners: List[Callable[[str, bool], None]] = []
+        self._online_count = 0
+
+    def _tick(self, timestamp: float) -> int:
+        return math.ceil(timestamp / self.resolution)
+
+    def add_listener(self, listener: Callable[[str, bool], None]) -> None:
+        self._listeners.append(listener)
+
+    # ------------------------------------------------------------------
+    # Events
+    # ------------------------------------------------------------------
+
+    def register(self, device_id: str, name: Optional[str] = None, company_id: Optional[str] = None,
+                 company_name: Optional[str] = None, last_seen: Optional[float] = None) -> DeviceLiveness:
+        """Add or update device metadata without counting as a sign of life"""
+        state = self._state(device_id)
+        if name is not None:
+            state.name = name
+        if company_id is not None:
+            state.company_id = company_id
+            if company_name is None:
+                company_name = self.company_names.get(company_id)
+        if company_name is not None:
+            state.company_name = company_name
+        if last_seen is not None and (state.last_seen is None or last_seen > state.last_seen):
+            state.last_seen = last_seen
+            if last_seen + self.timeout > self.clock() and not state.connected:
+                self._set_online(state, True)
+                self._schedule(state)
+        return state
+
+    def heartbeat(self, device_id: str, data: Optional[Dict[str, Any]] = None,
+                  performance_score: Optional[float] = None) -> None:
+        state = self._state(device_id)
+        state.last_seen = self.clock()
+        if data is not None:
+            state.last_heartbeat = data
+        if performance_score is not None:
+            state.performance_score = performance_score
+        if not state.connected:
+            self._schedule(state)
+        self._set_online(state, True)
+
+    def socket_connected(self, device_id: str) -> None:
+        state = self._state(device_id)
+        state.connected = True
+        state.last_seen = self.clock()
+        self._unschedule(device_id)
+        self._set_online(state, True)
+
+    def socket_disconnected(self, device_id: str) -> None:
+        state = self.devices.get(device_id)
+        if state is None or not state.connected:
+            return
+        state.connected = False
+        state.last_seen = self.clock()
+        self._schedule(state)
+
+    async def seed_from_repo(self, repo) -> int:
+        """Load names, companies and stored ``last_seen`` once at startup.
+
+        Devices seen within the timeout start online and expire on schedule;
+        everything later comes from heartbeats and socket events.
+        """
+        seeded = 0
+        for company in await repo.list_companies():
+            company_id = company.get("id")
+            if company.get("name"):
+                self.company_names[company_id] = company["name"]
+            for device in await repo.list_digital_screens(company_id):
+                if not device.get("id"):
+                    continue
+                self.register(device["id"], name=device.get("name"), company_id=company_id,
+                              company_name=company.get("name"),
+                              last_seen=_epoch_seconds(device.get("last_seen")))
+                seeded += 1
+        return seeded
+
+    def forget(self, device_id: str) -> None:
+        state = self.devices.pop(device_id, None)
+        self._unschedule(device_id)
+        if state is not None and state.online:
+            self._online_count -= 1
+
+    # ------------------------------------------------------------------
+    # Expiry
+    # ------------------------------------------------------------------
+
+    def expire(self) -> List[str]:
+        """Mark devices whose deadline passed as offline; returns them"""
+        now_tick = self._tick(self.clock())
+        if now_tick <= self._last_tick:
+            return []
+        if now_tick - self._last_tick <= len(self._buckets):
+            due = range(self._last_tick + 1, now_tick + 1)
+        else:
+            due = sorted(tick for tick in self._buckets if tick <= now_tick)
+        self._last_tick = now_tick
+
+        expired = []
+        for tick in due:
+            for device_id in self._buckets.pop(tick, ()):
+                del self._device_tick[device_id]
+                state = self.devices[device_id]
+                self._set_online(state, False)
+                expired.append(device_id)
+        return expired
+
+    async def confirm_offline(self, repo, device_ids: Iterable[str]) -> List[str]:
+        """Of the devices ``expire()`` returned, those the database has not seen either
+
+        A device whose stored ``last_seen`` is within the timeout was heard by
+        another worker; it goes back online here and is rescheduled instead.
+        A device with no screen was deleted, possibly through another worker,
+        and is forgotten. Devices whose lookup fails are reported as offline.
+        """
+        device_ids = list(device_ids)
+        screens = await asyncio.gather(*(repo.get_digital_screen(device_id) for device_id in device_ids),
+                                       return_exceptions=True)
+        offline = []
+        now = self.clock()
+        for device_id, screen in zip(device_ids, screens):
+            if isinstance(screen, Exception):
+                logger.error(f"Failed to read last_seen for device {device_id}: {screen}")
+                screen = None
+            elif screen is None:
+                self.forget(device_id)
+                continue
+            last_seen = _epoch_seconds(screen.get("last_seen")) if screen else None
+            if last_seen is not None and last_seen + self.timeout > now:
+                self.register(device_id, last_seen=last_seen)
+            else:
+                offline.append(device_id)
+        return offline
+
+    def _schedule(self, state: DeviceLiveness) -> None:
+        tick = max(self._tick(state.last_seen + self.timeout), self._last_tick + 1)
+        current = self._device_tick.get(state.device_id)
+        if current == tick:
+            return
+        if current is not None:
+            self._discard(current, state.device_id)
+        self._buckets.setdefault(tick, set()).add(state.device_id)
+        self._device_tick[state.device_id] = tick
+
+    def _unschedule(self, device_id: str) -> None:
+        tick = self._device_tick.pop(device_id, None)
+        if tick is not None:
+            self._discard(tick, device_id)
+
+    def _discard(self, tick: int, device_id: str) -> None:
+        bucket = self._buckets.get(tick)
+        if bucket is not None:
+            bucket.discard(device_id)
+            if not bucket:
+                del self._buckets[tick]
+
+    def _state(self, device_id: str) -> DeviceLiveness:
+        state = self.devices.get(device_id)
+        if state is None:
+            state = self.devices[device_id] = DeviceLiveness(device_id)
+        return state
+
+    def _set_online(self, state: DeviceLiveness, online: bool) -> None:
+        if state.online == online:
+            return
+        state.online = online
+        self._online_count += 1 if online else -1
+        for listener in self._listeners:
+            try:
+                listener(state.device_id, online)
+            except Exception as e:
+                logger.error(f"Liveness listener failed for device {state.device_id}: {e}")
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def is_online(self, device_id: str) -> bool:
+        state = self.devices.get(device_id)
+        return bool(state and state.online)
+
+    def summary(self, device_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Per-device liveness for the given devices, or every known device"""
+        if device_ids is None:
+            return [state.to_dict() for state in self.devices.values()]
+        return [self.devices[d].to_dict() for d in device_ids if d in self.devices]
+
+    def offline_devices(self) -> List[Dict[str, Any]]:
+        return [state.to_dict() for state in self.devices.values() if not state.online]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'tracked_devices': len(self.devices),
+            'online_devices': self._online_count,
+            'scheduled_expiries': len(self._device_tick),
+            'wheel_buckets': len(self._buckets),
+            'timeout_seconds': self.timeout
+        }
+
+
+# Global liveness index for WebSocket and HTTP heartbeats
+device_liveness = LivenessTracker(timeout_seconds=settings.DEVICE_LIVENESS_TIMEOUT_SECONDS)
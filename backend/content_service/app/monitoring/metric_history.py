@@ -0,0 +1,131 @@
+"""
+Compact per-device metric history for the health monitor.
+
+Each (device, metric type) series is a pair of typed ``array`` rings: float32
+values and uint32 epoch-second timestamps, 8 bytes per sample against several
+hundred for a ``HealthMetric`` object with its own uuid, datetime and dict. A
+ring grows with the samples it holds up to ``capacity`` (a day of one-minute
+heartbeats by default) and then overwrites its oldest slot, so quiet devices
+stay small.
+
+Samples arrive in time order, so each ring is two sorted runs; window queries
+bisect for the bounds and reduce the slices with the builtin C loops
+(``min``, ``max``, ``sum``, ``sorted``) rather than per-sample Python code.
+"""
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+DEFAULT_CAPACITY = 1440  # 24 hours at one sample per minute
+
+
+def _epoch(timestamp: datetime) -> int:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp())
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of an already sorted list"""
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class MetricSeries:
+    """Ring of (timestamp, value) samples for one metric of one device"""
+    __slots__ = ("capacity", "values", "times", "head")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.values = array('f')
+        self.times = array('I')
+        self.head = 0  # next slot to overwrite once the ring is full
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def append(self, value: float, timestamp: datetime) -> None:
+        epoch = _epoch(timestamp)
+        if len(self.values) < self.capacity:
+            self.values.append(value)
+            self.times.append(epoch)
+            return
+        self.values[self.head] = value
+        self.times[self.head] = epoch
+        self.head = (self.head + 1) % self.capacity
+
+    def _runs(self) -> Tuple[Tuple[int, int], ...]:
+        """Slot ranges holding samples oldest-first"""
+        if self.head == 0:
+            return ((0, len(self.values)),)
+        return ((self.head, self.capacity), (0, self.head))
+
+    def window(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> array:
+        """Values with start <= timestamp <= end, oldest first"""
+        low = _epoch(start) if start else 0
+        high = _epoch(end) if end else 2 ** 32 - 1
+        selected = array('f')
+        for run_start, run_end in self._runs():
+            first = bisect_left(self.times, low, run_start, run_end)
+            last = bisect_right(self.times, high, first, run_end)
+            selected.extend(self.values[first:last])
+        return selected
+
+    def samples(self) -> List[Tuple[datetime, float]]:
+        """All samples oldest first, as (timestamp, value) pairs"""
+        return [
+            (datetime.fromtimestamp(self.times[i], timezone.utc), self.values[i])
+            for run_start, run_end in self._runs() for i in range(run_start, run_end)
+        ]
+
+    def nbytes(self) -> int:
+        return self.values.itemsize * len(self.values) + self.times.itemsize * len(self.times)
+
+
+class MetricHistory:
+    """All metric series for one device, keyed by metric type"""
+    __slots__ = ("capacity", "series")
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.series: Dict[Hashable, MetricSeries] = {}
+
+    def __contains__(self, metric_type: Hashable) -> bool:
+        return metric_type in self.series
+
+    def __getitem__(self, metric_type: Hashable) -> MetricSeries:
+        return self.series[metric_type]
+
+    def record(self, metric_type: Hashable, value: float, timestamp: datetime) -> None:
+        series = self.series.get(metric_type)
+        if series is None:
+            series = self.series[metric_type] = MetricSeries(self.capacity)
+        series.append(value, timestamp)
+
+    def stats(self, metric_type: Hashable, start: Optional[datetime] = None,
+              end: Optional[datetime] = None, percentiles: Iterable[float] = (50, 95)) -> Dict[str, Any]:
+        """min/max/avg/percentiles of one metric over a time window"""
+        series = self.series.get(metric_type)
+        values = series.window(start, end) if series is not None else ()
+        if not values:
+            return {"count": 0}
+        ordered = sorted(values)
+        result = {
+            "count": len(ordered),
+            "min": ordered[0],
+            "max": ordered[-1],
+            "avg": math.fsum(ordered) / len(ordered)
+        }
+        for pct in percentiles:
+            result[f"p{pct:g}"] = percentile(ordered, pct)
+        return result
+
+    def nbytes(self) -> int:
+        return sum(series.nbytes() for series in self.series.values())
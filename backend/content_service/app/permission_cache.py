@@ -0,0 +1,207 @@
+"""
+Effective-permission cache for RBAC checks.
+
+Compiles everything a permission check needs for one (user_id, company_id)
+pair - the user's type, a bitset of role-level permissions from active roles,
+and a bitset of permissions per screen from role_permissions - so that
+``RBACService.check_permission`` and ``repo.check_user_permission`` normally
+cost no database calls at all.
+
+Entries expire after ``PERMISSION_CACHE_TTL_SECONDS`` and are invalidated
+explicitly by the repositories whenever users, roles, role permissions or user
+roles are saved or deleted. Invalidation is per process; the TTL bounds how
+long another worker can serve a stale entry.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.config import settings
+
+CacheKey = Tuple[str, Optional[str]]
+
+
+class PermissionBits:
+    """Interns permission strings to bit positions shared by all entries"""
+
+    def __init__(self):
+        self._bit_for: Dict[str, int] = {}
+        self._name_for: List[str] = []
+
+    def bit(self, permission: Any) -> int:
+        name = getattr(permission, "value", permission)
+        index = self._bit_for.get(name)
+        if index is None:
+            index = len(self._name_for)
+            self._bit_for[name] = index
+            self._name_for.append(name)
+        return 1 << index
+
+    def compile(self, permissions: Iterable[Any]) -> int:
+        bits = 0
+        for permission in permissions:
+            bits |= self.bit(permission)
+        return bits
+
+    def names(self, bits: int) -> Set[str]:
+        return {name for index, name in enumerate(self._name_for) if bits >> index & 1}
+
+
+permission_bits = PermissionBits()
+
+
+class EffectivePermissions:
+    """Compiled permissions of one user within one company (or all companies)"""
+
+    __slots__ = ("user_exists", "user_type", "role_bits", "screen_bits", "role_ids", "expires_at")
+
+    def __init__(self, user_exists: bool, user_type: Optional[str], role_bits: int,
+                 screen_bits: Dict[str, int], role_ids: Set[str], expires_at: float):
+        self.user_exists = user_exists
+        self.user_type = user_type
+        self.role_bits = role_bits
+        self.screen_bits = screen_bits
+        self.role_ids = role_ids
+        self.expires_at = expires_at
+
+    def has_role_permission(self, permission: Any) -> bool:
+        return bool(self.role_bits & permission_bits.bit(permission))
+
+    def has_screen_permission(self, screen: Any, permission: Any) -> bool:
+        screen = getattr(screen, "value", screen)
+        return bool(self.screen_bits.get(screen, 0) & permission_bits.bit(permission))
+
+    def role_permission_names(self) -> Set[str]:
+        return permission_bits.names(self.role_bits)
+
+
+class EffectivePermissionCache:
+    """TTL + LRU cache of EffectivePermissions with explicit invalidation"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.PERMISSION_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or settings.PERMISSION_CACHE_MAX_ENTRIES
+        self._entries: "OrderedDict[CacheKey, EffectivePermissions]" = OrderedDict()
+        # Reverse indexes so a user or role change drops only affected entries
+        self._keys_by_user: Dict[str, Set[CacheKey]] = {}
+        self._keys_by_role: Dict[str, Set[CacheKey]] = {}
+        # Bumped on every invalidation; builds that raced one are not stored
+        self._epoch = 0
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'builds_discarded': 0
+        }
+
+    async def get(self, repo, user_id: str, company_id: Optional[str]) -> EffectivePermissions:
+        key = (user_id, company_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._metrics['hits'] += 1
+                return entry
+            self._metrics['expired'] += 1
+            self._drop(key)
+
+        self._metrics['misses'] += 1
+        epoch = self._epoch
+        entry = await self._build(repo, user_id, company_id)
+        if epoch == self._epoch:
+            self._store(key, entry)
+        else:
+            self._metrics['builds_discarded'] += 1
+        return entry
+
+    async def _build(self, repo, user_id: str, company_id: Optional[str]) -> EffectivePermissions:
+        """Load with batched queries: user, assignments, roles ($in), role permissions ($in)"""
+        user = await repo.get_user(user_id)
+        assignments = await repo.get_user_role_assignments(user_id)
+        if company_id:
+            assignments = [a for a in assignments if a.get("company_id") == company_id]
+
+        role_ids = {a.get("role_id") for a in assignments if a.get("role_id")}
+        roles = await repo.get_roles_by_ids(list(role_ids)) if role_ids else {}
+
+        role_bits = 0
+        for role in roles.values():
+            if role.get("status") == "active":
+                role_bits |= permission_bits.compile(role.get("permissions", []))
+
+        screen_bits: Dict[str, int] = {}
+        if roles:
+            for perm in await repo.get_role_permissions_for_roles(list(roles)):
+                screen = getattr(perm.get("screen"), "value", perm.get("screen"))
+                screen_bits[screen] = screen_bits.get(screen, 0) | permission_bits.compile(
+                    perm.get("permissions", [])
+                )
+
+        user_type = user.get("user_type") if user else None
+        return EffectivePermissions(
+            user_exists=user is not None,
+            user_type=getattr(user_type, "value", user_type),
+            role_bits=role_bits,
+            screen_bits=screen_bits,
+            role_ids=role_ids,
+            expires_at=time.monotonic() + self.ttl_seconds
+        )
+
+    def _store(self, key: CacheKey, entry: EffectivePermissions) -> None:
+        self._drop(key)
+        self._entries[key] = entry
+        self._keys_by_user.setdefault(key[0], set()).add(key)
+        for role_id in entry.role_ids:
+            self._keys_by_role.setdefault(role_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._metrics['evictions'] += 1
+
+    def _drop(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for index, ids in ((self._keys_by_user, (key[0],)), (self._keys_by_role, entry.role_ids)):
+            for _id in ids:
+                keys = index.get(_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[_id]
+
+    def _invalidate_keys(self, keys: Iterable[CacheKey]) -> None:
+        self._epoch += 1
+        self._metrics['invalidations'] += 1
+        for key in list(keys):
+            self._drop(key)
+
+    def invalidate_user(self, user_id: Optional[str]) -> None:
+        """A user or one of their role assignments changed"""
+        if user_id:
+            self._invalidate_keys(self._keys_by_user.get(user_id, ()))
+
+    def invalidate_role(self, role_id: Optional[str]) -> None:
+        """A role or its role permissions changed"""
+        if role_id:
+            self._invalidate_keys(self._keys_by_role.get(role_id, ()))
+
+    def clear(self) -> None:
+        self._invalidate_keys(list(self._entries))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        lookups = self._metrics['hits'] + self._metrics['misses']
+        return {
+            **self._metrics,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hit_rate': round(self._metrics['hits'] / lookups, 4) if lookups else None
+        }
+
+
+# Global permission cache instance
+permission_cache = EffectivePermissionCache()
@@ -0,0 +1,406 @@
+"""
+Compiled device playlists, cached per ``(device_id, slot)``.
+
+``ContentSchedulerService.get_device_playlist`` used to look up active
+schedules, filter, order and time them on every call. Playlists only change on
+slot boundaries (``next_update``), so a playlist is now compiled once for the
+slot that contains the requested time (``PLAYLIST_SLOT_MINUTES``, aligned to
+midnight). Every fetch for that slot is then a dictionary lookup. Concurrent
+misses on one key share a single build, and a fetch within
+``PLAYLIST_PRECOMPUTE_LEAD_SECONDS`` of the slot end compiles the device's
+next slot in the background. Screens that poll at the boundary therefore find
+their playlist ready.
+
+Each entry records what it was compiled from: the device, the schedules it
+considered and their content. Writes that go through this process invalidate
+exactly the entries built from them:
+
+- schedule created or changed: ``invalidate_schedule(schedule_id, device_ids, fields)``;
+  proof-of-play counters such as ``total_plays`` are ignored
+- content approved, rejected or edited: ``invalidate_content(content_id)``
+- device attributes changed: ``invalidate_device(device_id, fields)``;
+  heartbeat telemetry such as ``last_seen`` is ignored
+
+As with the profile cache, an epoch guard stops a build that raced an
+invalidation from storing its stale result.
+
+Each worker has its own cache. Content and device invalidations therefore
+also bump a shared playlist version in the background through
+``version_store`` (the repository), and ``sync`` compares that version with the
+one this cache reflects, at most once per ``PLAYLIST_CACHE_REFRESH_SECONDS``,
+clearing the cache when another worker has invalidated since. Schedule writes
+reach other workers through the schedule index version instead.
+
+Entries can also carry the response already serialized, with an ETag over
+those bytes (``get_or_build_encoded``). A device that polls with a matching
+``If-None-Match`` gets a 304, and any other device gets the stored bytes, so
+neither compiles nor encodes anything. The fleet precompute job
+(``app.content_delivery.playlist_precompute``) compiles one playlist per group
+of identically targeted devices and binds it to each device with
+``for_device``, which splices the device id into the shared bytes.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SlotKey = Tuple[str, datetime]
+
+# Device fields written by heartbeats and health monitoring; they never change a playlist
+VOLATILE_DEVICE_FIELDS = frozenset({
+    "last_seen", "last_heartbeat", "updated_at", "health_status", "performance_score",
+    "sla_compliance", "system_metrics", "display_metrics"
+})
+
+# Schedule fields updated from proof-of-play; they never change a playlist
+SCHEDULE_COUNTER_FIELDS = frozenset({
+    "total_impressions", "total_plays", "average_engagement", "revenue_generated", "updated_at",
+    "deployment_history"
+})
+
+
+class CompiledPlaylist(NamedTuple):
+    """A playlist response plus the schedule and content ids it was built from"""
+    result: Dict[str, Any]
+    schedule_ids: Tuple[str, ...] = ()
+    content_ids: Tuple[str, ...] = ()
+    body: Optional[bytes] = None
+    etag: Optional[str] = None
+
+
+def encode_playlist(result: Dict[str, Any]) -> Tuple[bytes, str]:
+    """JSON bytes of a playlist response and a strong ETag over them"""
+    body = json.dumps(result, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return body, _etag(body)
+
+
+def for_device(shared: CompiledPlaylist, device_id: str) -> CompiledPlaylist:
+    """Bind a playlist compiled without a device id to one device"""
+    result = {"device_id": device_id, **shared.result}
+    if shared.body is None:
+        return shared._replace(result=result)
+    # shared.body is a non-empty JSON object, so the id can be spliced in front of its first key
+    body = b'{"device_id":' + json.dumps(device_id).encode("utf-8") + b"," + shared.body[1:]
+    return shared._replace(result=result, body=body, etag=_etag(body))
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+PlaylistBuilder = Callable[[str, datetime], Awaitable[CompiledPlaylist]]
+
+
+class PlaylistCache:
+    """LRU cache of compiled playlists with dependency-tracked invalidation"""
+
+    def __init__(self, slot_minutes: Optional[int] = None, max_entries: Optional[int] = None,
+                 precompute_lead_seconds: Optional[float] = None, refresh_seconds: Optional[float] = None):
+        self.slot_minutes = slot_minutes or settings.PLAYLIST_SLOT_MINUTES
+        self.slot_length = timedelta(minutes=self.slot_minutes)
+        self.max_entries = max_entries or settings.PLAYLIST_CACHE_MAX_ENTRIES
+        self.precompute_lead = timedelta(seconds=precompute_lead_seconds if precompute_lead_seconds is not None
+                                         else settings.PLAYLIST_PRECOMPUTE_LEAD_SECONDS)
+        self._entries: "OrderedDict[SlotKey, CompiledPlaylist]" = OrderedDict()
+        self._keys_by_device: Dict[str, Set[SlotKey]] = {}
+        self._keys_by_schedule: Dict[str, Set[SlotKey]] = {}
+        self._keys_by_content: Dict[str, Set[SlotKey]] = {}
+        self._inflight: Dict[SlotKey, asyncio.Task] = {}
+        self._epoch = 0
+        # Shared playlist version: bumped and read through the repository
+        self.version_store = None
+        self.version = 0
+        self.refresh_seconds = (settings.PLAYLIST_CACHE_REFRESH_SECONDS
+                                if refresh_seconds is None else refresh_seconds)
+        self._checked_at: Optional[float] = None
+        self._unpublished = 0
+        self._publisher: Optional[asyncio.Task] = None
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'builds': 0,
+            'build_errors': 0,
+            'build_ms_total': 0.0,
+            'build_ms_max': 0.0,
+            'precomputed': 0,
+            'encoded': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'entries_invalidated': 0,
+            'versions_published': 0,
+            'publish_errors': 0,
+            'version_checks': 0,
+            'stale_clears': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Slots
+    # ------------------------------------------------------------------
+
+    def slot_for(self, when: datetime) -> datetime:
+        """Start of the slot containing ``when``"""
+        midnight = when.replace(hour=0, minute=0, second=0, microsecond=0)
+        minutes = when.hour * 60 + when.minute
+        return midnight + timedelta(minutes=minutes - minutes % self.slot_minutes)
+
+    def next_slot(self, when: datetime) -> datetime:
+        return self.slot_for(when) + self.slot_length
+
+    # ------------------------------------------------------------------
+    # Lookup
+    # ------------------------------------------------------------------
+
+    def get(self, device_id: str, slot: datetime) -> Optional[Dict[str, Any]]:
+        key = (device_id, slot)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._metrics['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._metrics['hits'] += 1
+        return entry.result
+
+    async def get_or_build(self, device_id: str, when: datetime, build: PlaylistBuilder) -> Dict[str, Any]:
+        """Playlist for the slot containing ``when``, compiling it on a miss"""
+        slot = self.slot_for(when)
+        if slot + self.slot_length - when <= self.precompute_lead:
+            self._precompute_in_background(device_id, slot + self.slot_length, build)
+
+        result = self.get(device_id, slot)
+        if result is not None:
+            return result
+        return await self._build_shared((device_id, slot), build)
+
+    async def get_or_build_encoded(self, device_id: str, when: datetime, build: PlaylistBuilder) -> CompiledPlaylist:
+        """Like ``get_or_build``, with the serialized body and ETag attached"""
+        result = await self.get_or_build(device_id, when, build)
+        key = (device_id, self.slot_for(when))
+        entry = self._entries.get(key)
+        if entry is None or entry.result is not result:
+            # Failed builds are not cached
+            body, etag = encode_playlist(result)
+            return CompiledPlaylist(result, body=body, etag=etag)
+        if entry.body is None:
+            body, etag = encode_playlist(result)
+            entry = entry._replace(body=body, etag=etag)
+            self._entries[key] = entry
+            self._metrics['encoded'] += 1
+        return entry
+
+    def contains(self, device_id: str, slot: datetime) -> bool:
+        """True if the slot is cached for the device; not counted as a lookup"""
+        return (device_id, self.slot_for(slot)) in self._entries
+
+    async def precompute(self, device_id: str, slot: datetime, build: PlaylistBuilder) -> bool:
+        """Compile ``slot`` for a device unless it is cached already; True if it was built"""
+        key = (device_id, self.slot_for(slot))
+        if key in self._entries:
+            return False
+        await self._build_shared(key, build)
+        self._metrics['precomputed'] += 1
+        return True
+
+    def _precompute_in_background(self, device_id: str, slot: datetime, build: PlaylistBuilder) -> None:
+        key = (device_id, slot)
+        if key in self._entries or key in self._inflight:
+            return
+        task = asyncio.ensure_future(self.precompute(device_id, slot, build))
+        task.add_done_callback(_log_precompute_failure)
+
+    async def _build_shared(self, key: SlotKey, build: PlaylistBuilder) -> Dict[str, Any]:
+        task = self._inflight.get(key)
+        if task is not None:
+            self._metrics['coalesced'] += 1
+        else:
+            task = asyncio.ensure_future(self._build(key, build, self._epoch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A cancelled request must not cancel the build other requests are waiting on
+        return await asyncio.shield(task)
+
+    async def _build(self, key: SlotKey, build: PlaylistBuilder, epoch: int) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            compiled = await build(*key)
+        except Exception:
+            self._metrics['build_errors'] += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._metrics['builds'] += 1
+            self._metrics['build_ms_total'] += elapsed_ms
+            self._metrics['build_ms_max'] = max(self._metrics['build_ms_max'], elapsed_ms)
+        if compiled.result.get("success"):
+            self.put(key[0], key[1], compiled, epoch=epoch)
+        return compiled.result
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    @property
+    def epoch(self) -> int:
+        """Read before compiling a playlist and pass to ``put`` to skip racing stores"""
+        return self._epoch
+
+    def put(self, device_id: str, slot: datetime, compiled: CompiledPlaylist, epoch: Optional[int] = None) -> None:
+        if epoch is not None and epoch != self._epoch:
+            return
+        key = (device_id, slot)
+        self._drop(key)
+        self._entries[key] = compiled
+        self._keys_by_device.setdefault(device_id, set()).add(key)
+        for schedule_id in compiled.schedule_ids:
+            self._keys_by_schedule.setdefault(schedule_id, set()).add(key)
+        for content_id in compiled.content_ids:
+            self._keys_by_content.setdefault(content_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self._metrics['evictions'] += 1
+
+    def _drop(self, key: SlotKey) -> None:
+        compiled = self._entries.pop(key, None)
+        if compiled is None:
+            return
+        _discard(self._keys_by_device, key[0], key)
+        for schedule_id in compiled.schedule_ids:
+            _discard(self._keys_by_schedule, schedule_id, key)
+        for content_id in compiled.content_ids:
+            _discard(self._keys_by_content, content_id, key)
+
+    # ------------------------------------------------------------------
+    # Invalidation
+    # ------------------------------------------------------------------
+
+    def _invalidate_keys(self, keys: Iterable[SlotKey]) -> None:
+        self._epoch += 1
+        self._metrics['invalidations'] += 1
+        for key in list(keys):
+            if key in self._entries:
+                self._metrics['entries_invalidated'] += 1
+                self._drop(key)
+
+    def invalidate_device(self, device_id: Optional[str], fields: Optional[Iterable[str]] = None) -> None:
+        """Drop a device's playlists; ``fields`` that are all heartbeat telemetry are ignored"""
+        if not device_id:
+            return
+        if fields is not None and VOLATILE_DEVICE_FIELDS.issuperset(fields):
+            return
+        self._invalidate_keys(self._keys_by_device.get(device_id, ()))
+        self._publish()
+
+    def invalidate_devices(self, device_ids: Iterable[str]) -> None:
+        keys = [key for device_id in device_ids for key in self._keys_by_device.get(device_id, ())]
+        self._invalidate_keys(keys)
+        self._publish()
+
+    def invalidate_schedule(self, schedule_id: Optional[str], device_ids: Iterable[str] = (),
+                            fields: Optional[Iterable[str]] = None) -> None:
+        """Drop playlists built from a schedule, and those of the devices it now targets"""
+        if fields is not None and SCHEDULE_COUNTER_FIELDS.issuperset(fields):
+            return
+        keys = set(self._keys_by_schedule.get(schedule_id, ())) if schedule_id else set()
+        for device_id in device_ids:
+            keys.update(self._keys_by_device.get(device_id, ()))
+        self._invalidate_keys(keys)
+
+    def invalidate_content(self, content_id: Optional[str]) -> None:
+        if content_id:
+            self._invalidate_keys(self._keys_by_content.get(content_id, ()))
+            self._publish()
+
+    def clear(self) -> None:
+        self._invalidate_keys(list(self._entries))
+
+    # ------------------------------------------------------------------
+    # Other workers
+    # ------------------------------------------------------------------
+
+    def _publish(self) -> None:
+        """Bump the shared version so other workers drop their playlists too
+
+        Other workers may hold entries this one does not, so this happens even
+        when nothing was cached here. Invalidations made while a bump is in
+        flight are folded into one more bump.
+        """
+        if self.version_store is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._unpublished += 1
+        if self._publisher is None or self._publisher.done():
+            self._publisher = loop.create_task(self._publish_pending())
+
+    async def _publish_pending(self) -> None:
+        while self._unpublished:
+            self._unpublished = 0
+            try:
+                version = await self.version_store.bump_playlist_version()
+            except Exception as e:
+                self._metrics['publish_errors'] += 1
+                logger.error(f"Failed to publish playlist invalidation: {e}")
+                return
+            self._metrics['versions_published'] += 1
+            # Only a version directly after ours can be ours alone; a gap makes the next sync clear
+            if version == self.version + 1:
+                self.version = version
+
+    async def sync(self) -> bool:
+        """Clear if another worker has invalidated since the last check; True if cleared"""
+        if self.version_store is None:
+            return False
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+            return False
+        self._checked_at = now
+        self._metrics['version_checks'] += 1
+        version = await self.version_store.get_playlist_version()
+        if version == self.version:
+            return False
+        self.version = version
+        self._metrics['stale_clears'] += 1
+        self.clear()
+        return True
+
+    def get_metrics(self) -> Dict[str, Any]:
+        lookups = self._metrics['hits'] + self._metrics['misses']
+        builds = self._metrics['builds']
+        return {
+            **self._metrics,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'slot_minutes': self.slot_minutes,
+            'builds_in_flight': len(self._inflight),
+            'version': self.version,
+            'hit_rate': round(self._metrics['hits'] / lookups, 4) if lookups else None,
+            'avg_build_ms': round(self._metrics['build_ms_total'] / builds, 3) if builds else None
+        }
+
+
+def _discard(index: Dict[str, Set[SlotKey]], name: str, key: SlotKey) -> None:
+    keys = index.get(name)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del index[name]
+
+
+def _log_precompute_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Playlist precompute failed: {task.exception()}")
+
+
+# Global playlist cache instance
+playlist_cache = PlaylistCache()
@@ -0,0 +1,150 @@
+"""
+Short-lived cache of authenticated user profiles.
+
+``AuthService.get_current_user_from_token`` resolves a full profile (user,
+company, computed permissions and navigation) on every authenticated request.
+Profiles are cached per ``(user_id, jti)`` so each issued token pays for the
+database load once per ``PROFILE_CACHE_TTL_SECONDS``; a new token always
+starts from a fresh load.
+
+Writes that go through this process (repo/db_service user, role, user-role and
+company mutations) invalidate the affected users immediately. The short TTL
+bounds staleness for writes made by other workers.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from app.config import settings
+
+CacheKey = Tuple[str, Optional[str]]
+
+
+class UserProfileCache:
+    """TTL + LRU cache of user profiles keyed by user id and token jti"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.PROFILE_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or settings.PROFILE_CACHE_MAX_ENTRIES
+        self._entries: "OrderedDict[CacheKey, Tuple[Any, float]]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[CacheKey]] = {}
+        self._keys_by_company: Dict[str, Set[CacheKey]] = {}
+        self._company_of: Dict[CacheKey, Optional[str]] = {}
+        self._epoch = 0
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    def get(self, user_id: str, jti: Optional[str]) -> Optional[Any]:
+        key = (user_id, jti)
+        cached = self._entries.get(key)
+        if cached is None:
+            self._metrics['misses'] += 1
+            return None
+        profile, expires_at = cached
+        if expires_at <= time.monotonic():
+            self._metrics['expired'] += 1
+            self._metrics['misses'] += 1
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        self._metrics['hits'] += 1
+        return profile
+
+    @property
+    def epoch(self) -> int:
+        """Read before loading a profile and pass to ``put`` to skip racing stores"""
+        return self._epoch
+
+    def put(self, user_id: str, jti: Optional[str], profile: Any, epoch: Optional[int] = None) -> None:
+        if epoch is not None and epoch != self._epoch:
+            return
+        key = (user_id, jti)
+        self._drop(key)
+        self._entries[key] = (profile, time.monotonic() + self.ttl_seconds)
+        self._keys_by_user.setdefault(user_id, set()).add(key)
+        # The profile may have been found by email under a different id
+        profile_id = _field(profile, "id")
+        if profile_id and profile_id != user_id:
+            self._keys_by_user.setdefault(profile_id, set()).add(key)
+        company_id = _field(profile, "company_id")
+        self._company_of[key] = company_id
+        if company_id:
+            self._keys_by_company.setdefault(company_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self._metrics['evictions'] += 1
+
+    def _drop(self, key: CacheKey) -> None:
+        cached = self._entries.pop(key, None)
+        if cached is None:
+            return
+        user_ids = {key[0], _field(cached[0], "id")}
+        for user_id in user_ids:
+            keys = self._keys_by_user.get(user_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_user[user_id]
+        company_id = self._company_of.pop(key, None)
+        if company_id:
+            keys = self._keys_by_company.get(company_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_company[company_id]
+
+    def _invalidate_keys(self, keys) -> None:
+        self._epoch += 1
+        self._metrics['invalidations'] += 1
+        for key in list(keys):
+            self._drop(key)
+
+    def invalidate_user(self, user_id: Optional[str]) -> None:
+        if user_id:
+            self._invalidate_keys(self._keys_by_user.get(user_id, ()))
+
+    def invalidate_users(self, user_ids: Iterable[str]) -> None:
+        keys = {key for user_id in user_ids for key in self._keys_by_user.get(user_id, ())}
+        if keys:
+            self._invalidate_keys(keys)
+
+    def invalidate_company(self, company_id: Optional[str]) -> None:
+        if company_id:
+            self._invalidate_keys(self._keys_by_company.get(company_id, ()))
+
+    def invalidate_companies(self, company_ids: Iterable[str]) -> None:
+        keys = {key for company_id in company_ids for key in self._keys_by_company.get(company_id, ())}
+        if keys:
+            self._invalidate_keys(keys)
+
+    def invalidate_token(self, user_id: str, jti: Optional[str]) -> None:
+        self._invalidate_keys([(user_id, jti)])
+
+    def clear(self) -> None:
+        self._invalidate_keys(list(self._entries))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        lookups = self._metrics['hits'] + self._metrics['misses']
+        return {
+            **self._metrics,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hit_rate': round(self._metrics['hits'] / lookups, 4) if lookups else None
+        }
+
+
+def _field(profile: Any, name: str) -> Optional[str]:
+    if isinstance(profile, dict):
+        return profile.get(name)
+    return getattr(profile, name, None)
+
+
+# Global profile cache instance
+profile_cache = UserProfileCache()
@@ -30,6 +30,7 @@ from app.rbac_models import (
 from app.models import ContentDeleteType, UserRole
 from app.database_service import db_service
 from app.repo import repo
+from app.permission_cache import permission_cache
 
 logger = logging.getLogger(__name__)
 
@@ -154,24 +155,21 @@ class RBACService:
                              target_company_id: Optional[str] = None) -> bool:
         """Check if user has permission for a specific action"""
         try:
-            user = await repo.get_user(user_id)
-            if not user:
+            effective = await permission_cache.get(repo, user_id, company_id)
+            if not effective.user_exists:
                 return False
             
             # Super users have all permissions
-            if user.get("user_type") == UserType.SUPER_USER.value:
+            if effective.user_type == UserType.SUPER_USER.value:
                 return True
             
-            # Get user permissions
-            user_permissions = await self._get_user_permissions(user_id, company_id)
-            
             # Map action to required permission
             required_permission = self._map_action_to_permission(resource_type, action)
             if not required_permission:
                 return False
             
             # Check if user has required permission
-            if required_permission not in user_permissions:
+            if not effective.has_role_permission(required_permission):
                 return False
             
             # Additional checks for cross-company operations
@@ -464,19 +462,8 @@ class RBACService:
     async def _get_user_permissions(self, user_id: str, company_id: Optional[str]) -> Set[Permission]:
         """Get all permissions for a user"""
         try:
-            user_roles = await repo.get_user_roles(user_id)
-            permissions = set()
-            
-            for user_role in user_roles:
-                if company_id and user_role.get("company_id") != company_id:
-                    continue
-                
-                role = await repo.get_role(user_role.get("role_id"))
-                if role and role.get("status") == "active":
-                    role_permissions = role.get("permissions", [])
-                    permissions.update(Permission(p) for p in role_permissions)
-            
-            return permissions
+            effective = await permission_cache.get(repo, user_id, company_id)
+            return {Permission(p) for p in effective.role_permission_names()}
             
         except Exception as e:
             self.logger.error(f"Failed to get user permissions: {e}")
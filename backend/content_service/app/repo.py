@@ -10,6 +10,10 @@ from app.models import (
 )
 from app.rbac_models import Company
 from app.config import settings
+from app.permission_cache import permission_cache
+from app.playlist_cache import SCHEDULE_COUNTER_FIELDS, playlist_cache
+from app.schedule_index import schedule_index
+from app.profile_cache import profile_cache
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +67,7 @@ class InMemoryRepo:
             content_meta = self._store.setdefault("__content_meta__", {})
             meta.id = meta.id or str(len(content_meta) + 1) + "-cm"
             content_meta[meta.id] = meta.model_dump(exclude_none=True)
+            playlist_cache.invalidate_content(meta.id)
             return content_meta[meta.id]
 
     async def get_content_meta(self, _id: str) -> Optional[dict]:
@@ -95,11 +100,17 @@ class InMemoryRepo:
             roles = self._store.setdefault("__roles__", {})
             role.id = role.id or str(len(roles) + 1) + "-r"
             roles[role.id] = role.model_dump(exclude_none=True)
+            permission_cache.invalidate_role(role.id)
+            profile_cache.clear()
             return roles[role.id]
 
     async def get_role(self, _id: str) -> Optional[dict]:
         return self._store.get("__roles__", {}).get(_id)
 
+    async def get_roles_by_ids(self, ids: List[str]) -> Dict[str, Dict]:
+        roles = self._store.get("__roles__", {})
+        return {_id: roles[_id] for _id in ids if _id in roles}
+
     async def list_roles_by_company(self, company_id: str) -> List[Dict]:
         roles = self._store.get("__roles__", {})
         return [role for role in roles.values() if role.get("company_id") == company_id]
@@ -117,6 +128,8 @@ class InMemoryRepo:
         async with self._lock:
             if _id in self._store.get("__roles__", {}):
                 del self._store["__roles__"][_id]
+                permission_cache.invalidate_role(_id)
+                profile_cache.clear()
                 return True
             return False
 
@@ -126,12 +139,18 @@ class InMemoryRepo:
             role_perms = self._store.setdefault("__role_permissions__", {})
             permission.id = permission.id or str(len(role_perms) + 1) + "-rp"
             role_perms[permission.id] = permission.model_dump(exclude_none=True)
+            permission_cache.invalidate_role(permission.role_id)
             return role_perms[permission.id]
 
     async def get_role_permissions(self, role_id: str) -> List[Dict]:
         permissions = self._store.get("__role_permissions__", {})
         return [p for p in permissions.values() if p.get("role_id") == role_id]
 
+    async def get_role_permissions_for_roles(self, role_ids: List[str]) -> List[Dict]:
+        wanted = set(role_ids)
+        permissions = self._store.get("__role_permissions__", {})
+        return [p for p in permissions.values() if p.get("role_id") in wanted]
+
     # moderation related
     async def save_review(self, review: dict) -> dict:
         async with self._lock:
@@ -176,6 +195,7 @@ class InMemoryRepo:
         async with self._lock:
             if _id in self._store.get("__companies__", {}):
                 del self._store["__companies__"][_id]
+                profile_cache.invalidate_company(_id)
                 return True
             return False
 
@@ -185,6 +205,8 @@ class InMemoryRepo:
             users = self._store.setdefault("__users__", {})
             user.id = user.id or str(len(users) + 1) + "-u"
             users[user.id] = user.model_dump(exclude_none=True)
+            permission_cache.invalidate_user(user.id)
+            profile_cache.invalidate_user(user.id)
             return users[user.id]
 
     async def get_user(self, _id: str) -> Optional[dict]:
@@ -204,6 +226,8 @@ class InMemoryRepo:
         async with self._lock:
             if _id in self._store.get("__users__", {}):
                 del self._store["__users__"][_id]
+                permission_cache.invalidate_user(_id)
+                profile_cache.invalidate_user(_id)
                 return True
             return False
 
@@ -213,12 +237,18 @@ class InMemoryRepo:
             user_roles = self._store.setdefault("__user_roles__", {})
             user_role.id = user_role.id or str(len(user_roles) + 1) + "-ur"
             user_roles[user_role.id] = user_role.model_dump(exclude_none=True)
+            permission_cache.invalidate_user(user_role.user_id)
+            profile_cache.invalidate_user(user_role.user_id)
             return user_roles[user_role.id]
 
     async def get_user_roles(self, user_id: str) -> List[Dict]:
         roles = self._store.get("__user_roles__", {})
         return [role for role in roles.values() if role.get("user_id") == user_id]
 
+    async def get_user_role_assignments(self, user_id: str) -> List[Dict]:
+        """Raw user-role documents, without the role/company expansion"""
+        return await self.get_user_roles(user_id)
+
     async def get_user_roles_by_company(self, user_id: str, company_id: str) -> List[Dict]:
         roles = self._store.get("__user_roles__", {})
         return [role for role in roles.values()
@@ -227,38 +257,17 @@ class InMemoryRepo:
     async def delete_user_role(self, _id: str) -> bool:
         async with self._lock:
             if _id in self._store.get("__user_roles__", {}):
-                del self._store["__user_roles__"][_id]
+                removed = self._store["__user_roles__"].pop(_id)
+                permission_cache.invalidate_user(removed.get("user_id"))
+                profile_cache.invalidate_user(removed.get("user_id"))
                 return True
             return False
 
     # Permission checking
     async def check_user_permission(self, user_id: str, company_id: str, screen: str, permission: str) -> bool:
         """Check if user has specific permission for a screen in a company"""
-        user_roles = await self.get_user_roles_by_company(user_id, company_id)
-        if not user_roles:
-            return False
-
-        for user_role in user_roles:
-            role_id = user_role.get("role_id")
-            if not role_id:
-                continue
-                
-            role = await self.get_role(role_id)
-            if not role:
-                continue
-
-            # Check role permissions
-            role_id_from_role = role.get("id")
-            if not role_id_from_role:
-                continue
-                
-            permissions = await self.get_role_permissions(role_id_from_role)
-            for perm in permissions:
-                if (perm.get("screen") == screen and
-                    permission in perm.get("permissions", [])):
-                    return True
-
-        return False
+        effective = await permission_cache.get(self, user_id, company_id)
+        return effective.has_screen_permission(screen, permission)
 
     # Get user profile with expanded information
     async def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
@@ -267,27 +276,16 @@ class InMemoryRepo:
             return None
 
         user_roles = await self.get_user_roles(user_id)
-        companies = []
-
-        for role in user_roles:
-            company_id = role.get("company_id")
-            if company_id:
-                company = await self.get_company(company_id)
-                if company:
-                    companies.append(company)
+        company_store = self._store.get("__companies__", {})
+        companies = [company_store[role["company_id"]] for role in user_roles
+                     if role.get("company_id") in company_store]
 
         # Expand roles with role details
-        expanded_roles = []
-        for user_role in user_roles:
-            role_id = user_role.get("role_id")
-            if role_id:
-                role = await self.get_role(role_id)
-                if role:
-                    expanded_role = {
-                        **user_role,
-                        "role_details": role
-                    }
-                    expanded_roles.append(expanded_role)
+        roles = await self.get_roles_by_ids([r["role_id"] for r in user_roles if r.get("role_id")])
+        expanded_roles = [
+            {**user_role, "role_details": roles[user_role["role_id"]]}
+            for user_role in user_roles if user_role.get("role_id") in roles
+        ]
 
         profile_data = {
             **user,
@@ -346,7 +344,8 @@ class InMemoryRepo:
     async def delete_role_permission(self, _id: str) -> bool:
         async with self._lock:
             if _id in self._store.get("__role_permissions__", {}):
-                del self._store["__role_permissions__"][_id]
+                removed = self._store["__role_permissions__"].pop(_id)
+                permission_cache.invalidate_role(removed.get("role_id"))
                 return True
             return False
 
@@ -411,6 +410,7 @@ class InMemoryRepo:
             screens = self._store.setdefault("__digital_screens__", {})
             screen.id = screen.id or str(len(screens) + 1) + "-ds"
             screens[screen.id] = screen.model_dump(exclude_none=True)
+            playlist_cache.invalidate_device(screen.id)
             return screens[screen.id]
 
     async def get_digital_screen(self, _id: str) -> Optional[dict]:
@@ -469,6 +469,7 @@ class InMemoryRepo:
             if _id in screens:
                 screens[_id].update(updates)
                 screens[_id]["updated_at"] = datetime.utcnow()  # Use datetime object instead of ISO string
+                playlist_cache.invalidate_device(_id, updates)
                 return True
             return False
 
@@ -477,6 +478,7 @@ class InMemoryRepo:
             screens = self._store.get("__digital_screens__", {})
             if _id in screens:
                 del screens[_id]
+                playlist_cache.invalidate_device(_id)
                 return True
             return False
 
@@ -738,6 +740,20 @@ class InMemoryRepo:
                 
             return len(old_heartbeat_ids)
 
+    async def get_device_heartbeat_history(self, device_id: str, start: datetime, end: Optional[datetime] = None,
+                                           granularity: str = "raw") -> List[Dict]:
+        """Heartbeats in [start, end), oldest first; 5m/1h are rolled up from the stored beats"""
+        end = end or datetime.utcnow()
+        heartbeats = [
+            hb for hb in self._store.get("__device_heartbeats__", {}).values()
+            if hb.get("device_id") == device_id and start <= hb.get("timestamp", datetime.min) < end
+        ]
+        heartbeats.sort(key=lambda x: x.get("timestamp", datetime.min))
+        if granularity != "raw":
+            from app.monitoring.heartbeat_series import rollup_heartbeats
+            return rollup_heartbeats(device_id, heartbeats, granularity)
+        return heartbeats
+
     # Enhanced device operations
     async def get_device_with_credentials(self, device_id: str) -> Optional[Dict]:
         """Get device with its credentials and latest heartbeat"""
@@ -836,6 +852,84 @@ class InMemoryRepo:
                 return True
             return False
 
+    # Content Schedule operations
+    async def save_content_schedule(self, schedule: dict) -> dict:
+        async with self._lock:
+            schedules = self._store.setdefault("__content_schedules__", {})
+            schedule["id"] = schedule.get("id") or str(len(schedules) + 1) + "-cs"
+            schedules[schedule["id"]] = schedule
+            schedule_index.add(schedule)
+            schedule_index.mark_written(self._bump_schedule_version())
+            playlist_cache.invalidate_schedule(schedule["id"], schedule.get("device_ids", []))
+            return schedules[schedule["id"]]
+
+    async def get_content_schedule(self, schedule_id: str) -> Optional[dict]:
+        return self._store.get("__content_schedules__", {}).get(schedule_id)
+
+    async def list_content_schedules(self, device_id: Optional[str] = None,
+                                     exclude_statuses: Optional[List[str]] = None) -> List[Dict]:
+        schedules = list(self._store.get("__content_schedules__", {}).values())
+        if device_id:
+            schedules = [s for s in schedules if device_id in s.get("device_ids", [])]
+        if exclude_statuses:
+            schedules = [s for s in schedules if s.get("status") not in exclude_statuses]
+        return schedules
+
+    def _bump_schedule_version(self) -> int:
+        version = self._store.get("__schedule_version__", 0) + 1
+        self._store["__schedule_version__"] = version
+        return version
+
+    async def bump_schedule_version(self) -> int:
+        async with self._lock:
+            return self._bump_schedule_version()
+
+    async def get_schedule_version(self) -> int:
+        return self._store.get("__schedule_version__", 0)
+
+    async def bump_playlist_version(self) -> int:
+        version = self._store.get("__playlist_version__", 0) + 1
+        self._store["__playlist_version__"] = version
+        return version
+
+    async def get_playlist_version(self) -> int:
+        return self._store.get("__playlist_version__", 0)
+
+    async def update_content_schedule(self, schedule_id: str, updates: dict) -> bool:
+        async with self._lock:
+            schedules = self._store.get("__content_schedules__", {})
+            if schedule_id in schedules:
+                previous_devices = schedules[schedule_id].get("device_ids", [])
+                schedules[schedule_id].update(updates)
+                schedule_index.add(schedules[schedule_id])
+                # Proof-of-play counters never change what plays; other workers need not reload
+                if not SCHEDULE_COUNTER_FIELDS.issuperset(updates):
+                    schedule_index.mark_written(self._bump_schedule_version())
+                playlist_cache.invalidate_schedule(
+                    schedule_id, list(previous_devices) + list(updates.get("device_ids", [])), updates
+                )
+                return True
+            return False
+
+    # Content Package operations
+    async def save_content_package(self, package: dict) -> dict:
+        async with self._lock:
+            packages = self._store.setdefault("__content_packages__", {})
+            package["id"] = package.get("id") or str(len(packages) + 1) + "-cp"
+            packages[package["id"]] = package
+            return packages[package["id"]]
+
+    async def get_content_package(self, package_id: str) -> Optional[dict]:
+        return self._store.get("__content_packages__", {}).get(package_id)
+
+    async def update_content_package(self, package_id: str, updates: dict) -> bool:
+        async with self._lock:
+            packages = self._store.get("__content_packages__", {})
+            if package_id in packages:
+                packages[package_id].update(updates)
+                return True
+            return False
+
     # Layout Template operations
     async def save_layout_template(self, template: dict) -> dict:
         async with self._lock:
@@ -972,6 +1066,10 @@ class MongoRepo:
         db_name = parsed_uri.path.lstrip('/') if parsed_uri.path else 'openkiosk'
         self._db = self._client[db_name]
         self._col = self._db["content_metadata"]
+        self._heartbeat_buckets = None
+        if settings.HEARTBEAT_STORAGE_MODE == "buckets":
+            from app.monitoring.heartbeat_series import HeartbeatBucketStore
+            self._heartbeat_buckets = HeartbeatBucketStore(self._db)
 
     async def save(self, meta: ContentMetadata) -> dict:
         data = meta.model_dump(exclude_none=True)
@@ -999,6 +1097,7 @@ class MongoRepo:
             import uuid
             data["id"] = str(uuid.uuid4())
         await self._content_meta_col.replace_one({"id": data["id"]}, data, upsert=True)
+        playlist_cache.invalidate_content(data["id"])
         return data
 
     async def get_content_meta(self, _id: str) -> Optional[dict]:
@@ -1101,11 +1200,17 @@ class MongoRepo:
             import uuid
             data["id"] = str(uuid.uuid4())
         await self._role_col.replace_one({"id": data["id"]}, data, upsert=True)
+        permission_cache.invalidate_role(data["id"])
+        profile_cache.clear()
         return data
 
     async def get_role(self, _id: str) -> Optional[dict]:
         return await self._role_col.find_one({"id": _id})
 
+    async def get_roles_by_ids(self, ids: List[str]) -> Dict[str, Dict]:
+        cursor = self._role_col.find({"id": {"$in": list(ids)}})
+        return {d["id"]: d async for d in cursor}
+
     async def list_roles_by_company(self, company_id: str) -> List[Dict]:
         cursor = self._role_col.find({"company_id": company_id})
         return [d async for d in cursor]
@@ -1120,6 +1225,8 @@ class MongoRepo:
 
     async def delete_role(self, _id: str) -> bool:
         result = await self._role_col.delete_one({"id": _id})
+        permission_cache.invalidate_role(_id)
+        profile_cache.clear()
         return result.deleted_count > 0
 
     # RolePermission operations
@@ -1133,12 +1240,17 @@ class MongoRepo:
             import uuid
             data["id"] = str(uuid.uuid4())
         await self._role_permission_col.replace_one({"id": data["id"]}, data, upsert=True)
+        permission_cache.invalidate_role(data.get("role_id"))
         return data
 
     async def get_role_permissions(self, role_id: str) -> List[Dict]:
         cursor = self._role_permission_col.find({"role_id": role_id})
         return [d async for d in cursor]
 
+    async def get_role_permissions_for_roles(self, role_ids: List[str]) -> List[Dict]:
+        cursor = self._role_permission_col.find({"role_id": {"$in": list(role_ids)}})
+        return [d async for d in cursor]
+
     # moderation related
     @property
     def _rev_col(self):
@@ -1198,7 +1310,10 @@ class MongoRepo:
         doc = await self._company_col.find_one({"_id": _id})
         if not doc:
             return None
-            
+        return self._transform_company(doc)
+
+    @staticmethod
+    def _transform_company(doc: dict) -> dict:
         # Convert ObjectIds to strings
         if _OBJECTID_AVAILABLE and ObjectId is not None:
             doc = {k: str(v) if isinstance(v, ObjectId) else v for k, v in doc.items()}
@@ -1238,6 +1353,7 @@ class MongoRepo:
 
     async def delete_company(self, _id: str) -> bool:
         result = await self._company_col.delete_one({"_id": _id})
+        profile_cache.invalidate_company(_id)
         return result.deleted_count > 0
 
     # User operations
@@ -1251,6 +1367,8 @@ class MongoRepo:
             import uuid
             data["id"] = str(uuid.uuid4())
         await self._user_col.replace_one({"id": data["id"]}, data, upsert=True)
+        permission_cache.invalidate_user(data["id"])
+        profile_cache.invalidate_user(data["id"])
         return data
 
     async def get_user(self, _id: str) -> Optional[dict]:
@@ -1265,6 +1383,8 @@ class MongoRepo:
 
     async def delete_user(self, _id: str) -> bool:
         result = await self._user_col.delete_one({"id": _id})
+        permission_cache.invalidate_user(_id)
+        profile_cache.invalidate_user(_id)
         return result.deleted_count > 0
 
     # UserRole operations
@@ -1278,30 +1398,48 @@ class MongoRepo:
             import uuid
             data["id"] = str(uuid.uuid4())
         await self._user_role_col.replace_one({"id": data["id"]}, data, upsert=True)
+        permission_cache.invalidate_user(data.get("user_id"))
+        profile_cache.invalidate_user(data.get("user_id"))
         return data
 
     async def get_user_roles(self, user_id: str) -> List[Dict]:
-        cursor = self._user_role_col.find({"user_id": user_id})
+        assignments = [d async for d in self._user_role_col.find({"user_id": user_id})]
+
+        # Fetch all referenced roles and companies with one $in query each
+        role_ids = list({a["role_id"] for a in assignments if a.get("role_id")})
+        company_ids = list({a["company_id"] for a in assignments
+                            if a.get("company_id") and a.get("company_id") != "global"})
+        roles = []
+        if role_ids:
+            roles = [d async for d in self._role_col.find({"id": {"$in": role_ids}})]
+        companies = []
+        if company_ids:
+            companies = [d async for d in self._company_col.find({"_id": {"$in": company_ids}})]
+
+        return self._expand_user_roles(assignments, roles, companies)
+
+    def _expand_user_roles(self, assignments: List[Dict], roles: List[Dict],
+                           companies: List[Dict]) -> List[Dict]:
+        """Attach role and company details to raw user-role documents"""
+        roles_by_id = {role.get("id"): role for role in roles}
+        companies_by_id = {company.get("_id"): self._transform_company(company) for company in companies}
+
         user_roles = []
-        async for user_role_data in cursor:
+        for user_role_data in assignments:
             role_id = user_role_data.get("role_id")
             company_id = user_role_data.get("company_id")
             
             # Get role details
-            role = None
-            if role_id:
-                role = await self.get_role(role_id)
+            role = roles_by_id.get(role_id) if role_id else None
             
             # Get company details
             company = None
             if company_id and company_id != "global":
-                company = await self.get_company(company_id)
+                company = companies_by_id.get(company_id)
             
-            # Convert ObjectIds to strings in role and company data
+            # Convert ObjectIds to strings in role data
             if role and _OBJECTID_AVAILABLE and ObjectId is not None:
                 role = {k: str(v) if isinstance(v, ObjectId) else v for k, v in role.items()}
-            if company and _OBJECTID_AVAILABLE and ObjectId is not None:
-                company = {k: str(v) if isinstance(v, ObjectId) else v for k, v in company.items()}
             
             # Expand user role with details
             expanded_role = {
@@ -1320,61 +1458,54 @@ class MongoRepo:
         cursor = self._user_role_col.find({"user_id": user_id, "company_id": company_id})
         return [d async for d in cursor]
 
+    async def get_user_role_assignments(self, user_id: str) -> List[Dict]:
+        """Raw user-role documents, without the per-row role/company lookups"""
+        cursor = self._user_role_col.find({"user_id": user_id})
+        return [d async for d in cursor]
+
     async def delete_user_role(self, _id: str) -> bool:
-        result = await self._user_role_col.delete_one({"id": _id})
-        return result.deleted_count > 0
+        result = await self._user_role_col.find_one_and_delete({"id": _id})
+        if result:
+            permission_cache.invalidate_user(result.get("user_id"))
+            profile_cache.invalidate_user(result.get("user_id"))
+        return result is not None
 
     # Permission checking
     async def check_user_permission(self, user_id: str, company_id: str, screen: str, permission: str) -> bool:
         """Check if user has specific permission for a screen in a company"""
-        user_roles = await self.get_user_roles_by_company(user_id, company_id)
-        if not user_roles:
-            return False
-
-        for user_role in user_roles:
-            role_id = user_role.get("role_id")
-            if not role_id:
-                continue
-                
-            role = await self.get_role(role_id)
-            if not role:
-                continue
-
-            # Check role permissions
-            role_id_from_role = role.get("id")
-            if not role_id_from_role:
-                continue
-                
-            permissions = await self.get_role_permissions(role_id_from_role)
-            for perm in permissions:
-                if (perm.get("screen") == screen and
-                    permission in perm.get("permissions", [])):
-                    return True
-
-        return False
+        effective = await permission_cache.get(self, user_id, company_id)
+        return effective.has_screen_permission(screen, permission)
 
     # Get user profile with expanded information
     async def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
-        user = await self.get_user(user_id)
-        if not user:
+        # User, role assignments, roles and companies in one round trip
+        cursor = self._user_col.aggregate([
+            {"$match": {"id": user_id}},
+            {"$limit": 1},
+            {"$lookup": {"from": "user_roles", "localField": "id",
+                         "foreignField": "user_id", "as": "_user_roles"}},
+            {"$lookup": {"from": "roles", "localField": "_user_roles.role_id",
+                         "foreignField": "id", "as": "_roles"}},
+            {"$lookup": {"from": "companies", "localField": "_user_roles.company_id",
+                         "foreignField": "_id", "as": "_companies"}},
+        ])
+        docs = await cursor.to_list(length=1)
+        if not docs:
             return None
+        user = docs[0]
+        assignments = user.pop("_user_roles")
+        company_docs = user.pop("_companies")
+        user_roles = self._expand_user_roles(assignments, user.pop("_roles"), company_docs)
 
         # Convert ObjectIds in user data
         if _OBJECTID_AVAILABLE and ObjectId is not None:
             user = {k: str(v) if isinstance(v, ObjectId) else v for k, v in user.items()}
 
-        user_roles = await self.get_user_roles(user_id)
-        companies = []
-
-        for role in user_roles:
-            company_id = role.get("company_id")
-            if company_id and company_id != "global":
-                company = await self.get_company(company_id)
-                if company:
-                    # Convert ObjectIds in company data
-                    if _OBJECTID_AVAILABLE and ObjectId is not None:
-                        company = {k: str(v) if isinstance(v, ObjectId) else v for k, v in company.items()}
-                    companies.append(company)
+        companies_by_id = {company.get("_id"): self._transform_company(company) for company in company_docs}
+        companies = [
+            companies_by_id[assignment["company_id"]] for assignment in assignments
+            if assignment.get("company_id") != "global" and assignment.get("company_id") in companies_by_id
+        ]
 
         profile_data = {
             **user,
@@ -1502,6 +1633,7 @@ class MongoRepo:
             import uuid
             data["id"] = str(uuid.uuid4())
         await self._digital_screen_col.replace_one({"id": data["id"]}, data, upsert=True)
+        playlist_cache.invalidate_device(data["id"])
         return data
 
     async def get_digital_screen(self, _id: str) -> Optional[dict]:
@@ -1566,10 +1698,12 @@ class MongoRepo:
             {"id": _id},
             {"$set": updates}
         )
+        playlist_cache.invalidate_device(_id, updates)
         return result.modified_count > 0
 
     async def delete_digital_screen(self, _id: str) -> bool:
         result = await self._digital_screen_col.delete_one({"id": _id})
+        playlist_cache.invalidate_device(_id)
         return result.deleted_count > 0
 
     # ContentOverlay operations
@@ -1724,6 +1858,104 @@ class MongoRepo:
         )
         return result.modified_count > 0
 
+    # Content Schedule operations
+    @property
+    def _content_schedule_col(self):
+        return self._db["content_schedules"]
+
+    async def save_content_schedule(self, schedule: dict) -> dict:
+        if not schedule.get("id"):
+            import uuid
+            schedule["id"] = str(uuid.uuid4())
+        await self._content_schedule_col.replace_one({"id": schedule["id"]}, schedule, upsert=True)
+        schedule_index.add(schedule)
+        schedule_index.mark_written(await self.bump_schedule_version())
+        playlist_cache.invalidate_schedule(schedule["id"], schedule.get("device_ids", []))
+        return schedule
+
+    async def get_content_schedule(self, schedule_id: str) -> Optional[dict]:
+        return await self._content_schedule_col.find_one({"id": schedule_id}, {"_id": 0})
+
+    async def list_content_schedules(self, device_id: Optional[str] = None,
+                                     exclude_statuses: Optional[List[str]] = None) -> List[Dict]:
+        query = {}
+        if device_id:
+            query["device_ids"] = device_id
+        if exclude_statuses:
+            query["status"] = {"$nin": list(exclude_statuses)}
+        cursor = self._content_schedule_col.find(query, {"_id": 0, "deployment_history": 0})
+        return [d async for d in cursor]
+
+    async def bump_schedule_version(self) -> int:
+        """Advance the version other workers compare their schedule index against"""
+        counter = await self._db["counters"].find_one_and_update(
+            {"_id": "content_schedules"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=True  # pymongo ReturnDocument.AFTER
+        )
+        return counter["version"]
+
+    async def get_schedule_version(self) -> int:
+        counter = await self._db["counters"].find_one({"_id": "content_schedules"})
+        return counter.get("version", 0) if counter else 0
+
+    async def bump_playlist_version(self) -> int:
+        """Advance the version other workers compare their playlist cache against"""
+        counter = await self._db["counters"].find_one_and_update(
+            {"_id": "playlists"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=True  # pymongo ReturnDocument.AFTER
+        )
+        return counter["version"]
+
+    async def get_playlist_version(self) -> int:
+        counter = await self._db["counters"].find_one({"_id": "playlists"})
+        return counter.get("version", 0) if counter else 0
+
+    async def update_content_schedule(self, schedule_id: str, updates: dict) -> bool:
+        result = await self._content_schedule_col.update_one(
+            {"id": schedule_id},
+            {"$set": updates}
+        )
+        indexed = schedule_index.get(schedule_id)
+        if indexed is not None:
+            schedule_index.update(schedule_id, updates)
+        elif "status" in updates:
+            # A closed schedule may have been reopened
+            reopened = await self.get_content_schedule(schedule_id)
+            if reopened:
+                schedule_index.add(reopened)
+        # Proof-of-play counters never change what plays; other workers need not reload
+        if not SCHEDULE_COUNTER_FIELDS.issuperset(updates):
+            schedule_index.mark_written(await self.bump_schedule_version())
+        device_ids = list(indexed.get("device_ids", [])) if indexed else []
+        playlist_cache.invalidate_schedule(schedule_id, device_ids + list(updates.get("device_ids", [])), updates)
+        return result.modified_count > 0
+
+    # Content Package operations
+    @property
+    def _content_package_col(self):
+        return self._db["content_packages"]
+
+    async def save_content_package(self, package: dict) -> dict:
+        if not package.get("id"):
+            import uuid
+            package["id"] = str(uuid.uuid4())
+        await self._content_package_col.replace_one({"id": package["id"]}, package, upsert=True)
+        return package
+
+    async def get_content_package(self, package_id: str) -> Optional[dict]:
+        return await self._content_package_col.find_one({"id": package_id}, {"_id": 0})
+
+    async def update_content_package(self, package_id: str, updates: dict) -> bool:
+        result = await self._content_package_col.update_one(
+            {"id": package_id},
+            {"$set": updates}
+        )
+        return result.modified_count > 0
+
     # Layout Template operations
     @property
     def _layout_template_col(self):
@@ -1816,10 +2048,15 @@ class MongoRepo:
         if not data.get("id"):
             import uuid
             data["id"] = str(uuid.uuid4())
+        if self._heartbeat_buckets:
+            await self._heartbeat_buckets.save_many([data])
+            return data
         await self._device_heartbeat_col.replace_one({"id": data["id"]}, data, upsert=True)
         return data
 
     async def get_latest_heartbeat(self, device_id: str) -> Optional[dict]:
+        if self._heartbeat_buckets:
+            return await self._heartbeat_buckets.latest(device_id)
         cursor = self._device_heartbeat_col.find({"device_id": device_id}).sort("timestamp", -1).limit(1)
         async for doc in cursor:
             # Convert ObjectIds to strings
@@ -1829,6 +2066,8 @@ class MongoRepo:
         return None
 
     async def get_device_heartbeats(self, device_id: str, limit: int = 100) -> List[Dict]:
+        if self._heartbeat_buckets:
+            return await self._heartbeat_buckets.recent(device_id, limit)
         cursor = self._device_heartbeat_col.find({"device_id": device_id}).sort("timestamp", -1).limit(limit)
         heartbeats = []
         async for doc in cursor:
@@ -1841,12 +2080,32 @@ class MongoRepo:
     async def cleanup_old_heartbeats(self, older_than_hours: int = 24) -> int:
         """Clean up heartbeats older than specified hours"""
         cutoff_time = datetime.utcnow() - timedelta(hours=older_than_hours)
+        if self._heartbeat_buckets:
+            return await self._heartbeat_buckets.delete_older_than(cutoff_time)
         
         result = await self._device_heartbeat_col.delete_many({
             "timestamp": {"$lt": cutoff_time}
         })
         return result.deleted_count
 
+    async def get_device_heartbeat_history(self, device_id: str, start: datetime, end: Optional[datetime] = None,
+                                           granularity: str = "raw") -> List[Dict]:
+        """Heartbeats in [start, end), oldest first, raw or as 5m/1h rollups"""
+        if self._heartbeat_buckets:
+            return await self._heartbeat_buckets.history(device_id, start, end, granularity)
+        end = end or datetime.utcnow()
+        if granularity != "raw":
+            # Per-beat documents: group them the way the bucket store's rollups are
+            from app.monitoring.heartbeat_series import heartbeat_rollup_pipeline, rows_from_pipeline
+            groups = await self._device_heartbeat_col.aggregate(
+                heartbeat_rollup_pipeline(device_id, start, end, granularity)
+            ).to_list(length=None)
+            return rows_from_pipeline(device_id, granularity, groups)
+        cursor = self._device_heartbeat_col.find(
+            {"device_id": device_id, "timestamp": {"$gte": start, "$lt": end}}, {"_id": 0}
+        ).sort("timestamp", 1)
+        return await cursor.to_list(length=None)
+
     # Enhanced device operations
     async def get_device_with_credentials(self, device_id: str) -> Optional[Dict]:
         """Get device with its credentials and latest heartbeat"""
@@ -2147,3 +2406,5 @@ def initialize_repository():
 
 # Initialize repository on import
 persistence_enabled = initialize_repository()
+# Content and device invalidations reach other workers through the repository
+playlist_cache.version_store = repo
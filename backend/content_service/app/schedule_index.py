@@ -0,0 +1,461 @@
+"""
+In-memory interval index over content schedules, one tree per device.
+
+Schedules are persisted in ``content_schedules``. This index mirrors them so
+"which schedules are active for device d at t" and "which existing schedules
+overlap a new one on any of its N devices" do not scan the collection. Each
+device has an interval tree (a treap keyed by start time, with the maximum end
+time of every subtree kept on its root), so both queries are O(log n + k) per
+device.
+
+A schedule's outer window is ``start_date``/``end_date``. Documents written by
+the bulk scheduling endpoint use ``scheduled_start``/``scheduled_end`` instead.
+If a schedule has ``time_slots``, it is active only inside them. Slots are
+merged into disjoint sorted runs once per schedule and shared by all its
+devices, so checking them is a bisect.
+
+The repository keeps the index in step with its writes. ``load`` rebuilds the
+whole index from the repository at startup, building each device's tree from
+sorted intervals in linear time.
+
+Each worker has its own index, so every schedule write also bumps a schedule
+version stored with the schedules. ``sync`` compares that version with the one
+the index was built from (at most once per ``SCHEDULE_INDEX_REFRESH_SECONDS``)
+and reloads when another worker has written since.
+"""
+
+import logging
+import random
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Schedules in these states never play and never conflict
+CLOSED_STATUSES = frozenset({"rejected", "cancelled", "canceled", "completed", "expired", "deleted", "failed"})
+# Schedules that reserve their slot but do not play yet
+UNAPPROVED_STATUSES = frozenset({"pending_approval", "draft"})
+
+OPEN_ENDED = datetime.max
+
+
+def _as_datetime(value: Any) -> Optional[datetime]:
+    """Naive UTC datetime from a datetime or ISO string; None if missing or unparsable"""
+    if value is None or value == "":
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def schedule_window(schedule: Dict[str, Any]) -> Tuple[Optional[datetime], datetime]:
+    """Outer (start, end) of a schedule in either document shape"""
+    start = _as_datetime(schedule.get("start_date") or schedule.get("scheduled_start") or schedule.get("created_at"))
+    end = _as_datetime(schedule.get("end_date") or schedule.get("scheduled_end") or schedule.get("recurrence_end_date"))
+    return start, end or OPEN_ENDED
+
+
+def _merged_slots(schedule: Dict[str, Any], start: datetime, end: datetime) -> Optional[Tuple[List[datetime], List[datetime]]]:
+    """Disjoint, sorted (starts, ends) of the schedule's time slots clipped to its window"""
+    slots = []
+    for slot in schedule.get("time_slots") or ():
+        slot_start = _as_datetime(slot.get("start_time") if isinstance(slot, dict) else getattr(slot, "start_time", None))
+        slot_end = _as_datetime(slot.get("end_time") if isinstance(slot, dict) else getattr(slot, "end_time", None))
+        if slot_start is None or slot_end is None:
+            continue
+        slot_start, slot_end = max(slot_start, start), min(slot_end, end)
+        if slot_start < slot_end:
+            slots.append((slot_start, slot_end))
+    if not slots:
+        return None
+    slots.sort()
+    starts, ends = [slots[0][0]], [slots[0][1]]
+    for slot_start, slot_end in slots[1:]:
+        if slot_start <= ends[-1]:
+            ends[-1] = max(ends[-1], slot_end)
+        else:
+            starts.append(slot_start)
+            ends.append(slot_end)
+    return starts, ends
+
+
+class IndexedSchedule:
+    """A schedule document with its parsed window and merged time slots"""
+
+    __slots__ = ("id", "document", "start", "end", "slots", "status", "content_id", "device_ids")
+
+    def __init__(self, document: Dict[str, Any], start: datetime, end: datetime):
+        self.id = document["id"]
+        self.document = document
+        self.start = start
+        self.end = end
+        self.slots = _merged_slots(document, start, end)
+        self.status = document.get("status") or "active"
+        self.content_id = document.get("content_id")
+        self.device_ids = tuple(dict.fromkeys(document.get("device_ids") or ()))
+
+    @property
+    def playable(self) -> bool:
+        return self.status not in CLOSED_STATUSES and self.status not in UNAPPROVED_STATUSES
+
+    def active_at(self, when: datetime) -> bool:
+        if self.slots is None:
+            return True
+        starts, ends = self.slots
+        i = bisect_right(starts, when) - 1
+        return i >= 0 and when < ends[i]
+
+    def active_during(self, start: datetime, end: datetime) -> bool:
+        if self.slots is None:
+            return True
+        starts, ends = self.slots
+        i = bisect_right(starts, start) - 1
+        if i >= 0 and ends[i] > start:
+            return True
+        return i + 1 < len(starts) and starts[i + 1] < end
+
+    def shares_slot_with(self, other: "IndexedSchedule") -> bool:
+        """True if both schedules are active at some common instant"""
+        start, end = max(self.start, other.start), min(self.end, other.end)
+        if start >= end:
+            return False
+        if self.slots is None and other.slots is None:
+            return True
+        if self.slots is None:
+            return other.active_during(start, end)
+        if other.slots is None:
+            return self.active_during(start, end)
+        a_starts, a_ends = self.slots
+        b_starts, b_ends = other.slots
+        i = j = 0
+        while i < len(a_starts) and j < len(b_starts):
+            if a_starts[i] < b_ends[j] and b_starts[j] < a_ends[i]:
+                return True
+            if a_ends[i] <= b_ends[j]:
+                i += 1
+            else:
+                j += 1
+        return False
+
+
+class _Node:
+    __slots__ = ("key", "end", "max_end", "priority", "left", "right", "entry")
+
+    def __init__(self, entry: IndexedSchedule, priority: float):
+        self.key = (entry.start, entry.end, entry.id)
+        self.end = entry.end
+        self.max_end = entry.end
+        self.priority = priority
+        self.left: Optional["_Node"] = None
+        self.right: Optional["_Node"] = None
+        self.entry = entry
+
+
+def _update(node: _Node) -> _Node:
+    node.max_end = node.end
+    if node.left is not None and node.left.max_end > node.max_end:
+        node.max_end = node.left.max_end
+    if node.right is not None and node.right.max_end > node.max_end:
+        node.max_end = node.right.max_end
+    return node
+
+
+def _split(node: Optional[_Node], key) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Split into nodes with key < ``key`` and nodes with key >= ``key``"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        return _update(node), right
+    left, node.left = _split(node.left, key)
+    return left, _update(node)
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+class IntervalTree:
+    """Treap of schedule intervals augmented with subtree maximum end times"""
+
+    def __init__(self):
+        self.root: Optional[_Node] = None
+        self.size = 0
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[IndexedSchedule]) -> "IntervalTree":
+        """Build a balanced tree in O(n) (plus the sort) without per-item inserts"""
+        ordered = sorted(entries, key=lambda entry: (entry.start, entry.end, entry.id))
+        tree = cls()
+        tree.size = len(ordered)
+        # Priorities shrink with depth so later inserts keep the heap property
+        priorities = sorted((random.random() for _ in ordered), reverse=True)
+        nodes = [_Node(entry, 0.0) for entry in ordered]
+
+        queue = [(0, len(nodes), None, False)] if nodes else []
+        position = 0
+        while position < len(queue):
+            low, high, parent, is_left = queue[position]
+            mid = (low + high) // 2
+            node = nodes[mid]
+            node.priority = priorities[position]
+            if parent is None:
+                tree.root = node
+            elif is_left:
+                parent.left = node
+            else:
+                parent.right = node
+            if low < mid:
+                queue.append((low, mid, node, True))
+            if mid + 1 < high:
+                queue.append((mid + 1, high, node, False))
+            position += 1
+        for low, high, _, _ in reversed(queue):
+            _update(nodes[(low + high) // 2])
+        return tree
+
+    def __len__(self) -> int:
+        return self.size
+
+    def insert(self, entry: IndexedSchedule) -> None:
+        node = _Node(entry, random.random())
+        left, right = _split(self.root, node.key)
+        self.root = _merge(_merge(left, node), right)
+        self.size += 1
+
+    def remove(self, entry: IndexedSchedule) -> bool:
+        key = (entry.start, entry.end, entry.id)
+        left, rest = _split(self.root, key)
+        middle, right = _split(rest, (entry.start, entry.end, entry.id + "\0"))
+        removed = middle is not None
+        if removed:
+            self.size -= 1
+        self.root = _merge(left, right)
+        return removed
+
+    def stab(self, when: datetime) -> List[IndexedSchedule]:
+        """Entries whose interval contains ``when``"""
+        found: List[IndexedSchedule] = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.max_end <= when:
+                continue
+            stack.append(node.left)
+            if node.key[0] <= when:
+                if when < node.end:
+                    found.append(node.entry)
+                stack.append(node.right)
+        return found
+
+    def overlapping(self, start: datetime, end: datetime) -> List[IndexedSchedule]:
+        """Entries whose interval intersects [start, end)"""
+        found: List[IndexedSchedule] = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.max_end <= start:
+                continue
+            stack.append(node.left)
+            if node.key[0] < end:
+                if node.end > start:
+                    found.append(node.entry)
+                stack.append(node.right)
+        return found
+
+
+class ScheduleIndex:
+    """Per-device interval trees over all open content schedules"""
+
+    def __init__(self, refresh_seconds: Optional[float] = None):
+        self._trees: Dict[str, IntervalTree] = {}
+        self._schedules: Dict[str, IndexedSchedule] = {}
+        self.loaded = False
+        # Repository schedule version this index reflects
+        self.version = 0
+        self.refresh_seconds = (settings.SCHEDULE_INDEX_REFRESH_SECONDS
+                                if refresh_seconds is None else refresh_seconds)
+        self._checked_at = 0.0
+        self._metrics = {
+            'schedules_added': 0,
+            'schedules_removed': 0,
+            'active_queries': 0,
+            'overlap_queries': 0,
+            'rebuilds': 0,
+            'last_rebuild_schedules': 0,
+            'version_checks': 0,
+            'stale_reloads': 0
+        }
+
+    @staticmethod
+    def _entry(schedule: Dict[str, Any]) -> Optional[IndexedSchedule]:
+        if not schedule.get("id"):
+            return None
+        start, end = schedule_window(schedule)
+        if start is None or start >= end:
+            return None
+        return IndexedSchedule(schedule, start, end)
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def add(self, schedule: Dict[str, Any]) -> bool:
+        """Index (or re-index) a schedule document; closed schedules are dropped"""
+        if schedule.get("id"):
+            self.remove(schedule["id"])
+        entry = self._entry(schedule)
+        if entry is None or entry.status in CLOSED_STATUSES:
+            return False
+        self._schedules[entry.id] = entry
+        for device_id in entry.device_ids:
+            tree = self._trees.get(device_id)
+            if tree is None:
+                tree = self._trees[device_id] = IntervalTree()
+            tree.insert(entry)
+        self._metrics['schedules_added'] += 1
+        return True
+
+    def update(self, schedule_id: str, updates: Dict[str, Any]) -> bool:
+        entry = self._schedules.get(schedule_id)
+        if entry is None:
+            return False
+        return self.add({**entry.document, **updates})
+
+    def remove(self, schedule_id: str) -> bool:
+        entry = self._schedules.pop(schedule_id, None)
+        if entry is None:
+            return False
+        for device_id in entry.device_ids:
+            tree = self._trees.get(device_id)
+            if tree is not None:
+                tree.remove(entry)
+                if not len(tree):
+                    del self._trees[device_id]
+        self._metrics['schedules_removed'] += 1
+        return True
+
+    def rebuild(self, schedules: Iterable[Dict[str, Any]]) -> int:
+        """Replace the index contents with ``schedules``; returns the number indexed"""
+        entries: Dict[str, IndexedSchedule] = {}
+        by_device: Dict[str, List[IndexedSchedule]] = {}
+        for schedule in schedules:
+            entry = self._entry(schedule)
+            if entry is None or entry.status in CLOSED_STATUSES:
+                continue
+            entries[entry.id] = entry
+        for entry in entries.values():
+            for device_id in entry.device_ids:
+                by_device.setdefault(device_id, []).append(entry)
+        self._schedules = entries
+        self._trees = {device_id: IntervalTree.from_entries(items) for device_id, items in by_device.items()}
+        self.loaded = True
+        self._metrics['rebuilds'] += 1
+        self._metrics['last_rebuild_schedules'] = len(entries)
+        return len(entries)
+
+    async def load(self, repo) -> int:
+        """Rebuild from the repository's open schedules"""
+        # Read the version first so a write racing the listing triggers another reload
+        version = await repo.get_schedule_version()
+        schedules = await repo.list_content_schedules(exclude_statuses=sorted(CLOSED_STATUSES))
+        count = self.rebuild(schedules)
+        self.version = version
+        self._checked_at = time.monotonic()
+        logger.info(f"Schedule index rebuilt: {count} schedules across {len(self._trees)} devices")
+        return count
+
+    async def sync(self, repo) -> bool:
+        """Load, or reload if schedules were written elsewhere since the last load; True if rebuilt"""
+        if not self.loaded:
+            await self.load(repo)
+            return True
+        now = time.monotonic()
+        if now - self._checked_at < self.refresh_seconds:
+            return False
+        self._checked_at = now
+        self._metrics['version_checks'] += 1
+        if await repo.get_schedule_version() == self.version:
+            return False
+        self._metrics['stale_reloads'] += 1
+        await self.load(repo)
+        return True
+
+    def mark_written(self, version: int) -> None:
+        """Record a repository write this index has already applied
+
+        Only a version directly after ours can be ours alone; a gap means
+        another worker wrote too, so the next ``sync`` reloads.
+        """
+        if version == self.version + 1:
+            self.version = version
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def get(self, schedule_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._schedules.get(schedule_id)
+        return entry.document if entry is not None else None
+
+    def active_for_device(self, device_id: str, start: datetime, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Playable schedules for a device at ``start``, or at any point in [start, end)"""
+        self._metrics['active_queries'] += 1
+        tree = self._trees.get(device_id)
+        if tree is None:
+            return []
+        start = _as_datetime(start)
+        if end is None:
+            return [entry.document for entry in tree.stab(start) if entry.playable and entry.active_at(start)]
+        end = _as_datetime(end)
+        return [entry.document for entry in tree.overlapping(start, end)
+                if entry.playable and entry.active_during(start, end)]
+
+    def overlapping(self, schedule: Dict[str, Any], device_ids: Optional[Iterable[str]] = None
+                    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Existing schedules sharing a slot with ``schedule``, per targeted device"""
+        candidate = self._entry({**schedule, "id": schedule.get("id") or "\0candidate"})
+        if candidate is None:
+            return {}
+        found: Dict[str, List[Dict[str, Any]]] = {}
+        for device_id in device_ids if device_ids is not None else candidate.device_ids:
+            self._metrics['overlap_queries'] += 1
+            tree = self._trees.get(device_id)
+            if tree is None:
+                continue
+            matches = [entry.document for entry in tree.overlapping(candidate.start, candidate.end)
+                       if entry.id != candidate.id and entry.shares_slot_with(candidate)]
+            if matches:
+                found[device_id] = matches
+        return found
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self._metrics,
+            'schedules': len(self._schedules),
+            'devices': len(self._trees),
+            'intervals': sum(len(tree) for tree in self._trees.values()),
+            'loaded': self.loaded,
+            'version': self.version
+        }
+
+
+# Global schedule index instance
+schedule_index = ScheduleIndex()
@@ -19,13 +19,34 @@ except ImportError as e:
     import logging
     logger = logging.getLogger(__name__)
     logger.warning(f"Content scanner not available due to missing dependencies: {e}")
+    _scanner_import_error = str(e)
     
     class MockContentScanner:
         async def scan_content(self, content, filename, content_type):
             return type('MockResult', (), {
                 'security_level': 'unknown',
-                'scan_errors': [f'Content scanner unavailable: {e}']
+                'scan_errors': [f'Content scanner unavailable: {_scanner_import_error}']
             })()
+
+        def begin_stream_scan(self, filename, content_type):
+            import hashlib
+            scanner = self
+
+            class MockStreamScan:
+                should_stop = False
+
+                def __init__(self):
+                    self._hasher = hashlib.sha256()
+
+                def update(self, chunk):
+                    self._hasher.update(chunk)
+
+                async def finalize(self):
+                    result = await scanner.scan_content(b'', filename, content_type)
+                    result.file_hash = self._hasher.hexdigest()
+                    return result
+
+            return MockStreamScan()
     
     content_scanner = MockContentScanner()
 
@@ -0,0 +1,539 @@
+"""
+Append-only, hash-chained audit log in rotating segment files.
+
+``AuditLogger`` hands each entry to ``AuditLogStore.submit``, which only puts
+it on a ``queue.SimpleQueue`` and returns. A background writer thread takes
+entries off the queue in batches, waiting ``AUDIT_LOG_FLUSH_INTERVAL_MS``
+after the first entry of a batch so later ones can join it. It serializes each entry once, chains it
+to the previous entry and appends one JSON line per entry to the current
+segment, with one write and one fsync per batch.
+
+Each line ends with ``"checksum"``: the SHA-256 of the previous line's
+checksum followed by the line's own JSON without the checksum. The first
+line of the log chains from ``GENESIS_HASH``. Editing, removing or
+reordering any line breaks the chain from that point on; ``verify`` reports
+where.
+
+Each segment directory has a single writer. A store claims its own
+``writer-<n>`` directory under ``AUDIT_LOG_DIR`` by taking an exclusive lock
+on its ``writer.lock``, so every uvicorn worker appends to its own segments
+and keeps its own chain, and recovery never truncates another process's
+lines. A restarted worker reclaims the first free directory and continues
+that chain. Queries and ``verify`` read every writer directory.
+
+Layout under each writer directory:
+
+- ``<sequence>.jsonl``: a segment. A new one is started once the current
+  one reaches ``AUDIT_LOG_SEGMENT_BYTES``.
+- ``<sequence>.idx.json``: the sidecar index of a sealed segment. For each
+  user_id and ip_address it lists the time buckets
+  (``AUDIT_INDEX_BUCKET_SECONDS`` wide) the segment has entries in, plus
+  the segment's first and last timestamps and final checksum.
+
+Queries use the indexes to pick the segments that can hold matching
+entries, then read only those. The index of the open segment is kept in
+memory and rebuilt from the segment on startup. Segments whose newest entry
+is older than ``DATA_RETENTION_DAYS`` are deleted when a segment is sealed.
+"""
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+GENESIS_HASH = "0" * 64
+SEGMENT_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx.json"
+ANCHOR_FILE = "chain-anchor.json"
+WRITER_PREFIX = "writer-"
+LOCK_FILE = "writer.lock"
+MAX_BATCH = 5000
+
+# Every line ends with ,"checksum":"<64 hex>"}
+_CHECKSUM_PREFIX = ',"checksum":"'
+_CHECKSUM_SUFFIX_LENGTH = len(_CHECKSUM_PREFIX) + 64 + 2
+
+_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=str).encode
+
+
+def to_epoch(value: datetime) -> float:
+    """Seconds since the epoch; naive datetimes are taken as UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _try_lock(lock_file) -> bool:
+    """Take a non-blocking exclusive lock, held until the file is closed"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def chain_line(previous_hash: str, entry: Dict[str, Any]) -> Tuple[str, str]:
+    """(checksum, line) of an entry chained to ``previous_hash``"""
+    payload = _encode(entry)
+    checksum = hashlib.sha256((previous_hash + payload).encode("utf-8")).hexdigest()
+    return checksum, f'{payload[:-1]}{_CHECKSUM_PREFIX}{checksum}"}}\n'
+
+
+def split_line(line: str) -> Tuple[str, str]:
+    """(payload without the checksum, checksum) of a stored line"""
+    line = line.rstrip("\n")
+    cut = len(line) - _CHECKSUM_SUFFIX_LENGTH
+    if cut <= 0 or not line.startswith(_CHECKSUM_PREFIX, cut):
+        raise ValueError("Audit line has no checksum")
+    return line[:cut] + "}", line[cut + len(_CHECKSUM_PREFIX):-2]
+
+
+class SegmentIndex:
+    """Which time buckets one segment has entries in, per user and per IP"""
+
+    __slots__ = ("sequence", "previous_hash", "first_ts", "last_ts", "entries", "last_hash", "users", "ips")
+
+    def __init__(self, sequence: int, previous_hash: str = GENESIS_HASH):
+        self.sequence = sequence
+        # Checksum the segment's first line chains from
+        self.previous_hash = previous_hash
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.entries = 0
+        self.last_hash = previous_hash
+        self.users: Dict[str, Set[int]] = {}
+        self.ips: Dict[str, Set[int]] = {}
+
+    def add(self, ts: float, bucket: int, user_id: Optional[str], ip_address: Optional[str], checksum: str) -> None:
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+        self.entries += 1
+        self.last_hash = checksum
+        if user_id:
+            self.users.setdefault(user_id, set()).add(bucket)
+        if ip_address:
+            self.ips.setdefault(ip_address, set()).add(bucket)
+
+    def may_contain(self, key: str, value: str, first_bucket: int, last_bucket: int) -> bool:
+        buckets = (self.users if key == "user_id" else self.ips).get(value)
+        return bool(buckets) and any(first_bucket <= bucket <= last_bucket for bucket in buckets)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "previous_hash": self.previous_hash,
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "entries": self.entries,
+            "last_hash": self.last_hash,
+            "users": {key: sorted(buckets) for key, buckets in self.users.items()},
+            "ips": {key: sorted(buckets) for key, buckets in self.ips.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, sequence: int, data: Dict[str, Any]) -> "SegmentIndex":
+        index = cls(sequence, data["previous_hash"])
+        index.first_ts = data["first_ts"]
+        index.last_ts = data["last_ts"]
+        index.entries = data["entries"]
+        index.last_hash = data["last_hash"]
+        index.users = {key: set(buckets) for key, buckets in data["users"].items()}
+        index.ips = {key: set(buckets) for key, buckets in data["ips"].items()}
+        return index
+
+
+class AuditLogStore:
+    """Segment files, sidecar indexes and the background writer behind ``AuditLogger``"""
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024, bucket_seconds: int = 3600,
+                 retention_days: Optional[int] = None, flush_interval: float = 0.05):
+        self.root = directory
+        # This store's writer directory, claimed on first use
+        self.directory: Optional[str] = None
+        self._lock_file = None
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.bucket_seconds = bucket_seconds
+        self.retention_days = retention_days
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # Guards the indexes and the segment list, shared by the writer and queries
+        self._lock = threading.Lock()
+        self._indexes: List[SegmentIndex] = []
+        self._file = None
+        self._file_size = 0
+        self._loaded = False
+        self._metrics = {
+            'entries_submitted': 0,
+            'entries_written': 0,
+            'batches': 0,
+            'segments_sealed': 0,
+            'segments_expired': 0,
+            'write_errors': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Opening and recovery
+    # ------------------------------------------------------------------
+
+    def _path(self, sequence: int, suffix: str = SEGMENT_SUFFIX, directory: Optional[str] = None) -> str:
+        return os.path.join(directory or self.directory, f"{sequence:08d}{suffix}")
+
+    @staticmethod
+    def _sequences(directory: str) -> List[int]:
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _writer_directories(self) -> List[str]:
+        return [
+            os.path.join(self.root, name) for name in sorted(os.listdir(self.root))
+            if name.startswith(WRITER_PREFIX) and os.path.isdir(os.path.join(self.root, name))
+        ]
+
+    def _claim_directory(self) -> None:
+        """Lock the first writer directory no other store holds"""
+        number = 0
+        while True:
+            directory = os.path.join(self.root, f"{WRITER_PREFIX}{number:03d}")
+            os.makedirs(directory, exist_ok=True)
+            lock_file = open(os.path.join(directory, LOCK_FILE), "a+b")
+            if _try_lock(lock_file):
+                self.directory, self._lock_file = directory, lock_file
+                return
+            lock_file.close()
+            number += 1
+
+    def _load(self) -> None:
+        """Claim a writer directory, read its sealed indexes and reopen its last segment"""
+        if self._loaded:
+            return
+        self._claim_directory()
+        sequences = self._sequences(self.directory)
+        previous_hash = self._chain_start(sequences[0]) if sequences else GENESIS_HASH
+        for sequence in sequences[:-1]:
+            index = self._load_index(sequence)
+            if index is None:
+                index, _ = self._rebuild_index(sequence, previous_hash)
+                self._write_index(index)
+            self._indexes.append(index)
+            previous_hash = index.last_hash
+        if sequences:
+            index, valid_bytes = self._rebuild_index(sequences[-1], previous_hash)
+            self._file = open(self._path(index.sequence), "r+b")
+            self._file.truncate(valid_bytes)
+            self._file.seek(valid_bytes)
+            self._file_size = valid_bytes
+        else:
+            index = SegmentIndex(0)
+            self._file = open(self._path(0), "wb")
+            self._file_size = 0
+        self._indexes.append(index)
+        self._loaded = True
+
+    def _load_index(self, sequence: int, directory: Optional[str] = None) -> Optional[SegmentIndex]:
+        try:
+            with open(self._path(sequence, INDEX_SUFFIX, directory), "r", encoding="utf-8") as f:
+                return SegmentIndex.from_dict(sequence, json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Rebuilding unreadable audit index for segment {sequence}: {e}")
+            return None
+
+    def _rebuild_index(self, sequence: int, previous_hash: str) -> Tuple[SegmentIndex, int]:
+        """Index of a segment read from disk, and the length of its complete lines"""
+        index = SegmentIndex(sequence, previous_hash)
+        valid_bytes = 0
+        with open(self._path(sequence), "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    logger.warning(f"Dropping incomplete audit line at the end of segment {sequence}")
+                    break
+                try:
+                    payload, checksum = split_line(raw.decode("utf-8"))
+                    entry = json.loads(payload)
+                except ValueError:
+                    logger.warning(f"Dropping unreadable audit line at the end of segment {sequence}")
+                    break
+                ts = to_epoch(datetime.fromisoformat(entry["timestamp"]))
+                index.add(ts, int(ts // self.bucket_seconds), entry.get("user_id"), entry.get("ip_address"), checksum)
+                valid_bytes += len(raw)
+        return index, valid_bytes
+
+    def _chain_start(self, sequence: int, directory: Optional[str] = None) -> str:
+        """Checksum the oldest kept segment chains from, recorded when older ones expired"""
+        if sequence == 0:
+            return GENESIS_HASH
+        try:
+            with open(os.path.join(directory or self.directory, ANCHOR_FILE), "r", encoding="utf-8") as f:
+                anchor = json.load(f)
+            if anchor["sequence"] == sequence:
+                return anchor["previous_hash"]
+        except (OSError, ValueError, KeyError):
+            pass
+        index = self._load_index(sequence, directory)
+        if index is not None:
+            return index.previous_hash
+        logger.warning(f"No chain anchor for audit segment {sequence}; verification starts from genesis")
+        return GENESIS_HASH
+
+    def _write_index(self, index: SegmentIndex) -> None:
+        path = self._path(index.sequence, INDEX_SUFFIX)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def submit(self, entry: Dict[str, Any]) -> None:
+        """Queue an entry for the writer; never blocks on I/O"""
+        if self._thread is None:
+            self.start()
+        self._metrics['entries_submitted'] += 1
+        self._queue.put(entry)
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything submitted so far is on disk"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write what is queued, stop the writer and close the open segment"""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._indexes = []
+                self._loaded = False
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+                self.directory = None
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            if isinstance(batch[0], dict):
+                # Let the entries of the next few milliseconds share this write and fsync
+                time.sleep(self.flush_interval)
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            entries = [item for item in batch if isinstance(item, dict)]
+            if entries:
+                try:
+                    self._write_batch(entries)
+                except Exception as e:
+                    self._metrics['write_errors'] += 1
+                    logger.error(f"Audit log write of {len(entries)} entries failed: {e}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                return
+
+    def _write_batch(self, entries: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._load()
+            lines = []
+            for entry in entries:
+                ts = to_epoch(datetime.fromisoformat(entry["timestamp"]))
+                index = self._indexes[-1]
+                checksum, line = chain_line(index.last_hash, entry)
+                data = line.encode("utf-8")
+                lines.append(data)
+                self._file_size += len(data)
+                index.add(ts, int(ts // self.bucket_seconds), entry.get("user_id"), entry.get("ip_address"), checksum)
+                if self._file_size >= self.segment_bytes:
+                    self._file.write(b"".join(lines))
+                    lines = []
+                    self._seal()
+            if lines:
+                self._file.write(b"".join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._metrics['entries_written'] += len(entries)
+        self._metrics['batches'] += 1
+
+    def _seal(self) -> None:
+        """Close the current segment, write its index and start the next one"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        sealed = self._indexes[-1]
+        self._write_index(sealed)
+        self._metrics['segments_sealed'] += 1
+
+        following = SegmentIndex(sealed.sequence + 1, sealed.last_hash)
+        self._file = open(self._path(following.sequence), "wb")
+        self._file_size = 0
+        self._indexes.append(following)
+        self._expire()
+
+    def _expire(self) -> None:
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        expired = 0
+        while len(self._indexes) > 1 and (self._indexes[0].last_ts or 0) < cutoff:
+            expired += 1
+            self._indexes.pop(0)
+        if not expired:
+            return
+        # Record where the chain now starts before the segments holding its head go
+        oldest = self._indexes[0]
+        path = os.path.join(self.directory, ANCHOR_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"sequence": oldest.sequence, "previous_hash": oldest.previous_hash}, f)
+        os.replace(path + ".tmp", path)
+        for sequence in range(oldest.sequence - expired, oldest.sequence):
+            for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX):
+                try:
+                    os.remove(self._path(sequence, suffix))
+                except OSError:
+                    pass
+        self._metrics['segments_expired'] += expired
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def query(self, key: str, value: str, start: float, end: float) -> Iterator[Dict[str, Any]]:
+        """Entries whose ``key`` ("user_id" or "ip_address") is ``value``, oldest first"""
+        self.flush()
+        first_bucket, last_bucket = int(start // self.bucket_seconds), int(end // self.bucket_seconds)
+        with self._lock:
+            self._load()
+            own = [
+                self._path(index.sequence) for index in self._indexes
+                if index.may_contain(key, value, first_bucket, last_bucket)
+            ]
+            directory = self.directory
+        writers = [own]
+        for other in self._writer_directories():
+            if other != directory:
+                writers.append(self._candidate_paths(other, key, value, first_bucket, last_bucket))
+        matches = [self._scan(paths, key, value, start, end) for paths in writers if paths]
+        # Each writer's entries are in time order; interleave them
+        return heapq.merge(*matches, key=lambda entry: to_epoch(datetime.fromisoformat(entry["timestamp"])))
+
+    def _candidate_paths(self, directory: str, key: str, value: str, first_bucket: int, last_bucket: int) -> List[str]:
+        """Segments of another writer that may hold matches; its open segment has no index yet"""
+        paths = []
+        try:
+            sequences = self._sequences(directory)
+        except FileNotFoundError:
+            return paths
+        for sequence in sequences:
+            index = self._load_index(sequence, directory)
+            if index is None or index.may_contain(key, value, first_bucket, last_bucket):
+                paths.append(self._path(sequence, directory=directory))
+        return paths
+
+    def _scan(self, paths: List[str], key: str, value: str, start: float, end: float) -> Iterator[Dict[str, Any]]:
+        needle = _encode({key: value})[1:-1]
+        for path in paths:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if needle not in line or not line.endswith("\n"):
+                            continue
+                        entry = json.loads(line)
+                        if entry.get(key) != value:
+                            continue
+                        if start <= to_epoch(datetime.fromisoformat(entry["timestamp"])) <= end:
+                            yield entry
+            except FileNotFoundError:
+                continue  # Expired while we were reading
+
+    def verify(self) -> Dict[str, Any]:
+        """Recompute the hash chain of every writer directory"""
+        self.flush()
+        with self._lock:
+            self._load()
+            sequences = [index.sequence for index in self._indexes]
+            previous_hash = self._indexes[0].previous_hash
+            directory = self.directory
+        checked = 0
+        for writer in self._writer_directories():
+            if writer == directory:
+                writer_sequences, writer_hash = sequences, previous_hash
+            else:
+                writer_sequences = self._sequences(writer)
+                if not writer_sequences:
+                    continue
+                writer_hash = self._chain_start(writer_sequences[0], writer)
+            result = self._verify_chain(writer, writer_sequences, writer_hash)
+            checked += result["entries_checked"]
+            if not result["valid"]:
+                return {**result, "entries_checked": checked, "writer": os.path.basename(writer)}
+        return {"valid": True, "entries_checked": checked}
+
+    def _verify_chain(self, directory: str, sequences: List[int], previous_hash: str) -> Dict[str, Any]:
+        checked = 0
+        for sequence in sequences:
+            with open(self._path(sequence, directory=directory), "r", encoding="utf-8") as f:
+                for number, line in enumerate(f, 1):
+                    if not line.endswith("\n"):
+                        break  # Another writer is mid-append
+                    try:
+                        payload, checksum = split_line(line)
+                    except ValueError:
+                        checksum = None
+                    if checksum is None or checksum != hashlib.sha256(
+                            (previous_hash + payload).encode("utf-8")).hexdigest():
+                        return {"valid": False, "entries_checked": checked, "segment": sequence, "line": number}
+                    previous_hash = checksum
+                    checked += 1
+        return {"valid": True, "entries_checked": checked}
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            segments = len(self._indexes)
+            entries = sum(index.entries for index in self._indexes)
+            directory = self.directory
+        return {
+            **self._metrics,
+            'queued': self._queue.qsize(),
+            'segments': segments,
+            'entries_on_disk': entries,
+            'writer': os.path.basename(directory) if directory else None,
+            'running': self._thread is not None
+        }
@@ -1,16 +1,18 @@
 """
 Comprehensive Audit Logging System
 Implements GDPR-compliant audit logging for all security-sensitive operations
+
+Entries are handed to a background writer (see ``audit_log_store``) that
+appends them to hash-chained segment files, so logging an event never waits
+on disk.
 """
-import json
-import logging
-from datetime import datetime, timezone
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional, List
 from enum import Enum
 import uuid
-import hashlib
-from pathlib import Path
 
+from .audit_log_store import AuditLogStore, to_epoch
 from .config_manager import config_manager
 
 class AuditEventType(Enum):
@@ -35,42 +37,23 @@ class AuditSeverity(Enum):
 class AuditLogger:
     """Comprehensive audit logging system"""
     
+    # detect_suspicious_patterns thresholds, per time window
+    FAILED_LOGIN_THRESHOLD = 5
+    TARGETED_ACCOUNTS_THRESHOLD = 3
+    BURST_WINDOW_SECONDS = 60
+    BURST_THRESHOLD = 30
+
     def __init__(self):
         self.config = config_manager.get_compliance_config()
         self.audit_enabled = self.config.get("audit_logging", True)
-        # Initialize audit storage and ensure logs directory exists before setting up logger
-        self.audit_file = Path("logs/audit.log")
-        try:
-            self.audit_file.parent.mkdir(parents=True, exist_ok=True)
-        except Exception:
-            # If creation fails, continue and let _setup_logger handle fallback
-            pass
-
-        self.logger = self._setup_logger()
-    
-    def _setup_logger(self) -> logging.Logger:
-        """Setup dedicated audit logger"""
-        logger = logging.getLogger("audit")
-        logger.setLevel(logging.INFO)
-        # Ensure logs directory exists before creating file handler
-        audit_dir = self.audit_file.parent
-        try:
-            audit_dir.mkdir(parents=True, exist_ok=True)
-        except Exception:
-            # If path is invalid or cannot be created, fall back to current directory
-            audit_dir = Path('.')
-
-        # Create file handler for audit logs
-        handler = logging.FileHandler(audit_dir / "audit.log", encoding='utf-8')
-        formatter = logging.Formatter(
-            '%(asctime)s - AUDIT - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S UTC'
+        self.store = AuditLogStore(
+            self.config["audit_log_dir"],
+            segment_bytes=self.config["audit_log_segment_bytes"],
+            bucket_seconds=self.config["audit_index_bucket_seconds"],
+            retention_days=self.config["data_retention_days"],
+            flush_interval=self.config["audit_log_flush_interval_ms"] / 1000
         )
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        
-        return logger
-    
+
     def _create_audit_entry(self, event_type: AuditEventType, event_name: str, 
                            details: Dict[str, Any], severity: AuditSeverity = AuditSeverity.MEDIUM,
                            user_id: Optional[str] = None, ip_address: Optional[str] = None) -> Dict[str, Any]:
@@ -81,35 +64,18 @@ class AuditLogger:
             "event_type": event_type.value,
             "event_name": event_name,
             "severity": severity.value,
-            "details": details,
+            "details": dict(details),  # Written later, by another thread
             "user_id": user_id,
-            "ip_address": ip_address,
-            "checksum": None  # Will be calculated
+            "ip_address": ip_address
         }
-        
-        # Calculate checksum for integrity
-        entry_copy = {k: v for k, v in entry.items() if k != "checksum"}
-        entry_str = json.dumps(entry_copy, sort_keys=True)
-        entry["checksum"] = hashlib.sha256(entry_str.encode()).hexdigest()
-        
+        # The writer adds the chained checksum
         return entry
     
     def _log_entry(self, entry: Dict[str, Any]) -> None:
-        """Log audit entry to file and database"""
+        """Queue audit entry for the background writer"""
         if not self.audit_enabled:
             return
-        
-        try:
-            # Log to file
-            self.logger.info(json.dumps(entry, ensure_ascii=False))
-            
-            # TODO: Also store in database for searchability
-            # await self.store_in_database(entry)
-            
-        except Exception as e:
-            # Critical: audit logging failure should never crash the application
-            # but should be logged to system logger
-            logging.getLogger(__name__).error(f"Audit logging failed: {e}")
+        self.store.submit(entry)
     
     # Authentication Events
     def log_auth_event(self, event_name: str, details: Dict[str, Any], 
@@ -275,15 +241,65 @@ class AuditLogger:
     # Query methods for audit trail analysis
     def get_user_activity(self, user_id: str, start_date: datetime, end_date: datetime) -> List[Dict]:
         """Get user activity for specified date range (for GDPR data export)"""
-        # TODO: Implement database query
-        # This is a placeholder - in production, query from database
-        return []
+        return list(self.store.query("user_id", user_id, to_epoch(start_date), to_epoch(end_date)))
     
     def detect_suspicious_patterns(self, ip_address: str, time_window_hours: int = 24) -> List[Dict]:
         """Detect suspicious activity patterns from an IP"""
-        # TODO: Implement pattern detection
-        # Look for: multiple failed logins, rapid requests, unusual access patterns
-        return []
+        end = datetime.now(timezone.utc)
+        start = end - timedelta(hours=time_window_hours)
+        entries = list(self.store.query("ip_address", ip_address, start.timestamp(), end.timestamp()))
+        patterns = []
+
+        failed = [e for e in entries if e["event_name"] == "login_failed"]
+        if len(failed) >= self.FAILED_LOGIN_THRESHOLD:
+            patterns.append(_pattern("repeated_failed_logins", AuditSeverity.HIGH, failed))
+
+        accounts = {e["details"].get("email") for e in failed} - {None}
+        if len(accounts) >= self.TARGETED_ACCOUNTS_THRESHOLD:
+            patterns.append({**_pattern("multiple_accounts_targeted", AuditSeverity.CRITICAL, failed),
+                             "accounts": sorted(accounts)})
+
+        # Most entries in any BURST_WINDOW_SECONDS; entries are in time order
+        times = [datetime.fromisoformat(e["timestamp"]).timestamp() for e in entries]
+        first = peak = peak_start = 0
+        for last, ts in enumerate(times):
+            while ts - times[first] > self.BURST_WINDOW_SECONDS:
+                first += 1
+            if last - first + 1 > peak:
+                peak, peak_start = last - first + 1, first
+        if peak >= self.BURST_THRESHOLD:
+            patterns.append(_pattern("burst_activity", AuditSeverity.MEDIUM,
+                                     entries[peak_start:peak_start + peak]))
+
+        flagged = [e for e in entries if e["severity"] == AuditSeverity.CRITICAL.value]
+        if flagged:
+            by_name = defaultdict(int)
+            for e in flagged:
+                by_name[e["event_name"]] += 1
+            patterns.append({**_pattern("critical_events", AuditSeverity.CRITICAL, flagged),
+                             "events": dict(by_name)})
+        return patterns
+
+    def verify_integrity(self) -> Dict[str, Any]:
+        """Check the hash chain over every kept audit segment"""
+        return self.store.verify()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return self.store.get_metrics()
+
+    def close(self) -> None:
+        """Write out queued entries and stop the writer"""
+        self.store.close()
+
+
+def _pattern(name: str, severity: AuditSeverity, entries: List[Dict]) -> Dict[str, Any]:
+    return {
+        "pattern": name,
+        "severity": severity.value,
+        "count": len(entries),
+        "first_seen": entries[0]["timestamp"],
+        "last_seen": entries[-1]["timestamp"]
+    }
 
 # Global audit logger instance
 audit_logger = AuditLogger()
\ No newline at end of file
@@ -168,9 +168,12 @@ class SecureConfigManager:
         """Get content security configuration"""
         return {
             "max_size_mb": int(os.getenv("CONTENT_MAX_SIZE_MB", "100")),
+            "upload_spool_max_memory_mb": int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY_MB", "8")),
             "allowed_types": os.getenv("ALLOWED_FILE_TYPES", "jpg,jpeg,png,gif,webp,mp4,avi,mov,txt,json").split(","),
             "scan_enabled": os.getenv("CONTENT_SCAN_ENABLED", "true").lower() == "true",
-            "copyright_check": os.getenv("COPYRIGHT_CHECK_ENABLED", "true").lower() == "true"
+            "copyright_check": os.getenv("COPYRIGHT_CHECK_ENABLED", "true").lower() == "true",
+            "phash_index_path": os.getenv("PHASH_INDEX_PATH", "./data/phash_index.log"),
+            "phash_max_distance": int(os.getenv("PHASH_MAX_DISTANCE", "6"))
         }
     
     def get_compliance_config(self) -> Dict[str, Any]:
@@ -179,6 +182,10 @@ class SecureConfigManager:
             "gdpr_mode": os.getenv("GDPR_COMPLIANCE_MODE", "true").lower() == "true",
             "audit_logging": os.getenv("AUDIT_LOGGING_ENABLED", "true").lower() == "true",
             "data_retention_days": int(os.getenv("DATA_RETENTION_DAYS", "365")),
+            "audit_log_dir": os.getenv("AUDIT_LOG_DIR", "logs/audit"),
+            "audit_log_segment_bytes": int(os.getenv("AUDIT_LOG_SEGMENT_BYTES", str(16 * 1024 * 1024))),
+            "audit_index_bucket_seconds": int(os.getenv("AUDIT_INDEX_BUCKET_SECONDS", "3600")),
+            "audit_log_flush_interval_ms": float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL_MS", "50")),
             "dmca_email": self.get_secret("DMCA_NOTIFICATION_EMAIL", "dmca@localhost")
         }
 
@@ -7,20 +7,23 @@ Implements industry-standard content scanning for:
 - Malware scanning
 - Content authenticity verification
 """
+import asyncio
+import codecs
 import hashlib
 import logging
 import mimetypes
 import os
+import tempfile
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Any
 import requests
 import json
-from io import BytesIO
-from PIL import Image
-import imagehash
 
 from .config_manager import config_manager
 from .audit_logger import audit_logger, AuditSeverity
+from .signature_matcher import SignatureMatcher
+from .phash_index import PerceptualHashIndex
+from .image_analysis import analyze_image, image_analysis_pool
 
 logger = logging.getLogger(__name__)
 
@@ -57,6 +60,74 @@ class ContentScanResult:
         self.recommendation = "pending_review"
         self.scan_errors = []
 
+class TextStats:
+    """Text metadata and suspicious-pattern checks, fed incrementally.
+
+    Gives the same figures as decoding the whole body at once, without
+    keeping it: chunks are decoded with an incremental UTF-8 decoder, and a
+    short tail is carried over so patterns split across chunks still match.
+    """
+    
+    SUSPICIOUS_PATTERNS = (
+        'javascript:', 'vbscript:', 'data:', 'mailto:', 'tel:',
+        '<script', '<iframe', '<object', '<embed'
+    )
+    _TAIL = max(len(pattern) for pattern in SUSPICIOUS_PATTERNS) - 1
+    
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self.character_count = 0
+        self.newline_count = 0
+        self.word_count = 0
+        self._in_word = False
+        self._tail = ''
+        self._found = set()
+    
+    @classmethod
+    def of(cls, content: bytes) -> "TextStats":
+        stats = cls()
+        stats.feed(content)
+        return stats.close()
+    
+    def feed(self, chunk: bytes, final: bool = False) -> None:
+        text = self._decoder.decode(chunk, final)
+        if not text:
+            return
+        self.character_count += len(text)
+        self.newline_count += text.count('\n')
+        words = len(text.split())
+        if self._in_word and not text[0].isspace():
+            words -= 1  # The word carried on from the previous chunk
+        self.word_count += words
+        self._in_word = not text[-1].isspace()
+        
+        window = self._tail + text.lower()
+        for pattern in self.SUSPICIOUS_PATTERNS:
+            if pattern not in self._found and pattern in window:
+                self._found.add(pattern)
+        self._tail = window[-self._TAIL:]
+    
+    def close(self) -> "TextStats":
+        self.feed(b'', final=True)
+        return self
+    
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            'encoding': 'utf-8',
+            'character_count': self.character_count,
+            'line_count': self.newline_count + 1,
+            'word_count': self.word_count,
+        }
+    
+    def analysis(self) -> Dict[str, Any]:
+        warnings = [
+            f"Suspicious content pattern detected: {pattern}"
+            for pattern in self.SUSPICIOUS_PATTERNS if pattern in self._found
+        ]
+        if self.character_count > 10000:
+            warnings.append("Very long text content")
+        return {'warnings': warnings, 'metadata': {'text_length': self.character_count}}
+
 class ContentSecurityScanner:
     """Comprehensive content security and copyright scanner"""
     
@@ -66,6 +137,7 @@ class ContentSecurityScanner:
         
         # Content scanning settings
         self.max_file_size = self.config.get('max_size_mb', 100) * 1024 * 1024  # Convert to bytes
+        self.spool_max_memory = self.config.get('upload_spool_max_memory_mb', 8) * 1024 * 1024
         self.allowed_types = self.config.get('allowed_types', [])
         self.scan_enabled = self.config.get('scan_enabled', True)
         self.copyright_check_enabled = self.config.get('copyright_check', True)
@@ -73,7 +145,13 @@ class ContentSecurityScanner:
         # Known copyright-protected content hashes (would be populated from database)
         self.protected_hashes = set()
         
-        # Malware scanning patterns (basic implementation)
+        # Near-duplicate lookup over 64-bit pHashes of protected images;
+        # the journal is replayed lazily on first use
+        self.phash_max_distance = self.config.get('phash_max_distance', 6)
+        self.phash_index = PerceptualHashIndex(path=self.config.get('phash_index_path'))
+        
+        # Malware scanning patterns (basic implementation); assigning
+        # compiles the matchers
         self.malware_signatures = [
             b'<script',
             b'javascript:',
@@ -84,6 +162,30 @@ class ContentSecurityScanner:
             b'eval(',
         ]
     
+    @property
+    def malware_signatures(self) -> Tuple[bytes, ...]:
+        return self._malware_signatures
+    
+    @malware_signatures.setter
+    def malware_signatures(self, signatures: Iterable[bytes]) -> None:
+        """Replace the signature set and rebuild the compiled matchers"""
+        self._malware_signatures = tuple(signatures)
+        self._malware_matcher = SignatureMatcher(self._malware_signatures)
+        # Images additionally must not carry embedded scripts (steganography)
+        self._image_malware_matcher = SignatureMatcher(self._malware_signatures + (b'javascript',))
+    
+    def add_malware_signature(self, signature: bytes) -> None:
+        """Add a signature and rebuild the matchers"""
+        if signature not in self._malware_signatures:
+            self.malware_signatures = self._malware_signatures + (signature,)
+    
+    def remove_malware_signature(self, signature: bytes) -> bool:
+        """Remove a signature and rebuild the matchers"""
+        if signature not in self._malware_signatures:
+            return False
+        self.malware_signatures = tuple(sig for sig in self._malware_signatures if sig != signature)
+        return True
+    
     async def scan_content(self, file_content: bytes, filename: str, 
                           content_type: str = None) -> ContentScanResult:
         """Perform comprehensive content scan"""
@@ -94,7 +196,31 @@ class ContentSecurityScanner:
             result.file_size = len(file_content)
             result.content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
             result.file_hash = self._calculate_file_hash(file_content)
-            
+        except Exception as e:
+            return self._fail_scan(result, filename, e)
+        
+        return await self._complete_scan(
+            result, filename, file_content,
+            malware_check=lambda: self._scan_for_malware(file_content, filename)
+        )
+    
+    def begin_stream_scan(self, filename: str, content_type: str = None) -> "StreamingContentScan":
+        """Start an incremental scan for content delivered in chunks"""
+        return StreamingContentScan(self, filename, content_type)
+    
+    async def _complete_scan(self, result: ContentScanResult, filename: str,
+                             file_content: Optional[bytes],
+                             malware_check: Callable[[], bool],
+                             image_path: Optional[str] = None,
+                             text_stats: Optional[TextStats] = None) -> ContentScanResult:
+        """Run the policy checks on a hashed and sized result.
+        
+        ``file_content`` is None for streamed uploads. Their images arrive as
+        ``image_path``, a file the analysis pool reads itself, and their
+        text as ``text_stats`` gathered while streaming. Body-level checks
+        are skipped for other types (e.g. video).
+        """
+        try:
             # Log scan start
             audit_logger.log_content_event("content_scan_started", result.scan_id, {
                 "filename": filename,
@@ -118,7 +244,7 @@ class ContentSecurityScanner:
                 return result
             
             # Malware scanning
-            if self._scan_for_malware(file_content, filename):
+            if malware_check():
                 result.malware_detected = True
                 result.security_level = ContentSecurityLevel.BLOCKED
                 result.content_warnings.append("Potential malware detected")
@@ -133,9 +259,18 @@ class ContentSecurityScanner:
                 
                 return result
             
+            # Decode images once, off the event loop, for all image checks below
+            image_analysis = None
+            image_source = file_content if file_content is not None else image_path
+            if image_source is not None and result.content_type.startswith('image/'):
+                image_analysis = await image_analysis_pool.analyze(image_source)
+            
             # Copyright protection check
             if self.copyright_check_enabled:
-                result.copyright_result = await self._check_copyright(file_content, filename, result.content_type)
+                result.copyright_result = await self._check_copyright(
+                    file_content, filename, result.content_type, content_hash=result.file_hash,
+                    image_analysis=image_analysis
+                )
                 
                 if result.copyright_result.is_protected and result.copyright_result.confidence > 0.8:
                     result.security_level = ContentSecurityLevel.BLOCKED
@@ -153,10 +288,16 @@ class ContentSecurityScanner:
                     return result
             
             # Extract technical metadata
-            result.technical_metadata = self._extract_metadata(file_content, filename, result.content_type)
+            result.technical_metadata = self._extract_metadata(
+                file_content, filename, result.content_type, file_size=result.file_size,
+                image_analysis=image_analysis, text_stats=text_stats
+            )
             
             # Content analysis based on type
-            content_analysis = self._analyze_content_by_type(file_content, result.content_type)
+            content_analysis = self._analyze_content_by_type(
+                file_content, result.content_type, file_size=result.file_size,
+                image_analysis=image_analysis, text_stats=text_stats
+            )
             result.content_warnings.extend(content_analysis.get('warnings', []))
             result.technical_metadata.update(content_analysis.get('metadata', {}))
             
@@ -179,17 +320,21 @@ class ContentSecurityScanner:
             return result
             
         except Exception as e:
-            result.scan_errors.append(f"Scan error: {str(e)}")
-            result.security_level = ContentSecurityLevel.UNKNOWN
-            result.recommendation = "manual_review"
-            
-            logger.error(f"Content scan failed for {filename}: {e}")
-            audit_logger.log_content_event("content_scan_failed", result.scan_id, {
-                "filename": filename,
-                "error": str(e)
-            })
-            
-            return result
+            return self._fail_scan(result, filename, e)
+    
+    def _fail_scan(self, result: ContentScanResult, filename: str, error: Exception) -> ContentScanResult:
+        """Mark a scan as errored and route it to manual review"""
+        result.scan_errors.append(f"Scan error: {str(error)}")
+        result.security_level = ContentSecurityLevel.UNKNOWN
+        result.recommendation = "manual_review"
+        
+        logger.error(f"Content scan failed for {filename}: {error}")
+        audit_logger.log_content_event("content_scan_failed", result.scan_id, {
+            "filename": filename,
+            "error": str(error)
+        })
+        
+        return result
     
     def _calculate_file_hash(self, file_content: bytes) -> str:
         """Calculate SHA-256 hash of file content"""
@@ -220,38 +365,39 @@ class ContentSecurityScanner:
     def _scan_for_malware(self, file_content: bytes, filename: str) -> bool:
         """Basic malware pattern scanning"""
         try:
-            # Convert to lowercase for case-insensitive matching
-            content_lower = file_content.lower()
-            
-            # Check for known malware signatures
-            for signature in self.malware_signatures:
-                if signature.lower() in content_lower:
-                    logger.warning(f"Malware signature detected in {filename}: {signature}")
-                    return True
-            
-            # Additional checks for suspicious file patterns
-            if filename.lower().endswith(('.exe', '.scr', '.bat', '.cmd', '.pif', '.com')):
-                logger.warning(f"Suspicious executable file type: {filename}")
+            # Case-insensitive single pass over the content, without a lowercased copy
+            signature = self._matcher_for(filename).search(file_content)
+            if signature is not None:
+                logger.warning(f"Malware signature detected in {filename}: {signature}")
                 return True
             
-            # Check for embedded scripts in images (steganography)
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                if b'<script' in content_lower or b'javascript' in content_lower:
-                    logger.warning(f"Suspicious script found in image: {filename}")
-                    return True
-            
-            return False
+            return self._is_suspicious_filename(filename)
             
         except Exception as e:
             logger.error(f"Malware scanning failed for {filename}: {e}")
             return True  # Err on the side of caution
     
-    async def _check_copyright(self, file_content: bytes, filename: str, 
-                              content_type: str) -> CopyrightCheckResult:
+    def _matcher_for(self, filename: str) -> SignatureMatcher:
+        """Compiled matcher for the signatures that apply to this file"""
+        if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
+            return self._image_malware_matcher
+        return self._malware_matcher
+    
+    def _is_suspicious_filename(self, filename: str) -> bool:
+        """Additional checks for suspicious file patterns"""
+        if filename.lower().endswith(('.exe', '.scr', '.bat', '.cmd', '.pif', '.com')):
+            logger.warning(f"Suspicious executable file type: {filename}")
+            return True
+        return False
+    
+    async def _check_copyright(self, file_content: Optional[bytes], filename: str, 
+                              content_type: str, content_hash: Optional[str] = None,
+                              image_analysis: Optional[Dict[str, Any]] = None) -> CopyrightCheckResult:
         """Check for copyright protected content"""
         try:
             # Calculate content hash
-            content_hash = self._calculate_file_hash(file_content)
+            if content_hash is None:
+                content_hash = self._calculate_file_hash(file_content)
             
             # Check against known protected hashes
             if content_hash in self.protected_hashes:
@@ -263,8 +409,9 @@ class ContentSecurityScanner:
                 )
             
             # Perform perceptual hashing for images
-            if content_type and content_type.startswith('image/'):
-                perceptual_result = await self._check_image_copyright(file_content)
+            if (file_content is not None or image_analysis is not None) and \
+                    content_type and content_type.startswith('image/'):
+                perceptual_result = await self._check_image_copyright(file_content, image_analysis)
                 if perceptual_result:
                     return perceptual_result
             
@@ -291,44 +438,64 @@ class ContentSecurityScanner:
                 details=f"Copyright check error: {str(e)}"
             )
     
-    async def _check_image_copyright(self, image_content: bytes) -> Optional[CopyrightCheckResult]:
+    async def _check_image_copyright(self, image_content: bytes,
+                                     image_analysis: Optional[Dict[str, Any]] = None) -> Optional[CopyrightCheckResult]:
         """Check image for copyright using perceptual hashing"""
         try:
-            # Load image and calculate perceptual hash
-            image = Image.open(BytesIO(image_content))
-            
-            # Calculate different types of perceptual hashes
-            avg_hash = str(imagehash.average_hash(image))
-            dhash = str(imagehash.dhash(image))
-            phash = str(imagehash.phash(image))
-            
-            # In production, compare against database of known protected image hashes
-            # For now, just log the hashes for future use
-            logger.debug(f"Image hashes - avg: {avg_hash}, dhash: {dhash}, phash: {phash}")
-            
-            # TODO: Implement actual comparison against protected content database
-            
-            return None  # No copyright violation detected
+            if image_analysis is None:
+                image_analysis = await image_analysis_pool.analyze(image_content)
+            hashes = image_analysis.get('hashes')
+            if not hashes:
+                logger.error(f"Image copyright check failed: {image_analysis.get('error')}")
+                return None
+            
+            phash = hashes['phash']
+            logger.debug(f"Image hashes - avg: {hashes['average_hash']}, dhash: {hashes['dhash']}, phash: {phash}")
+            
+            # Compare against the protected image index
+            await self._load_phash_index()
+            match = self.phash_index.nearest(phash, self.phash_max_distance)
+            if match is None:
+                return None  # No copyright violation detected
+            
+            matched_hash, distance, refs = match
+            return CopyrightCheckResult(
+                is_protected=True,
+                confidence=max(0.0, 1.0 - distance / 32),
+                sources=sorted(refs),
+                details=f"Perceptual match with protected image {matched_hash:016x} (distance {distance})"
+            )
             
         except Exception as e:
             logger.error(f"Image copyright check failed: {e}")
             return None
     
-    def _extract_metadata(self, file_content: bytes, filename: str, content_type: str) -> Dict[str, Any]:
+    def _extract_metadata(self, file_content: Optional[bytes], filename: str, content_type: str,
+                          file_size: Optional[int] = None,
+                          image_analysis: Optional[Dict[str, Any]] = None,
+                          text_stats: Optional[TextStats] = None) -> Dict[str, Any]:
         """Extract technical metadata from content"""
         metadata = {}
+        if file_size is None:
+            file_size = len(file_content)
         
         try:
-            if content_type and content_type.startswith('image/'):
-                metadata.update(self._extract_image_metadata(file_content))
-            elif content_type and content_type.startswith('video/'):
+            if content_type and content_type.startswith('video/'):
                 metadata.update(self._extract_video_metadata(file_content))
+            elif image_analysis is not None:
+                metadata.update(image_analysis['metadata'])
+            elif text_stats is not None:
+                metadata.update(text_stats.metadata())
+            elif file_content is None:
+                pass
+            elif content_type and content_type.startswith('image/'):
+                metadata.update(self._extract_image_metadata(file_content))
             elif content_type and content_type.startswith('text/'):
                 metadata.update(self._extract_text_metadata(file_content))
             
             # Common metadata
             metadata.update({
-                'file_size_bytes': len(file_content),
+                'file_size_bytes': file_size,
                 'content_type_detected': content_type,
                 'filename': filename,
                 'scan_timestamp': datetime.now(timezone.utc).isoformat()
@@ -342,35 +509,9 @@ class ContentSecurityScanner:
     
     def _extract_image_metadata(self, image_content: bytes) -> Dict[str, Any]:
         """Extract image-specific metadata"""
-        try:
-            image = Image.open(BytesIO(image_content))
-            
-            metadata = {
-                'format': image.format,
-                'mode': image.mode,
-                'size': image.size,
-                'width': image.size[0],
-                'height': image.size[1]
-            }
-            
-            # Extract EXIF data if available
-            if hasattr(image, '_getexif') and image._getexif():
-                exif_data = image._getexif()
-                if exif_data:
-                    # Only include non-sensitive EXIF data
-                    safe_exif = {}
-                    for tag, value in exif_data.items():
-                        if tag in [0x0100, 0x0101, 0x0112, 0x011A, 0x011B]:  # Basic image info only
-                            safe_exif[str(tag)] = str(value)
-                    metadata['exif'] = safe_exif
-            
-            return metadata
-            
-        except Exception as e:
-            logger.error(f"Image metadata extraction failed: {e}")
-            return {'extraction_error': str(e)}
+        return analyze_image(image_content)['metadata']
     
-    def _extract_video_metadata(self, video_content: bytes) -> Dict[str, Any]:
+    def _extract_video_metadata(self, video_content: Optional[bytes]) -> Dict[str, Any]:
         """Extract video-specific metadata (basic implementation)"""
         # For production, use ffprobe or similar tool
         return {
@@ -380,33 +521,27 @@ class ContentSecurityScanner:
     
     def _extract_text_metadata(self, text_content: bytes) -> Dict[str, Any]:
         """Extract text-specific metadata"""
-        try:
-            # Try to decode text
-            try:
-                text = text_content.decode('utf-8')
-            except UnicodeDecodeError:
-                text = text_content.decode('utf-8', errors='ignore')
-            
-            return {
-                'encoding': 'utf-8',
-                'character_count': len(text),
-                'line_count': text.count('\n') + 1,
-                'word_count': len(text.split()),
-            }
-            
-        except Exception as e:
-            logger.error(f"Text metadata extraction failed: {e}")
-            return {'extraction_error': str(e)}
+        return TextStats.of(text_content).metadata()
     
-    def _analyze_content_by_type(self, file_content: bytes, content_type: str) -> Dict[str, Any]:
+    def _analyze_content_by_type(self, file_content: Optional[bytes], content_type: str,
+                                 file_size: Optional[int] = None,
+                                 image_analysis: Optional[Dict[str, Any]] = None,
+                                 text_stats: Optional[TextStats] = None) -> Dict[str, Any]:
         """Analyze content based on its type"""
         analysis = {'warnings': [], 'metadata': {}}
         
         try:
-            if content_type and content_type.startswith('image/'):
+            if content_type and content_type.startswith('video/'):
+                analysis.update(self._analyze_video_content(file_content, file_size=file_size))
+            elif image_analysis is not None:
+                analysis.update({'warnings': list(image_analysis['warnings']),
+                                 'metadata': dict(image_analysis['analysis_metadata'])})
+            elif text_stats is not None:
+                analysis.update(text_stats.analysis())
+            elif file_content is None:
+                pass
+            elif content_type and content_type.startswith('image/'):
                 analysis.update(self._analyze_image_content(file_content))
-            elif content_type and content_type.startswith('video/'):
-                analysis.update(self._analyze_video_content(file_content))
             elif content_type and content_type.startswith('text/'):
                 analysis.update(self._analyze_text_content(file_content))
         
@@ -417,77 +552,44 @@ class ContentSecurityScanner:
     
     def _analyze_image_content(self, image_content: bytes) -> Dict[str, Any]:
         """Analyze image content for potential issues"""
-        warnings = []
-        metadata = {}
-        
-        try:
-            image = Image.open(BytesIO(image_content))
-            
-            # Check image dimensions
-            width, height = image.size
-            if width > 4096 or height > 4096:
-                warnings.append("Very large image dimensions may impact performance")
-            
-            if width < 100 or height < 100:
-                warnings.append("Very small image may not display well on large screens")
-            
-            # Check for unusual aspect ratios
-            aspect_ratio = width / height
-            if aspect_ratio > 5 or aspect_ratio < 0.2:
-                warnings.append("Unusual aspect ratio may not display properly")
-            
-            metadata['aspect_ratio'] = round(aspect_ratio, 2)
-            
-        except Exception as e:
-            warnings.append(f"Image analysis error: {str(e)}")
-        
-        return {'warnings': warnings, 'metadata': metadata}
+        analysis = analyze_image(image_content)
+        return {'warnings': analysis['warnings'], 'metadata': analysis['analysis_metadata']}
     
-    def _analyze_video_content(self, video_content: bytes) -> Dict[str, Any]:
+    def _analyze_video_content(self, video_content: Optional[bytes],
+                               file_size: Optional[int] = None) -> Dict[str, Any]:
         """Analyze video content for potential issues"""
         warnings = []
         metadata = {}
+        if file_size is None:
+            file_size = len(video_content)
         
         # Basic video file validation
-        if len(video_content) > 500 * 1024 * 1024:  # 500MB
+        if file_size > 500 * 1024 * 1024:  # 500MB
             warnings.append("Large video file may cause playback issues")
         
         return {'warnings': warnings, 'metadata': metadata}
     
     def _analyze_text_content(self, text_content: bytes) -> Dict[str, Any]:
         """Analyze text content for potential issues"""
-        warnings = []
-        metadata = {}
-        
-        try:
-            text = text_content.decode('utf-8', errors='ignore')
-            
-            # Check for suspicious content
-            suspicious_patterns = [
-                'javascript:', 'vbscript:', 'data:', 'mailto:', 'tel:',
-                '<script', '<iframe', '<object', '<embed'
-            ]
-            
-            text_lower = text.lower()
-            for pattern in suspicious_patterns:
-                if pattern in text_lower:
-                    warnings.append(f"Suspicious content pattern detected: {pattern}")
-            
-            # Check text length
-            if len(text) > 10000:
-                warnings.append("Very long text content")
-            
-            metadata['text_length'] = len(text)
-            
-        except Exception as e:
-            warnings.append(f"Text analysis error: {str(e)}")
-        
-        return {'warnings': warnings, 'metadata': metadata}
+        return TextStats.of(text_content).analysis()
+    
+    async def _load_phash_index(self) -> None:
+        """Replay the perceptual hash journal off the event loop, once"""
+        if not self.phash_index.loaded:
+            await asyncio.to_thread(self.phash_index.load)
+    
+    def _is_perceptual_hash(self, value: str) -> bool:
+        """64-bit perceptual hashes are 16 hex chars; SHA-256 digests are 64"""
+        return len(value) == 16
     
     async def add_protected_hash(self, file_hash: str, source: str = "manual") -> bool:
-        """Add a file hash to protected content database"""
+        """Add a SHA-256 or 64-bit perceptual hash to protected content database"""
         try:
-            self.protected_hashes.add(file_hash)
+            if self._is_perceptual_hash(file_hash):
+                await self._load_phash_index()
+                self.phash_index.add(file_hash, source)
+            else:
+                self.protected_hashes.add(file_hash)
             
             # Log the addition
             audit_logger.log_content_event("protected_hash_added", file_hash, {
@@ -505,21 +607,148 @@ class ContentSecurityScanner:
     async def remove_protected_hash(self, file_hash: str) -> bool:
         """Remove a file hash from protected content database"""
         try:
-            if file_hash in self.protected_hashes:
+            if self._is_perceptual_hash(file_hash):
+                await self._load_phash_index()
+                removed = self.phash_index.remove(file_hash)
+            elif file_hash in self.protected_hashes:
                 self.protected_hashes.remove(file_hash)
-                
+                removed = True
+            else:
+                removed = False
+            
+            if removed:
                 # Log the removal
                 audit_logger.log_content_event("protected_hash_removed", file_hash, {
                     "hash": file_hash
                 })
                 
                 # TODO: Remove from database
-                return True
-            return False
+            return removed
             
         except Exception as e:
             logger.error(f"Failed to remove protected hash {file_hash}: {e}")
             return False
+    
+    async def import_protected_hashes(self, records: Iterable[Tuple[str, str]]) -> int:
+        """Bulk-seed protected hashes from ``(hash, source)`` pairs.
+        
+        Perceptual hashes are added to the index in one journal write;
+        returns the number of new entries.
+        """
+        await self._load_phash_index()
+        perceptual = []
+        added = 0
+        for file_hash, source in records:
+            if self._is_perceptual_hash(file_hash):
+                perceptual.append((file_hash, source))
+            elif file_hash not in self.protected_hashes:
+                self.protected_hashes.add(file_hash)
+                added += 1
+        added += self.phash_index.bulk_add(perceptual)
+        
+        audit_logger.log_content_event("protected_hashes_imported", "bulk", {
+            "added": added,
+            "perceptual_index_size": len(self.phash_index)
+        })
+        return added
+    
+    async def add_protected_image(self, image_content: bytes, source: str = "manual") -> Optional[str]:
+        """Register an image as protected by its pHash; returns the hash"""
+        try:
+            analysis = await image_analysis_pool.analyze(image_content)
+            phash = analysis['hashes']['phash']
+        except Exception as e:
+            logger.error(f"Failed to hash protected image from {source}: {e}")
+            return None
+        if await self.add_protected_hash(phash, source):
+            return phash
+        return None
+
+class StreamingContentScan:
+    """Incremental scan over an upload that arrives in chunks.
+
+    Each chunk is hashed and signature-scanned as it arrives, carrying a short
+    tail across chunk boundaries so split signatures still match. Text is
+    measured and pattern-checked chunk by chunk and not retained. Images are
+    kept in memory up to the scanner's spool limit and spilled to a temp file
+    beyond it, which the analysis pool then reads from disk.
+    """
+    
+    def __init__(self, scanner: ContentSecurityScanner, filename: str, content_type: str = None):
+        self.scanner = scanner
+        self.filename = filename
+        self.result = ContentScanResult()
+        self.result.content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self._hasher = hashlib.sha256()
+        self._signature_stream = scanner._matcher_for(filename).stream()
+        self._malware_detected = False
+        self._text_stats = TextStats() if self.result.content_type.startswith('text/') else None
+        self._image = bytearray() if self.result.content_type.startswith('image/') else None
+        self._image_file = None
+    
+    @property
+    def should_stop(self) -> bool:
+        """True once the outcome is decided and further bytes are irrelevant"""
+        return self._malware_detected or self.result.file_size > self.scanner.max_file_size
+    
+    def update(self, chunk: bytes) -> None:
+        """Feed the next chunk of the upload"""
+        self.result.file_size += len(chunk)
+        self._hasher.update(chunk)
+        
+        if not self._malware_detected:
+            try:
+                signature = self._signature_stream.feed(chunk)
+                if signature is not None:
+                    logger.warning(f"Malware signature detected in {self.filename}: {signature}")
+                    self._malware_detected = True
+            except Exception as e:
+                logger.error(f"Malware scanning failed for {self.filename}: {e}")
+                self._malware_detected = True  # Err on the side of caution
+        
+        if self._text_stats is not None:
+            self._text_stats.feed(chunk)
+        elif self.result.file_size > self.scanner.max_file_size:
+            # Will be rejected on size; stop retaining the body
+            self._discard_image()
+        elif self._image_file is not None:
+            self._image_file.write(chunk)
+        elif self._image is not None:
+            self._image += chunk
+            if len(self._image) > self.scanner.spool_max_memory:
+                self._image_file = tempfile.NamedTemporaryFile(prefix="scan-", delete=False)
+                self._image_file.write(self._image)
+                self._image = None
+    
+    def _discard_image(self) -> None:
+        self._image = None
+        if self._image_file is not None:
+            self._image_file.close()
+            try:
+                os.remove(self._image_file.name)
+            except OSError:
+                pass
+            self._image_file = None
+    
+    async def finalize(self) -> ContentScanResult:
+        """Run the remaining checks and return the scan result"""
+        self.result.file_hash = self._hasher.hexdigest()
+        
+        file_content = bytes(self._image) if self._image is not None else None
+        image_path = None
+        if self._image_file is not None:
+            self._image_file.close()
+            image_path = self._image_file.name
+        text_stats = self._text_stats.close() if self._text_stats is not None else None
+        
+        try:
+            return await self.scanner._complete_scan(
+                self.result, self.filename, file_content,
+                malware_check=lambda: self._malware_detected or self.scanner._is_suspicious_filename(self.filename),
+                image_path=image_path, text_stats=text_stats
+            )
+        finally:
+            self._discard_image()
 
 # Global content scanner instance
 content_scanner = ContentSecurityScanner()
\ No newline at end of file
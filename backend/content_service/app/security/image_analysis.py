@@ -0,0 +1,217 @@
+"""
+Decode-once image analysis on a bounded process pool.
+
+``analyze_image`` opens an image a single time and derives everything the
+content scanner needs from it: perceptual hashes for copyright matching,
+technical metadata, and display warnings. ``ImageAnalysisPool`` runs that job
+on a ``ProcessPoolExecutor`` so PIL decoding and hashing never hold the event
+loop, and bounds the number of in-flight jobs so a burst of uploads queues
+(with a timeout) instead of growing the executor backlog without limit.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Dict, Optional, Union
+
+from PIL import Image
+import imagehash
+
+from app.utils.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Basic image info only; no location or device identifiers
+SAFE_EXIF_TAGS = (0x0100, 0x0101, 0x0112, 0x011A, 0x011B)
+
+
+class ImageAnalysisBusyError(RuntimeError):
+    """Raised when no analysis slot frees up within the queue timeout"""
+
+
+def analyze_image(image_content: Union[bytes, str]) -> Dict[str, Any]:
+    """Decode an image once and return hashes, metadata and warnings.
+
+    ``image_content`` is the image itself or the path of a file holding it.
+    Runs inside worker processes, so it must stay a module-level function
+    returning plain picklable data.
+    """
+    try:
+        image = Image.open(BytesIO(image_content) if isinstance(image_content, (bytes, bytearray)) else image_content)
+        image.load()
+    except Exception as e:
+        return {
+            'error': str(e),
+            'hashes': None,
+            'metadata': {'extraction_error': str(e)},
+            'warnings': [f"Image analysis error: {str(e)}"],
+            'analysis_metadata': {},
+        }
+
+    width, height = image.size
+    metadata = {
+        'format': image.format,
+        'mode': image.mode,
+        'size': image.size,
+        'width': width,
+        'height': height
+    }
+    try:
+        # Extract EXIF data if available
+        exif_data = image._getexif() if hasattr(image, '_getexif') else None
+        if exif_data:
+            metadata['exif'] = {
+                str(tag): str(value) for tag, value in exif_data.items() if tag in SAFE_EXIF_TAGS
+            }
+    except Exception as e:
+        logger.debug(f"EXIF extraction failed: {e}")
+
+    hashes = None
+    try:
+        hashes = {
+            'average_hash': str(imagehash.average_hash(image)),
+            'dhash': str(imagehash.dhash(image)),
+            'phash': str(imagehash.phash(image)),
+        }
+    except Exception as e:
+        logger.error(f"Image hashing failed: {e}")
+
+    warnings = []
+    analysis_metadata = {}
+    if width > 4096 or height > 4096:
+        warnings.append("Very large image dimensions may impact performance")
+    if width < 100 or height < 100:
+        warnings.append("Very small image may not display well on large screens")
+    if height:
+        # Check for unusual aspect ratios
+        aspect_ratio = width / height
+        if aspect_ratio > 5 or aspect_ratio < 0.2:
+            warnings.append("Unusual aspect ratio may not display properly")
+        analysis_metadata['aspect_ratio'] = round(aspect_ratio, 2)
+
+    return {
+        'error': None,
+        'hashes': hashes,
+        'metadata': metadata,
+        'warnings': warnings,
+        'analysis_metadata': analysis_metadata,
+    }
+
+
+class ImageAnalysisPool:
+    """Bounded process pool for ``analyze_image`` jobs with metrics"""
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        self.max_workers = max_workers or int(
+            os.getenv("IMAGE_ANALYSIS_WORKERS", str(min(4, os.cpu_count() or 1)))
+        )
+        self.max_pending = max_pending or int(
+            os.getenv("IMAGE_ANALYSIS_MAX_PENDING", str(self.max_workers * 4))
+        )
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(
+            os.getenv("IMAGE_ANALYSIS_QUEUE_TIMEOUT_SECONDS", "30")
+        )
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._metrics = {
+            'jobs_submitted': 0,
+            'jobs_completed': 0,
+            'jobs_failed': 0,
+            'jobs_rejected': 0,
+            'pool_restarts': 0
+        }
+        self._queue_wait = LatencyHistogram()
+        self._job_latency = LatencyHistogram()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            try:
+                # Spawned, not forked: a fork would copy the event loop, open
+                # sockets and lock state of a threaded server into each worker
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            except (OSError, NotImplementedError) as e:
+                # e.g. no multiprocessing support in a restricted sandbox
+                logger.warning(f"Process pool unavailable, analysing images on threads: {e}")
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="image-analysis"
+                )
+        return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._slots_loop = loop
+        return self._slots
+
+    async def analyze(self, image_content: Union[bytes, str]) -> Dict[str, Any]:
+        """Run ``analyze_image`` off the event loop, waiting for a free slot"""
+        slots = self._get_slots()
+        self._metrics['jobs_submitted'] += 1
+        enqueued_at = time.perf_counter()
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._metrics['jobs_rejected'] += 1
+            raise ImageAnalysisBusyError(
+                f"Image analysis queue full ({self.max_pending} jobs in flight)"
+            )
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        self._queue_wait.observe(time.perf_counter() - enqueued_at)
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), analyze_image, image_content)
+            self._metrics['jobs_completed'] += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a decompression bomb); start a fresh pool
+            self._metrics['jobs_failed'] += 1
+            self._metrics['pool_restarts'] += 1
+            broken, self._executor = self._executor, None
+            if broken is not None:
+                broken.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception:
+            self._metrics['jobs_failed'] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            slots.release()
+            self._job_latency.observe(time.perf_counter() - enqueued_at)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Queue depth counts jobs waiting for a slot plus jobs queued behind busy workers"""
+        return {
+            **self._metrics,
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'in_flight': self._in_flight,
+            'waiting_for_slot': self._waiting,
+            'queue_depth': self._waiting + max(0, self._in_flight - self.max_workers),
+            'queue_wait': self._queue_wait.snapshot(),
+            'job_latency': self._job_latency.snapshot()
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Global image analysis pool
+image_analysis_pool = ImageAnalysisPool()
@@ -0,0 +1,253 @@
+"""
+Hamming-distance index over 64-bit perceptual image hashes.
+
+Uses multi-index hashing: each hash is split into ``segments`` equal
+substrings, each with its own lookup table. By the pigeonhole principle, two
+hashes within distance ``k`` agree to within ``k // segments`` bits on at
+least one segment, so a query only probes the few table buckets near its own
+segments and verifies those candidates with a popcount. With the default 4 x
+16-bit segments and ``k <= 7`` that is 68 bucket lookups, which keeps queries
+well under a millisecond on a million-entry corpus.
+
+The index is persisted as an append-only journal of ``+``/``-`` lines that is
+replayed on load and can be compacted into a snapshot.
+"""
+
+import logging
+import os
+import threading
+from array import array
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+
+def parse_hash(value) -> int:
+    """Accept an int, a 16-char hex string or an ``imagehash.ImageHash``"""
+    if isinstance(value, int):
+        phash = value
+    else:
+        phash = int(str(value), 16)
+    if not 0 <= phash < (1 << HASH_BITS):
+        raise ValueError(f"Perceptual hash out of 64-bit range: {value}")
+    return phash
+
+
+def format_hash(phash: int) -> str:
+    return f"{phash:016x}"
+
+
+class PerceptualHashIndex:
+    """Multi-index hash table answering "all hashes within distance k" queries"""
+
+    def __init__(self, path: Optional[str] = None, segments: int = 4):
+        if HASH_BITS % segments:
+            raise ValueError("segments must divide 64")
+        self.path = path
+        self.segments = segments
+        self.segment_bits = HASH_BITS // segments
+        self._segment_mask = (1 << self.segment_bits) - 1
+        # hash -> references (e.g. protected content ids / sources)
+        self._entries: Dict[int, Set[str]] = {}
+        # one table per segment: segment value -> hashes sharing it
+        self._tables: List[Dict[int, array]] = [{} for _ in range(segments)]
+        self._flip_masks: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def __contains__(self, phash) -> bool:
+        return parse_hash(phash) in self._entries
+
+    def _split(self, phash: int) -> List[int]:
+        return [(phash >> (i * self.segment_bits)) & self._segment_mask for i in range(self.segments)]
+
+    def _masks_within(self, radius: int) -> List[int]:
+        """XOR masks for every segment value within ``radius`` bits"""
+        masks = self._flip_masks.get(radius)
+        if masks is None:
+            masks = [0]
+            for r in range(1, radius + 1):
+                for bits in combinations(range(self.segment_bits), r):
+                    mask = 0
+                    for bit in bits:
+                        mask |= 1 << bit
+                    masks.append(mask)
+            self._flip_masks[radius] = masks
+        return masks
+
+    # ------------------------------------------------------------------
+    # Mutation
+    # ------------------------------------------------------------------
+
+    def _insert(self, phash: int, ref: str) -> bool:
+        refs = self._entries.get(phash)
+        if refs is not None:
+            if ref in refs:
+                return False
+            refs.add(ref)
+            return True
+        self._entries[phash] = {ref}
+        for table, value in zip(self._tables, self._split(phash)):
+            bucket = table.get(value)
+            if bucket is None:
+                table[value] = array('Q', (phash,))
+            else:
+                bucket.append(phash)
+        return True
+
+    def _delete(self, phash: int, ref: Optional[str]) -> bool:
+        refs = self._entries.get(phash)
+        if refs is None:
+            return False
+        if ref is not None:
+            if ref not in refs:
+                return False
+            refs.discard(ref)
+            if refs:
+                return True
+        del self._entries[phash]
+        for table, value in zip(self._tables, self._split(phash)):
+            bucket = table[value]
+            bucket.remove(phash)
+            if not bucket:
+                del table[value]
+        return True
+
+    def add(self, phash, ref: str = "manual") -> bool:
+        """Index a hash under a reference; returns False if already present"""
+        phash = parse_hash(phash)
+        with self._lock:
+            added = self._insert(phash, ref)
+            if added:
+                self._journal([("+", phash, ref)])
+        return added
+
+    def remove(self, phash, ref: Optional[str] = None) -> bool:
+        """Remove one reference, or the whole hash when ``ref`` is None"""
+        phash = parse_hash(phash)
+        with self._lock:
+            removed = self._delete(phash, ref)
+            if removed:
+                self._journal([("-", phash, ref or "*")])
+        return removed
+
+    def bulk_add(self, records: Iterable[Tuple[object, str]]) -> int:
+        """Seed many ``(hash, ref)`` pairs with a single journal write"""
+        added = []
+        with self._lock:
+            for value, ref in records:
+                phash = parse_hash(value)
+                if self._insert(phash, ref):
+                    added.append(("+", phash, ref))
+            self._journal(added)
+        logger.info("Bulk-imported %d perceptual hashes (%d total)", len(added), len(self._entries))
+        return len(added)
+
+    def import_file(self, path: str, ref: str = "bulk_import") -> int:
+        """Bulk-import a file of ``<hex hash>[ <ref>]`` lines"""
+        def records():
+            with open(path, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    parts = line.split(None, 1)
+                    if parts and not parts[0].startswith("#"):
+                        yield parts[0], parts[1].strip() if len(parts) > 1 else ref
+        return self.bulk_add(records())
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def query(self, phash, max_distance: int) -> List[Tuple[int, int, Set[str]]]:
+        """All indexed hashes within ``max_distance`` bits, closest first.
+
+        Returns ``(hash, distance, refs)`` tuples.
+        """
+        phash = parse_hash(phash)
+        radius = max_distance // self.segments
+        masks = self._masks_within(radius)
+        seen = set()
+        matches = []
+        for table, value in zip(self._tables, self._split(phash)):
+            for mask in masks:
+                bucket = table.get(value ^ mask)
+                if bucket is None:
+                    continue
+                for candidate in bucket:
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = (candidate ^ phash).bit_count()
+                    if distance <= max_distance:
+                        matches.append((candidate, distance, set(self._entries[candidate])))
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def nearest(self, phash, max_distance: int) -> Optional[Tuple[int, int, Set[str]]]:
+        matches = self.query(phash, max_distance)
+        return matches[0] if matches else None
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def _journal(self, ops: List[Tuple[str, int, str]]) -> None:
+        if not self.path or not ops:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as fh:
+            fh.write("".join(f"{op} {format_hash(phash)} {ref}\n" for op, phash, ref in ops))
+
+    def load(self) -> int:
+        """Replay the journal from disk; safe to call more than once"""
+        with self._lock:
+            if self._loaded:
+                return len(self._entries)
+            self._loaded = True
+            if not self.path or not os.path.exists(self.path):
+                return 0
+            with open(self.path, "r", encoding="utf-8") as fh:
+                for line_no, line in enumerate(fh, 1):
+                    parts = line.rstrip("\n").split(" ", 2)
+                    if len(parts) != 3:
+                        continue
+                    op, value, ref = parts
+                    try:
+                        phash = parse_hash(value)
+                    except ValueError:
+                        logger.warning("Skipping bad perceptual hash journal line %d", line_no)
+                        continue
+                    if op == "+":
+                        self._insert(phash, ref)
+                    elif op == "-":
+                        self._delete(phash, None if ref == "*" else ref)
+        logger.info("Loaded %d perceptual hashes from %s", len(self._entries), self.path)
+        return len(self._entries)
+
+    def compact(self) -> None:
+        """Rewrite the journal as a snapshot of the live entries.
+
+        Replays the journal first if needed, so entries not yet loaded are
+        kept rather than dropped from the snapshot.
+        """
+        if not self.path:
+            return
+        self.load()
+        with self._lock:
+            tmp_path = f"{self.path}.compact"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                for phash, refs in self._entries.items():
+                    for ref in refs:
+                        fh.write(f"+ {format_hash(phash)} {ref}\n")
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,124 @@
+"""
+Multi-signature byte matcher for malware scanning.
+
+Signatures are normalised and compiled once per signature set. Content is
+searched case-insensitively through a ``memoryview`` in cache-sized windows:
+only the current window is lowercased, never the whole file, so main memory is
+read once and the extra allocation is bounded by the window size. Searches can
+also be fed chunk by chunk for streaming uploads, with a tail carried across
+chunk boundaries.
+
+When ``pyahocorasick`` is installed and the signature set is large enough for
+it to pay off, each window is matched by an Aho-Corasick automaton in a single
+pass regardless of signature count. Small sets use per-signature ``in`` scans,
+which are faster there.
+"""
+
+import logging
+from typing import Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Window size for case-folding; small enough to stay in L2 cache
+DEFAULT_WINDOW_SIZE = 256 * 1024
+
+# Below this many signatures the per-signature scan beats the automaton
+AUTOMATON_MIN_SIGNATURES = 16
+
+
+def _normalise(signatures: Iterable[bytes]) -> Tuple[bytes, ...]:
+    """Lowercase, deduplicate and drop signatures that contain another one"""
+    unique = sorted({bytes(sig).lower() for sig in signatures if sig}, key=len)
+    kept = []
+    for sig in unique:
+        if not any(shorter in sig for shorter in kept):
+            kept.append(sig)
+    return tuple(kept)
+
+
+class SignatureMatcher:
+    """Precompiled case-insensitive matcher for a fixed set of byte signatures"""
+
+    def __init__(self, signatures: Iterable[bytes], window_size: int = DEFAULT_WINDOW_SIZE):
+        self.signatures = _normalise(signatures)
+        self.max_length = max((len(sig) for sig in self.signatures), default=0)
+        self.window_size = max(window_size, self.max_length)
+        self._automaton = None
+
+        if ahocorasick is not None and len(self.signatures) >= AUTOMATON_MIN_SIGNATURES:
+            automaton = ahocorasick.Automaton()
+            for sig in self.signatures:
+                # latin-1 maps bytes 1:1 onto code points
+                automaton.add_word(sig.decode('latin-1'), sig)
+            automaton.make_automaton()
+            self._automaton = automaton
+
+    @property
+    def uses_automaton(self) -> bool:
+        return self._automaton is not None
+
+    def _search_lowered(self, window: bytes) -> Optional[bytes]:
+        if self._automaton is not None:
+            for _, sig in self._automaton.iter(window.decode('latin-1')):
+                return sig
+            return None
+        for sig in self.signatures:
+            if sig in window:
+                return sig
+        return None
+
+    def search(self, data) -> Optional[bytes]:
+        """Return the first signature found in ``data`` (any bytes-like), or None"""
+        if not self.signatures:
+            return None
+        view = memoryview(data).cast('B')
+        overlap = self.max_length - 1
+        step = self.window_size
+        for start in range(0, len(view), step):
+            window = bytes(view[start:start + step + overlap]).lower()
+            found = self._search_lowered(window)
+            if found is not None:
+                return found
+        return None
+
+    def stream(self) -> "SignatureStream":
+        """Start an incremental search over chunked input"""
+        return SignatureStream(self)
+
+
+class SignatureStream:
+    """Incremental search state for one chunked input"""
+
+    def __init__(self, matcher: SignatureMatcher):
+        self.matcher = matcher
+        self.match: Optional[bytes] = None
+        self._tail = b''
+
+    def feed(self, chunk) -> Optional[bytes]:
+        """Search the next chunk; returns the first match once one is found"""
+        if self.match is not None or not self.matcher.signatures:
+            return self.match
+
+        view = memoryview(chunk).cast('B')
+        overlap = self.matcher.max_length - 1
+
+        # Signatures straddling the previous chunk boundary
+        if self._tail:
+            boundary = self._tail + bytes(view[:overlap])
+            self.match = self.matcher._search_lowered(boundary.lower())
+            if self.match is not None:
+                return self.match
+
+        self.match = self.matcher.search(view)
+
+        if overlap:
+            if len(view) >= overlap:
+                self._tail = bytes(view[len(view) - overlap:])
+            else:
+                self._tail = (self._tail + bytes(view))[-overlap:]
+        return self.match
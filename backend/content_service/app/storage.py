@@ -1,6 +1,8 @@
 import os
+import base64
 import logging
 import re
+import uuid
 from typing import Optional
 from app.config import settings
 
@@ -45,9 +47,44 @@ def presign_local(filename: str) -> str:
     return path
 
 
+class LocalMediaStager:
+    """Write an upload into LOCAL_MEDIA_DIR one chunk at a time.
+
+    Chunks go to a hidden ``.partial`` file that is renamed into place on
+    commit, so a rejected or interrupted upload never appears as media.
+    """
+
+    def __init__(self, filename: str):
+        ensure_local_dir()
+        self.safe_name = _safe_filename(filename)
+        self.path = os.path.join(settings.LOCAL_MEDIA_DIR, self.safe_name)
+        self._partial_path = os.path.join(
+            settings.LOCAL_MEDIA_DIR, f".{uuid.uuid4().hex}.{self.safe_name}.partial"
+        )
+        self._fh = open(self._partial_path, "wb")
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self._fh.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> str:
+        self._fh.close()
+        os.replace(self._partial_path, self.path)
+        logger.info("Saved media locally: %s (%d bytes, streamed)", self.path, self.size)
+        return self.path
+
+    def abort(self) -> None:
+        self._fh.close()
+        try:
+            os.remove(self._partial_path)
+        except FileNotFoundError:
+            pass
+
+
 # Try to import Azure SDK; if not available, we gracefully fall back to local.
 try:
-    from azure.storage.blob import BlobServiceClient, ContentSettings
+    from azure.storage.blob import BlobServiceClient, BlobBlock, ContentSettings
 
     def _ensure_container(client: BlobServiceClient, container_name: str):
         try:
@@ -64,7 +101,7 @@ try:
                 logger.exception("Failed to ensure azure container %s: %s", container_name, exc)
                 raise
 
-    def save_azure(filename: str, content: bytes, content_type: Optional[str] = None) -> str:
+    def _get_blob_client(filename: str):
         conn = settings.AZURE_STORAGE_CONNECTION_STRING
         if not conn:
             raise RuntimeError("Azure connection string not configured")
@@ -73,24 +110,77 @@ try:
         # ensure container exists
         _ensure_container(client, container)
         blob_name = _safe_filename(filename)
-        blob_client = client.get_blob_client(container=container, blob=blob_name)
-        kwargs = {}
-        if content_type:
-            kwargs["content_settings"] = ContentSettings(content_type=content_type)
-        blob_client.upload_blob(content, overwrite=True, **kwargs)
-        
+        return client.get_blob_client(container=container, blob=blob_name)
+
+    def _blob_url(blob_client) -> str:
+        conn = settings.AZURE_STORAGE_CONNECTION_STRING or ""
         # For Azurite, return the actual HTTP URL instead of azure://
         if "localhost" in conn or "127.0.0.1" in conn:
             url = blob_client.url
             logger.info("Uploaded media to Azurite: %s", url)
         else:
-            url = f"azure://{container}/{blob_name}"
+            url = f"azure://{blob_client.container_name}/{blob_client.blob_name}"
             logger.info("Uploaded media to Azure: %s", url)
         return url
 
+    def save_azure(filename: str, content: bytes, content_type: Optional[str] = None) -> str:
+        blob_client = _get_blob_client(filename)
+        kwargs = {}
+        if content_type:
+            kwargs["content_settings"] = ContentSettings(content_type=content_type)
+        blob_client.upload_blob(content, overwrite=True, **kwargs)
+        return _blob_url(blob_client)
+
+    class AzureBlockBlobStager:
+        """Stage an upload to Azure as block-blob blocks while it streams in.
+
+        Only one block is buffered at a time. Nothing becomes visible until
+        ``commit()`` writes the block list; blocks left uncommitted by
+        ``abort()`` are garbage-collected by the storage service.
+        """
+
+        def __init__(self, filename: str, content_type: Optional[str] = None):
+            self._blob_client = _get_blob_client(filename)
+            self._content_type = content_type
+            self._block_size = max(1, settings.AZURE_BLOCK_SIZE_MB) * 1024 * 1024
+            self._pending = bytearray()
+            self._block_ids = []
+            self.size = 0
+
+        def _stage_block(self, data: bytes) -> None:
+            # Block ids must be base64 and all the same length within a blob
+            block_id = base64.b64encode(f"{len(self._block_ids):08d}".encode()).decode()
+            self._blob_client.stage_block(block_id=block_id, data=data)
+            self._block_ids.append(block_id)
+
+        def write(self, chunk: bytes) -> None:
+            self._pending.extend(chunk)
+            self.size += len(chunk)
+            while len(self._pending) >= self._block_size:
+                self._stage_block(bytes(self._pending[:self._block_size]))
+                del self._pending[:self._block_size]
+
+        def commit(self) -> str:
+            if self._pending:
+                self._stage_block(bytes(self._pending))
+                self._pending.clear()
+            kwargs = {}
+            if self._content_type:
+                kwargs["content_settings"] = ContentSettings(content_type=self._content_type)
+            self._blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for block_id in self._block_ids], **kwargs
+            )
+            return _blob_url(self._blob_client)
+
+        def abort(self) -> None:
+            self._pending.clear()
+            self._block_ids.clear()
+
 except Exception:
     BlobServiceClient = None
+    BlobBlock = None
     ContentSettings = None
+    AzureBlockBlobStager = None
 
 
 def save_media(filename: str, content: bytes, content_type: Optional[str] = None) -> str:
@@ -105,3 +195,18 @@ def save_media(filename: str, content: bytes, content_type: Optional[str] = None
         except Exception as exc:
             logger.warning("Azure upload failed, falling back to local storage: %s", exc)
     return save_local(filename, content)
+
+
+def open_media_stager(filename: str, content_type: Optional[str] = None):
+    """Open a chunked writer for an upload, with the same Azure-then-local
+    preference as save_media().
+
+    The returned stager exposes ``write(chunk)``, ``commit() -> path`` and
+    ``abort()``.
+    """
+    if getattr(settings, "AZURE_STORAGE_CONNECTION_STRING", None) and AzureBlockBlobStager is not None:
+        try:
+            return AzureBlockBlobStager(filename, content_type=content_type)
+        except Exception as exc:
+            logger.warning("Azure staging unavailable, falling back to local storage: %s", exc)
+    return LocalMediaStager(filename)
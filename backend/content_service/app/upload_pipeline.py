@@ -0,0 +1,88 @@
+"""
+Streaming upload ingest.
+
+Reads an ``UploadFile`` in fixed-size chunks and feeds every chunk, in a single
+pass, to an incremental SHA-256, the content scanner's streaming session and a
+media stager (local ``.partial`` file or Azure block-blob blocks). Peak memory
+per upload is bounded by the chunk size instead of the file size.
+"""
+
+import asyncio
+import hashlib
+import logging
+from typing import Any, Optional
+
+from app.config import settings
+from .storage import open_media_stager
+
+logger = logging.getLogger(__name__)
+
+
+class UploadIngestResult:
+    """Outcome of a streamed upload"""
+
+    def __init__(self, filename: str, content_type: str):
+        self.filename = filename
+        self.content_type = content_type
+        self.file_size = 0
+        self.file_hash: Optional[str] = None
+        self.scan_result: Any = None
+        self.path: Optional[str] = None
+
+    @property
+    def blocked(self) -> bool:
+        return getattr(self.scan_result, "security_level", None) == "blocked"
+
+
+async def ingest_upload(
+    upload,
+    filename: Optional[str] = None,
+    content_type: Optional[str] = None,
+    scanner=None,
+    chunk_size: Optional[int] = None,
+) -> UploadIngestResult:
+    """Stream an upload through hashing, scanning and storage.
+
+    When a scanner is given and it blocks the content, the staged bytes are
+    discarded and ``path`` stays None. Reading stops early once the scanner
+    has already decided (signature hit or size limit exceeded).
+    """
+    filename = filename or upload.filename or "upload.bin"
+    content_type = content_type or upload.content_type or "application/octet-stream"
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE_KB * 1024
+
+    result = UploadIngestResult(filename, content_type)
+    session = scanner.begin_stream_scan(filename, content_type) if scanner is not None else None
+    hasher = hashlib.sha256() if session is None else None
+
+    stager = await asyncio.to_thread(open_media_stager, filename, content_type)
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            result.file_size += len(chunk)
+            if session is not None:
+                session.update(chunk)
+                if session.should_stop:
+                    break
+            else:
+                hasher.update(chunk)
+            await asyncio.to_thread(stager.write, chunk)
+
+        if session is not None:
+            result.scan_result = await session.finalize()
+            result.file_hash = getattr(result.scan_result, "file_hash", None)
+        else:
+            result.file_hash = hasher.hexdigest()
+
+        if result.blocked:
+            await asyncio.to_thread(stager.abort)
+            logger.info("Discarded blocked upload %s (%d bytes read)", filename, result.file_size)
+        else:
+            result.path = await asyncio.to_thread(stager.commit)
+    except BaseException:
+        stager.abort()
+        raise
+
+    return result
@@ -0,0 +1,437 @@
+"""
+WebSocket fan-out hub used by DeviceWebSocketManager.
+
+Every connection gets a bounded send queue drained by its own writer task, so
+a broadcast only enqueues and never waits on a socket; one slow dashboard can
+no longer stall everybody else. Messages are serialized once by the caller and
+the same text is queued for every recipient.
+
+When a queue is full the connection's slow-consumer policy applies:
+
+* ``DROP_OLDEST`` (admin dashboards): the oldest queued message is discarded
+  and counted; dashboards only show the latest state anyway.
+* ``DISCONNECT`` (devices): the socket is closed and its unsent messages are
+  handed to ``on_device_evicted`` so they can be redelivered when the device
+  reconnects.
+
+With several uvicorn workers a device is connected to exactly one of them.
+Hubs announce device presence over a ``Backplane`` and route device messages
+to the owning worker; admin broadcasts go to every worker. ``RedisBackplane``
+is the production implementation, ``InProcessBackplane`` connects hubs
+within one process for tests. Without a backplane the hub is local only.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from enum import Enum
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+Envelope = Dict[str, Any]
+
+
+class SlowConsumerPolicy(str, Enum):
+    """What to do when a connection's send queue is full"""
+    DROP_OLDEST = "drop_oldest"
+    DISCONNECT = "disconnect"
+
+
+class HubConnection:
+    """One socket, its bounded send queue and its writer task"""
+
+    def __init__(self, hub: "WebSocketHub", websocket, max_queue: int,
+                 policy: SlowConsumerPolicy, device_id: Optional[str] = None):
+        self.hub = hub
+        self.websocket = websocket
+        self.device_id = device_id
+        self.max_queue = max_queue
+        self.policy = policy
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self._pending: Deque[str] = deque()
+        self._in_flight: Optional[str] = None
+        self._ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._write_loop())
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def offer(self, text: str) -> bool:
+        """Queue a message; False if it was not accepted"""
+        if self.closed:
+            return False
+        if len(self._pending) >= self.max_queue:
+            if self.policy is SlowConsumerPolicy.DISCONNECT:
+                self.hub._evict(self, reason="send queue full", slow_consumer=True)
+                return False
+            self._pending.popleft()
+            self.dropped += 1
+            self.hub._metrics['messages_dropped'] += 1
+        self._pending.append(text)
+        self._ready.set()
+        return True
+
+    def preload(self, texts: Iterable[str]) -> None:
+        """Queue a reconnect backlog ahead of new messages, ignoring the size limit"""
+        if self.closed:
+            return
+        self._pending.extend(texts)
+        if self._pending:
+            self._ready.set()
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                while not self._pending:
+                    self._ready.clear()
+                    await self._ready.wait()
+                self._in_flight = self._pending.popleft()
+                await self.websocket.send_text(self._in_flight)
+                self._in_flight = None
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.hub._evict(self, reason=f"send failed: {e}")
+
+    def close(self) -> List[str]:
+        """Stop the writer; returns the messages that were not sent"""
+        if self.closed:
+            return []
+        self.closed = True
+        self._task.cancel()
+        unsent = ([self._in_flight] if self._in_flight is not None else []) + list(self._pending)
+        self._in_flight = None
+        self._pending.clear()
+        return unsent
+
+
+class Backplane(ABC):
+    """Carries hub envelopes (JSON-serializable dicts) between workers"""
+
+    @abstractmethod
+    async def start(self, handler: Callable[[Envelope], None]) -> None:
+        """Subscribe and start delivering envelopes to ``handler``"""
+        pass
+
+    @abstractmethod
+    async def publish(self, envelope: Envelope) -> None:
+        """Send an envelope to every subscribed worker, this one included"""
+        pass
+
+    @abstractmethod
+    async def stop(self) -> None:
+        """Stop delivering envelopes and release the connection"""
+        pass
+
+
+class InProcessBackplane(Backplane):
+    """Backplane between hubs in one process; use ``peer()`` for each extra hub"""
+
+    def __init__(self, _subscribers: Optional[List[Callable[[Envelope], None]]] = None):
+        self._subscribers = _subscribers if _subscribers is not None else []
+        self._handler: Optional[Callable[[Envelope], None]] = None
+
+    def peer(self) -> "InProcessBackplane":
+        return InProcessBackplane(self._subscribers)
+
+    async def start(self, handler: Callable[[Envelope], None]) -> None:
+        self._handler = handler
+        self._subscribers.append(handler)
+
+    async def publish(self, envelope: Envelope) -> None:
+        # Round-trip through JSON like a real backplane would
+        payload = json.dumps(envelope)
+        for handler in list(self._subscribers):
+            handler(json.loads(payload))
+
+    async def stop(self) -> None:
+        if self._handler in self._subscribers:
+            self._subscribers.remove(self._handler)
+        self._handler = None
+
+
+class RedisBackplane(Backplane):
+    """Redis pub/sub backplane shared by all workers"""
+
+    def __init__(self, url: str, channel: str = "adara:websocket-hub"):
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Callable[[Envelope], None]) -> None:
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(self.url)
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._listen(handler))
+
+    async def _listen(self, handler: Callable[[Envelope], None]) -> None:
+        async for message in self._pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            try:
+                handler(json.loads(message["data"]))
+            except Exception as e:
+                logger.error(f"Failed to handle WebSocket backplane message: {e}")
+
+    async def publish(self, envelope: Envelope) -> None:
+        await self._redis.publish(self.channel, json.dumps(envelope))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+class WebSocketHub:
+    """Local connections plus backplane routing for one worker"""
+
+    def __init__(self, backplane: Optional[Backplane] = None, device_queue_size: int = 256,
+                 admin_queue_size: int = 1024,
+                 on_device_evicted: Optional[Callable[[str, List[str]], None]] = None):
+        self.worker_id = uuid.uuid4().hex
+        self.backplane = backplane
+        self.device_queue_size = device_queue_size
+        self.admin_queue_size = admin_queue_size
+        # Receives (device_id, unsent messages) when the hub drops a device connection
+        self.on_device_evicted = on_device_evicted
+
+        self.devices: Dict[str, HubConnection] = {}
+        self.admins: Set[HubConnection] = set()
+        self.remote_devices: Dict[str, str] = {}  # device_id -> owning worker id
+        self._background: Set[asyncio.Task] = set()
+        self._started = False
+        self._metrics = {
+            'messages_queued': 0,
+            'messages_dropped': 0,
+            'slow_consumer_disconnects': 0,
+            'failed_connections': 0,
+            'backplane_published': 0,
+            'backplane_received': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    async def start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        if self.backplane:
+            await self.backplane.start(self._on_envelope)
+            await self._publish({"kind": "sync_request"})
+
+    async def stop(self) -> None:
+        if not self._started:
+            return
+        self._started = False
+        if self.backplane:
+            await self._publish({"kind": "worker_down"})
+            await self.backplane.stop()
+        for connection in list(self.devices.values()) + list(self.admins):
+            connection.close()
+        self.devices.clear()
+        self.admins.clear()
+        self.remote_devices.clear()
+
+    # ------------------------------------------------------------------
+    # Connections
+    # ------------------------------------------------------------------
+
+    async def add_device(self, device_id: str, websocket) -> HubConnection:
+        """Register a device socket, replacing any previous one for the device"""
+        connection = HubConnection(self, websocket, self.device_queue_size,
+                                   SlowConsumerPolicy.DISCONNECT, device_id=device_id)
+        previous = self.devices.get(device_id)
+        self.devices[device_id] = connection
+        if previous is not None:
+            connection.preload(previous.close())
+        self.remote_devices.pop(device_id, None)
+        await self._publish({"kind": "presence", "device_ids": [device_id], "online": True})
+        return connection
+
+    async def remove_device(self, device_id: str, websocket=None) -> List[str]:
+        """Unregister a device socket; returns its unsent messages"""
+        connection = self.devices.get(device_id)
+        if connection is None or (websocket is not None and connection.websocket is not websocket):
+            return []
+        del self.devices[device_id]
+        await self._publish({"kind": "presence", "device_ids": [device_id], "online": False})
+        return connection.close()
+
+    def add_admin(self, websocket) -> HubConnection:
+        connection = HubConnection(self, websocket, self.admin_queue_size, SlowConsumerPolicy.DROP_OLDEST)
+        self.admins.add(connection)
+        return connection
+
+    def remove_admin(self, websocket) -> None:
+        for connection in [c for c in self.admins if c.websocket is websocket]:
+            self.admins.discard(connection)
+            connection.close()
+
+    def is_device_connected(self, device_id: str) -> bool:
+        """Connected to this worker or, as far as the backplane says, another one"""
+        return device_id in self.devices or device_id in self.remote_devices
+
+    def _evict(self, connection: HubConnection, reason: str, slow_consumer: bool = False) -> None:
+        """Drop a connection the hub gave up on (slow consumer or dead socket)"""
+        if connection.closed:
+            return
+        unsent = connection.close()
+        if slow_consumer:
+            self._metrics['slow_consumer_disconnects'] += 1
+        else:
+            self._metrics['failed_connections'] += 1
+
+        if connection.device_id is None:
+            self.admins.discard(connection)
+            logger.warning(f"Dropped admin WebSocket: {reason}")
+        elif self.devices.get(connection.device_id) is connection:
+            del self.devices[connection.device_id]
+            logger.warning(f"Dropped WebSocket for device {connection.device_id}: {reason}")
+            self._spawn(self._publish({"kind": "presence", "device_ids": [connection.device_id], "online": False}))
+            if self.on_device_evicted and unsent:
+                self.on_device_evicted(connection.device_id, unsent)
+        self._spawn(self._close_socket(connection.websocket))
+
+    @staticmethod
+    async def _close_socket(websocket) -> None:
+        try:
+            await websocket.close(code=1013, reason="Try again later")
+        except Exception:
+            pass
+
+    # ------------------------------------------------------------------
+    # Sending
+    # ------------------------------------------------------------------
+
+    async def send_to_device(self, device_id: str, text: str) -> bool:
+        """Queue a message for one device; False if it is not connected anywhere"""
+        return not await self.send_to_devices([device_id], text)
+
+    async def send_to_devices(self, device_ids: Iterable[str], text: str) -> List[str]:
+        """Queue the same message for many devices; returns those not connected anywhere"""
+        undelivered = []
+        remote: Dict[str, List[str]] = {}
+        for device_id in device_ids:
+            connection = self.devices.get(device_id)
+            if connection is not None:
+                if connection.offer(text):
+                    self._metrics['messages_queued'] += 1
+                else:
+                    undelivered.append(device_id)
+                continue
+            owner = self.remote_devices.get(device_id)
+            if owner is not None and self.backplane:
+                remote.setdefault(owner, []).append(device_id)
+            else:
+                undelivered.append(device_id)
+
+        for owner, owned in remote.items():
+            await self._publish({"kind": "devices", "to": owner, "device_ids": owned, "text": text})
+        return undelivered
+
+    async def broadcast_to_admins(self, text: str) -> None:
+        """Queue a message for every admin connection on every worker"""
+        self._offer_admins(text)
+        await self._publish({"kind": "admins", "text": text})
+
+    def _offer_admins(self, text: str) -> None:
+        for connection in list(self.admins):
+            if connection.offer(text):
+                self._metrics['messages_queued'] += 1
+
+    # ------------------------------------------------------------------
+    # Backplane
+    # ------------------------------------------------------------------
+
+    async def _publish(self, envelope: Envelope) -> None:
+        if not self.backplane or not self._started:
+            return
+        envelope["origin"] = self.worker_id
+        try:
+            await self.backplane.publish(envelope)
+            self._metrics['backplane_published'] += 1
+        except Exception as e:
+            logger.error(f"Failed to publish to WebSocket backplane: {e}")
+
+    def _on_envelope(self, envelope: Envelope) -> None:
+        origin = envelope.get("origin")
+        if origin == self.worker_id:
+            return
+        to = envelope.get("to")
+        if to is not None and to != self.worker_id:
+            return
+        self._metrics['backplane_received'] += 1
+        kind = envelope.get("kind")
+
+        if kind == "admins":
+            self._offer_admins(envelope["text"])
+        elif kind == "devices":
+            bounced = []
+            for device_id in envelope["device_ids"]:
+                connection = self.devices.get(device_id)
+                if connection is not None and connection.offer(envelope["text"]):
+                    self._metrics['messages_queued'] += 1
+                else:
+                    bounced.append(device_id)
+            if bounced:
+                # Stale presence on the sender; let it queue the message as offline
+                self._spawn(self._publish({"kind": "bounce", "to": origin, "device_ids": bounced,
+                                           "text": envelope["text"]}))
+        elif kind == "bounce":
+            for device_id in envelope["device_ids"]:
+                self.remote_devices.pop(device_id, None)
+                if self.on_device_evicted:
+                    self.on_device_evicted(device_id, [envelope["text"]])
+        elif kind == "presence":
+            for device_id in envelope["device_ids"]:
+                if envelope["online"]:
+                    self.remote_devices[device_id] = origin
+                elif self.remote_devices.get(device_id) == origin:
+                    del self.remote_devices[device_id]
+        elif kind == "sync_request":
+            if self.devices:
+                self._spawn(self._publish({"kind": "presence", "to": origin,
+                                           "device_ids": list(self.devices), "online": True}))
+        elif kind == "worker_down":
+            for device_id in [d for d, owner in self.remote_devices.items() if owner == origin]:
+                del self.remote_devices[device_id]
+
+    def _spawn(self, coro) -> None:
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+            return
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self._metrics,
+            'worker_id': self.worker_id,
+            'local_devices': len(self.devices),
+            'remote_devices': len(self.remote_devices),
+            'admin_connections': len(self.admins),
+            'queued_device_messages': sum(len(c) for c in self.devices.values()),
+            'backplane': type(self.backplane).__name__ if self.backplane else None
+        }
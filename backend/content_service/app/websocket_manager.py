@@ -2,30 +2,62 @@ import json
 import logging
 import asyncio
 from typing import Dict, List, Set, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 from fastapi import WebSocket, WebSocketDisconnect
 from app.repo import repo
-from app.device_auth import device_auth_service
+from app.heartbeat_pipeline import heartbeat_pipeline
+from app.config import settings
+from app.websocket_hub import WebSocketHub, RedisBackplane
+from app.device_outbox import DeviceOutbox
+from app.monitoring.liveness import LivenessTracker, device_liveness
 
 logger = logging.getLogger(__name__)
 
 class DeviceWebSocketManager:
     """Manages WebSocket connections for real-time device communication"""
     
-    def __init__(self):
-        # Active WebSocket connections
-        self.device_connections: Dict[str, WebSocket] = {}  # device_id -> websocket
-        self.admin_connections: Set[WebSocket] = set()  # Admin dashboard connections
+    def __init__(self, hub: Optional[WebSocketHub] = None, outbox: Optional[DeviceOutbox] = None,
+                 liveness: Optional[LivenessTracker] = None):
+        # Active WebSocket connections, each with its own send queue and writer
+        self.hub = hub or WebSocketHub(
+            backplane=RedisBackplane(settings.WEBSOCKET_BACKPLANE_URL) if settings.WEBSOCKET_BACKPLANE_URL else None,
+            device_queue_size=settings.WEBSOCKET_DEVICE_QUEUE_SIZE,
+            admin_queue_size=settings.WEBSOCKET_ADMIN_QUEUE_SIZE
+        )
+        self.hub.on_device_evicted = self._requeue_unsent
         
-        # Message queues for offline devices
-        self.device_message_queues: Dict[str, List[Dict]] = {}
+        # Durable outbox for offline devices, replayed as one acknowledged batch on reconnect
+        self.outbox = outbox or DeviceOutbox()
+        self._requeue_tasks: Dict[str, asyncio.Task] = {}  # device_id -> pending requeue of unsent messages
+        
+        # Liveness index fed by socket events and heartbeats; no per-device DB reads
+        self.liveness = liveness or device_liveness
+        self._liveness_seeded = False
         
         # Background tasks
         self.cleanup_task: Optional[asyncio.Task] = None
         self.heartbeat_task: Optional[asyncio.Task] = None
         
+    @property
+    def device_connections(self) -> Dict[str, WebSocket]:
+        """Devices connected to this worker (device_id -> websocket)"""
+        return {device_id: connection.websocket for device_id, connection in self.hub.devices.items()}
+    
+    @property
+    def admin_connections(self) -> Set[WebSocket]:
+        """Admin dashboards connected to this worker"""
+        return {connection.websocket for connection in self.hub.admins}
+    
     async def start_background_tasks(self):
         """Start background maintenance tasks"""
+        await self.hub.start()
+        if not self._liveness_seeded:
+            try:
+                seeded = await self.liveness.seed_from_repo(repo)
+                self._liveness_seeded = True
+                logger.info(f"Liveness index seeded with {seeded} devices")
+            except Exception as e:
+                logger.error(f"Failed to seed device liveness index: {e}")
         if not self.cleanup_task:
             self.cleanup_task = asyncio.create_task(self._cleanup_old_messages())
         if not self.heartbeat_task:
@@ -39,24 +71,21 @@ class DeviceWebSocketManager:
         if self.heartbeat_task:
             self.heartbeat_task.cancel()
             self.heartbeat_task = None
+        await self.hub.stop()
     
     async def connect_device(self, device_id: str, websocket: WebSocket):
         """Connect a device WebSocket"""
         await websocket.accept()
-        self.device_connections[device_id] = websocket
+        connection = await self.hub.add_device(device_id, websocket)
+        self.liveness.socket_connected(device_id)
         
         logger.info(f"Device {device_id} connected via WebSocket")
         
-        # Send any queued messages
-        if device_id in self.device_message_queues:
-            for message in self.device_message_queues[device_id]:
-                try:
-                    await websocket.send_text(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Failed to send queued message to device {device_id}: {e}")
-            
-            # Clear the queue
-            del self.device_message_queues[device_id]
+        # Send queued messages as one catch-up frame
+        await self._await_requeue(device_id)
+        batch = await self.outbox.next_batch(device_id)
+        if batch:
+            connection.preload([json.dumps(batch)])
         
         # Notify admins about device connection
         await self._broadcast_to_admins({
@@ -65,10 +94,17 @@ class DeviceWebSocketManager:
             "timestamp": datetime.utcnow().isoformat()
         })
     
-    async def disconnect_device(self, device_id: str):
-        """Disconnect a device WebSocket"""
-        if device_id in self.device_connections:
-            del self.device_connections[device_id]
+    async def disconnect_device(self, device_id: str, websocket: Optional[WebSocket] = None):
+        """Disconnect a device WebSocket
+        
+        Pass the websocket to avoid dropping a newer connection from the same device.
+        """
+        if device_id in self.hub.devices:
+            unsent = await self.hub.remove_device(device_id, websocket)
+            if device_id in self.hub.devices:
+                return  # a newer connection replaced this one
+            self._requeue_unsent(device_id, unsent)
+            self.liveness.socket_disconnected(device_id)
             logger.info(f"Device {device_id} disconnected from WebSocket")
             
             # Notify admins about device disconnection
@@ -81,59 +117,89 @@ class DeviceWebSocketManager:
     async def connect_admin(self, websocket: WebSocket):
         """Connect an admin dashboard WebSocket"""
         await websocket.accept()
-        self.admin_connections.add(websocket)
+        connection = self.hub.add_admin(websocket)
         logger.info("Admin dashboard connected via WebSocket")
         
         # Send current device status summary
-        await self._send_device_status_summary(websocket)
+        await self._send_device_status_summary(connection)
     
     async def disconnect_admin(self, websocket: WebSocket):
         """Disconnect an admin WebSocket"""
-        self.admin_connections.discard(websocket)
+        self.hub.remove_admin(websocket)
         logger.info("Admin dashboard disconnected from WebSocket")
     
     async def send_to_device(self, device_id: str, message: Dict) -> bool:
-        """Send a message to a specific device"""
+        """Send a message to a specific device
+        
+        Returns False if the device is not connected to any worker; the
+        message is then queued until it reconnects.
+        """
         message["timestamp"] = datetime.utcnow().isoformat()
         
-        if device_id in self.device_connections:
-            try:
-                websocket = self.device_connections[device_id]
-                await websocket.send_text(json.dumps(message))
-                return True
-            except Exception as e:
-                logger.error(f"Failed to send message to device {device_id}: {e}")
-                # Remove dead connection
-                await self.disconnect_device(device_id)
+        if await self.hub.send_to_device(device_id, json.dumps(message)):
+            return True
         
         # Queue message for when device comes online
-        if device_id not in self.device_message_queues:
-            self.device_message_queues[device_id] = []
+        await self._queue_for_offline(device_id, message)
+        return False
+    
+    async def broadcast_to_devices(self, company_id: str, message: Dict) -> int:
+        """Send the same message to every device of a company; returns how many were online"""
+        message["timestamp"] = datetime.utcnow().isoformat()
+        devices = await repo.list_digital_screens(company_id)
+        device_ids = [device["id"] for device in devices if device.get("id")]
         
-        self.device_message_queues[device_id].append(message)
+        offline = await self.hub.send_to_devices(device_ids, json.dumps(message))
+        for device_id in offline:
+            await self._queue_for_offline(device_id, dict(message))
+        return len(device_ids) - len(offline)
+    
+    async def _queue_for_offline(self, device_id: str, message: Dict):
+        await self._await_requeue(device_id)
+        await self.outbox.enqueue(device_id, message)
         logger.info(f"Queued message for offline device {device_id}")
-        return False
     
-    async def notify_content_distribution(self, device_id: str, content_id: str, distribution_id: str):
+    def _requeue_unsent(self, device_id: str, unsent: List[str]):
+        """Move messages a dropped connection never sent back into the outbox
+        
+        Called synchronously by the hub, so the write runs as a task; later
+        outbox writes for the device wait for it to keep sequence order.
+        Catch-up frames are skipped, their messages are still in the outbox.
+        """
+        messages = [m for m in (json.loads(text) for text in unsent) if m.get("type") != "outbox_batch"]
+        if not messages:
+            return
+        previous = self._requeue_tasks.get(device_id)
+        
+        async def requeue():
+            if previous:
+                await asyncio.gather(previous, return_exceptions=True)
+            await self.outbox.enqueue_many(device_id, messages)
+            logger.info(f"Requeued {len(messages)} unsent messages for device {device_id}")
+        
+        self._requeue_tasks[device_id] = asyncio.get_running_loop().create_task(requeue())
+    
+    async def _await_requeue(self, device_id: str):
+        task = self._requeue_tasks.get(device_id)
+        if task:
+            try:
+                await task
+            except Exception as e:
+                logger.error(f"Failed to requeue unsent messages for device {device_id}: {e}")
+            if self._requeue_tasks.get(device_id) is task:
+                del self._requeue_tasks[device_id]
+    
+    async def notify_content_distribution(self, device_id: str, content_id: str, distribution_id: str,
+                                          content: Optional[Dict] = None):
         """Notify a device about new content distribution"""
         try:
             # Get content metadata
-            content = await repo.get_content_meta(content_id)
+            content = content or await repo.get_content_meta(content_id)
             if not content:
                 logger.error(f"Content {content_id} not found for distribution to device {device_id}")
                 return
             
-            message = {
-                "type": "content_distributed",
-                "data": {
-                    "content_id": content_id,
-                    "distribution_id": distribution_id,
-                    "filename": content.get("filename"),
-                    "content_type": content.get("content_type"),
-                    "size": content.get("size"),
-                    "download_url": f"/api/content/download/{content_id}"  # TODO: Implement actual download endpoint
-                }
-            }
+            message = self._content_distributed_message(content, content_id, distribution_id)
             
             success = await self.send_to_device(device_id, message)
             
@@ -167,30 +233,45 @@ class DeviceWebSocketManager:
         except Exception as e:
             logger.error(f"Failed to notify device {device_id} about content update: {e}")
     
+    @staticmethod
+    def _content_distributed_message(content: Dict, content_id: str, distribution_id: str) -> Dict:
+        return {
+            "type": "content_distributed",
+            "data": {
+                "content_id": content_id,
+                "distribution_id": distribution_id,
+                "filename": content.get("filename"),
+                "content_type": content.get("content_type"),
+                "size": content.get("size"),
+                "download_url": f"/api/content/download/{content_id}"  # TODO: Implement actual download endpoint
+            }
+        }
+    
     async def broadcast_content_distribution(self, company_id: str, content_id: str, distribution_records: List[Dict]):
-        """Broadcast content distribution to all devices in a company"""
+        """Broadcast content distribution to all devices in a company
+        
+        Content metadata is loaded once; each message only enqueues, so the
+        broadcast does not wait on any device socket.
+        """
         try:
+            content = await repo.get_content_meta(content_id)
+            if not content:
+                logger.error(f"Content {content_id} not found for distribution to company {company_id}")
+                return
+            
             devices = await repo.list_digital_screens(company_id)
+            distribution_ids = {
+                dist.get("device_id"): dist.get("id") for dist in distribution_records if dist.get("id")
+            }
             
+            online = 0
             for device in devices:
-                device_id = device.get("id")
-                if device_id:
-                    # Find the distribution record for this device
-                    device_distribution = next(
-                        (dist for dist in distribution_records if dist.get("device_id") == device_id),
-                        None
-                    )
-                    
-                    if device_distribution:
-                        distribution_id = device_distribution.get("id")
-                        if distribution_id:
-                            await self.notify_content_distribution(
-                                device_id, 
-                                content_id, 
-                                distribution_id
-                            )
+                distribution_id = distribution_ids.get(device.get("id"))
+                if distribution_id:
+                    message = self._content_distributed_message(content, content_id, distribution_id)
+                    online += await self.send_to_device(device["id"], message)
             
-            logger.info(f"Broadcasted content {content_id} distribution to {len(devices)} devices in company {company_id}")
+            logger.info(f"Broadcasted content {content_id} distribution to {len(devices)} devices in company {company_id} ({online} online)")
             
         except Exception as e:
             logger.error(f"Failed to broadcast content distribution: {e}")
@@ -211,6 +292,9 @@ class DeviceWebSocketManager:
         elif message_type == "content_download_complete":
             # Handle content download completion
             await self._handle_content_download_complete(device_id, message.get("data", {}))
+        elif message_type == "outbox_ack":
+            # Device processed a catch-up batch up to the given sequence number
+            await self._handle_outbox_ack(device_id, message.get("data", {}))
         elif message_type == "error":
             # Handle error reports
             await self._handle_device_error(device_id, message.get("data", {}))
@@ -220,8 +304,7 @@ class DeviceWebSocketManager:
     async def _handle_device_heartbeat(self, device_id: str, heartbeat_data: Dict):
         """Process device heartbeat via WebSocket"""
         try:
-            # Use existing heartbeat processing
-            result = await device_auth_service.process_device_heartbeat(device_id, heartbeat_data)
+            result = await heartbeat_pipeline.process(device_id, heartbeat_data)
             
             if result.get("success"):
                 # Broadcast heartbeat update to admins
@@ -303,6 +386,20 @@ class DeviceWebSocketManager:
         except Exception as e:
             logger.error(f"Failed to handle download completion from device {device_id}: {e}")
     
+    async def _handle_outbox_ack(self, device_id: str, ack_data: Dict):
+        """Drop acknowledged outbox messages and send the next batch, if any"""
+        try:
+            seq = int(ack_data["seq"])
+            await self.outbox.ack(device_id, seq)
+            
+            batch = await self.outbox.next_batch(device_id)
+            if batch:
+                await self.hub.send_to_device(device_id, json.dumps(batch))
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"Invalid outbox acknowledgment from device {device_id}: {ack_data}")
+        except Exception as e:
+            logger.error(f"Failed to handle outbox acknowledgment from device {device_id}: {e}")
+    
     async def _handle_device_error(self, device_id: str, error_data: Dict):
         """Handle device error reports"""
         try:
@@ -322,54 +419,22 @@ class DeviceWebSocketManager:
             logger.error(f"Failed to handle device error from {device_id}: {e}")
     
     async def _broadcast_to_admins(self, message: Dict):
-        """Broadcast message to all admin connections"""
-        if not self.admin_connections:
-            return
-        
-        dead_connections = []
-        message_text = json.dumps(message)
+        """Broadcast message to all admin connections on every worker
         
-        for websocket in self.admin_connections:
-            try:
-                await websocket.send_text(message_text)
-            except Exception as e:
-                logger.error(f"Failed to send to admin connection: {e}")
-                dead_connections.append(websocket)
-        
-        # Remove dead connections
-        for websocket in dead_connections:
-            self.admin_connections.discard(websocket)
+        Serialized once and queued per connection; slow dashboards lose their
+        oldest queued messages instead of delaying the broadcast.
+        """
+        await self.hub.broadcast_to_admins(json.dumps(message))
     
-    async def _send_device_status_summary(self, websocket: WebSocket):
+    async def _send_device_status_summary(self, connection):
         """Send current device status summary to new admin connection"""
         try:
-            # Get all companies and their devices
-            companies = await repo.list_companies()
-            device_summary = []
-            
-            for company in companies:
-                company_id = company.get("id")
-                devices = await repo.list_digital_screens(company_id)
-                
-                for device in devices:
-                    device_id = device.get("id")
-                    if device_id:
-                        # Get latest heartbeat
-                        latest_heartbeat = await repo.get_latest_heartbeat(device_id)
-                    
-                    # Check online status
-                    is_online = device_id in self.device_connections
-                    
-                    device_summary.append({
-                        "device_id": device_id,
-                        "name": device.get("name"),
-                        "company_name": company.get("name"),
-                        "is_online": is_online,
-                        "latest_heartbeat": latest_heartbeat,
-                        "performance_score": latest_heartbeat.get("performance_score") if latest_heartbeat else None
-                    })
+            device_summary = self.liveness.summary()
+            for device in device_summary:
+                # Devices connected to another worker are online here too
+                device["is_online"] = device["is_online"] or self.hub.is_device_connected(device["device_id"])
             
-            await websocket.send_text(json.dumps({
+            connection.offer(json.dumps({
                 "type": "device_status_summary",
                 "data": device_summary,
                 "timestamp": datetime.utcnow().isoformat()
@@ -379,78 +444,62 @@ class DeviceWebSocketManager:
             logger.error(f"Failed to send device status summary: {e}")
     
     async def _cleanup_old_messages(self):
-        """Background task to cleanup old queued messages"""
+        """Background task to purge expired outbox messages
+        
+        A no-op with MongoDB, where the TTL index on expires_at does this.
+        """
         while True:
             try:
                 await asyncio.sleep(3600)  # Run every hour
                 
-                cutoff_time = datetime.utcnow() - timedelta(hours=24)
-                
-                for device_id in list(self.device_message_queues.keys()):
-                    messages = self.device_message_queues[device_id]
-                    
-                    # Remove messages older than 24 hours
-                    filtered_messages = []
-                    for msg in messages:
-                        msg_time_str = msg.get("timestamp")
-                        if msg_time_str:
-                            msg_time = datetime.fromisoformat(msg_time_str.replace("Z", "+00:00"))
-                            if msg_time > cutoff_time:
-                                filtered_messages.append(msg)
-                    
-                    if filtered_messages:
-                        self.device_message_queues[device_id] = filtered_messages
-                    else:
-                        del self.device_message_queues[device_id]
-                
-                logger.info(f"Cleaned up old messages. Active queues: {len(self.device_message_queues)}")
+                purged = await self.outbox.purge_expired()
+                if purged:
+                    logger.info(f"Purged {purged} expired outbox messages")
                 
             except Exception as e:
                 logger.error(f"Error in message cleanup task: {e}")
     
     async def _monitor_device_heartbeats(self):
-        """Background task to monitor device heartbeat health"""
+        """Background task to alert admins about devices that went offline"""
         while True:
             try:
-                await asyncio.sleep(300)  # Check every 5 minutes
-                
-                # Get all devices
-                companies = await repo.list_companies()
-                offline_devices = []
-                
-                for company in companies:
-                    devices = await repo.list_digital_screens(company.get("id"))
-                    
-                    for device in devices:
-                        device_id = device.get("id")
-                        if device_id:
-                            # Check if device is connected
-                            is_connected = device_id in self.device_connections
-                            
-                            # Check last heartbeat time
-                            latest_heartbeat = await repo.get_latest_heartbeat(device_id)
-                        
-                        if not is_connected or not latest_heartbeat:
-                            offline_devices.append({
-                                "device_id": device_id,
-                                "name": device.get("name"),
-                                "company_name": company.get("name"),
-                                "last_seen": device.get("last_seen")
-                            })
-                
-                if offline_devices:
-                    # Broadcast offline device alert
-                    await self._broadcast_to_admins({
-                        "type": "offline_devices_alert",
-                        "data": offline_devices,
-                        "count": len(offline_devices),
-                        "timestamp": datetime.utcnow().isoformat()
-                    })
-                
-                logger.info(f"Heartbeat monitor: {len(offline_devices)} devices offline")
+                await asyncio.sleep(settings.DEVICE_LIVENESS_CHECK_INTERVAL_SECONDS)
+                await self._check_offline_devices()
                 
             except Exception as e:
                 logger.error(f"Error in heartbeat monitor task: {e}")
+    
+    async def _check_offline_devices(self) -> int:
+        """Alert admins about devices whose heartbeat deadline passed since the last check
+        
+        Only newly expired devices are looked at, so each pass costs O(newly
+        offline devices). Heartbeats may have reached another worker, so the
+        stored last_seen is checked before a device is reported.
+        """
+        expired = [
+            device_id for device_id in self.liveness.expire()
+            if not self.hub.is_device_connected(device_id)
+        ]
+        if expired:
+            expired = await self.liveness.confirm_offline(repo, expired)
+        if not expired:
+            return 0
+        
+        offline_devices = [
+            {key: device[key] for key in ("device_id", "name", "company_name", "last_seen")}
+            for device in self.liveness.summary(expired)
+        ]
+        
+        # Broadcast offline device alert
+        await self._broadcast_to_admins({
+            "type": "offline_devices_alert",
+            "data": offline_devices,
+            "count": len(offline_devices),
+            "timestamp": datetime.utcnow().isoformat()
+        })
+        
+        logger.info(f"Heartbeat monitor: {len(offline_devices)} devices went offline")
+        return len(offline_devices)
 
 # Global WebSocket manager instance
 websocket_manager = DeviceWebSocketManager()
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+Benchmark: RealTimeAnalyticsService batch ingestion throughput.
+
+Feeds synthetic device metrics through ``record_batch_metrics`` and, for
+comparison, through ``record_metric`` one at a time (what the batch path used
+to do), and reports metrics per second on one worker.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_analytics_batch.py [--metrics 200000] [--batch-size 500] [--subscribers 10]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.analytics.real_time_analytics import RealTimeAnalyticsService  # noqa: E402
+
+METRIC_SHAPES = [
+    ("impression", "content_view_start"),
+    ("impression", "content_view_end"),
+    ("engagement", "content_interaction"),
+    ("interaction", "content_interaction"),
+    ("performance", "system_metrics"),
+]
+
+
+def make_metrics(count, devices=500):
+    rng = random.Random(3)
+    timestamp = datetime.utcnow().isoformat()
+    metrics = []
+    for _ in range(count):
+        metric_type, event_type = rng.choice(METRIC_SHAPES)
+        metrics.append({
+            "metric_type": metric_type,
+            "event_type": event_type,
+            "device_id": f"device-{rng.randrange(devices)}",
+            "content_id": f"content-{rng.randrange(50)}",
+            "value": rng.random() * 10,
+            "duration_seconds": rng.random() * 30,
+            "timestamp": timestamp,
+        })
+    return metrics
+
+
+def make_service(subscribers):
+    service = RealTimeAnalyticsService()
+    # Ingestion only: no audit log writes or persistence from the background loop
+    service.audit_logger = None
+    service.repo = None
+    for i in range(subscribers):
+        service.subscribers.add(f"subscriber-{i}")
+    return service
+
+
+async def run(args):
+    metrics = make_metrics(args.metrics)
+
+    service = make_service(args.subscribers)
+    start = time.perf_counter()
+    for metric in metrics[:args.single_metrics]:
+        await service.record_metric(metric)
+    single_rate = args.single_metrics / (time.perf_counter() - start)
+    service.processing_task.cancel()
+
+    service = make_service(args.subscribers)
+    start = time.perf_counter()
+    for offset in range(0, len(metrics), args.batch_size):
+        result = await service.record_batch_metrics(metrics[offset:offset + args.batch_size])
+        assert result["success"], result
+    batch_rate = len(metrics) / (time.perf_counter() - start)
+
+    service.processing_task.cancel()
+
+    print(f"subscribers={args.subscribers} batch_size={args.batch_size}")
+    print(f"record_metric loop   {single_rate:>10,.0f} metrics/s")
+    print(f"record_batch_metrics {batch_rate:>10,.0f} metrics/s  ({batch_rate / single_rate:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--metrics", type=int, default=200_000)
+    parser.add_argument("--single-metrics", type=int, default=50_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--subscribers", type=int, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
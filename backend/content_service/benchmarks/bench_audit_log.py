@@ -0,0 +1,130 @@
+"""
+Benchmark: audit logging on the request path, and indexed audit queries.
+
+Logs ``--entries`` content and login events through ``AuditLogger`` into a
+temporary directory and reports:
+
+- the time each ``log_*`` call spends on the calling thread, against the
+  old path (``json.dumps`` with ``sort_keys`` for the checksum, then another
+  ``json.dumps`` into a ``logging.FileHandler``, both on that thread);
+- how long the writer takes to have everything on disk, and how many
+  entries share each fsync;
+- a user activity export and a scan of an IP that only shows up near the
+  end, with the number of segments each one read.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_audit_log.py [--entries 100000] [--users 5000]
+"""
+
+import argparse
+import builtins
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.security import audit_log_store  # noqa: E402
+from app.security.audit_logger import AuditLogger  # noqa: E402
+
+
+class SynchronousAuditLogger(AuditLogger):
+    """The path this replaced: checksum and write on the calling thread"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.handler = logging.FileHandler(path, encoding="utf-8")
+        self.logger = logging.getLogger("bench-audit-sync")
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def _log_entry(self, entry):
+        entry["checksum"] = hashlib.sha256(json.dumps(entry, sort_keys=True).encode()).hexdigest()
+        self.logger.info(json.dumps(entry, ensure_ascii=False))
+
+    def close(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+
+def log_events(audit, args):
+    n = args.entries
+    started = time.perf_counter()
+    for i in range(n):
+        if i % 20 == 0 and i > n * 0.9:
+            # An attacker showing up near the end of the run
+            audit.log_failed_login(f"user{i % 7}@example.com", "203.0.113.7", "invalid_credentials")
+        else:
+            audit.log_content_upload(f"u{i % args.users}", f"f{i}.mp4", "video/mp4", 1024,
+                                     f"10.0.{i % 250}.{i % 200}")
+    return time.perf_counter() - started
+
+
+def run(args):
+    root = tempfile.mkdtemp(prefix="bench-audit-")
+    try:
+        os.environ["AUDIT_LOG_DIR"] = os.path.join(root, "segments")
+        os.environ["AUDIT_LOG_SEGMENT_BYTES"] = str(args.segment_kb * 1024)
+        synchronous = SynchronousAuditLogger(os.path.join(root, "audit.log"))
+        old_s = log_events(synchronous, args)
+        synchronous.close()
+
+        audit = AuditLogger()
+        start = datetime.utcnow() - timedelta(minutes=1)
+        started = time.perf_counter()
+        submit_s = log_events(audit, args)
+        audit.store.flush(timeout=300)
+        durable_s = time.perf_counter() - started
+        metrics = audit.get_metrics()
+
+        opened = []
+        real_open = builtins.open
+
+        def counting_open(path, *a, **kw):
+            opened.append(path)
+            return real_open(path, *a, **kw)
+
+        audit_log_store.open = counting_open
+        started = time.perf_counter()
+        activity = audit.get_user_activity("u42", start, datetime.utcnow() + timedelta(minutes=1))
+        export_s = time.perf_counter() - started
+        export_reads = len(opened)
+        opened.clear()
+        started = time.perf_counter()
+        patterns = audit.detect_suspicious_patterns("203.0.113.7")
+        scan_s = time.perf_counter() - started
+        scan_reads = len(opened)
+        del audit_log_store.open
+        audit.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    n = args.entries
+    print(f"entries={n:,} users={args.users:,} segments={metrics['segments']} ({args.segment_kb}KB each)")
+    print(f"  {'old path, per call':34} {old_s / n * 1e6:>10.1f}us")
+    print(f"  {'writer thread, per call':34} {submit_s / n * 1e6:>10.1f}us")
+    print(f"  {'  all on disk after':34} {durable_s * 1000:>10,.0f}ms  "
+          f"({n / max(metrics['batches'], 1):,.0f} entries per fsync)")
+    print(f"  {'user export':34} {export_s * 1000:>10.1f}ms  {len(activity)} entries, {export_reads} segments read")
+    print(f"  {'suspicious-pattern scan':34} {scan_s * 1000:>10.1f}ms  {len(patterns)} patterns, "
+          f"{scan_reads} segments read")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--segment-kb", type=int, default=1024)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark: authenticated-request latency vs. roles per user.
+
+Times the profile resolution behind ``AuthService.get_current_user_from_token``
+for users holding 1, 5 and 20 roles, three ways:
+
+  per-role  the previous loader: get_user, get_user_roles, then one
+            get_company and one get_role per role, awaited in sequence
+  batched   repo.get_user_profile with ``$in`` batch fetches
+  cached    full token path (JWT decode + blacklist check) hitting the
+            per-(user, jti) profile cache
+
+Every repo call sleeps ``--rtt-ms`` to stand in for a database round trip.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_auth_profile.py [--roles 1 5 20] [--rtt-ms 0.5]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app import database_service  # noqa: E402
+from app.auth_service import AuthService  # noqa: E402
+from app.models import UserProfile  # noqa: E402
+from app.profile_cache import profile_cache  # noqa: E402
+from app.repo import InMemoryRepo  # noqa: E402
+
+
+class RoundTripRepo(InMemoryRepo):
+    """InMemoryRepo where each read costs one simulated database round trip"""
+
+    def __init__(self, rtt: float):
+        super().__init__()
+        self.rtt = rtt
+
+    async def get_user(self, _id):
+        await asyncio.sleep(self.rtt)
+        return await super().get_user(_id)
+
+    async def get_user_roles(self, user_id):
+        await asyncio.sleep(self.rtt)
+        return await super().get_user_roles(user_id)
+
+    async def get_role(self, _id):
+        await asyncio.sleep(self.rtt)
+        return await super().get_role(_id)
+
+    async def get_company(self, _id):
+        await asyncio.sleep(self.rtt)
+        return await super().get_company(_id)
+
+    async def get_roles_by_ids(self, ids):
+        await asyncio.sleep(self.rtt)
+        return await super().get_roles_by_ids(ids)
+
+
+async def per_role_profile(repo, user_id):
+    user = await repo.get_user(user_id)
+    user_roles = await repo.get_user_roles(user_id)
+    companies = []
+    for role in user_roles:
+        company = await repo.get_company(role["company_id"])
+        if company:
+            companies.append(company)
+    expanded_roles = []
+    for user_role in user_roles:
+        role = await repo.get_role(user_role["role_id"])
+        if role:
+            expanded_roles.append({**user_role, "role_details": role})
+    return UserProfile(**{**user, "roles": expanded_roles, "companies": companies})
+
+
+def seed(repo, roles):
+    now = datetime.utcnow()
+    repo._store["__users__"] = {"u1": {"id": "u1", "name": "Bench", "email": "bench@example.com",
+                                       "is_active": True, "created_at": now, "updated_at": now}}
+    repo._store["__companies__"] = {f"c{i}": {"id": f"c{i}", "name": f"Company {i}"} for i in range(roles)}
+    repo._store["__roles__"] = {f"r{i}": {"id": f"r{i}", "name": f"Role {i}", "company_id": f"c{i}",
+                                          "status": "active"} for i in range(roles)}
+    repo._store["__user_roles__"] = {f"ur{i}": {"id": f"ur{i}", "user_id": "u1", "company_id": f"c{i}",
+                                                "role_id": f"r{i}"} for i in range(roles)}
+
+
+async def timed(fn, requests):
+    samples = []
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), sorted(samples)[int(len(samples) * 0.99) - 1]
+
+
+async def run(args):
+    auth = AuthService()
+    auth.jwt_secret = "bench-auth-profile-secret-0123456789abcdef"
+    print(f"{'roles':>5} {'loader':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for roles in args.roles:
+        repo = RoundTripRepo(args.rtt_ms / 1000)
+        seed(repo, roles)
+        database_service.db_service.get_user_profile = repo.get_user_profile
+        token = auth.create_access_token({"id": "u1", "user_type": "COMPANY_USER", "email": "bench@example.com"})
+        profile_cache.clear()
+
+        loaders = {
+            "per-role": lambda: per_role_profile(repo, "u1"),
+            "batched": lambda: repo.get_user_profile("u1"),
+            "cached": lambda: auth.get_current_user_from_token(token),
+        }
+        for name, fn in loaders.items():
+            p50, p99 = await timed(fn, args.requests)
+            print(f"{roles:>5} {name:>9} {p50:>8.3f} {p99:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roles", nargs="+", type=int, default=[1, 5, 20])
+    parser.add_argument("--rtt-ms", type=float, default=0.5)
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmark: event log appends, group commit and replay.
+
+Runs three passes against a temporary log directory:
+
+- raw appends: ``--events`` analytics events encoded and appended to a
+  ``SegmentLog`` from a single coroutine while its committer runs. Reports
+  appends/s, fsyncs and the average number of events per fsync.
+- publish: the same events through ``AsyncEventBus.publish`` with and
+  without ``EVENT_LOG_DIR``. No workers run, so this is the publish path
+  alone, including the lane put.
+- replay: the bus is reopened on the log and replays every event to a
+  handler that does nothing.
+
+The target is 100k appends/s on one worker. Raw appends and publishes with
+the event log are each reported as PASS or FAIL against ``--target``, and the
+script exits with status 1 if either falls short. Rates depend on the
+machine, so compare against the in-memory publish rate printed alongside.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_event_log.py [--events 200000] [--commit-interval-ms 5] [--target 100000]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.events.event_bus import AsyncEventBus, Event, EventHandler, EventType, _log_record  # noqa: E402
+from app.events.event_log import SegmentLog  # noqa: E402
+
+
+class NullHandler(EventHandler):
+    def __init__(self):
+        super().__init__("null", [EventType.CONTENT_VIEWED])
+        self.handled = 0
+
+    async def handle(self, event):
+        self.handled += 1
+        return True
+
+
+def make_events(count):
+    now = datetime.utcnow()
+    return [
+        Event(event_id=str(uuid.uuid4()), event_type=EventType.CONTENT_VIEWED, timestamp=now, source="bench",
+              company_id=f"co{i % 50}", device_id=f"d{i % 10000}", content_id=f"c{i % 500}",
+              payload={"duration": 15.0, "position": i % 20})
+        for i in range(count)
+    ]
+
+
+async def raw_appends(directory, events, commit_interval):
+    log = SegmentLog(directory, commit_interval=commit_interval)
+    log.start_committer()
+    started = time.perf_counter()
+    for i, event in enumerate(events):
+        log.append(_log_record(event))
+        if i % 1000 == 999:
+            await asyncio.sleep(0)  # Let the committer run, as a real publisher would
+    appended = time.perf_counter() - started
+    await log.stop_committer()
+    durable = time.perf_counter() - started
+    metrics = log.get_metrics()
+    log.close()
+    return appended, durable, metrics
+
+
+async def publish_all(events, log_dir, commit_interval_ms):
+    bus = AsyncEventBus(workers=1, queue_capacity=len(events) + 1, backpressure="", log_dir=log_dir)
+    if bus._log is not None:
+        bus._log.log.commit_interval = bus._log.dead_letters.commit_interval = commit_interval_ms / 1000
+    bus.subscribe(NullHandler())
+    if bus._log is not None:
+        bus._log.start()
+    started = time.perf_counter()
+    for i, event in enumerate(events):
+        await bus.publish(event)
+        if i % 1000 == 999:
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    if bus._log is not None:
+        await bus._log.stop()
+        bus._log.close()
+    return elapsed
+
+
+async def replay(log_dir, count):
+    bus = AsyncEventBus(workers=1, queue_capacity=count + 1, backpressure="", log_dir=log_dir)
+    handler = NullHandler()
+    bus.subscribe(handler)
+    # A fresh handler name would start at the end of the log; rewind it to replay everything
+    bus._log._cursors[handler.name].start = bus._log.log.start
+    started = time.perf_counter()
+    await bus.start_processing()
+    queued = time.perf_counter() - started
+    while handler.handled < count:
+        await asyncio.sleep(0.01)
+    handled = time.perf_counter() - started
+    await bus.stop_processing()
+    bus._log.close()
+    return queued, handled
+
+
+async def run(args):
+    events = make_events(args.events)
+    root = tempfile.mkdtemp(prefix="bench-event-log-")
+    try:
+        appended, durable, metrics = await raw_appends(os.path.join(root, "raw"), events, args.commit_interval_ms / 1000)
+        memory_s = await publish_all(events, "", args.commit_interval_ms)
+        logged_s = await publish_all(events, os.path.join(root, "bus"), args.commit_interval_ms)
+        queued_s, replay_s = await replay(os.path.join(root, "bus"), args.events)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    n = args.events
+    print(f"events={n:,} commit interval={args.commit_interval_ms}ms "
+          f"record={metrics['bytes_written'] / n:.0f}B segments={metrics['segments']}")
+    print(f"  {'raw appends':28} {n / appended:>12,.0f}/s  ({appended * 1000:,.0f}ms, durable after {durable * 1000:,.0f}ms)")
+    print(f"  {'  fsyncs':28} {metrics['commits']:>12,}   ({n / max(metrics['commits'], 1):,.0f} events per fsync)")
+    print(f"  {'publish, in memory':28} {n / memory_s:>12,.0f}/s")
+    print(f"  {'publish, event log':28} {n / logged_s:>12,.0f}/s")
+    print(f"  {'replay, read and queue':28} {n / queued_s:>12,.0f}/s")
+    print(f"  {'replay, through handler':28} {n / replay_s:>12,.0f}/s")
+
+    passed = True
+    print(f"target {args.target:,.0f}/s:")
+    for name, rate in (("raw appends", n / appended), ("publish, event log", n / logged_s)):
+        ok = rate >= args.target
+        passed = passed and ok
+        print(f"  {name:28} {'PASS' if ok else 'FAIL':>12}   ({rate / args.target:.0%} of target)")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--commit-interval-ms", type=float, default=5.0)
+    parser.add_argument("--target", type=float, default=100000, help="appends/s each checked rate must reach")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark: DeviceHealthMonitor metric history, HealthMetric deques vs. MetricHistory rings.
+
+Records the same synthetic heartbeat samples (six metrics per heartbeat) for
+a fleet of devices and reports traced memory and the latency of a one-hour
+min/max/avg/p95 window query. The object-per-sample deques are measured on
+--legacy-devices and projected linearly to the fleet sizes, since 100k
+devices' worth of HealthMetric objects does not fit in memory.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_health_history.py [--devices 10000 100000] [--samples 60] [--legacy-devices 1000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.monitoring.device_health_monitor import HealthMetric, MetricType  # noqa: E402
+from app.monitoring.metric_history import MetricHistory  # noqa: E402
+
+METRICS = (MetricType.CPU_USAGE, MetricType.MEMORY_USAGE, MetricType.STORAGE_USAGE,
+           MetricType.TEMPERATURE, MetricType.NETWORK_STRENGTH, MetricType.BANDWIDTH)
+
+
+def record_legacy(devices, samples, start):
+    histories = {}
+    rng = random.Random(3)
+    for device in range(devices):
+        device_id = f"device-{device}"
+        history = histories[device_id] = defaultdict(lambda: deque(maxlen=1440))
+        for minute in range(samples):
+            timestamp = start + timedelta(minutes=minute)
+            for metric_type in METRICS:
+                history[metric_type].append(HealthMetric(device_id, metric_type, rng.random() * 100, timestamp))
+    return histories
+
+
+def record_compact(devices, samples, start):
+    histories = {}
+    rng = random.Random(3)
+    for device in range(devices):
+        history = histories[f"device-{device}"] = MetricHistory(capacity=1440)
+        for minute in range(samples):
+            timestamp = start + timedelta(minutes=minute)
+            for metric_type in METRICS:
+                history.record(metric_type, rng.random() * 100, timestamp)
+    return histories
+
+
+def measure(record, devices, samples, start):
+    tracemalloc.start()
+    started = time.perf_counter()
+    histories = record(devices, samples, start)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return histories, current / 1024 / 1024, elapsed
+
+
+def time_queries(query, devices, queries):
+    rng = random.Random(9)
+    started = time.perf_counter()
+    for _ in range(queries):
+        query(f"device-{rng.randrange(devices)}")
+    return (time.perf_counter() - started) / queries * 1000
+
+
+def legacy_stats(history, since):
+    values = sorted(m.value for m in history[MetricType.CPU_USAGE] if m.timestamp >= since)
+    return min(values), max(values), statistics.fmean(values), statistics.quantiles(values, n=20)[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--samples", type=int, default=60, help="heartbeats per device")
+    parser.add_argument("--legacy-devices", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    start = datetime.now(timezone.utc) - timedelta(minutes=args.samples)
+    since = start + timedelta(minutes=args.samples) - timedelta(hours=1)
+    per_device_samples = args.samples * len(METRICS)
+
+    legacy, legacy_mb, legacy_fill = measure(record_legacy, args.legacy_devices, args.samples, start)
+    legacy_ms = time_queries(lambda d, legacy=legacy: legacy_stats(legacy[d], since), args.legacy_devices, args.queries)
+    legacy_bytes = legacy_mb * 1024 * 1024 / (args.legacy_devices * per_device_samples)
+    del legacy
+
+    print(f"samples/device={per_device_samples} ({args.samples} heartbeats x {len(METRICS)} metrics)")
+    print(f"{'':22} {'devices':>8} {'memory MB':>10} {'B/sample':>9} {'fill s':>8} {'1h stats ms':>12}")
+    print(f"{'HealthMetric deques':22} {args.legacy_devices:>8,} {legacy_mb:>10.1f} "
+          f"{legacy_bytes:>9.0f} {legacy_fill:>8.2f} {legacy_ms:>12.4f}")
+    for devices in args.devices:
+        projected = legacy_bytes * devices * per_device_samples / 1024 / 1024
+        print(f"{'  projected':22} {devices:>8,} {projected:>10.1f}")
+
+    for devices in args.devices:
+        compact, compact_mb, compact_fill = measure(record_compact, devices, args.samples, start)
+        compact_ms = time_queries(lambda d, compact=compact: compact[d].stats(MetricType.CPU_USAGE, start=since), devices, args.queries)
+        compact_bytes = compact_mb * 1024 * 1024 / (devices * per_device_samples)
+        print(f"{'MetricHistory':22} {devices:>8,} {compact_mb:>10.1f} "
+              f"{compact_bytes:>9.0f} {compact_fill:>8.2f} {compact_ms:>12.4f}")
+        del compact
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: MetricStore vs. a deque of AnalyticsMetric dataclasses.
+
+Fills both with the same synthetic metrics and reports memory (tracemalloc)
+and the latency of a per-device window query, which the deque answers by
+scanning everything and the store answers by walking the device's chain.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_metric_store.py [--metrics 1000000] [--devices 2000] [--queries 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.analytics.metric_store import MetricStore  # noqa: E402
+from app.analytics.real_time_analytics import AnalyticsEvent, AnalyticsMetric, MetricType  # noqa: E402
+
+
+def make_metrics(count, devices):
+    rng = random.Random(5)
+    start = datetime.utcnow() - timedelta(hours=24)
+    step = timedelta(hours=24) / count
+    for i in range(count):
+        device = rng.randrange(devices)
+        yield AnalyticsMetric(
+            id=str(i), metric_type=MetricType.IMPRESSION, event_type=AnalyticsEvent.CONTENT_VIEW_START,
+            device_id=f"device-{device}", content_id=f"content-{rng.randrange(200)}",
+            campaign_id=f"campaign-{rng.randrange(50)}", value=rng.random(),
+            duration_seconds=rng.random() * 30, timestamp=start + step * i,
+            location={"lat": device / 100, "lng": device / 50},
+            device_capabilities={"resolution": "1920x1080", "storage_gb": 64},
+            network_conditions={"bandwidth_mbps": 50, "latency_ms": 20}
+        )
+
+
+def fill(container, args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for metric in make_metrics(args.metrics, args.devices):
+        container.append(metric)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / 1024 / 1024, elapsed
+
+
+def time_queries(query, args):
+    rng = random.Random(9)
+    cutoff = datetime.utcnow() - timedelta(hours=1)
+    started = time.perf_counter()
+    for _ in range(args.queries):
+        query(f"device-{rng.randrange(args.devices)}", cutoff)
+    return (time.perf_counter() - started) / args.queries * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--metrics", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    buffer = deque(maxlen=args.metrics)
+    deque_mb, deque_fill = fill(buffer, args)
+    deque_ms = time_queries(
+        lambda device_id, cutoff, buffer=buffer: [m for m in buffer if m.device_id == device_id and m.timestamp > cutoff], args)
+    del buffer
+
+    store = MetricStore(args.metrics)
+    store_mb, store_fill = fill(store, args)
+    store_ms = time_queries(lambda device_id, cutoff: store.for_device(device_id, start=cutoff), args)
+
+    print(f"metrics={args.metrics:,} devices={args.devices}")
+    print(f"{'':12} {'memory MB':>10} {'fill s':>8} {'device query ms':>16}")
+    print(f"{'deque':12} {deque_mb:>10.1f} {deque_fill:>8.2f} {deque_ms:>16.3f}")
+    print(f"{'MetricStore':12} {store_mb:>10.1f} {store_fill:>8.2f} {store_ms:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
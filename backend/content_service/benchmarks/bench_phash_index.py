@@ -0,0 +1,61 @@
+"""
+Benchmark: near-duplicate lookups in PerceptualHashIndex.
+
+Builds an index of random 64-bit hashes and times "all hashes within
+distance k" queries for near-duplicate probes and for misses.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_phash_index.py [--entries 1000000] [--distances 4 6 8]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.security.phash_index import PerceptualHashIndex  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--distances", nargs="+", type=int, default=[4, 6, 8])
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    corpus = [rng.getrandbits(64) for _ in range(args.entries)]
+    index = PerceptualHashIndex()
+    start = time.perf_counter()
+    index.bulk_add((h, "bench") for h in corpus)
+    print(f"bulk_add {args.entries:,} hashes: {time.perf_counter() - start:.1f}s")
+
+    print(f"{'k':>3} {'probe':>6} {'p50 us':>8} {'p99 us':>8} {'mean hits':>10}")
+    for k in args.distances:
+        for kind in ("near", "miss"):
+            timings, hits = [], []
+            for _ in range(args.queries):
+                probe = rng.getrandbits(64)
+                if kind == "near":
+                    probe = rng.choice(corpus)
+                    for bit in rng.sample(range(64), rng.randint(0, k)):
+                        probe ^= 1 << bit
+                t0 = time.perf_counter()
+                found = index.query(probe, k)
+                timings.append((time.perf_counter() - t0) * 1e6)
+                hits.append(len(found))
+            print(f"{k:>3} {kind:>6} {percentile(timings, 50):>8.0f} {percentile(timings, 99):>8.0f} "
+                  f"{statistics.mean(hits):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark: schedule conflict checks and active-schedule lookups.
+
+Builds a fleet with --schedules existing schedules, each targeting a random
+subset of --devices screens, then times two things for a campaign that targets
+--campaign-devices screens:
+
+- the conflict check for the campaign, three ways: a scan of every schedule
+  per device (timed on a sample of devices and extrapolated), one pass over
+  all schedules, and ScheduleIndex. The one-pass row keeps every schedule in
+  memory already; in production it would first load the whole collection
+  for each create_schedule.
+- "active at t" lookups for single devices, by scan and through the index.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_schedule_index.py [--devices 20000] [--schedules 20000] [--campaign-devices 10000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.schedule_index import ScheduleIndex, schedule_window  # noqa: E402
+
+START = datetime(2025, 1, 1)
+
+
+def make_schedules(args, rng):
+    schedules = []
+    for i in range(args.schedules):
+        start = START + timedelta(hours=rng.randrange(0, 24 * 180))
+        schedules.append({
+            "id": f"s{i}",
+            "content_id": f"c{rng.randrange(args.schedules // 4 or 1)}",
+            "device_ids": [f"d{j}" for j in rng.sample(range(args.devices), args.devices_per_schedule)],
+            "status": "approved",
+            "start_date": start,
+            "end_date": start + timedelta(days=rng.randrange(1, 30))
+        })
+    return schedules
+
+
+def scan_device_overlaps(schedules, campaign, device_id):
+    start, end = schedule_window(campaign)
+    return [s for s in schedules if device_id in s["device_ids"] and s["start_date"] < end and s["end_date"] > start]
+
+
+def scan_overlaps(schedules, campaign):
+    start, end = schedule_window(campaign)
+    targets = set(campaign["device_ids"])
+    found = {}
+    for schedule in schedules:
+        other_start, other_end = schedule_window(schedule)
+        if other_start < end and other_end > start:
+            for device_id in schedule["device_ids"]:
+                if device_id in targets:
+                    found.setdefault(device_id, []).append(schedule)
+    return found
+
+
+def scan_active(schedules, device_id, when):
+    return [s for s in schedules if device_id in s["device_ids"] and s["start_date"] <= when < s["end_date"]]
+
+
+def timed(fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=20000)
+    parser.add_argument("--schedules", type=int, default=20000)
+    parser.add_argument("--devices-per-schedule", type=int, default=50)
+    parser.add_argument("--campaign-devices", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    schedules = make_schedules(args, rng)
+    index = ScheduleIndex()
+    _, build_s = timed(lambda: index.rebuild(schedules))
+
+    campaign_start = START + timedelta(days=90)
+    campaign = {"content_id": "campaign", "start_date": campaign_start, "end_date": campaign_start + timedelta(days=7),
+                "device_ids": [f"d{i}" for i in rng.sample(range(args.devices), args.campaign_devices)]}
+    sample = campaign["device_ids"][:50]
+    _, sample_s = timed(lambda: [scan_device_overlaps(schedules, campaign, d) for d in sample])
+    per_device_s = sample_s / len(sample) * len(campaign["device_ids"])
+    scanned, scan_s = timed(lambda: scan_overlaps(schedules, campaign))
+    indexed, index_s = timed(lambda: index.overlapping(campaign))
+    assert {d: len(v) for d, v in scanned.items()} == {d: len(v) for d, v in indexed.items()}
+
+    probes = [(f"d{rng.randrange(args.devices)}", START + timedelta(hours=rng.randrange(0, 24 * 200)))
+              for _ in range(args.lookups)]
+    _, scan_lookup_s = timed(lambda: [scan_active(schedules, d, t) for d, t in probes])
+    _, index_lookup_s = timed(lambda: [index.active_for_device(d, t) for d, t in probes])
+
+    metrics = index.get_metrics()
+    print(f"schedules={args.schedules:,} devices={args.devices:,} intervals={metrics['intervals']:,} "
+          f"rebuild={build_s * 1000:,.0f}ms")
+    print(f"conflict check for a campaign on {args.campaign_devices:,} devices:")
+    print(f"  {'scan per device (extrapolated)':32} {per_device_s * 1000:>10,.1f}ms")
+    print(f"  {'one pass over all schedules':32} {scan_s * 1000:>10,.1f}ms")
+    print(f"  {'ScheduleIndex':32} {index_s * 1000:>10,.1f}ms")
+    print("active at t, per lookup:")
+    print(f"  {'scan':32} {scan_lookup_s / args.lookups * 1000:>10,.3f}ms")
+    print(f"  {'ScheduleIndex':32} {index_lookup_s / args.lookups * 1000:>10,.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Load test: WebSocket hub fan-out to 10k simulated device sockets.
+
+Connects ``--devices`` fake sockets split across ``--workers`` hubs joined by
+an in-process backplane, plus admin dashboards (one of them stalled). It then
+sends ``--messages`` fleet-wide broadcasts from a single worker, one every
+``--interval-ms``, and reports how long the broadcast calls took (enqueue
+only) and how long the sockets took to receive everything. Each socket send sleeps ``--send-ms``; ``--slow``
+devices never finish a send, so they get disconnected as slow consumers.
+
+For comparison it also times the previous pattern: one awaited send_text per
+socket, in sequence.
+
+Usage (from backend/content_service):
+    python benchmarks/bench_websocket_hub.py [--devices 10000] [--workers 4] [--messages 20] [--slow 50]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.websocket_hub import InProcessBackplane, WebSocketHub  # noqa: E402
+
+
+class SimulatedSocket:
+    def __init__(self, send_delay, stalled=False):
+        self.send_delay = send_delay
+        self.stalled = stalled
+        self.received = 0
+        self.closed = False
+
+    async def send_text(self, text):
+        if self.stalled:
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.send_delay)
+        self.received += 1
+
+    async def close(self, code=1000, reason=None):
+        self.closed = True
+
+
+async def sequential_baseline(sockets, messages):
+    started = time.perf_counter()
+    for i in range(messages):
+        text = json.dumps({"type": "content_update", "n": i})
+        for socket in sockets:
+            await socket.send_text(text)
+    return time.perf_counter() - started
+
+
+async def run(args):
+    backplane = InProcessBackplane()
+    hubs = [WebSocketHub(backplane=backplane if i == 0 else backplane.peer(),
+                         device_queue_size=args.queue_size) for i in range(args.workers)]
+    for hub in hubs:
+        await hub.start()
+
+    send_delay = args.send_ms / 1000
+    sockets = {}
+    for i in range(args.devices):
+        device_id = f"device-{i}"
+        sockets[device_id] = SimulatedSocket(send_delay, stalled=i < args.slow)
+        await hubs[i % args.workers].add_device(device_id, sockets[device_id])
+    admins = [SimulatedSocket(send_delay, stalled=i == 0) for i in range(args.admins)]
+    for admin in admins:
+        hubs[0].add_admin(admin)
+    await asyncio.sleep(0.01)
+
+    sender = hubs[-1]
+    device_ids = list(sockets)
+    started = time.perf_counter()
+    enqueue_s = 0.0
+    for i in range(args.messages):
+        t0 = time.perf_counter()
+        text = json.dumps({"type": "content_update", "n": i})  # serialized once per broadcast
+        await sender.send_to_devices(device_ids, text)
+        await sender.broadcast_to_admins(text)
+        enqueue_s += time.perf_counter() - t0
+        await asyncio.sleep(args.interval_ms / 1000)
+
+    healthy = [s for s in sockets.values() if not s.stalled]
+    while any(s.received < args.messages for s in healthy):
+        await asyncio.sleep(0.01)
+    delivered_s = time.perf_counter() - started
+
+    evicted = sum(hub.get_metrics()["slow_consumer_disconnects"] for hub in hubs)
+    print(f"devices={args.devices} workers={args.workers} messages={args.messages} "
+          f"send_ms={args.send_ms} stalled_devices={args.slow}")
+    print(f"hub: {enqueue_s / args.messages * 1000:.1f}ms per broadcast call, "
+          f"all healthy sockets received in {delivered_s:.2f}s "
+          f"({args.devices * args.messages / delivered_s:,.0f} msgs/s)")
+    print(f"     slow consumers disconnected: {evicted}, "
+          f"healthy admins received: {[a.received for a in admins[1:]]}")
+
+    for hub in hubs:
+        await hub.stop()
+
+    baseline_sockets = [SimulatedSocket(send_delay) for _ in range(args.baseline_devices)]
+    baseline_s = await sequential_baseline(baseline_sockets, args.messages)
+    projected = baseline_s * args.devices / args.baseline_devices
+    print(f"sequential send_text: {args.baseline_devices} sockets took {baseline_s:.2f}s "
+          f"(~{projected:.1f}s projected for {args.devices}; a stalled socket blocks forever)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--slow", type=int, default=50)
+    parser.add_argument("--admins", type=int, default=5)
+    parser.add_argument("--send-ms", type=float, default=1.0)
+    parser.add_argument("--interval-ms", type=float, default=50)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--baseline-devices", type=int, default=500)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
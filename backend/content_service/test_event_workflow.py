@@ -216,12 +216,9 @@ class EventWorkflowTester:
             # Wait for background processing
             await asyncio.sleep(2)
 
-            # Check analytics handler processed events
-            analytics_handler = event_manager.handlers.get("analytics")
-            if analytics_handler:
-                # Force batch processing to get latest data
-                await analytics_handler.flush_batch()
-                logger.info("✅ Analytics batch processing completed")
+            # Force batch processing to get latest data
+            await event_manager.event_bus.flush_batches()
+            logger.info("✅ Analytics batch processing completed")
 
             return True
 
@@ -0,0 +1,191 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.analytics.rollups import RollupAccumulator, plan_ranges, summarize
+
+
+class CannedCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def to_list(self, length=None):
+        return self.rows
+
+
+class CannedCollection:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return CannedCursor(self.results.pop(0) if self.results else [])
+
+
+class Screens:
+    def __init__(self, device_ids):
+        self.device_ids = device_ids
+        self.lookups = 0
+
+    async def distinct(self, field, query):
+        self.lookups += 1
+        return self.device_ids
+
+
+class State:
+    def __init__(self, cutover):
+        self.cutover = cutover
+
+    async def find_one(self, query, projection=None):
+        return {"id": query["id"], "cutover": self.cutover} if self.cutover else None
+
+
+def test_accumulator_collapses_events_per_bucket():
+    accumulator = RollupAccumulator()
+    for second in (1, 30):
+        accumulator.add({"device_id": "d1", "company_id": "co1", "content_id": "c1", "event_type": "impression",
+                         "duration_seconds": 4, "estimated_revenue": 0.25,
+                         "timestamp": f"2025-01-02T10:15:{second:02d}"})
+    accumulator.add({"device_id": "d1", "company_id": "co1", "content_id": "c1", "event_type": "impression",
+                     "timestamp": "2025-01-02T10:16:00"})
+
+    updates = {op._filter["id"]: op._doc for op in accumulator.drain()}
+    assert len(accumulator) == 0
+    assert len(updates) == 4  # two minutes, one hour, one day
+
+    minute = updates["minute:2025-01-02T10:15:00:d1:c1:impression"]
+    assert minute["$inc"] == {"count": 2, "revenue": 0.5, "duration_sum": 8, "duration_count": 2}
+    assert minute["$set"]["company_id"] == "co1"
+    assert updates["hour:2025-01-02T10:00:00:d1:c1:impression"]["$inc"]["count"] == 3
+    assert updates["day:2025-01-02T00:00:00:d1:c1:impression"]["$inc"]["duration_count"] == 2
+
+
+
+def test_restored_deltas_merge_with_new_events():
+    accumulator = RollupAccumulator()
+    event = {"device_id": "d1", "content_id": "c1", "event_type": "impression", "duration_seconds": 2,
+             "timestamp": "2025-01-02T10:15:00"}
+    accumulator.add(event)
+    failed = accumulator.take()
+    accumulator.add({**event, "company_id": "co1"})
+    accumulator.restore(failed)
+
+    updates = {op._filter["id"]: op._doc for op in accumulator.drain()}
+    minute = updates["minute:2025-01-02T10:15:00:d1:c1:impression"]
+    assert minute["$inc"] == {"count": 2, "revenue": 0.0, "duration_sum": 4, "duration_count": 2}
+    assert minute["$set"]["company_id"] == "co1"
+
+def test_plan_ranges_uses_coarsest_buckets():
+    buckets, raw = plan_ranges(datetime(2025, 1, 1, 22, 30, 15), datetime(2025, 1, 4, 1, 5, 30))
+    assert buckets == [
+        ("minute", datetime(2025, 1, 1, 22, 31), datetime(2025, 1, 1, 23)),
+        ("hour", datetime(2025, 1, 1, 23), datetime(2025, 1, 2)),
+        ("day", datetime(2025, 1, 2), datetime(2025, 1, 4)),
+        ("hour", datetime(2025, 1, 4), datetime(2025, 1, 4, 1)),
+        ("minute", datetime(2025, 1, 4, 1), datetime(2025, 1, 4, 1, 5)),
+    ]
+    assert raw == [
+        (datetime(2025, 1, 1, 22, 30, 15), datetime(2025, 1, 1, 22, 31)),
+        (datetime(2025, 1, 4, 1, 5), datetime(2025, 1, 4, 1, 5, 30)),
+    ]
+
+
+def test_plan_ranges_short_and_unbounded():
+    assert plan_ranges(datetime(2025, 1, 1, 10, 0, 5), datetime(2025, 1, 1, 10, 0, 50)) == (
+        [], [(datetime(2025, 1, 1, 10, 0, 5), datetime(2025, 1, 1, 10, 0, 50))])
+
+    buckets, raw = plan_ranges(None, datetime(2025, 1, 3, 2, 0, 10))
+    assert buckets == [("day", None, datetime(2025, 1, 3)),
+                       ("hour", datetime(2025, 1, 3), datetime(2025, 1, 3, 2))]
+    assert raw == [(datetime(2025, 1, 3, 2), datetime(2025, 1, 3, 2, 0, 10))]
+
+
+@pytest.mark.asyncio
+async def test_summarize_merges_rollups_with_partial_bucket():
+    rollup_groups = [
+        {"_id": {"content_id": "c1", "event_type": "impression"}, "count": 10, "revenue": 2.0,
+         "duration_sum": 40.0, "duration_count": 8, "devices": ["d1", "d2"]},
+        {"_id": {"content_id": "c2", "event_type": "interaction"}, "count": 3, "revenue": 0.0,
+         "duration_sum": 0.0, "duration_count": 0, "devices": ["d2"]},
+    ]
+    raw_groups = [
+        {"_id": {"content_id": "c2", "event_type": "impression"}, "count": 12, "revenue": 1.0,
+         "duration_sum": 10.0, "duration_count": 2, "devices": ["d3"]},
+    ]
+    hourly = [{"_id": datetime(2025, 1, 1, 10), "impressions": 10, "interactions": 3, "revenue": 2.0}]
+    db = SimpleNamespace(analytics_rollups=CannedCollection(rollup_groups, hourly),
+                         device_analytics=CannedCollection(raw_groups), digital_screens=Screens(["d1", "d3", "d4"]),
+                         analytics_rollup_state=State(datetime(2025, 1, 1)))
+
+    summary = await summarize(db, ["co1"], start=datetime(2025, 1, 1, 10),
+                              end=datetime(2025, 1, 1, 11, 0, 30), device_ids=["d1", "d2", "d3"])
+
+    assert summary["total_impressions"] == 22
+    assert summary["total_interactions"] == 3
+    assert summary["total_revenue"] == 3.0
+    assert summary["unique_devices"] == 3
+    assert summary["avg_engagement_time"] == 5.0
+    assert summary["top_performing_content"] == [{"_id": "c2", "impressions": 12},
+                                                 {"_id": "c1", "impressions": 10}]
+    assert summary["hourly_breakdown"] == [{"hour": "2025-01-01T10:00:00", "impressions": 10,
+                                            "interactions": 3, "revenue": 2.0}]
+
+    rollup_match = db.analytics_rollups.pipelines[0][0]["$match"]
+    assert rollup_match["company_id"] == {"$in": ["co1"]}
+    assert rollup_match["$or"] == [{"granularity": "hour", "bucket_start": {
+        "$gte": datetime(2025, 1, 1, 10), "$lt": datetime(2025, 1, 1, 11)}}]
+    raw_match = db.device_analytics.pipelines[0][0]["$match"]
+    assert raw_match["$or"] == [{"timestamp": {"$gte": "2025-01-01T11:00:00", "$lte": "2025-01-01T11:00:30"}}]
+    assert raw_match["company_id"] == {"$in": ["co1"]}
+    # Screens are only looked up for ranges before the cutover
+    assert db.digital_screens.lookups == 0
+
+
+@pytest.mark.asyncio
+async def test_summarize_reads_raw_events_before_the_cutover():
+    rollup_groups = [
+        {"_id": {"content_id": "c1", "event_type": "impression"}, "count": 4, "revenue": 1.0,
+         "duration_sum": 0.0, "duration_count": 0, "devices": ["d1"]},
+    ]
+    legacy_groups = [
+        {"_id": {"content_id": "c1", "event_type": "impression"}, "count": 6, "revenue": 0.5,
+         "duration_sum": 0.0, "duration_count": 0, "devices": ["d3"]},
+    ]
+    db = SimpleNamespace(analytics_rollups=CannedCollection(rollup_groups),
+                         device_analytics=CannedCollection([], legacy_groups),
+                         digital_screens=Screens(["d1", "d3", "d4"]),
+                         analytics_rollup_state=State(datetime(2025, 1, 1, 10, 30)))
+
+    summary = await summarize(db, ["co1"], start=datetime(2025, 1, 1, 9),
+                              end=datetime(2025, 1, 1, 11, 0, 30), device_ids=["d1", "d2", "d3"])
+
+    assert summary["total_impressions"] == 10
+    assert summary["unique_devices"] == 2
+    rollup_match = db.analytics_rollups.pipelines[0][0]["$match"]
+    assert rollup_match["$or"] == [{"granularity": "minute", "bucket_start": {
+        "$gte": datetime(2025, 1, 1, 10, 30), "$lt": datetime(2025, 1, 1, 11, 0)}}]
+    legacy_match = db.device_analytics.pipelines[1][0]["$match"]
+    assert legacy_match["$or"] == [{"timestamp": {"$gte": "2025-01-01T09:00:00", "$lt": "2025-01-01T10:30:00"}}]
+    # Events stored before company_id was recorded are scoped by device
+    assert legacy_match["$and"] == [{"$or": [{"company_id": {"$in": ["co1"]}},
+                                             {"company_id": None, "device_id": {"$in": ["d1", "d3"]}}]}]
+
+
+@pytest.mark.asyncio
+async def test_summarize_without_a_cutover_reads_raw_events():
+    db = SimpleNamespace(analytics_rollups=CannedCollection(), device_analytics=CannedCollection(),
+                         digital_screens=Screens(["d1"]), analytics_rollup_state=State(None))
+
+    await summarize(db, ["co1"], start=datetime(2025, 1, 1), end=datetime(2025, 1, 2))
+
+    assert len(db.analytics_rollups.pipelines) == 1  # only the hourly breakdown
+    legacy_match = db.device_analytics.pipelines[0][0]["$match"]
+    assert legacy_match["$or"] == [{"timestamp": {"$gte": "2025-01-01T00:00:00", "$lte": "2025-01-02T00:00:00"}}]
+
+
+def test_plan_ranges_includes_an_end_on_a_minute_boundary():
+    buckets, raw = plan_ranges(datetime(2025, 1, 1, 10, 30), datetime(2025, 1, 1, 10, 45))
+    assert buckets == [("minute", datetime(2025, 1, 1, 10, 30), datetime(2025, 1, 1, 10, 45))]
+    assert raw == [(datetime(2025, 1, 1, 10, 45), datetime(2025, 1, 1, 10, 45))]
@@ -0,0 +1,204 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from app.analytics.write_behind import AnalyticsWriteBehind
+
+
+class RecordingCollection:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+        self.errors = []
+
+    async def insert_many(self, documents, ordered=True):
+        if self.fail:
+            raise RuntimeError("insert failed")
+        self.calls.append((list(documents), ordered))
+        self._raise_queued_error()
+
+    async def bulk_write(self, operations, ordered=True):
+        self.calls.append((list(operations), ordered))
+        self._raise_queued_error()
+
+    def _raise_queued_error(self):
+        if self.errors:
+            raise self.errors.pop(0)
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls.append((query, update))
+
+
+def _db(fail=False):
+    return SimpleNamespace(device_analytics=RecordingCollection(fail), daily_metrics=RecordingCollection(),
+                           analytics_rollups=RecordingCollection(), analytics_rollup_state=RecordingCollection())
+
+
+def _bulk_error(*indexes):
+    return BulkWriteError({"writeErrors": [{"index": index, "code": 1, "errmsg": "failed"} for index in indexes]})
+
+
+def _event(event_type="impression", content_id="c1", revenue=0.0):
+    return {"device_id": "d1", "content_id": content_id, "event_type": event_type,
+            "estimated_revenue": revenue, "timestamp": "2025-01-02T10:00:00"}
+
+
+@pytest.mark.asyncio
+async def test_flush_batches_events_and_collapses_rollups():
+    db = _db()
+    writer = AnalyticsWriteBehind(get_db=lambda: db, flush_interval=60, max_buffered_events=100)
+    for _ in range(3):
+        writer.record(_event(revenue=0.5))
+    writer.record(_event("interaction"))
+    writer.record(_event(content_id="c2"))
+
+    assert await writer.flush() == 5
+    events, ordered = db.device_analytics.calls[0]
+    assert len(events) == 5 and ordered is False
+
+    operations, ordered = db.daily_metrics.calls[0]
+    assert ordered is False
+    updates = {op._filter["id"]: op._doc for op in operations}
+    assert updates["d1_c1_2025-01-02"]["$inc"] == {"impressions": 3, "revenue": 1.5, "interactions": 1}
+    assert updates["d1_c2_2025-01-02"]["$inc"] == {"impressions": 1}
+    assert writer.get_metrics()["events_flushed"] == 5
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_buffer_is_bounded_and_stop_flushes():
+    db = _db()
+    writer = AnalyticsWriteBehind(get_db=lambda: db, flush_interval=60, max_buffered_events=2)
+    assert writer.record(_event())
+    assert writer.record(_event())
+    assert not writer.record(_event())
+
+    await writer.stop()
+    metrics = writer.get_metrics()
+    assert metrics["events_dropped"] == 1
+    assert metrics["events_buffered"] == 0
+    assert metrics["events_flushed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_background_flush_and_failed_flush_counts_drops():
+    db = _db()
+    writer = AnalyticsWriteBehind(get_db=lambda: db, flush_interval=0.01, max_buffered_events=100)
+    writer.record(_event())
+    await asyncio.sleep(0.05)
+    assert writer.get_metrics()["events_flushed"] == 1
+
+    failing = _db(fail=True)
+    writer._get_db = lambda: failing
+    writer.record(_event())
+    await writer.stop()
+    metrics = writer.get_metrics()
+    assert metrics["flush_errors"] == 1
+    assert metrics["events_dropped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_first_flush_records_the_rollup_cutover():
+    db = _db()
+    writer = AnalyticsWriteBehind(get_db=lambda: db, flush_interval=60, max_buffered_events=100)
+    writer.record({**_event(), "timestamp": "2025-01-02T10:00:05"})
+    writer.record(_event())
+    await writer.flush()
+    writer.record(_event())
+    await writer.flush()
+
+    assert db.analytics_rollup_state.calls == [
+        ({"id": "device_analytics"}, {"$min": {"cutover": datetime(2025, 1, 2, 10)}})
+    ]
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_partial_insert_only_drops_and_skips_rollups_of_failed_events():
+    db = _db()
+    db.device_analytics.errors.append(_bulk_error(1))
+    writer = AnalyticsWriteBehind(get_db=lambda: db, flush_interval=60, max_buffered_events=100)
+    writer.record(_event())
+    writer.record(_event(content_id="c2"))
+    writer.record(_event("interaction"))
+
+    assert await writer.flush() == 2
+    (operations, _), = db.daily_metrics.calls
+    assert {op._filter["id"]: op._doc["$inc"] for op in operations} == {
+        "d1_c1_2025-01-02": {"impressions": 1, "interactions": 1}
+    }
+    (buckets, _), = db.analytics_rollups.calls
+    assert {op._doc["$set"]["content_id"] for op in buckets} == {"c1"}
+    metrics = writer.get_metrics()
+    assert (metrics["events_flushed"], metrics["events_dropped"], metrics["flush_errors"]) == (2, 1, 1)
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_daily_metrics_are_requeued_into_the_next_flush():
+    db = _db()
+    db.daily_metrics.errors += [_bulk_error(1), RuntimeError("connection reset")]
+    writer = AnalyticsWriteBehind(get_db=lambda: db, flush_interval=60, max_buffered_events=100)
+    writer.record(_event())
+    writer.record(_event(content_id="c2"))
+    await writer.flush()
+
+    writer.record(_event(content_id="c2"))
+    await writer.flush()
+    await writer.flush()
+
+    incs = [{op._filter["id"]: op._doc["$inc"] for op in operations} for operations, _ in db.daily_metrics.calls]
+    assert incs == [
+        {"d1_c1_2025-01-02": {"impressions": 1}, "d1_c2_2025-01-02": {"impressions": 1}},
+        {"d1_c2_2025-01-02": {"impressions": 2}},
+        {"d1_c2_2025-01-02": {"impressions": 2}},
+    ]
+    metrics = writer.get_metrics()
+    assert (metrics["rollups_flushed"], metrics["rollups_requeued"], metrics["rollups_buffered"]) == (2, 2, 0)
+    assert metrics["events_dropped"] == 0
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_bucket_rollups_are_requeued_until_they_converge():
+    db = _db()
+    db.analytics_rollups.errors += [_bulk_error(0), RuntimeError("connection reset")]
+    writer = AnalyticsWriteBehind(get_db=lambda: db, flush_interval=60, max_buffered_events=100)
+    writer.record(_event())
+    await writer.flush()
+    writer.record(_event())
+    await writer.flush()
+    await writer.flush()
+
+    (first, _), (second, _), (third, _) = db.analytics_rollups.calls
+    applied = {}
+    for op in first[1:] + third:  # the first upsert of the first flush and all of the second failed
+        applied[op._filter["id"]] = applied.get(op._filter["id"], 0) + op._doc["$inc"]["count"]
+    assert len(applied) == 3 and set(applied.values()) == {2}
+    metrics = writer.get_metrics()
+    assert (metrics["bucket_rollups_requeued"], metrics["bucket_rollups_buffered"]) == (4, 0)
+    assert metrics["events_flushed"] == 2 and metrics["events_dropped"] == 0
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_events_wait_for_the_next_flush_when_the_cutover_cannot_be_recorded():
+    db = _db()
+
+    async def unavailable(query, update, upsert=False):
+        raise RuntimeError("not primary")
+
+    db.analytics_rollup_state.update_one = unavailable
+    writer = AnalyticsWriteBehind(get_db=lambda: db, flush_interval=60, max_buffered_events=100)
+    writer.record(_event())
+    assert await writer.flush() == 0
+    assert db.device_analytics.calls == []
+    assert writer.get_metrics()["events_buffered"] == 1
+
+    del db.analytics_rollup_state.update_one
+    assert await writer.flush() == 1
+    assert writer.get_metrics()["events_dropped"] == 0
+    await writer.stop()
@@ -0,0 +1,107 @@
+import builtins
+from datetime import datetime, timedelta, timezone
+
+from app.security import audit_log_store
+from app.security.audit_log_store import AuditLogStore
+from app.security.audit_logger import AuditLogger
+
+
+def _entry(n, user_id=None, ip_address=None, at=None):
+    at = at or datetime.now(timezone.utc)
+    return {"audit_id": str(n), "timestamp": at.isoformat(), "event_type": "content", "event_name": "viewed",
+            "severity": "low", "details": {"n": n, "note": "café"}, "user_id": user_id, "ip_address": ip_address}
+
+
+def test_segments_chain_across_restarts_and_tampering_is_located(tmp_path):
+    store = AuditLogStore(str(tmp_path), segment_bytes=1024)
+    for n in range(20):
+        store.submit(_entry(n, user_id=f"u{n % 3}"))
+    store.close()
+    metrics = store.get_metrics()
+    assert metrics["entries_written"] == 20 and metrics["segments_sealed"] >= 2
+
+    # A reopened store continues the chain from the last line on disk
+    store = AuditLogStore(str(tmp_path), segment_bytes=1024)
+    store.submit(_entry(20, user_id="u0"))
+    assert store.verify() == {"valid": True, "entries_checked": 21}
+    store.close()
+
+    first = sorted((tmp_path / "writer-000").glob("*.jsonl"))[1]
+    lines = first.read_text(encoding="utf-8").splitlines(keepends=True)
+    lines[1] = lines[1].replace('"n":', '"n":1')
+    first.write_text("".join(lines), encoding="utf-8")
+    store = AuditLogStore(str(tmp_path), segment_bytes=1024)
+    result = store.verify()
+    assert (result["valid"], result["writer"], result["segment"], result["line"]) == (False, "writer-000", 1, 2)
+    store.close()
+
+
+def test_queries_read_only_segments_indexed_for_the_user_and_time(tmp_path, monkeypatch):
+    store = AuditLogStore(str(tmp_path), segment_bytes=512, bucket_seconds=3600)
+    old = datetime.now(timezone.utc) - timedelta(days=3)
+    for n in range(6):
+        store.submit(_entry(n, user_id="gdpr-subject", ip_address="10.0.0.9", at=old + timedelta(minutes=n)))
+    for n in range(6, 30):
+        store.submit(_entry(n, user_id=f"other{n}", ip_address="10.0.0.1"))
+    store.flush()
+
+    opened = []
+    real_open = builtins.open
+
+    def spy(path, *args, **kwargs):
+        opened.append(str(path))
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(audit_log_store, "open", spy, raising=False)
+    activity = list(store.query("user_id", "gdpr-subject", (old - timedelta(hours=1)).timestamp(),
+                                datetime.now(timezone.utc).timestamp()))
+    assert [entry["details"]["n"] for entry in activity] == list(range(6))
+    holding = [str(path) for path in sorted((tmp_path / "writer-000").glob("*.jsonl")) if "gdpr-subject" in path.read_text()]
+    assert opened == holding and len(holding) < store.get_metrics()["segments"] // 2
+
+    # Outside the subject's time buckets nothing is read at all
+    opened.clear()
+    assert list(store.query("user_id", "gdpr-subject", old.timestamp() + 86400,
+                            datetime.now(timezone.utc).timestamp())) == []
+    assert opened == []
+    store.close()
+
+
+def test_concurrent_stores_write_separate_chains_and_query_each_other(tmp_path):
+    first = AuditLogStore(str(tmp_path), segment_bytes=1024)
+    second = AuditLogStore(str(tmp_path), segment_bytes=1024)
+    start = datetime.now(timezone.utc)
+    for n in range(10):
+        (first if n % 2 else second).submit(_entry(n, user_id="shared", at=start + timedelta(seconds=n)))
+    first.flush()
+    second.flush()
+    assert {first.get_metrics()["writer"], second.get_metrics()["writer"]} == {"writer-000", "writer-001"}
+
+    activity = list(first.query("user_id", "shared", start.timestamp() - 1, start.timestamp() + 60))
+    assert [entry["details"]["n"] for entry in activity] == list(range(10))
+    assert first.verify() == {"valid": True, "entries_checked": 10}
+    first.close()
+    second.close()
+
+
+def test_audit_logger_queues_entries_and_detects_failed_login_patterns(tmp_path, monkeypatch):
+    monkeypatch.setenv("AUDIT_LOG_DIR", str(tmp_path))
+    audit = AuditLogger()
+    start = datetime.utcnow() - timedelta(minutes=1)
+    for n in range(6):
+        audit.log_failed_login(f"user{n % 3}@example.com", "203.0.113.7", "invalid_credentials")
+    audit.log_successful_login("u1", "user1@example.com", "198.51.100.2")
+    audit.log_content_upload("u1", "promo.mp4", "video/mp4", 1024, "198.51.100.2")
+
+    activity = audit.get_user_activity("u1", start, datetime.utcnow() + timedelta(minutes=1))
+    assert [entry["event_name"] for entry in activity] == ["login_successful", "content_uploaded"]
+
+    patterns = {p["pattern"]: p for p in audit.detect_suspicious_patterns("203.0.113.7")}
+    assert set(patterns) == {"repeated_failed_logins", "multiple_accounts_targeted"}
+    assert patterns["repeated_failed_logins"]["count"] == 6
+    assert patterns["multiple_accounts_targeted"]["accounts"] == [
+        "user0@example.com", "user1@example.com", "user2@example.com"
+    ]
+    assert audit.detect_suspicious_patterns("198.51.100.2") == []
+    assert audit.verify_integrity()["valid"]
+    audit.close()
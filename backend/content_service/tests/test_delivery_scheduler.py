@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.content_delivery.content_distributor import ContentDistributorService, ContentPackage, DeliveryStatus
+from app.content_delivery.delivery_scheduler import DeliveryScheduler, mbps_to_bytes_per_second
+
+NOW = datetime.utcnow()
+
+
+def _package(package_id, device_id="d1", priority=5, deadline_minutes=60, size=0, **extra):
+    return ContentPackage(id=package_id, device_id=device_id, priority=priority, content_size=size,
+                          delivery_deadline=NOW + timedelta(minutes=deadline_minutes), **extra)
+
+
+@pytest.mark.asyncio
+async def test_workers_respect_concurrency_and_effective_deadline_order():
+    started, in_flight, peak = [], [], [0]
+    release = asyncio.Event()
+
+    async def handler(package):
+        started.append(package.id)
+        in_flight.append(package.id)
+        peak[0] = max(peak[0], len(in_flight))
+        await release.wait()
+        in_flight.remove(package.id)
+
+    scheduler = DeliveryScheduler(handler, max_workers=2, priority_step_seconds=600)
+    for package in [
+        _package("relaxed-urgent", priority=1, deadline_minutes=120),   # key: 120 + 10 min
+        _package("soon-normal", priority=5, deadline_minutes=30),       # key: 30 + 50 min
+        _package("late-normal", priority=5, deadline_minutes=240),
+        _package("soon-low", priority=9, deadline_minutes=30)           # key: 30 + 90 min
+    ]:
+        assert scheduler.submit(package)
+    assert not scheduler.submit(_package("soon-normal"))
+
+    await asyncio.sleep(0.01)
+    assert started == ["soon-normal", "soon-low"] and scheduler.get_metrics()["active"] == 2
+    release.set()
+    await asyncio.sleep(0.01)
+    assert started == ["soon-normal", "soon-low", "relaxed-urgent", "late-normal"]
+    assert peak[0] == 2
+
+    metrics = scheduler.get_metrics()
+    assert (metrics["dispatched"], metrics["duplicates_ignored"], metrics["queue_latency"]["count"]) == (4, 1, 4)
+    await scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_device_bucket_defers_busy_device_without_blocking_others():
+    delivered = []
+
+    async def handler(package):
+        delivered.append(package.id)
+
+    scheduler = DeliveryScheduler(handler, max_workers=1, device_bandwidth_mbps=80)
+    burst = int(mbps_to_bytes_per_second(80))
+    scheduler.submit(_package("a1", "a", deadline_minutes=1, size=burst))
+    scheduler.submit(_package("a2", "a", deadline_minutes=2, size=burst // 20))
+    scheduler.submit(_package("b1", "b", deadline_minutes=3, size=burst // 20))
+
+    await asyncio.sleep(0.01)
+    assert delivered == ["a1", "b1"]
+    await asyncio.sleep(0.1)
+    assert delivered == ["a1", "b1", "a2"]
+    assert scheduler.get_metrics()["bandwidth_deferrals"] == 1
+    await scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_delivery_is_retried_after_backoff():
+    class Repo:
+        def __init__(self):
+            self.packages = {}
+
+        async def get_content_package(self, package_id):
+            return self.packages.get(package_id)
+
+        async def update_content_package(self, package_id, updates):
+            self.packages[package_id].update(updates)
+            return True
+
+    distributor = ContentDistributorService()
+    distributor.repo = Repo()
+    distributor.audit_logger = None
+    distributor.retry_delay_multiplier = 0.02
+    package = _package("p1", content_id="c1_fail", size=1024, target_bandwidth=10_000, content_hash="h")
+    distributor.repo.packages["p1"] = distributor._package_document(package)
+
+    result = await distributor.queue_delivery("p1")
+    assert result["success"] and result["queue_position"] == 1
+    for _ in range(50):
+        await asyncio.sleep(0.01)
+        if distributor.repo.packages["p1"]["status"] == DeliveryStatus.DELIVERED.value:
+            break
+
+    stored = distributor.repo.packages["p1"]
+    assert (stored["status"], stored["retry_count"]) == ("delivered", 1)
+    metrics = (await distributor.get_delivery_metrics())["queue_metrics"]
+    assert (metrics["dispatched"], metrics["retries_scheduled"]) == (2, 1)
+    await distributor.delivery_scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_completion_window_is_trimmed_without_metrics_polling():
+    now = [0.0]
+
+    async def handler(package):
+        now[0] += 40
+
+    scheduler = DeliveryScheduler(handler, max_workers=1, clock=lambda: now[0])
+    for index in range(3):
+        scheduler.submit(_package(f"p{index}", deadline_minutes=index + 1))
+    await asyncio.sleep(0.01)
+
+    # Finished at 40, 80 and 120 seconds; only the last minute is kept
+    assert [finished for finished, _ in scheduler._completions] == [80.0, 120.0]
+    await scheduler.stop()
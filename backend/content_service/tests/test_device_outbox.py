@@ -0,0 +1,94 @@
+import asyncio
+import json
+from datetime import timedelta
+
+import pytest
+
+from app.device_outbox import DeviceOutbox, InMemoryOutboxStore
+from app.websocket_hub import WebSocketHub
+from app.websocket_manager import DeviceWebSocketManager
+
+
+def _outbox(**kwargs):
+    return DeviceOutbox(store=InMemoryOutboxStore(), **{"max_messages": 100, "batch_size": 10, **kwargs})
+
+
+def _update(content_id, update_type):
+    return {"type": "content_update", "data": {"content_id": content_id, "update_type": update_type}}
+
+
+@pytest.mark.asyncio
+async def test_newer_content_update_replaces_queued_one():
+    outbox = _outbox()
+    await outbox.enqueue("d1", _update("c1", "priority_changed"))
+    await outbox.enqueue("d1", {"type": "command", "command": "reboot"})
+    await outbox.enqueue("d1", _update("c1", "revoked"))
+    await outbox.enqueue("d1", _update("c2", "revoked"))
+
+    batch = await outbox.next_batch("d1")
+    messages = batch["data"]["messages"]
+    assert [(m["type"], m.get("data", {}).get("update_type")) for m in messages] == [
+        ("command", None), ("content_update", "revoked"), ("content_update", "revoked")]
+    assert [m["seq"] for m in messages] == [2, 3, 4]
+    assert outbox.get_metrics()["messages_coalesced"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cap_drops_oldest_and_batches_follow_acks():
+    outbox = _outbox(max_messages=25)
+    for i in range(30):
+        await outbox.enqueue("d1", {"type": "command", "n": i})
+    assert await outbox.pending_count("d1") == 25
+
+    first = await outbox.next_batch("d1")
+    assert (first["data"]["first_seq"], first["data"]["last_seq"], first["data"]["count"]) == (6, 15, 10)
+    # Nothing is removed until the device acknowledges
+    assert (await outbox.next_batch("d1"))["data"]["first_seq"] == 6
+
+    assert await outbox.ack("d1", first["data"]["last_seq"]) == 10
+    second = await outbox.next_batch("d1")
+    assert second["data"]["first_seq"] == 16
+    await outbox.ack("d1", 30)
+    assert await outbox.next_batch("d1") is None
+
+
+@pytest.mark.asyncio
+async def test_expired_messages_are_not_delivered():
+    outbox = _outbox(ttl=timedelta(seconds=-1))
+    await outbox.enqueue("d1", {"type": "command"})
+    assert await outbox.next_batch("d1") is None
+    assert await outbox.purge_expired() == 0
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_reconnect_gets_one_catch_up_frame_then_next_after_ack():
+    manager = DeviceWebSocketManager(hub=WebSocketHub(), outbox=_outbox(batch_size=3))
+    for i in range(5):
+        assert not await manager.send_to_device("d1", {"type": "command", "n": i})
+
+    socket = RecordingSocket()
+    await manager.connect_device("d1", socket)
+    await asyncio.sleep(0)
+    (frame,) = socket.sent
+    assert frame["type"] == "outbox_batch"
+    assert [m["n"] for m in frame["data"]["messages"]] == [0, 1, 2]
+
+    await manager.handle_device_message("d1", {"type": "outbox_ack", "data": {"seq": frame["data"]["last_seq"]}})
+    await asyncio.sleep(0)
+    next_frame = socket.sent[1]
+    assert [m["n"] for m in next_frame["data"]["messages"]] == [3, 4]
+    assert await manager.outbox.pending_count("d1") == 2
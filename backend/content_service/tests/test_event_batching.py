@@ -0,0 +1,147 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.events.event_bus import AsyncEventBus, Event, EventHandler, EventType
+from app.events.handlers import analytics_handler, notification_handler
+from app.events.handlers.analytics_handler import AnalyticsHandler
+from app.events.handlers.notification_handler import NotificationHandler, RecipientIndex
+
+
+def _event(event_type, company_id="co1", device_id=None, content_id=None, user_id=None, **payload):
+    return Event(event_id=str(uuid.uuid4()), event_type=event_type, timestamp=datetime.utcnow(), source="test",
+                 company_id=company_id, device_id=device_id, content_id=content_id, user_id=user_id,
+                 payload=payload)
+
+
+async def _wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.005)
+
+
+class FakeDb:
+    def __init__(self, users=()):
+        self.users = list(users)
+        self.calls = []
+
+    async def insert_many(self, collection, documents):
+        self.calls.append(("insert_many", collection, documents))
+        return [str(i) for i in range(len(documents))]
+
+    async def bulk_update(self, collection, updates, upsert=False):
+        self.calls.append(("bulk_update", collection, updates))
+
+    async def update_many(self, collection, query, update):
+        self.calls.append(("update_many", collection, query))
+
+    async def get_document(self, collection, query):
+        return None
+
+    async def find_documents(self, collection, query, sort=None, limit=None):
+        self.calls.append(("find_documents", collection, query))
+        if "company_id" in query:
+            return [u for u in self.users if u.get("company_id") == query["company_id"]]
+        return [u for u in self.users if u.get("user_type") == query.get("user_type")]
+
+    def named(self, name):
+        return [call for call in self.calls if call[0] == name]
+
+
+class BatchRecorder(EventHandler):
+    def __init__(self):
+        super().__init__("batch_recorder", [EventType.CONTENT_VIEWED], batch_size=4, batch_max_wait=0.05)
+        self.batches = []
+        self.singles = []
+
+    async def handle(self, event):
+        self.singles.append(event.payload["n"])
+        return True
+
+    async def handle_batch(self, events):
+        self.batches.append([event.payload["n"] for event in events])
+        return [event.payload["n"] != 5 for event in events]
+
+
+@pytest.mark.asyncio
+async def test_bus_delivers_size_and_time_bounded_batches_and_retries_failures_alone():
+    bus = AsyncEventBus(workers=2, queue_capacity=100, backpressure="", retry_base_seconds=0.01)
+    handler = BatchRecorder()
+    bus.subscribe(handler)
+    await bus.start_processing()
+
+    for n in range(10):
+        await bus.publish(_event(EventType.CONTENT_VIEWED, device_id=f"d{n % 3}", n=n))
+    await _wait_for(lambda: sum(len(batch) for batch in handler.batches) == 10 and handler.singles == [5])
+
+    assert [len(batch) for batch in handler.batches] == [4, 4, 2]
+    metrics = bus.get_metrics()
+    assert (metrics["batched_events_processed"], metrics["events_failed"], metrics["retries"]) == (9, 1, 1)
+    assert metrics["batching"]["batch_recorder"]["full_batches"] == 2
+    await bus.stop_processing()
+
+
+@pytest.mark.asyncio
+async def test_analytics_batch_merges_counters_into_one_write_per_collection(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(analytics_handler, "db_service", db)
+    handler = AnalyticsHandler()
+
+    events = [_event(EventType.CONTENT_VIEWED, device_id=f"d{i % 2}", content_id="c1") for i in range(6)]
+    events.append(_event(EventType.DEVICE_INTERACTION, device_id="d0", interaction_type="touch", duration=4))
+    events.append(_event(EventType.USER_LOGIN, user_id="u1", ip_address="10.0.0.1"))
+    assert await handler.handle_batch(events) == [True] * 8
+
+    assert [(name, collection, len(docs)) for name, collection, docs in db.named("insert_many")] == \
+        [("insert_many", "analytics_events", 8)]
+    writes = {collection: dict((query["_id"], update) for query, update in updates)
+              for _, collection, updates in db.named("bulk_update") if collection != "analytics_aggregations"}
+    assert set(writes) == {"content", "devices", "companies", "users"}
+    assert writes["content"]["c1"]["$inc"] == {"analytics.total_views": 6, "analytics.daily_views": 6}
+    assert writes["content"]["c1"]["$addToSet"] == {"analytics.viewing_devices": {"$each": ["d0", "d1"]}}
+    assert writes["devices"]["d0"]["$inc"] == {
+        "analytics.total_content_views": 3, "analytics.total_interactions": 1,
+        "analytics.interactions_by_type.touch": 1, "analytics.total_interaction_time": 4
+    }
+    assert writes["companies"]["co1"]["$inc"] == {"analytics.total_content_views": 6}
+    aggregations = next(updates for _, collection, updates in db.named("bulk_update")
+                        if collection == "analytics_aggregations")
+    assert sorted((query["event_type"], update["$inc"]["count"]) for query, update in aggregations) == [
+        ("analytics.content.viewed", 6), ("analytics.device.interaction", 1), ("user.login", 1)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_notification_batch_resolves_recipients_once_per_company_and_role_set(monkeypatch):
+    db = FakeDb(users=[
+        {"_id": "admin", "company_id": "co1", "company_role": "ADMIN"},
+        {"_id": "reviewer", "company_id": "co1", "company_role": "REVIEWER"},
+        {"_id": "moderator", "company_id": "co1", "permissions": ["content_moderate"]},
+        {"_id": "viewer", "company_id": "co1", "company_role": "VIEWER"},
+        {"_id": "other", "company_id": "co2", "company_role": "ADMIN"},
+        {"_id": "support", "user_type": "SUPER_USER"}
+    ])
+    monkeypatch.setattr(notification_handler, "db_service", db)
+    handler = NotificationHandler(recipient_index=RecipientIndex(ttl_seconds=60))
+
+    uploads = [_event(EventType.CONTENT_UPLOADED, content_id=f"c{i}", filename=f"f{i}") for i in range(5)]
+    rejected = _event(EventType.CONTENT_REJECTED, content_id="c9", user_id="owner", filename="f9",
+                      rejection_reason="blurry")
+    assert await handler.handle_batch([*uploads, rejected]) == [True] * 6
+
+    assert len(db.named("find_documents")) == 1
+    (_, _, docs), = db.named("insert_many")
+    by_event = {}
+    for doc in docs:
+        by_event.setdefault(doc["event_id"], set()).add(doc["recipient_id"])
+    assert all(by_event[e.event_id] == {"admin", "reviewer", "moderator"} for e in uploads)
+    assert by_event[rejected.event_id] == {"owner"}
+    assert len(db.named("update_many")) == 1
+
+    # The next batch is served from the index
+    await handler.handle_batch([_event(EventType.CONTENT_UPLOADED, content_id="c10", filename="f10")])
+    assert len(db.named("find_documents")) == 1
+    assert handler.recipient_index.get_metrics()["hits"] == 1
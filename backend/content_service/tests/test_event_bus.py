@@ -0,0 +1,119 @@
+import asyncio
+import random
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.events.event_bus import AsyncEventBus, Event, EventHandler, EventType
+
+
+def _event(event_type, device_id=None, content_id=None, **payload):
+    return Event(event_id=str(uuid.uuid4()), event_type=event_type, timestamp=datetime.utcnow(),
+                 source="test", device_id=device_id, content_id=content_id, payload=payload)
+
+
+class RecordingHandler(EventHandler):
+    def __init__(self, event_types, gate=None, max_concurrency=None, delay=0.0):
+        super().__init__("recording", event_types, max_concurrency=max_concurrency)
+        self.seen = []
+        self.gate = gate
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+
+    async def handle(self, event):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            if self.delay:
+                await asyncio.sleep(random.random() * self.delay)
+            self.seen.append(event)
+            return True
+        finally:
+            self.in_flight -= 1
+
+
+async def _wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.005)
+
+
+@pytest.mark.asyncio
+async def test_critical_lane_overtakes_queued_analytics():
+    gate = asyncio.Event()
+    handler = RecordingHandler([EventType.CONTENT_VIEWED, EventType.CONTENT_UPLOADED], gate=gate)
+    bus = AsyncEventBus(workers=1, queue_capacity=100, backpressure="")
+    bus.subscribe(handler)
+    await bus.start_processing()
+
+    for i in range(5):
+        await bus.publish(_event(EventType.CONTENT_VIEWED, content_id="c1", n=i))
+    await asyncio.sleep(0.01)  # the worker is now holding the first view
+    await bus.publish(_event(EventType.CONTENT_UPLOADED, content_id="c1"))
+    gate.set()
+    await _wait_for(lambda: len(handler.seen) == 6)
+
+    assert [e.event_type for e in handler.seen][:2] == [EventType.CONTENT_VIEWED, EventType.CONTENT_UPLOADED]
+    assert [e.payload["n"] for e in handler.seen if e.payload] == [0, 1, 2, 3, 4]
+    lanes = bus.get_metrics()["lanes"]
+    assert (lanes["bulk"]["dispatched"], lanes["critical"]["dispatched"]) == (5, 1)
+    assert lanes["bulk"]["lag"]["count"] == 5
+    await bus.stop_processing()
+
+
+@pytest.mark.asyncio
+async def test_partitions_keep_per_device_order_and_limit_handler_concurrency():
+    handler = RecordingHandler([EventType.DEVICE_STATUS_CHANGED], max_concurrency=2, delay=0.003)
+    bus = AsyncEventBus(workers=4, queue_capacity=100, backpressure="")
+    bus.subscribe(handler)
+    await bus.start_processing()
+
+    for n in range(20):
+        for device in ("d1", "d2", "d3", "d4", "d5"):
+            await bus.publish(_event(EventType.DEVICE_STATUS_CHANGED, device_id=device, n=n))
+    await _wait_for(lambda: len(handler.seen) == 100)
+
+    for device in ("d1", "d2", "d3", "d4", "d5"):
+        assert [e.payload["n"] for e in handler.seen if e.device_id == device] == list(range(20))
+    assert handler.peak == 2
+    assert bus.get_metrics()["handler_latency"]["recording"]["count"] == 100
+    await bus.stop_processing()
+
+
+@pytest.mark.asyncio
+async def test_full_lanes_drop_spill_or_block(tmp_path):
+    bus = AsyncEventBus(workers=1, queue_capacity=2, spill_dir=str(tmp_path),
+                        backpressure="bulk=drop_oldest,critical=spill,default=block")
+    handler = RecordingHandler([EventType.CONTENT_VIEWED, EventType.CONTENT_UPLOADED, EventType.USER_LOGIN])
+    bus.subscribe(handler)
+
+    for i in range(4):
+        await bus.publish(_event(EventType.CONTENT_VIEWED, n=i))
+        await bus.publish(_event(EventType.CONTENT_UPLOADED, n=i))
+    await bus.publish(_event(EventType.USER_LOGIN, n=0))
+    await bus.publish(_event(EventType.USER_LOGIN, n=1))
+    blocked = asyncio.ensure_future(bus.publish(_event(EventType.USER_LOGIN, n=2)))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    lanes = bus.get_metrics()["lanes"]
+    assert (lanes["bulk"]["dropped"], lanes["bulk"]["queued"]) == (2, 2)
+    assert (lanes["critical"]["spilled"], lanes["critical"]["queued"]) == (2, 4)
+    assert lanes["default"]["blocked"] == 1
+
+    await bus.start_processing()
+    await blocked
+    await _wait_for(lambda: len(handler.seen) == 9)
+    by_type = {}
+    for event in handler.seen:
+        by_type.setdefault(event.event_type, []).append(event.payload["n"])
+    assert by_type[EventType.CONTENT_UPLOADED] == [0, 1, 2, 3]
+    assert by_type[EventType.CONTENT_VIEWED] == [2, 3]
+    assert by_type[EventType.USER_LOGIN] == [0, 1, 2]
+    await bus.stop_processing()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.events.event_bus import AsyncEventBus, Event, EventHandler, EventType
+from app.events.event_log import EventLog, SegmentLog
+
+
+def _event(event_type, device_id=None, **payload):
+    return Event(event_id=str(uuid.uuid4()), event_type=event_type, timestamp=datetime.utcnow(),
+                 source="test", device_id=device_id, payload=payload)
+
+
+class CountingHandler(EventHandler):
+    def __init__(self, name, event_types, fail_times=0):
+        super().__init__(name, event_types)
+        self.seen = []
+        self.fail_times = fail_times
+        self.calls = 0
+
+    async def handle(self, event):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise RuntimeError("transient failure")
+        self.seen.append(event.payload["n"])
+        return True
+
+
+async def _wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.005)
+
+
+@pytest.mark.asyncio
+async def test_segments_group_commit_roll_recover_and_compact(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=150, commit_interval=0.001)
+    log.start_committer()
+    offsets = [log.append({"n": n}) for n in range(20)]
+    await asyncio.gather(*(log.wait_durable(offset) for offset in offsets))
+    metrics = log.get_metrics()
+    assert metrics["commits"] == 1 and metrics["appends"] == 20
+    for n in range(20, 30):
+        offsets.append(log.append({"n": n}))
+        await log.wait_durable(offsets[-1])
+    await log.stop_committer()
+    # 16-byte records: the first commit rolls a segment, the next ten single commits another
+    assert log.get_metrics()["segments"] == 3
+    assert [record["n"] for _, record in log.read(offsets[5])] == list(range(5, 30))
+    log.close()
+
+    # A torn write at the tail is cut off when the log is reopened
+    last = max(tmp_path.iterdir())
+    with open(last, "ab") as f:
+        f.write(b"\x00\x00\x00\x40garbage")
+    log = SegmentLog(str(tmp_path), segment_bytes=150)
+    assert log.end == offsets[-1] + 16
+    assert [record["n"] for _, record in log.read()] == list(range(30))
+    # Only whole sealed segments go
+    assert await log.delete_before(offsets[25]) == 1
+    assert next(log.read())[1]["n"] == 20
+    log.close()
+
+
+@pytest.mark.asyncio
+async def test_restart_replays_only_what_each_handler_had_not_finished(tmp_path):
+    bus = AsyncEventBus(workers=2, queue_capacity=100, backpressure="", log_dir=str(tmp_path))
+    fast = CountingHandler("fast", [EventType.DEVICE_STATUS_CHANGED])
+    slow = CountingHandler("slow", [EventType.DEVICE_STATUS_CHANGED])
+    gate = asyncio.Event()
+    slow_handle = slow.handle
+
+    async def held(event):
+        if event.payload["n"] >= 3:
+            await gate.wait()
+        return await slow_handle(event)
+
+    slow.handle = held
+    bus.subscribe(fast)
+    bus.subscribe(slow)
+    await bus.start_processing()
+    for n in range(6):
+        await bus.publish(_event(EventType.DEVICE_STATUS_CHANGED, device_id="d1", n=n))
+    # The partition waits for slow on event 3, so fast has finished 0-3 and slow 0-2
+    await _wait_for(lambda: len(fast.seen) == 4 and len(slow.seen) == 3)
+    await asyncio.sleep(0.02)
+    await bus.stop_processing()
+    bus._log.close()
+    saved = json.loads((tmp_path / "writer-000" / "offsets.json").read_text())
+    assert saved["fast"] > saved["slow"]
+
+    restarted = AsyncEventBus(workers=2, queue_capacity=100, backpressure="", log_dir=str(tmp_path))
+    fast, slow = (CountingHandler(name, [EventType.DEVICE_STATUS_CHANGED]) for name in ("fast", "slow"))
+    restarted.subscribe(fast)
+    restarted.subscribe(slow)
+    await restarted.start_processing()
+    await _wait_for(lambda: slow.seen == [3, 4, 5] and fast.seen == [4, 5])
+    assert restarted.get_metrics()["replayed"] == 3
+    await restarted.stop_processing()
+    assert restarted.get_metrics()["event_log"]["consumer_lag_bytes"] == {"fast": 0, "slow": 0}
+    restarted._log.close()
+
+
+@pytest.mark.asyncio
+async def test_poison_event_backs_off_then_dead_letters_and_retries(tmp_path):
+    bus = AsyncEventBus(workers=1, queue_capacity=100, backpressure="", log_dir=str(tmp_path),
+                        retry_attempts=3, retry_base_seconds=0.01)
+    flaky = CountingHandler("flaky", [EventType.USER_LOGIN], fail_times=1)
+    bus.subscribe(flaky)
+    await bus.start_processing()
+    await bus.publish(_event(EventType.USER_LOGIN, n=0))
+    await _wait_for(lambda: flaky.seen == [0])
+    assert bus.get_metrics()["retries"] == 1
+
+    flaky.fail_times = flaky.calls + 3
+    await bus.publish(_event(EventType.USER_LOGIN, n=1))
+    await _wait_for(lambda: bus.get_metrics()["dead_lettered"] == 1)
+    dead = await bus.get_failed_events()
+    assert [(d["handler"], d["attempts"], d["event"]["payload"]["n"]) for d in dead] == [("flaky", 3, 1)]
+    assert bus.get_metrics()["event_log"]["consumer_lag_bytes"]["flaky"] == 0
+
+    assert await bus.retry_failed_events() == 1
+    await _wait_for(lambda: flaky.seen == [0, 1])
+    assert await bus.get_failed_events() == []
+    await bus.stop_processing()
+    bus._log.close()
+    assert os.listdir(tmp_path / "writer-000" / "dead-letter") != []
+
+
+@pytest.mark.asyncio
+async def test_each_worker_writes_and_replays_its_own_directory(tmp_path):
+    first, second = EventLog(str(tmp_path)), EventLog(str(tmp_path))
+    assert (first.directory, second.directory) == (str(tmp_path / "writer-000"), str(tmp_path / "writer-001"))
+    for n, log in enumerate((first, second)):
+        log.add_consumer("h")
+        log.append({"n": n}, ["h"])
+        await log.log.commit()
+        await log.checkpoint()
+    assert json.loads((tmp_path / "writer-000" / "offsets.json").read_text()) == {"h": 0}
+    assert json.loads((tmp_path / "writer-001" / "offsets.json").read_text()) == {"h": 0}
+
+    # A restarted worker takes the freed directory and replays only that worker's events
+    first.close()
+    restarted = EventLog(str(tmp_path))
+    assert restarted.directory == first.directory
+    restarted.add_consumer("h")
+    assert [record["n"] for _, record, _ in restarted.replay(lambda record: ["h"])] == [0]
+    restarted.close()
+    second.close()
+
+
+@pytest.mark.asyncio
+async def test_dead_letters_written_during_a_retry_are_kept(tmp_path):
+    log = EventLog(str(tmp_path))
+    log.dead_letter({"handler": "h", "n": 1})
+    records, until = await log.dead_letter_batch()
+    # A retry that ran out of attempts while the batch was being queued again
+    log.dead_letter({"handler": "h", "n": 2})
+    await log.clear_dead_letters(until, len(records))
+
+    assert [record["n"] for record in await log.read_dead_letters()] == [2]
+    assert log.dead_letter_count == 1
+    await log.dead_letters.commit()
+    log.close()
+
+    reopened = EventLog(str(tmp_path))
+    assert [record["n"] for record in await reopened.read_dead_letters()] == [2]
+    assert reopened.dead_letter_count == 1
+    reopened.close()
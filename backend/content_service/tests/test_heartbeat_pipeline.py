@@ -0,0 +1,92 @@
+import pytest
+
+from app.heartbeat_pipeline import HeartbeatPipeline
+from app.monitoring.device_health_monitor import DeviceHealthMonitor
+from app.monitoring.liveness import LivenessTracker
+
+
+class FakeRepo:
+    def __init__(self, devices):
+        self.devices = devices
+        self.lookups = 0
+
+    async def get_digital_screen(self, device_id):
+        self.lookups += 1
+        return self.devices.get(device_id)
+
+
+class RecordingSink:
+    def __init__(self):
+        self.writes = []
+
+    async def write(self, screen_updates, rows):
+        self.writes.append((screen_updates, rows))
+
+
+def _pipeline(sample_rate=0.0):
+    repo = FakeRepo({"d1": {"id": "d1", "name": "Lobby", "company_id": "c1"}})
+    sink = RecordingSink()
+    pipeline = HeartbeatPipeline(repo=repo, sink=sink, monitor=DeviceHealthMonitor(),
+                                 liveness=LivenessTracker(), flush_interval=3600, sample_rate=sample_rate)
+    return pipeline, repo, sink
+
+
+@pytest.mark.asyncio
+async def test_beats_are_coalesced_and_flushed_in_one_batch():
+    pipeline, repo, sink = _pipeline()
+    for cpu in (10, 20, 30):
+        result = await pipeline.process("d1", {"status": "active", "cpu_usage": cpu})
+        assert result["success"]
+    assert repo.lookups == 1
+    assert pipeline.liveness.is_online("d1")
+
+    assert await pipeline.flush() == 1
+    ((screen_updates, rows),) = sink.writes
+    assert list(screen_updates) == ["d1"]
+    assert {"last_seen", "health_status", "performance_score"} <= set(screen_updates["d1"])
+    # Only the first beat changed state; the rest were not sampled
+    assert [row["cpu_usage"] for row in rows] == [10]
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_raw_rows_on_state_change_and_at_sample_rate():
+    pipeline, _, sink = _pipeline(sample_rate=0.25)
+    kept = []
+    for i in range(9):
+        content_id = "c2" if i >= 6 else "c1"
+        result = await pipeline.process("d1", {"cpu_usage": 10, "current_content_id": content_id})
+        kept.append(result["persisted"])
+    # Beat 0 and beat 6 change state; one in four of the others is sampled
+    assert kept == [True, False, False, False, True, False, True, False, False]
+    metrics = pipeline.get_metrics()
+    assert (metrics["rows_on_state_change"], metrics["rows_sampled"]) == (2, 1)
+    await pipeline.stop()
+    assert len(sink.writes[-1][1]) == 3
+
+
+@pytest.mark.asyncio
+async def test_unknown_device_is_rejected_without_buffering():
+    pipeline, _, sink = _pipeline()
+    result = await pipeline.process("missing", {"cpu_usage": 10})
+    assert not result["success"]
+    assert await pipeline.flush() == 0
+    assert sink.writes == []
+
+
+def test_tokens_are_verified_once(monkeypatch):
+    from app.device_auth import device_auth_service
+
+    calls = []
+
+    def verify(token):
+        calls.append(token)
+        return {"sub": "d1", "exp": 4_000_000_000} if token == "good" else None
+
+    monkeypatch.setattr(device_auth_service, "verify_device_jwt", verify)
+    pipeline, _, _ = _pipeline()
+    assert pipeline.authenticate("d1", "good")
+    assert pipeline.authenticate("d1", "good")
+    assert not pipeline.authenticate("d2", "good")
+    assert not pipeline.authenticate("d1", "bad")
+    assert calls == ["good", "bad"]
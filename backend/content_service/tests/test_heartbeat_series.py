@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.monitoring.heartbeat_series import HeartbeatBucketStore, combine, summarize
+
+HOUR_START = datetime(2025, 3, 1, 10)
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        value = doc.get(key)
+        if isinstance(condition, dict):
+            if "$lt" in condition and not value < condition["$lt"]:
+                return False
+            if "$gte" in condition and not value >= condition["$gte"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs
+
+    def __aiter__(self):
+        self._iter = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    """Applies the subset of update operators the bucket store uses"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def find(self, query, projection=None):
+        docs = [dict(doc) for doc in self.docs.values() if _matches(doc, query)]
+        if projection:
+            docs = [{k: v for k, v in doc.items() if projection.get(k, 1)} for doc in docs]
+        return FakeCursor(docs)
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            matches = [doc for doc in self.docs.values() if _matches(doc, operation._filter)]
+            if not matches and not operation._upsert:
+                continue
+            doc = matches[0] if matches else None
+            update = operation._doc
+            if doc is None:
+                doc = self.docs[operation._filter["_id"]] = {"_id": operation._filter["_id"]}
+                doc.update(update.get("$setOnInsert", {}))
+            doc.update(update.get("$set", {}))
+            for path, each in update.get("$push", {}).items():
+                target = doc
+                *parents, leaf = path.split(".")
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                target.setdefault(leaf, []).extend(each["$each"])
+            for key, amount in update.get("$inc", {}).items():
+                doc[key] = doc.get(key, 0) + amount
+            for key, value in update.get("$min", {}).items():
+                doc[key] = min(doc.get(key, value), value)
+            for key, value in update.get("$max", {}).items():
+                doc[key] = max(doc.get(key, value), value)
+
+    async def delete_many(self, query):
+        doomed = [key for key, doc in self.docs.items() if _matches(doc, query)]
+        for key in doomed:
+            del self.docs[key]
+        return SimpleNamespace(deleted_count=len(doomed))
+
+
+def _store():
+    return HeartbeatBucketStore(SimpleNamespace(device_heartbeat_buckets=FakeCollection(),
+                                                device_heartbeat_rollups=FakeCollection()))
+
+
+def _beats(device_id, minutes, start=HOUR_START):
+    return [{"device_id": device_id, "timestamp": start + timedelta(minutes=m), "status": "active",
+             "cpu_usage": float(m), "memory_usage": 50.0} for m in minutes]
+
+
+def test_summarize_then_combine_gives_hourly_stats():
+    timestamps = [HOUR_START + timedelta(minutes=m) for m in (0, 2, 7, 59)]
+    series = {"cpu_usage": [10.0, 20.0, None, 40.0]}
+    five_minute = summarize(timestamps, series)
+    assert five_minute[HOUR_START]["cpu_usage"] == {"min": 10.0, "max": 20.0, "sum": 30.0, "count": 2}
+    assert five_minute[HOUR_START + timedelta(minutes=5)] == {}
+    hourly = combine(five_minute.values())
+    assert hourly["cpu_usage"] == {"min": 10.0, "max": 40.0, "sum": 70.0, "count": 3}
+
+
+@pytest.mark.asyncio
+async def test_one_document_per_device_hour_and_newest_first_reads():
+    store = _store()
+    await store.save_many(_beats("d1", range(0, 60, 10)))
+    await store.save_many(_beats("d1", [5], start=HOUR_START + timedelta(hours=1)) + _beats("d2", [1]))
+
+    assert len(store.buckets.docs) == 3
+    bucket = store.buckets.docs[f"d1:{HOUR_START.isoformat()}"]
+    assert bucket["count"] == 6 and len(bucket["series"]["cpu_usage"]) == 6
+    assert bucket["expires_at"] == HOUR_START + timedelta(hours=49)
+
+    recent = await store.recent("d1", limit=3)
+    assert [row["cpu_usage"] for row in recent] == [5.0, 50.0, 40.0]
+    assert (await store.latest("d1"))["timestamp"] == HOUR_START + timedelta(hours=1, minutes=5)
+
+
+@pytest.mark.asyncio
+async def test_downsample_completed_hours_and_reopen_on_late_beats():
+    store = _store()
+    await store.save_many(_beats("d1", [0, 1, 2, 30, 31]))
+    await store.save_many(_beats("d1", [0], start=HOUR_START + timedelta(hours=1)))
+
+    assert await store.downsample(now=HOUR_START + timedelta(hours=1, minutes=10)) == 1
+    five_minute = await store.history("d1", HOUR_START, HOUR_START + timedelta(hours=1), "5m")
+    assert [r["bucket_start"].minute for r in five_minute] == [0, 30]
+    assert five_minute[0]["metrics"]["cpu_usage"]["avg"] == 1.0
+    (hourly,) = await store.history("d1", HOUR_START, HOUR_START + timedelta(hours=1), "1h")
+    assert hourly["metrics"]["cpu_usage"] == {"min": 0.0, "max": 31.0, "avg": 12.8, "count": 5, "sum": 64.0}
+    assert await store.downsample(now=HOUR_START + timedelta(hours=1, minutes=10)) == 0
+
+    # A late beat reopens the hour and the next pass rewrites its rollups
+    await store.save_many(_beats("d1", [59]))
+    assert await store.downsample(now=HOUR_START + timedelta(hours=1, minutes=15)) == 1
+    (hourly,) = await store.history("d1", HOUR_START, HOUR_START + timedelta(hours=1), "1h")
+    assert hourly["metrics"]["cpu_usage"]["count"] == 6
+
+    raw = await store.history("d1", HOUR_START + timedelta(minutes=30), HOUR_START + timedelta(hours=2), "raw")
+    assert [row["timestamp"].minute for row in raw] == [30, 31, 59, 0]
+    assert await store.delete_older_than(HOUR_START + timedelta(hours=1)) == 1
+
+
+@pytest.mark.asyncio
+async def test_document_mode_history_is_rolled_up_not_raw():
+    from app.models import DeviceHeartbeat
+    from app.repo import InMemoryRepo, MongoRepo
+
+    repo = InMemoryRepo()
+    for beat in _beats("d1", [0, 1, 2, 30, 31]):
+        await repo.save_device_heartbeat(DeviceHeartbeat(**beat))
+    five_minute = await repo.get_device_heartbeat_history("d1", HOUR_START, HOUR_START + timedelta(hours=1), "5m")
+    assert [(r["granularity"], r["bucket_start"].minute) for r in five_minute] == [("5m", 0), ("5m", 30)]
+    (hourly,) = await repo.get_device_heartbeat_history("d1", HOUR_START, HOUR_START + timedelta(hours=1), "1h")
+    assert hourly["metrics"]["cpu_usage"] == {"min": 0.0, "max": 31.0, "avg": 12.8, "count": 5, "sum": 64.0}
+
+    # Mongo documents mode groups per bucket in the database and shapes rows the same way
+    pipelines = []
+    group = {"_id": HOUR_START, **{f"{field}__count": 0 for field in ("memory_usage", "temperature")},
+             "cpu_usage__min": 0.0, "cpu_usage__max": 31.0, "cpu_usage__sum": 64.0, "cpu_usage__count": 5}
+
+    class Beats:
+        def aggregate(self, pipeline):
+            pipelines.append(pipeline)
+            return FakeCursor([group])
+
+    mongo = MongoRepo.__new__(MongoRepo)
+    mongo._heartbeat_buckets = None
+    mongo._db = {"device_heartbeats": Beats()}
+    (row,) = await mongo.get_device_heartbeat_history("d1", HOUR_START, HOUR_START + timedelta(hours=1), "1h")
+    assert (row["granularity"], row["bucket_start"]) == ("1h", HOUR_START)
+    assert row["metrics"] == {"cpu_usage": hourly["metrics"]["cpu_usage"]}
+    assert pipelines[0][1]["$group"]["_id"]["$subtract"][1]["$mod"][1] == 3600 * 1000
@@ -0,0 +1,58 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from app.security.image_analysis import ImageAnalysisPool, ImageAnalysisBusyError, analyze_image
+
+
+def _png(width=640, height=480):
+    buf = BytesIO()
+    Image.new("RGB", (width, height), "navy").save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_analyze_image_returns_everything_from_one_decode():
+    result = analyze_image(_png(6000, 500))
+    assert result['error'] is None
+    assert set(result['hashes']) == {'average_hash', 'dhash', 'phash'}
+    assert len(result['hashes']['phash']) == 16
+    assert result['metadata']['width'] == 6000
+    assert result['analysis_metadata']['aspect_ratio'] == 12.0
+    assert "Unusual aspect ratio may not display properly" in result['warnings']
+
+
+def test_analyze_image_reports_decode_errors():
+    result = analyze_image(b"not an image")
+    assert result['hashes'] is None
+    assert 'extraction_error' in result['metadata']
+    assert result['warnings'][0].startswith("Image analysis error")
+
+
+@pytest.mark.asyncio
+async def test_pool_runs_jobs_and_records_metrics():
+    pool = ImageAnalysisPool(max_workers=1, max_pending=2)
+    try:
+        results = await asyncio.gather(*(pool.analyze(_png()) for _ in range(4)))
+        executor = pool._get_executor()
+        if isinstance(executor, ProcessPoolExecutor):
+            assert executor._mp_context.get_start_method() == "spawn"
+    finally:
+        pool.shutdown()
+    assert all(r['hashes'] for r in results)
+    metrics = pool.get_metrics()
+    assert metrics['jobs_completed'] == 4
+    assert metrics['in_flight'] == 0 and metrics['queue_depth'] == 0
+    assert metrics['job_latency']['count'] == 4
+
+
+@pytest.mark.asyncio
+async def test_pool_rejects_when_queue_stays_full():
+    pool = ImageAnalysisPool(max_workers=1, max_pending=1, queue_timeout=0.01)
+    slots = pool._get_slots()
+    await slots.acquire()  # simulate a job holding the only slot
+    with pytest.raises(ImageAnalysisBusyError):
+        await pool.analyze(_png())
+    assert pool.get_metrics()['jobs_rejected'] == 1
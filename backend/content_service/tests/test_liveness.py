@@ -0,0 +1,203 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.device_outbox import DeviceOutbox, InMemoryOutboxStore
+from app.monitoring.liveness import LivenessTracker
+from app.websocket_hub import WebSocketHub
+from app.websocket_manager import DeviceWebSocketManager
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _tracker(timeout=60):
+    clock = FakeClock()
+    return LivenessTracker(timeout_seconds=timeout, clock=clock), clock
+
+
+def test_heartbeat_pushes_deadline_back():
+    tracker, clock = _tracker()
+    tracker.heartbeat("d1")
+    clock.now += 50
+    tracker.heartbeat("d1")
+    clock.now += 50
+    assert tracker.expire() == []
+    assert tracker.is_online("d1")
+
+    clock.now += 11
+    assert tracker.expire() == ["d1"]
+    assert not tracker.is_online("d1")
+    # Reported once, not on every pass
+    clock.now += 60
+    assert tracker.expire() == []
+
+
+def test_connected_device_never_expires_until_socket_closes():
+    tracker, clock = _tracker()
+    tracker.socket_connected("d1")
+    clock.now += 600
+    assert tracker.expire() == []
+
+    tracker.socket_disconnected("d1")
+    clock.now += 59
+    assert tracker.expire() == []
+    clock.now += 2
+    assert tracker.expire() == ["d1"]
+
+
+def test_expire_only_visits_due_buckets_and_notifies_listeners():
+    tracker, clock = _tracker()
+    transitions = []
+    tracker.add_listener(lambda device_id, online: transitions.append((device_id, online)))
+    for i in range(1000):
+        tracker.heartbeat(f"d{i}")
+        clock.now += 0.1
+    assert tracker.get_metrics()["online_devices"] == 1000
+
+    # Long gap: jumps straight to the populated buckets
+    clock.now += 10_000
+    assert len(tracker.expire()) == 1000
+    assert tracker.get_metrics()["wheel_buckets"] == 0
+    assert len(transitions) == 2000 and not any(online for _, online in transitions[1000:])
+    assert tracker.get_metrics()["online_devices"] == 0
+
+
+@pytest.mark.asyncio
+async def test_seed_from_repo_marks_recent_devices_online():
+    tracker, clock = _tracker(timeout=300)
+    now = datetime.utcfromtimestamp(clock.now)
+
+    class FakeRepo:
+        async def list_companies(self):
+            return [{"id": "c1", "name": "Acme"}]
+
+        async def list_digital_screens(self, company_id):
+            return [
+                {"id": "recent", "name": "Lobby", "last_seen": (now - timedelta(seconds=30)).isoformat()},
+                {"id": "stale", "name": "Back", "last_seen": now - timedelta(hours=2)},
+                {"id": "never", "name": "New"}
+            ]
+
+    assert await tracker.seed_from_repo(FakeRepo()) == 3
+    summary = {d["device_id"]: d for d in tracker.summary()}
+    assert summary["recent"]["is_online"] and summary["recent"]["company_name"] == "Acme"
+    assert not summary["stale"]["is_online"] and not summary["never"]["is_online"]
+
+    # A device registered later picks up the seeded company name
+    tracker.register("late", company_id="c1")
+    assert tracker.devices["late"].company_name == "Acme"
+
+    clock.now += 271
+    assert tracker.expire() == ["recent"]
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_admin_summary_comes_from_the_tracker():
+    tracker, clock = _tracker()
+    tracker.register("d1", name="Lobby", company_id="c1", company_name="Acme")
+    tracker.register("d2", name="Back", company_id="c1", company_name="Acme")
+    manager = DeviceWebSocketManager(hub=WebSocketHub(), outbox=DeviceOutbox(store=InMemoryOutboxStore()),
+                                     liveness=tracker)
+    await manager.connect_device("d1", RecordingSocket())
+
+    admin = RecordingSocket()
+    await manager.connect_admin(admin)
+    await asyncio.sleep(0)
+    summary = next(m for m in admin.sent if m["type"] == "device_status_summary")
+    online = {d["device_id"]: d["is_online"] for d in summary["data"]}
+    assert online == {"d1": True, "d2": False}
+
+    await manager.disconnect_device("d1")
+    assert not tracker.devices["d1"].connected
+    clock.now += 61
+    assert tracker.expire() == ["d1"]
+
+
+@pytest.mark.asyncio
+async def test_devices_heard_by_another_worker_are_not_reported_offline(monkeypatch):
+    tracker, clock = _tracker(timeout=60)
+    for device_id in ("elsewhere", "gone", "broken"):
+        tracker.heartbeat(device_id)
+    clock.now += 61
+    now = datetime.utcfromtimestamp(clock.now)
+
+    class FakeRepo:
+        async def get_digital_screen(self, device_id):
+            if device_id == "broken":
+                raise RuntimeError("lookup failed")
+            # Another worker flushed a recent heartbeat for "elsewhere"
+            seen = now - timedelta(seconds=5 if device_id == "elsewhere" else 61)
+            return {"id": device_id, "last_seen": seen}
+
+    monkeypatch.setattr("app.websocket_manager.repo", FakeRepo())
+    manager = DeviceWebSocketManager(hub=WebSocketHub(), outbox=DeviceOutbox(store=InMemoryOutboxStore()),
+                                     liveness=tracker)
+    admin = RecordingSocket()
+    await manager.connect_admin(admin)
+
+    assert await manager._check_offline_devices() == 2
+    await asyncio.sleep(0)
+    alert = next(m for m in admin.sent if m["type"] == "offline_devices_alert")
+    assert sorted(d["device_id"] for d in alert["data"]) == ["broken", "gone"]
+    assert tracker.is_online("elsewhere") and not tracker.is_online("gone")
+
+    # Rescheduled from the stored last_seen, not from this worker's last sighting
+    clock.now += 50
+    assert tracker.expire() == []
+    clock.now += 5
+    assert tracker.expire() == ["elsewhere"]
+
+
+@pytest.mark.asyncio
+async def test_deleted_devices_are_forgotten_instead_of_alerted(monkeypatch):
+    from app.api import devices_unified
+    from app.monitoring import device_health_monitor
+
+    tracker, clock = _tracker(timeout=60)
+    tracker.heartbeat("deleted-here")
+    tracker.heartbeat("deleted-elsewhere")
+    device_health_monitor.liveness.heartbeat("deleted-here")
+
+    class FakeRepo:
+        async def get_digital_screen(self, device_id):
+            return None if device_id == "deleted-elsewhere" else {"id": device_id, "company_id": "c1"}
+
+        async def delete_digital_screen(self, device_id):
+            return True
+
+    monkeypatch.setattr(devices_unified, "repo", FakeRepo())
+    monkeypatch.setattr(devices_unified, "device_liveness", tracker)
+    monkeypatch.setattr("app.websocket_manager.repo", FakeRepo())
+    admin_user = {"roles": [{"role": "ADMIN", "company_id": "c1"}]}
+    await devices_unified.delete_device("deleted-here", current_user=admin_user)
+    assert "deleted-here" not in tracker.devices
+    assert "deleted-here" not in device_health_monitor.liveness.devices
+
+    # Deleted through another worker: the missing screen is noticed on expiry
+    manager = DeviceWebSocketManager(hub=WebSocketHub(), outbox=DeviceOutbox(store=InMemoryOutboxStore()),
+                                     liveness=tracker)
+    clock.now += 61
+    assert await manager._check_offline_devices() == 0
+    assert tracker.devices == {}
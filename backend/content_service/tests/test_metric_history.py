@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.monitoring.device_health_monitor import DeviceHealthMonitor, MetricType
+from app.monitoring.metric_history import MetricHistory
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def test_ring_keeps_newest_samples_in_order():
+    history = MetricHistory(capacity=5)
+    for minute in range(8):
+        history.record(MetricType.CPU_USAGE, float(minute), START + timedelta(minutes=minute))
+
+    series = history[MetricType.CPU_USAGE]
+    assert len(series) == 5
+    assert [value for _, value in series.samples()] == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert series.samples()[0][0] == START + timedelta(minutes=3)
+    assert series.nbytes() == 5 * 8
+
+
+def test_window_stats_across_the_wrap_point():
+    history = MetricHistory(capacity=10)
+    for minute in range(14):
+        history.record(MetricType.CPU_USAGE, float(minute), START + timedelta(minutes=minute))
+
+    stats = history.stats(MetricType.CPU_USAGE, start=START + timedelta(minutes=6),
+                          end=START + timedelta(minutes=11), percentiles=(50, 90))
+    assert stats == {"count": 6, "min": 6.0, "max": 11.0, "avg": 8.5, "p50": 8.5, "p90": 10.5}
+    assert history.stats(MetricType.CPU_USAGE)["count"] == 10
+    assert history.stats(MetricType.TEMPERATURE) == {"count": 0}
+
+
+@pytest.mark.asyncio
+async def test_monitor_records_history_and_reports_window_stats():
+    monitor = DeviceHealthMonitor()
+    for cpu in (20, 40, 60):
+        result = await monitor.process_heartbeat("d1", {"cpu_usage": cpu, "memory_usage": 50})
+        assert result["success"]
+
+    stats = monitor.get_metric_window_stats("d1", MetricType.CPU_USAGE)
+    assert (stats["count"], stats["min"], stats["max"], stats["avg"], stats["p50"]) == (3, 20.0, 60.0, 40.0, 40.0)
+    status = await monitor.get_device_health_status("d1")
+    assert status["current_metrics"]["cpu_usage"]["value"] == 60
+    assert monitor.get_metric_window_stats("missing", MetricType.CPU_USAGE)["count"] == 0
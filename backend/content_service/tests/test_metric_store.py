@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+from app.analytics.metric_store import MetricStore
+from app.analytics.real_time_analytics import AnalyticsEvent, AnalyticsMetric, MetricType
+
+BASE = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def _metric(i, device_id="d1", campaign_id=None, **kwargs):
+    return AnalyticsMetric(
+        id=str(i), metric_type=MetricType.IMPRESSION, event_type=AnalyticsEvent.CONTENT_VIEW_START,
+        device_id=device_id, content_id=f"c{i % 3}", campaign_id=campaign_id, value=float(i),
+        timestamp=BASE + timedelta(minutes=i), **kwargs
+    )
+
+
+def test_round_trips_metric_fields():
+    store = MetricStore(capacity=8)
+    store.append(_metric(1, campaign_id="camp", count=4, duration_seconds=2.5, revenue_impact=0.75,
+                         audience_count=3, location={"lat": 1.5, "lng": 2.5},
+                         demographic_data={"age_group": "25-34"}, network_conditions={"rssi": -60}))
+    store.append(_metric(2, device_id="d2"))
+
+    (row,) = store.for_device("d1")
+    assert row.metric_type is MetricType.IMPRESSION
+    assert row.event_type is AnalyticsEvent.CONTENT_VIEW_START
+    assert (row.device_id, row.content_id, row.campaign_id) == ("d1", "c1", "camp")
+    assert (row.value, row.count, row.duration_seconds, row.revenue_impact) == (1.0, 4, 2.5, 0.75)
+    assert row.audience_count == 3
+    assert row.timestamp == BASE + timedelta(minutes=1)
+    assert row.location == {"lat": 1.5, "lng": 2.5}
+    assert row.demographic_data == {"age_group": "25-34"}
+
+    (other,) = store.for_device("d2")
+    assert other.campaign_id is None and other.duration_seconds is None and other.audience_count is None
+    assert store.for_device("unknown") == []
+
+
+def test_device_and_campaign_chains_respect_window_and_wraparound():
+    store = MetricStore(capacity=10)
+    for i in range(25):
+        store.append(_metric(i, device_id=f"d{i % 2}", campaign_id="camp" if i % 5 == 0 else None))
+
+    assert len(store) == 10
+    assert [int(m.value) for m in store.for_device("d0")] == [16, 18, 20, 22, 24]
+    assert [int(m.value) for m in store.for_device("d1", start=BASE + timedelta(minutes=19),
+                                                   end=BASE + timedelta(minutes=21))] == [19, 21]
+    assert [int(m.value) for m in store.for_campaign("camp")] == [15, 20]
+    assert [int(m.value) for m in store.in_window(BASE + timedelta(minutes=22), BASE + timedelta(hours=1))] == [22, 23, 24]
+    assert store.get_metrics()["tracked_devices"] == 2
+
+
+def test_evicted_chain_heads_are_dropped():
+    store = MetricStore(capacity=3)
+    store.append(_metric(0, device_id="gone", campaign_id="old"))
+    for i in range(1, 4):
+        store.append(_metric(i))
+    assert store.for_device("gone") == []
+    assert store.for_campaign("old") == []
+    assert store.get_metrics()["tracked_campaigns"] == 0
+
+
+def test_interners_are_bounded_by_live_slots():
+    store = MetricStore(capacity=4)
+    for i in range(100):
+        store.append(_metric(i, device_id=f"d{i}", campaign_id=f"camp{i}",
+                             location={"lat": float(i)}, demographic_data={"bucket": i}))
+
+    metrics = store.get_metrics()
+    # 4 live slots: a device, campaign and up to 3 shared content ids; two contexts each
+    assert metrics["interned_ids"] <= 4 * 2 + 3
+    assert metrics["interned_contexts"] == 8
+    assert metrics["interner_bytes"] > 0
+    assert store.for_device("d0") == []
+    (row,) = store.for_device("d99")
+    assert (row.campaign_id, row.location, row.demographic_data) == ("camp99", {"lat": 99.0}, {"bucket": 99})
+    assert [int(m.value) for m in store.for_campaign("camp98")] == [98]
+
+
+def test_round_trips_nested_location_and_demographics():
+    store = MetricStore(capacity=2)
+    demographics = {"age_groups": {"18-24": 3}, "genders": ["m", "f"]}
+    location = {"coords": {"lat": 1.5, "lng": 2.5}, "zones": ["lobby"]}
+    for i in range(3):
+        store.append(_metric(i, location=location, demographic_data=demographics))
+
+    rows = store.for_device("d1")
+    assert [row.demographic_data for row in rows] == [demographics] * 2
+    assert [row.location for row in rows] == [location] * 2
+    assert store.get_metrics()["interned_contexts"] == 2
+
+    rows[0].demographic_data["age_groups"]["18-24"] = 99
+    assert store.for_device("d1")[0].demographic_data == {"age_groups": {"18-24": 3}, "genders": ["m", "f"]}
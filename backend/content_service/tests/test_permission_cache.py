@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.permission_cache import EffectivePermissionCache, permission_cache
+from app.repo import InMemoryRepo
+
+
+class CountingRepo(InMemoryRepo):
+    def __init__(self):
+        super().__init__()
+        self.loads = 0
+
+    async def get_user_role_assignments(self, user_id):
+        self.loads += 1
+        return await super().get_user_role_assignments(user_id)
+
+
+def _role_permission(permissions):
+    doc = {"id": "rp1", "role_id": "r1", "screen": "content", "permissions": permissions}
+    return SimpleNamespace(**doc, model_dump=lambda **_: dict(doc))
+
+
+async def _seed(repo):
+    repo._store["__users__"] = {"u1": {"id": "u1", "email": "u1@example.com", "user_type": "COMPANY_USER"}}
+    repo._store["__roles__"] = {"r1": {"id": "r1", "name": "Editor", "company_id": "c1", "status": "active"}}
+    repo._store["__user_roles__"] = {"ur1": {"id": "ur1", "user_id": "u1", "company_id": "c1", "role_id": "r1"}}
+    await repo.save_role_permission(_role_permission(["view"]))
+
+
+@pytest.mark.asyncio
+async def test_check_user_permission_is_served_from_cache():
+    permission_cache.clear()
+    repo = CountingRepo()
+    await _seed(repo)
+
+    assert await repo.check_user_permission("u1", "c1", "content", "view")
+    assert not await repo.check_user_permission("u1", "c1", "content", "delete")
+    assert not await repo.check_user_permission("u1", "other", "content", "view")
+    # one build per (user, company) pair; the repeat lookup is a hit
+    assert repo.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_mutations_invalidate_affected_entries():
+    permission_cache.clear()
+    repo = CountingRepo()
+    await _seed(repo)
+    assert not await repo.check_user_permission("u1", "c1", "content", "edit")
+
+    await repo.save_role_permission(_role_permission(["view", "edit"]))
+    assert await repo.check_user_permission("u1", "c1", "content", "edit")
+
+    await repo.delete_user_role("ur1")
+    assert not await repo.check_user_permission("u1", "c1", "content", "view")
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_lru_bounds():
+    repo = CountingRepo()
+    await _seed(repo)
+
+    expiring = EffectivePermissionCache(ttl_seconds=0, max_entries=10)
+    await expiring.get(repo, "u1", "c1")
+    await expiring.get(repo, "u1", "c1")
+    assert expiring.get_metrics()["expired"] == 1
+
+    bounded = EffectivePermissionCache(ttl_seconds=60, max_entries=2)
+    for company_id in ("c1", "c2", "c3"):
+        await bounded.get(repo, "u1", company_id)
+    metrics = bounded.get_metrics()
+    assert metrics["size"] == 2
+    assert metrics["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_user_endpoints_writing_stores_directly_invalidate(monkeypatch):
+    from app.api import users
+    from app.models import UserUpdate
+
+    permission_cache.clear()
+    repo = CountingRepo()
+    await _seed(repo)
+    monkeypatch.setattr(users, "repo", repo)
+    admin = SimpleNamespace(id="admin")
+    context = {"is_platform_admin": True, "accessible_companies": []}
+    assert await repo.check_user_permission("u1", "c1", "content", "view")
+
+    await users.update_user("u1", UserUpdate(name="Renamed"), current_user=admin, company_context=context)
+    assert await repo.check_user_permission("u1", "c1", "content", "view")
+    assert repo.loads == 2
+
+    await users.delete_user("u1", current_user=admin, company_context=context)
+    assert not await repo.check_user_permission("u1", "c1", "content", "view")
+
+
+@pytest.mark.asyncio
+async def test_create_user_evicts_a_cached_miss(monkeypatch):
+    from app.api import users
+
+    permission_cache.clear()
+    repo = CountingRepo()
+    await _seed(repo)
+    monkeypatch.setattr(users, "repo", repo)
+    ids = iter(["new-user", "new-assignment"])
+    monkeypatch.setattr(users.uuid, "uuid4", lambda: next(ids))
+    monkeypatch.setattr(users.auth_service, "hash_password", lambda password: "hashed")
+    admin = SimpleNamespace(id="admin")
+    context = {"is_platform_admin": True, "accessible_companies": []}
+    assert not await repo.check_user_permission("new-user", "c1", "content", "view")
+
+    await users.create_user({"email": "new@example.com", "roles": [{"company_id": "c1", "role_id": "r1"}]},
+                            current_user=admin, company_context=context)
+    assert await repo.check_user_permission("new-user", "c1", "content", "view")
@@ -0,0 +1,72 @@
+import random
+
+from app.security.phash_index import PerceptualHashIndex
+
+
+def _flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_query_finds_hashes_within_distance():
+    index = PerceptualHashIndex()
+    base = 0x8F3C_11A0_5E77_0C21
+    index.add(base, "studio-a")
+    index.add(_flip(base, [0, 17, 40]), "studio-b")
+    index.add(_flip(base, range(20)), "unrelated")
+
+    matches = index.query(base, 6)
+    assert [(h, d) for h, d, _ in matches] == [(base, 0), (_flip(base, [0, 17, 40]), 3)]
+    assert matches[0][2] == {"studio-a"}
+
+
+def test_query_matches_brute_force():
+    rng = random.Random(7)
+    index = PerceptualHashIndex()
+    corpus = [rng.getrandbits(64) for _ in range(2000)]
+    index.bulk_add((h, f"ref-{i}") for i, h in enumerate(corpus))
+    for _ in range(50):
+        probe = _flip(rng.choice(corpus), rng.sample(range(64), rng.randint(0, 9)))
+        for k in (0, 3, 7, 9):
+            expected = sorted(h for h in corpus if (h ^ probe).bit_count() <= k)
+            assert sorted(h for h, _, _ in index.query(probe, k)) == expected
+
+
+def test_remove_and_hex_input():
+    index = PerceptualHashIndex()
+    index.add("00000000000000ff", "a")
+    index.add("00000000000000ff", "b")
+    assert index.remove("00000000000000ff", "a")
+    assert index.query(0xFF, 0)[0][2] == {"b"}
+    assert index.remove("00000000000000ff")
+    assert index.query(0xFF, 4) == []
+    assert len(index) == 0
+
+
+def test_journal_roundtrip_and_compact(tmp_path):
+    path = str(tmp_path / "phash.log")
+    index = PerceptualHashIndex(path=path)
+    index.bulk_add([(1, "a"), (2, "b"), (3, "c")])
+    index.remove(2)
+
+    reloaded = PerceptualHashIndex(path=path)
+    assert reloaded.load() == 2
+    assert 2 not in reloaded and 3 in reloaded
+
+    reloaded.compact()
+    with open(path) as fh:
+        assert len(fh.readlines()) == 2
+    again = PerceptualHashIndex(path=path)
+    assert again.load() == 2
+
+
+def test_compact_before_load_keeps_the_journal(tmp_path):
+    path = str(tmp_path / "phash.log")
+    PerceptualHashIndex(path=path).bulk_add([(1, "a"), (2, "b")])
+
+    fresh = PerceptualHashIndex(path=path)
+    fresh.compact()
+    assert fresh.loaded and len(fresh) == 2
+    again = PerceptualHashIndex(path=path)
+    assert again.load() == 2
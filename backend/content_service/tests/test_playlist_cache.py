@@ -0,0 +1,160 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.content_delivery.content_scheduler import ContentSchedulerService
+from app.playlist_cache import PlaylistCache
+from app.schedule_index import ScheduleIndex
+
+SLOT = datetime(2025, 3, 1, 10)
+
+
+class FakeRepo:
+    def __init__(self):
+        window = {"start_date": datetime(2025, 1, 1), "end_date": datetime(2026, 1, 1), "status": "approved"}
+        self.schedules = [
+            {"id": "s1", "content_id": "c1", "device_ids": ["d1"], "priority": 3, **window},
+            {"id": "s2", "content_id": "c2", "device_ids": ["d1"], **window},
+            {"id": "s3", "content_id": "c3", "device_ids": ["d2"], **window}
+        ]
+        self.content = {"c1": {"duration": 15}, "c2": {"duration": 30}, "c3": {"duration": 10}}
+        self.device_lookups = 0
+        self.gate = None
+
+    async def get_schedule_version(self):
+        return 0
+
+    async def list_content_schedules(self, device_id=None, exclude_statuses=None):
+        return self.schedules
+
+    async def get_digital_screen(self, device_id):
+        self.device_lookups += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        return {"id": device_id}
+
+    async def get_content_meta(self, content_id):
+        return self.content.get(content_id)
+
+
+def _scheduler(lead_seconds=0):
+    scheduler = ContentSchedulerService()
+    scheduler.repo = FakeRepo()
+    scheduler.audit_logger = None
+    scheduler.schedule_index = ScheduleIndex()
+    scheduler.playlist_cache = PlaylistCache(slot_minutes=60, max_entries=100, precompute_lead_seconds=lead_seconds)
+    return scheduler
+
+
+@pytest.mark.asyncio
+async def test_playlist_is_compiled_once_per_slot():
+    scheduler = _scheduler()
+    first = await scheduler.get_device_playlist("d1", SLOT.replace(minute=5))
+    second = await scheduler.get_device_playlist("d1", SLOT.replace(minute=40))
+
+    assert second is first
+    assert scheduler.repo.device_lookups == 1
+    assert [item["content_id"] for item in first["playlist"]] == ["c1", "c2"]
+    assert first["playlist"][0]["start_time"] == SLOT.isoformat()
+    assert first["next_update"] == SLOT.replace(hour=11).isoformat()
+
+    await scheduler.get_device_playlist("d1", SLOT.replace(hour=11, minute=1))
+    metrics = scheduler.playlist_cache.get_metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["builds"]) == (1, 2, 2)
+    assert metrics["hit_rate"] == 0.3333 and metrics["avg_build_ms"] is not None
+
+
+@pytest.mark.asyncio
+async def test_invalidation_drops_only_dependent_playlists():
+    scheduler = _scheduler()
+    cache = scheduler.playlist_cache
+    for device_id in ("d1", "d2"):
+        await scheduler.get_device_playlist(device_id, SLOT)
+
+    cache.invalidate_content("c3")
+    assert cache.get("d1", SLOT) is not None and cache.get("d2", SLOT) is None
+
+    cache.invalidate_device("d1", {"last_seen": SLOT, "health_status": "healthy"})
+    assert cache.get("d1", SLOT) is not None
+    cache.invalidate_device("d1", {"location": "Lobby"})
+    assert cache.get("d1", SLOT) is None
+
+    await scheduler.get_device_playlist("d1", SLOT)
+    cache.invalidate_schedule("new-schedule", device_ids=["d1"])
+    assert cache.get("d1", SLOT) is None
+    assert cache.get_metrics()["entries_invalidated"] == 3
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_build_and_racing_invalidation_is_not_cached():
+    scheduler = _scheduler()
+    scheduler.repo.gate = asyncio.Event()
+    requests = [asyncio.ensure_future(scheduler.get_device_playlist("d1", SLOT)) for _ in range(5)]
+    await asyncio.sleep(0)
+    scheduler.playlist_cache.invalidate_content("c1")
+    scheduler.repo.gate.set()
+    results = await asyncio.gather(*requests)
+
+    assert all(result is results[0] for result in results)
+    assert scheduler.repo.device_lookups == 1
+    assert scheduler.playlist_cache.get_metrics()["coalesced"] == 4
+    # The build started before the invalidation, so its result was not stored
+    assert scheduler.playlist_cache.get("d1", SLOT) is None
+
+
+@pytest.mark.asyncio
+async def test_next_slot_is_precomputed_near_the_boundary():
+    scheduler = _scheduler(lead_seconds=120)
+    await scheduler.get_device_playlist("d1", SLOT.replace(minute=30))
+    assert scheduler.playlist_cache.get("d1", SLOT.replace(hour=11)) is None
+
+    await scheduler.get_device_playlist("d1", SLOT.replace(minute=59))
+    await asyncio.sleep(0.01)
+    assert scheduler.playlist_cache.get("d1", SLOT.replace(hour=11)) is not None
+
+    assert await scheduler.precompute_next_slot(["d1", "d2"], now=SLOT.replace(minute=30)) == 1
+    assert scheduler.playlist_cache.get_metrics()["precomputed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_content_and_device_invalidations_reach_other_workers():
+    class SharedVersion:
+        def __init__(self):
+            self.version = 0
+
+        async def bump_playlist_version(self):
+            self.version += 1
+            return self.version
+
+        async def get_playlist_version(self):
+            return self.version
+
+    shared = SharedVersion()
+    workers = [_scheduler(), _scheduler()]
+    for scheduler in workers:
+        scheduler.playlist_cache.version_store = shared
+        scheduler.playlist_cache.refresh_seconds = 0
+        await scheduler.get_device_playlist("d1", SLOT)
+    here, elsewhere = (scheduler.playlist_cache for scheduler in workers)
+
+    # Heartbeat telemetry is not published
+    here.invalidate_device("d1", {"last_seen": SLOT})
+    await asyncio.sleep(0)
+    assert shared.version == 0
+
+    here.invalidate_content("c1")
+    here.invalidate_device("d2", {"location": "Lobby"})
+    await asyncio.sleep(0.01)
+    # Folded into one bump, and recognised as this worker's own
+    assert shared.version == 1 and here.version == 1
+    assert here.get_metrics()["versions_published"] == 1
+
+    assert elsewhere.get("d1", SLOT) is not None
+    await workers[1].get_device_playlist("d1", SLOT)
+    assert elsewhere.get_metrics()["stale_clears"] == 1
+    assert elsewhere.get_metrics()["builds"] == 2
+
+    # This worker's own bumps do not clear it again
+    await workers[0].get_device_playlist("d1", SLOT)
+    assert here.get_metrics()["stale_clears"] == 0
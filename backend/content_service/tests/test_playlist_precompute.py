@@ -0,0 +1,105 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from app.content_delivery.content_scheduler import ContentSchedulerService
+from app.content_delivery.playlist_precompute import FleetPlaylistPrecomputer
+from app.playlist_cache import PlaylistCache
+from app.schedule_index import ScheduleIndex
+
+SLOT = datetime(2025, 3, 1, 10)
+
+
+class FleetRepo:
+    def __init__(self):
+        window = {"start_date": datetime(2025, 1, 1), "end_date": datetime(2026, 1, 1), "status": "approved"}
+        self.schedules = [
+            {"id": "s1", "content_id": "c1", "device_ids": ["d1", "d2", "d3"], **window},
+            {"id": "s2", "content_id": "c2", "device_ids": ["d1", "d2", "d3"], "priority": 3, **window}
+        ]
+        landscape = {"company_id": "co1", "orientation": "landscape"}
+        self.devices = [
+            {"id": "d1", "name": "Lobby", **landscape},
+            {"id": "d2", "name": "Atrium", **landscape},
+            {"id": "d3", "name": "Lift", "company_id": "co1", "orientation": "portrait"},
+            {"id": "d4", "name": "Car park", **landscape}
+        ]
+        self.content_lookups = 0
+
+    async def get_schedule_version(self):
+        return 0
+
+    async def list_content_schedules(self, device_id=None, exclude_statuses=None):
+        return self.schedules
+
+    async def list_digital_screens(self, company_id=None):
+        return self.devices
+
+    async def get_digital_screen(self, device_id):
+        return next((d for d in self.devices if d["id"] == device_id), None)
+
+    async def get_content_meta(self, content_id):
+        self.content_lookups += 1
+        return {"duration": 20}
+
+
+def _precomputer():
+    scheduler = ContentSchedulerService()
+    scheduler.repo = FleetRepo()
+    scheduler.audit_logger = None
+    scheduler.schedule_index = ScheduleIndex()
+    scheduler.playlist_cache = PlaylistCache(slot_minutes=60, max_entries=100, precompute_lead_seconds=0)
+    return FleetPlaylistPrecomputer(scheduler, chunk_size=2, workers=2, lead_seconds=0)
+
+
+@pytest.mark.asyncio
+async def test_fleet_run_compiles_once_per_equivalence_class():
+    precomputer = _precomputer()
+    scheduler = precomputer.scheduler
+
+    summary = await precomputer.run(SLOT)
+    # d1 and d2 share schedules and targeting; d3 differs in orientation; d4 has no schedules
+    assert (summary["devices"], summary["classes"], summary["playlists_stored"]) == (4, 3, 4)
+    assert scheduler.repo.content_lookups == 4
+
+    payloads = {}
+    for device_id in ("d1", "d2", "d3", "d4"):
+        compiled = await scheduler.get_device_playlist_payload(device_id, SLOT.replace(minute=1))
+        payloads[device_id] = compiled
+        assert json.loads(compiled.body) == compiled.result
+        assert compiled.result["device_id"] == device_id
+    assert [item["content_id"] for item in payloads["d1"].result["playlist"]] == ["c2", "c1"]
+    assert payloads["d4"].result["playlist"] == []
+    assert len({compiled.etag for compiled in payloads.values()}) == 4
+    metrics = scheduler.playlist_cache.get_metrics()
+    assert (metrics["builds"], metrics["hits"], metrics["encoded"]) == (0, 4, 0)
+
+    # Already cached devices are skipped on the next run
+    assert (await precomputer.run(SLOT))["classes"] == 0
+
+
+@pytest.mark.asyncio
+async def test_on_demand_payload_is_encoded_once_and_racing_changes_fall_back_per_device():
+    precomputer = _precomputer()
+    scheduler = precomputer.scheduler
+
+    first = await scheduler.get_device_playlist_payload("d1", SLOT)
+    second = await scheduler.get_device_playlist_payload("d1", SLOT.replace(minute=30))
+    assert second.etag == first.etag and second.body is first.body
+    assert scheduler.playlist_cache.get_metrics()["encoded"] == 1
+
+    compile_shared = scheduler.compile_shared_playlist
+    edits = ["c1"]
+
+    async def compile_then_edit(schedules, device_info, slot_start):
+        compiled = await compile_shared(schedules, device_info, slot_start)
+        if edits:
+            scheduler.playlist_cache.invalidate_content(edits.pop())
+        return compiled
+
+    scheduler.compile_shared_playlist = compile_then_edit
+    summary = await precomputer.run(SLOT.replace(hour=11), devices=scheduler.repo.devices[:2])
+    assert summary["playlists_stored"] == 2
+    assert precomputer.get_metrics()["compiled_per_device"] == 2
+    assert scheduler.playlist_cache.contains("d2", SLOT.replace(hour=11))
@@ -0,0 +1,114 @@
+import pytest
+
+from app import database_service
+from app.auth_service import AuthService
+from app.profile_cache import UserProfileCache, profile_cache
+
+
+@pytest.fixture
+def auth(monkeypatch):
+    profile_cache.clear()
+    loads = []
+
+    async def get_user_profile(user_id):
+        loads.append(user_id)
+        return {"id": user_id, "company_id": "c1", "is_active": True}
+
+    monkeypatch.setattr(database_service.db_service, "get_user_profile", get_user_profile)
+    service = AuthService()
+    service.jwt_secret = "profile-cache-test-secret-0123456789abcdef"
+    service.loads = loads
+    return service
+
+
+def _token(service, user_id="u1"):
+    return service.create_access_token({"id": user_id, "user_type": "COMPANY_USER", "email": "u@example.com"})
+
+
+@pytest.mark.asyncio
+async def test_profile_is_loaded_once_per_token(auth):
+    token = _token(auth)
+    first = await auth.get_current_user_from_token(token)
+    second = await auth.get_current_user_from_token(token)
+    assert first is second
+    assert auth.loads == ["u1"]
+
+    # A new token (new jti) starts from a fresh load
+    await auth.get_current_user_from_token(_token(auth))
+    assert auth.loads == ["u1", "u1"]
+
+
+@pytest.mark.asyncio
+async def test_user_and_company_invalidation(auth):
+    token = _token(auth)
+    await auth.get_current_user_from_token(token)
+
+    profile_cache.invalidate_user("u1")
+    await auth.get_current_user_from_token(token)
+    assert len(auth.loads) == 2
+
+    profile_cache.invalidate_company("c1")
+    await auth.get_current_user_from_token(token)
+    assert len(auth.loads) == 3
+
+
+def test_ttl_and_lru_bounds():
+    expiring = UserProfileCache(ttl_seconds=0, max_entries=10)
+    expiring.put("u1", "j1", {"id": "u1"})
+    assert expiring.get("u1", "j1") is None
+
+    bounded = UserProfileCache(ttl_seconds=60, max_entries=2)
+    for jti in ("j1", "j2", "j3"):
+        bounded.put("u1", jti, {"id": "u1"})
+    assert bounded.get("u1", "j1") is None
+    assert bounded.get_metrics()["evictions"] == 1
+
+    # a store that raced an invalidation is skipped
+    epoch = bounded.epoch
+    bounded.invalidate_user("u1")
+    bounded.put("u1", "j4", {"id": "u1"}, epoch=epoch)
+    assert bounded.get("u1", "j4") is None
+
+
+@pytest.mark.asyncio
+async def test_db_service_writes_invalidate_only_what_they_touch(auth, monkeypatch):
+    class Collection:
+        async def update_one(self, query, update, upsert=False):
+            return None
+
+    monkeypatch.setattr(database_service.db_service, "db", {"users": Collection()})
+    token = _token(auth)
+    other = _token(auth, "u2")
+    await auth.get_current_user_from_token(token)
+    await auth.get_current_user_from_token(other)
+
+    # analytics counters never change a profile
+    await database_service.db_service.update_document("users", {"_id": "u1"}, {"$inc": {"analytics.login_count": 1}})
+    await auth.get_current_user_from_token(token)
+    assert auth.loads == ["u1", "u2"]
+
+    # an _id query is as targeted as an id query
+    await database_service.db_service.update_document("users", {"_id": "u1"}, {"$set": {"name": "Renamed"}})
+    await auth.get_current_user_from_token(token)
+    await auth.get_current_user_from_token(other)
+    assert auth.loads == ["u1", "u2", "u1"]
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_invalidates_once_per_batch(auth, monkeypatch):
+    class Collection:
+        async def bulk_write(self, requests, ordered=True):
+            return None
+
+    monkeypatch.setattr(database_service.db_service, "db", {"users": Collection()})
+    for user_id in ("u1", "u2", "u3"):
+        await auth.get_current_user_from_token(_token(auth, user_id))
+    before = profile_cache.get_metrics()["invalidations"]
+
+    await database_service.db_service.bulk_update("users", [
+        ({"_id": "u1"}, {"$inc": {"analytics.login_count": 1}}),
+        ({"_id": "u2"}, {"$set": {"status": "suspended"}}),
+        ({"_id": "u3"}, {"$set": {"phone": "555"}, "$inc": {"analytics.login_count": 1}}),
+    ])
+    assert profile_cache.get_metrics()["invalidations"] == before + 1
+    assert profile_cache.get_metrics()["size"] == 1
@@ -0,0 +1,76 @@
+import pytest
+
+from app.analytics.real_time_analytics import RealTimeAnalyticsService
+
+
+def _metrics():
+    return [
+        {"metric_type": "impression", "event_type": "content_view_start", "device_id": "d1", "count": 2},
+        {"metric_type": "impression", "event_type": "content_view_end", "device_id": "d2"},
+        {"metric_type": "engagement", "event_type": "content_interaction", "device_id": "d1",
+         "duration_seconds": 4.5},
+        {"metric_type": "error", "event_type": "error_occurred", "device_id": "d2", "count": 3},
+        {"metric_type": "interaction", "event_type": "content_interaction", "device_id": "d1"},
+    ]
+
+
+def _service():
+    service = RealTimeAnalyticsService()
+    service.audit_logger = None
+    service.repo = None
+    return service
+
+
+def _minute_cache(service):
+    (key,) = [k for k in service.real_time_cache if k.startswith("minute_")]
+    cached = service.real_time_cache[key]
+    return (cached.total_impressions, cached.unique_viewers, cached.total_dwell_time,
+            cached.error_count, cached.content_plays, cached.content_completions)
+
+
+@pytest.mark.asyncio
+async def test_batch_matches_per_metric_aggregation():
+    single = _service()
+    for metric in _metrics():
+        await single.record_metric(metric)
+
+    batch = _service()
+    result = await batch.record_batch_metrics(_metrics())
+
+    assert result["successful"] == 5 and result["failed"] == 0
+    assert _minute_cache(batch) == _minute_cache(single) == (3, 2, 4.5, 3, 1, 1)
+    assert len(batch.metric_buffer) == len(single.metric_buffer) == 5
+    assert {k.split("_")[0] for k in batch.real_time_cache} == {"minute", "hour"}
+    for service in (single, batch):
+        service.processing_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_batch_reports_invalid_metrics_without_dropping_valid_ones():
+    service = _service()
+    result = await service.record_batch_metrics(
+        _metrics()[:2] + [{"metric_type": "bogus", "event_type": "content_view_start", "device_id": "d1"},
+                          {"metric_type": "impression", "event_type": "content_view_start"}]
+    )
+    assert result["successful"] == 2
+    assert result["failed"] == 2
+    assert not result["success"]
+    assert len(result["errors"]) == 2
+    service.processing_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_nested_demographics_and_location_are_recorded():
+    service = _service()
+    nested = {"metric_type": "impression", "event_type": "content_view_start", "device_id": "d1",
+              "demographic_data": {"age_groups": {"18-24": 3}, "genders": ["m", "f"]},
+              "location": {"coords": {"lat": 1.5, "lng": 2.5}}}
+
+    assert await service.record_metric(dict(nested))
+    result = await service.record_batch_metrics([dict(nested)])
+
+    assert result["successful"] == 1 and result["failed"] == 0
+    rows = service.metric_store.for_device("d1")
+    assert [row.demographic_data for row in rows] == [nested["demographic_data"]] * 2
+    assert [row.location for row in rows] == [nested["location"]] * 2
+    service.processing_task.cancel()
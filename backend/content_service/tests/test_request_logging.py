@@ -0,0 +1,130 @@
+import json
+import threading
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+
+from app.middleware.logging import RequestLogSink, RequestLoggingMiddleware, RouteLatencyRegistry
+
+
+class CapturingSink(RequestLogSink):
+    def __init__(self, max_queue=100):
+        self.lines = []
+        super().__init__(max_queue=max_queue, emit=lambda level, line: self.lines.append((level, json.loads(line))))
+
+
+def _app(sink, routes, body_max_bytes=1024, log_requests=True):
+    app = FastAPI()
+    received = {}
+
+    @app.post("/devices/{device_id}/register")
+    async def register(device_id: str, request: Request):
+        chunks = [chunk async for chunk in request.stream() if chunk]
+        received[device_id] = chunks
+        return {"chunks": len(chunks), "bytes": sum(len(c) for c in chunks)}
+
+    app.add_middleware(RequestLoggingMiddleware, sink=sink, routes=routes, body_max_bytes=body_max_bytes,
+                       log_requests=log_requests)
+    return app, received
+
+
+@pytest.mark.asyncio
+async def test_small_json_body_is_sampled_masked_and_timed_per_route_template():
+    sink, routes = CapturingSink(), RouteLatencyRegistry()
+    app, _ = _app(sink, routes)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        for device_id in ("d1", "d2"):
+            response = await client.post(f"/devices/{device_id}/register", json={
+                "name": "lobby", "password": "hunter2", "credentials": {"api_key": "k"}, "nested": [{"token": "t"}]
+            }, headers={"x-request-id": "req-1"})
+            assert response.status_code == 200
+            assert float(response.headers["x-process-time"]) >= 0
+        assert (await client.get("/missing")).status_code == 404
+    sink.stop()
+
+    (level, record), _, (_, missing) = sink.lines
+    assert record["route"] == "/devices/{device_id}/register" and record["path"] == "/devices/d1/register"
+    assert record["body"] == {"name": "lobby", "password": "***", "credentials": "***", "nested": [{"token": "***"}]}
+    assert (record["status"], record["request_id"]) == (200, "req-1")
+    assert (missing["route"], missing["status"]) == ("<unmatched>", 404)
+
+    by_route = {(r["method"], r["route"]): r for r in routes.get_metrics()}
+    assert by_route[("POST", "/devices/{device_id}/register")]["count"] == 2
+    assert by_route[("POST", "/devices/{device_id}/register")]["statuses"] == {"2xx": 2}
+    assert by_route[("GET", "<unmatched>")]["statuses"] == {"4xx": 1}
+
+
+@pytest.mark.asyncio
+async def test_large_bodies_stream_through_without_a_copy():
+    sink, routes = CapturingSink(), RouteLatencyRegistry()
+    app, received = _app(sink, routes, body_max_bytes=16)
+    chunks = [b"x" * 64 for _ in range(5)]
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    delivered = []
+
+    async def receive():
+        message = messages.pop(0)
+        delivered.append(message)
+        return message
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/devices/d9/register", "raw_path": b"/devices/d9/register", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", b"320")],
+        "client": ("10.0.0.1", 1234), "server": ("test", 80), "root_path": ""
+    }
+    await app(scope, receive, send)
+    sink.stop()
+
+    # The endpoint read the chunks as sent, one at a time
+    assert received["d9"] == chunks and len(delivered) == 5
+    (_, record), = sink.lines
+    assert record["body"] is None and record["content_length"] == 320 and record["client"] == "10.0.0.1"
+    assert sent[0]["status"] == 200
+
+
+@pytest.mark.asyncio
+async def test_without_request_logging_only_latency_is_recorded():
+    sink, routes = CapturingSink(), RouteLatencyRegistry()
+    app, _ = _app(sink, routes, log_requests=False)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/devices/d1/register", json={"email": "someone@example.com"})
+        assert response.status_code == 200
+    sink.stop()
+
+    assert sink.lines == [] and sink.get_metrics()["records_queued"] == 0
+    assert routes.get_metrics()[0]["count"] == 1
+
+
+def test_sink_drops_instead_of_blocking_when_the_writer_falls_behind():
+    release = threading.Event()
+    written = []
+
+    def slow_emit(level, line):
+        release.wait(2)
+        written.append(line)
+
+    sink = RequestLogSink(max_queue=2, emit=slow_emit)
+    results = [sink.submit({"status": 200, "n": n}) for n in range(10)]
+    assert results.count(False) >= 7
+    release.set()
+    sink.stop()
+    metrics = sink.get_metrics()
+    assert metrics["records_dropped"] == results.count(False)
+    assert metrics["records_written"] == len(written) == results.count(True)
+
+
+def test_nonstandard_methods_share_one_histogram_per_route():
+    routes = RouteLatencyRegistry()
+    for method in ("GET", "BREW", "PROPFIND", "X-" + "A" * 40):
+        routes.observe(method, "<unmatched>", 405, 0.001)
+
+    counts = {(route["method"], route["route"]): route["count"] for route in routes.get_metrics()}
+    assert counts == {("GET", "<unmatched>"): 1, ("OTHER", "<unmatched>"): 3}
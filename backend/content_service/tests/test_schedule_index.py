@@ -0,0 +1,148 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.content_delivery.content_scheduler import ContentSchedulerService
+from app.playlist_cache import PlaylistCache
+from app.repo import InMemoryRepo
+from app.schedule_index import IndexedSchedule, IntervalTree, ScheduleIndex
+
+DAY = datetime(2025, 3, 1)
+
+
+def _schedule(schedule_id, content_id, devices, start_hour, end_hour, **extra):
+    return {"id": schedule_id, "content_id": content_id, "device_ids": devices, "status": "approved",
+            "start_date": DAY + timedelta(hours=start_hour), "end_date": DAY + timedelta(hours=end_hour), **extra}
+
+
+def _entry(schedule_id, start, end):
+    return IndexedSchedule({"id": schedule_id}, DAY + timedelta(minutes=start), DAY + timedelta(minutes=end))
+
+
+def test_tree_queries_match_a_linear_scan():
+    rng = random.Random(7)
+    entries = []
+    for i in range(400):
+        start = rng.randrange(0, 10_000)
+        entries.append(_entry(f"s{i}", start, start + rng.randrange(1, 600)))
+
+    bulk = IntervalTree.from_entries(entries[:200])
+    for entry in entries[200:]:
+        bulk.insert(entry)
+    for entry in entries[::3]:
+        assert bulk.remove(entry)
+    live = [entry for i, entry in enumerate(entries) if i % 3]
+    assert len(bulk) == len(live)
+
+    for _ in range(200):
+        t = DAY + timedelta(minutes=rng.randrange(0, 10_600))
+        assert {e.id for e in bulk.stab(t)} == {e.id for e in live if e.start <= t < e.end}
+        end = t + timedelta(minutes=rng.randrange(1, 300))
+        assert {e.id for e in bulk.overlapping(t, end)} == {e.id for e in live if e.start < end and e.end > t}
+
+
+def test_active_lookup_respects_time_slots_and_status():
+    index = ScheduleIndex()
+    index.add(_schedule("morning", "c1", ["d1"], 0, 48, time_slots=[
+        {"start_time": (DAY + timedelta(hours=8)).isoformat(), "end_time": (DAY + timedelta(hours=10)).isoformat()},
+        {"start_time": DAY + timedelta(hours=9), "end_time": DAY + timedelta(hours=11)}
+    ]))
+    index.add(_schedule("all-day", "c2", ["d1", "d2"], 0, 24))
+    index.add(_schedule("pending", "c3", ["d1"], 0, 24, status="pending_approval"))
+    index.add(_schedule("rejected", "c4", ["d1"], 0, 24, status="rejected"))
+
+    def active(device_id, hour, until=None):
+        end = DAY + timedelta(hours=until) if until is not None else None
+        return sorted(s["id"] for s in index.active_for_device(device_id, DAY + timedelta(hours=hour), end))
+
+    assert active("d1", 10.5) == ["all-day", "morning"]
+    assert active("d1", 12) == ["all-day"]
+    assert active("d1", 7, until=8.5) == ["all-day", "morning"]
+    assert active("d2", 30) == []
+
+    index.update("all-day", {"status": "cancelled"})
+    assert active("d2", 12) == [] and index.get_metrics()["devices"] == 1
+
+
+def test_overlaps_only_where_slots_intersect():
+    index = ScheduleIndex()
+    index.add(_schedule("existing", "c1", ["d1", "d2"], 0, 24, time_slots=[
+        {"start_time": DAY + timedelta(hours=8), "end_time": DAY + timedelta(hours=10)}]))
+    evening = _schedule("new", "c2", ["d1", "d2", "d3"], 0, 24, time_slots=[
+        {"start_time": DAY + timedelta(hours=18), "end_time": DAY + timedelta(hours=21)}])
+    assert index.overlapping(evening) == {}
+
+    morning = _schedule("new", "c2", ["d1", "d3"], 9, 12)
+    assert {device: [s["id"] for s in found] for device, found in index.overlapping(morning).items()} == {
+        "d1": ["existing"]}
+
+
+@pytest.mark.asyncio
+async def test_create_schedule_reports_conflicts_and_stores_enum_values():
+    class Repo:
+        def __init__(self):
+            self.saved = {}
+
+        async def get_schedule_version(self):
+            return 0
+
+        async def list_content_schedules(self, device_id=None, exclude_statuses=None):
+            now = datetime.utcnow()
+            return [{"id": "booked", "content_id": "c1", "device_ids": ["d2"], "status": "approved",
+                     "start_date": now, "end_date": now + timedelta(days=30)}]
+
+        async def save_content_schedule(self, schedule):
+            self.saved[schedule["id"]] = schedule
+            return schedule
+
+    scheduler = ContentSchedulerService()
+    scheduler.repo = Repo()
+    scheduler.audit_logger = None
+    scheduler.schedule_index = ScheduleIndex()
+    scheduler.playlist_cache = PlaylistCache(slot_minutes=60, max_entries=100, precompute_lead_seconds=0)
+    start = datetime.utcnow() + timedelta(days=1)
+    request = {"content_id": "c1", "device_ids": ["d1", "d2"], "created_by": "u1",
+               "start_date": start.isoformat(), "end_date": (start + timedelta(days=2)).isoformat()}
+
+    result = await scheduler.create_schedule(dict(request))
+    assert not result["success"]
+    assert result["conflicts"] == [
+        {"device_id": "d2", "type": "duplicate_content", "schedule_id": "booked", "content_id": "c1"}]
+
+    result = await scheduler.create_schedule({**request, "content_id": "c2"})
+    assert result["success"]
+    saved = scheduler.repo.saved[result["schedule_id"]]
+    assert saved["priority"] == 2 and saved["delivery_mode"] == "scheduled"
+
+
+@pytest.mark.asyncio
+async def test_workers_reload_after_schedule_writes_elsewhere():
+    repo = InMemoryRepo()
+    await repo.save_content_schedule(_schedule("s1", "c1", ["d1"], 8, 10))
+    # One index per worker; the repository's own writes only reach the process-wide one
+    worker_a, worker_b = ScheduleIndex(refresh_seconds=0), ScheduleIndex(refresh_seconds=0)
+    assert await worker_a.sync(repo) and await worker_b.sync(repo)
+    assert not await worker_b.sync(repo)
+
+    await repo.save_content_schedule(_schedule("s2", "c2", ["d1"], 9, 11))
+    worker_a.add(await repo.get_content_schedule("s2"))
+    worker_a.mark_written(await repo.get_schedule_version())
+    assert not await worker_a.sync(repo)
+    assert await worker_b.sync(repo)
+    assert {s["id"] for s in worker_b.active_for_device("d1", DAY + timedelta(hours=9, minutes=30))} == {"s1", "s2"}
+
+    # Proof-of-play counter writes do not make other workers reload
+    version = await repo.get_schedule_version()
+    await repo.update_content_schedule("s1", {"total_plays": 5, "updated_at": DAY})
+    assert await repo.get_schedule_version() == version
+    assert not await worker_b.sync(repo)
+
+    await repo.update_content_schedule("s1", {"status": "cancelled"})
+    assert await worker_a.sync(repo) and await worker_b.sync(repo)
+    assert [s["id"] for s in worker_a.active_for_device("d1", DAY + timedelta(hours=9, minutes=30))] == ["s2"]
+
+    throttled = ScheduleIndex(refresh_seconds=3600)
+    await throttled.sync(repo)
+    await repo.save_content_schedule(_schedule("s3", "c3", ["d1"], 9, 11))
+    assert not await throttled.sync(repo)
@@ -0,0 +1,68 @@
+import os
+import pytest
+
+from app.security import signature_matcher
+from app.security.signature_matcher import SignatureMatcher
+
+SIGNATURES = [b'<script', b'javascript:', b'vbscript:', b'onload=', b'onerror=', b'<iframe', b'eval(']
+
+
+def test_case_insensitive_search():
+    matcher = SignatureMatcher(SIGNATURES)
+    assert matcher.search(b"hello <ScRiPt>alert(1)") == b'<script'
+    assert matcher.search(memoryview(b"a=EVAL(x)")) == b'eval('
+    assert matcher.search(b"perfectly innocent bytes") is None
+
+
+def test_signature_spanning_windows():
+    matcher = SignatureMatcher(SIGNATURES, window_size=16)
+    data = b"x" * 13 + b"JAVASCRIPT:" + b"y" * 40
+    assert matcher.search(data) == b'javascript:'
+
+
+def test_contained_signatures_are_pruned():
+    matcher = SignatureMatcher(SIGNATURES + [b'javascript'])
+    assert b'javascript:' not in matcher.signatures
+    assert matcher.search(b"JavaScript") == b'javascript'
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_stream_matches_across_chunk_boundaries(chunk_size):
+    matcher = SignatureMatcher(SIGNATURES)
+    data = os.urandom(200).replace(b'<', b'_') + b"<IfRaMe src=x>" + b"z" * 50
+    stream = matcher.stream()
+    for i in range(0, len(data), chunk_size):
+        stream.feed(data[i:i + chunk_size])
+    assert stream.match == b'<iframe'
+
+
+def test_stream_without_match():
+    stream = SignatureMatcher(SIGNATURES).stream()
+    for _ in range(10):
+        assert stream.feed(b"onload" + b"-" * 10) is None
+
+
+def test_automaton_path_agrees(monkeypatch):
+    monkeypatch.setattr(signature_matcher, "AUTOMATON_MIN_SIGNATURES", 1)
+    matcher = SignatureMatcher(SIGNATURES, window_size=16)
+    assert matcher.uses_automaton
+    assert matcher.search(b"x" * 14 + b"VBScript:") == b'vbscript:'
+    assert matcher.search(b"nothing here") is None
+
+
+def test_large_signature_sets_use_the_automaton_and_agree_with_the_scan(monkeypatch):
+    signatures = SIGNATURES + [f"payload-{n}:".encode() for n in range(20)]
+    automaton = SignatureMatcher(signatures, window_size=32)
+    assert automaton.uses_automaton
+
+    monkeypatch.setattr(signature_matcher, "ahocorasick", None)
+    scan = SignatureMatcher(signatures, window_size=32)
+    assert not scan.uses_automaton
+
+    content = os.urandom(200).replace(b"<", b"_") + b"PAYLOAD-17:" + b"-" * 50 + b"onerror="
+    for matcher in (automaton, scan):
+        assert matcher.search(content) == b"payload-17:"
+        assert matcher.search(content[:150]) is None
+        stream = matcher.stream()
+        results = [stream.feed(content[offset:offset + 7]) for offset in range(0, len(content), 7)]
+        assert [r for r in results if r is not None][:1] == [b"payload-17:"]
@@ -0,0 +1,142 @@
+import os
+import hashlib
+import pytest
+
+from app import storage
+from app.upload_pipeline import ingest_upload
+
+
+class FakeUpload:
+    """Minimal stand-in for starlette's UploadFile"""
+
+    def __init__(self, data: bytes, filename="clip.mp4", content_type="video/mp4"):
+        self._data = data
+        self._pos = 0
+        self.filename = filename
+        self.content_type = content_type
+        self.reads = []
+
+    async def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._data) - self._pos
+        chunk = self._data[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        self.reads.append(len(chunk))
+        return chunk
+
+
+class BlockingScan:
+    def __init__(self, needle):
+        self.needle = needle
+        self.hasher = hashlib.sha256()
+        self.should_stop = False
+
+    def update(self, chunk):
+        self.hasher.update(chunk)
+        if self.needle in chunk:
+            self.should_stop = True
+
+    async def finalize(self):
+        level = "blocked" if self.should_stop else "safe"
+        return type("Result", (), {"security_level": level, "file_hash": self.hasher.hexdigest(),
+                                   "content_warnings": []})()
+
+
+class FakeScanner:
+    def __init__(self, needle=b"<script"):
+        self.needle = needle
+
+    def begin_stream_scan(self, filename, content_type):
+        return BlockingScan(self.needle)
+
+
+@pytest.fixture
+def media_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage.settings, "AZURE_STORAGE_CONNECTION_STRING", None)
+    monkeypatch.setattr(storage.settings, "LOCAL_MEDIA_DIR", str(tmp_path / "media"))
+    return tmp_path / "media"
+
+
+@pytest.mark.asyncio
+async def test_ingest_streams_in_chunks(media_dir):
+    data = os.urandom(10_000)
+    upload = FakeUpload(data)
+    result = await ingest_upload(upload, chunk_size=4096)
+
+    assert max(upload.reads) <= 4096
+    assert result.file_size == len(data)
+    assert result.file_hash == hashlib.sha256(data).hexdigest()
+    with open(result.path, "rb") as fh:
+        assert fh.read() == data
+    assert not [p for p in os.listdir(media_dir) if p.endswith(".partial")]
+
+
+@pytest.mark.asyncio
+async def test_blocked_upload_is_discarded(media_dir):
+    data = b"a" * 5000 + b"<script" + b"b" * 50_000
+    upload = FakeUpload(data, filename="page.txt", content_type="text/plain")
+    result = await ingest_upload(upload, scanner=FakeScanner(), chunk_size=1024)
+
+    assert result.blocked
+    assert result.path is None
+    assert result.file_size < len(data)  # stopped reading once decided
+    assert os.listdir(media_dir) == []
+
+
+def _stream(scanner, filename, content_type, data, chunk_size):
+    scan = scanner.begin_stream_scan(filename, content_type)
+    for offset in range(0, len(data), chunk_size):
+        scan.update(data[offset:offset + chunk_size])
+    return scan
+
+
+@pytest.mark.asyncio
+async def test_streamed_text_matches_whole_body_scan_without_retaining_it():
+    from app.security.content_scanner import ContentSecurityScanner
+
+    scanner = ContentSecurityScanner()
+    # Multi-byte characters and a pattern straddle the 7-byte chunk boundaries
+    data = ("héllo wörld\n" * 50 + "write to MAILTO:ops@example.com or <Embed src=x>\n").encode("utf-8")
+    whole = await scanner.scan_content(data, "notes.txt", "text/plain")
+
+    scan = _stream(scanner, "notes.txt", "text/plain", data, chunk_size=7)
+    assert scan._image is None and scan._image_file is None
+    streamed = await scan.finalize()
+
+    assert streamed.file_hash == whole.file_hash
+    for metadata in (streamed.technical_metadata, whole.technical_metadata):
+        metadata.pop("scan_timestamp")
+    assert streamed.technical_metadata == whole.technical_metadata
+    assert streamed.content_warnings == whole.content_warnings
+    assert "Suspicious content pattern detected: <embed" in streamed.content_warnings
+
+
+@pytest.mark.asyncio
+async def test_streamed_image_over_spool_limit_is_analyzed_from_disk(monkeypatch):
+    import io
+    import sys
+    from PIL import Image
+    from app.security.content_scanner import ContentSecurityScanner
+
+    scanner_module = sys.modules[ContentSecurityScanner.__module__]
+
+    buffer = io.BytesIO()
+    Image.effect_noise((64, 64), 80).convert("RGB").save(buffer, format="PNG")
+    data = buffer.getvalue()
+
+    scanner = ContentSecurityScanner()
+    scanner.spool_max_memory = 1024
+    sources = []
+    real_analyze = scanner_module.image_analysis_pool.analyze
+
+    async def spy(source):
+        sources.append((source, isinstance(source, str) and os.path.exists(source)))
+        return await real_analyze(source)
+
+    monkeypatch.setattr(scanner_module.image_analysis_pool, "analyze", spy)
+    scan = _stream(scanner, "photo.png", "image/png", data, chunk_size=512)
+    result = await scan.finalize()
+
+    (path, existed), = sources
+    assert existed and not os.path.exists(path)
+    assert result.technical_metadata["width"] == 64 and result.file_hash == hashlib.sha256(data).hexdigest()
@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+
+from app.device_outbox import DeviceOutbox, InMemoryOutboxStore
+from app.websocket_hub import Backplane, InProcessBackplane, WebSocketHub
+from app.websocket_manager import DeviceWebSocketManager
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed = False
+        self.release = asyncio.Event()
+        if not delay:
+            self.release.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.fail:
+            raise RuntimeError("socket gone")
+        await self.release.wait()
+        self.sent.append(text)
+
+    async def close(self, code=1000, reason=None):
+        self.closed = True
+
+
+async def _drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_slow_admin_does_not_stall_broadcast_and_drops_oldest():
+    hub = WebSocketHub(admin_queue_size=2)
+    slow, fast = FakeSocket(delay=1), FakeSocket()
+    hub.add_admin(slow)
+    hub.add_admin(fast)
+
+    for i in range(5):
+        await hub.broadcast_to_admins(json.dumps({"n": i}))
+        await _drain()
+
+    assert [json.loads(t)["n"] for t in fast.sent] == [0, 1, 2, 3, 4]
+    slow.release.set()
+    await _drain()
+    # The first message was in flight; the queue then kept only the newest two
+    assert [json.loads(t)["n"] for t in slow.sent] == [0, 3, 4]
+    assert hub.get_metrics()["messages_dropped"] == 2
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_slow_device_is_disconnected_and_messages_requeued():
+    manager = DeviceWebSocketManager(hub=WebSocketHub(device_queue_size=2),
+                                     outbox=DeviceOutbox(store=InMemoryOutboxStore()))
+    socket = FakeSocket(delay=1)
+    await manager.connect_device("d1", socket)
+
+    results = []
+    for i in range(4):
+        results.append(await manager.send_to_device("d1", {"type": "command", "n": i}))
+        await _drain()
+
+    assert results == [True, True, True, False]
+    assert socket.closed
+    assert "d1" not in manager.device_connections
+    assert manager.hub.get_metrics()["slow_consumer_disconnects"] == 1
+
+    replacement = FakeSocket()
+    await manager.connect_device("d1", replacement)
+    await _drain()
+    (frame,) = [json.loads(t) for t in replacement.sent]
+    assert frame["type"] == "outbox_batch"
+    assert [m["n"] for m in frame["data"]["messages"]] == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_failed_socket_is_evicted():
+    hub = WebSocketHub()
+    evicted = []
+    hub.on_device_evicted = lambda device_id, unsent: evicted.append((device_id, unsent))
+    await hub.add_device("d1", FakeSocket(fail=True))
+    assert await hub.send_to_device("d1", "hello")
+    await _drain()
+    assert not hub.is_device_connected("d1")
+    assert evicted == [("d1", ["hello"])]
+
+
+def test_backplane_subclasses_must_implement_every_method():
+    class PublishOnly(Backplane):
+        async def publish(self, envelope):
+            pass
+
+    with pytest.raises(TypeError):
+        PublishOnly()
+
+
+@pytest.mark.asyncio
+async def test_backplane_routes_devices_and_admins_across_workers():
+    backplane = InProcessBackplane()
+    worker_a, worker_b = WebSocketHub(backplane=backplane), WebSocketHub(backplane=backplane.peer())
+    await worker_a.start()
+    device, admin = FakeSocket(), FakeSocket()
+    await worker_a.add_device("d1", device)
+    await worker_b.start()  # joins late and learns about d1 through a sync request
+    await _drain()
+    worker_a.add_admin(admin)
+
+    assert worker_b.is_device_connected("d1")
+    assert await worker_b.send_to_device("d1", "to-device")
+    assert await worker_b.send_to_devices(["d1", "d2"], "many") == ["d2"]
+    await worker_b.broadcast_to_admins("to-admins")
+    await _drain()
+    assert device.sent == ["to-device", "many"]
+    assert admin.sent == ["to-admins"]
+
+    # A stale presence entry bounces back to the sender for offline queueing
+    bounced = []
+    worker_b.on_device_evicted = lambda device_id, unsent: bounced.append((device_id, unsent))
+    worker_b.remote_devices["ghost"] = worker_a.worker_id
+    assert await worker_b.send_to_device("ghost", "lost?")
+    await _drain()
+    assert bounced == [("ghost", ["lost?"])]
+
+    await worker_a.remove_device("d1")
+    assert not worker_b.is_device_connected("d1")
+    await worker_a.stop()
+    await worker_b.stop()